@@ -2,14 +2,16 @@ import os
 from datetime import timedelta
 from flask import Flask, jsonify
 from flask_cors import CORS
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from sqlalchemy import inspect
 from sqlalchemy.engine import Engine
 from sqlalchemy.exc import OperationalError
 from dotenv import load_dotenv
 from flask_jwt_extended import JWTManager
 import bcrypt
-from utils.helpers import get_database_url
+from utils.helpers import get_engine
+from utils.sql_profiler import install_sql_profiler
+from utils.fast_json import install_fast_json, install_response_compression
 import logging
 
 load_dotenv()
@@ -63,14 +65,7 @@ except ImportError:
 except Exception as e:
     logger.warning(f"Error setting up NLTK: {e}")
 
-DATABASE_URL = get_database_url()
-
-_DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', '5'))
-_ENGINE_KWARGS: dict[str, object] = {"pool_pre_ping": True}
-if DATABASE_URL.startswith("postgresql"):
-    _ENGINE_KWARGS["connect_args"] = {"connect_timeout": _DB_CONNECT_TIMEOUT}
-
-engine: Engine = create_engine(DATABASE_URL, **_ENGINE_KWARGS)
+engine: Engine = get_engine()
 
 SKIP_SCHEMA_BOOTSTRAP = os.getenv('SKIP_SCHEMA_BOOTSTRAP', 'false').lower() in ('1', 'true', 'yes')
 _database_available: bool | None = None
@@ -107,6 +102,16 @@ DEBUG_MODE = os.getenv('FLASK_DEBUG', '1').lower() in ('1', 'true', 'yes')
 app.config['DEBUG'] = DEBUG_MODE
 jwt = JWTManager(app)
 
+# orjson-backed jsonify() and gzip/brotli for large JSON responses
+if install_fast_json(app):
+	logger.info("Fast JSON serialization enabled (orjson)")
+if install_response_compression(app):
+	logger.info("Response compression enabled")
+
+# Per-request SQL profiling (SQL_PROFILING=true)
+if install_sql_profiler(app):
+	logger.info("SQL profiling enabled")
+
 # JSON auth/permission error handlers
 @jwt.unauthorized_loader
 def _jwt_unauthorized(err):
@@ -138,7 +143,22 @@ from database.schema import (
 	ensure_announcements_table,
 	ensure_subscription_plans_table,
 	ensure_subscription_status_enum,
-	ensure_subscription_payment_fields
+	ensure_subscription_payment_fields,
+	ensure_sales_rollup_tables,
+	ensure_keyset_pagination_indexes,
+	ensure_pos_sales_tables,
+	ensure_pos_catalog_versioning,
+	ensure_pos_sync_tables,
+	ensure_purchase_order_receiving,
+	ensure_expiry_risk_index,
+	ensure_product_ved_class,
+	ensure_tenant_storage_usage,
+	ensure_support_search,
+	ensure_announcement_feed_version,
+	ensure_live_events,
+	ensure_inventory_snapshots,
+	ensure_user_identity_changes,
+	ensure_reorder_forecast_rates
 )
 
 # Schema function definitions moved to database/schema.py
@@ -164,6 +184,21 @@ def _run_schema_bootstrap() -> None:
     ensure_subscription_plans_table()
     ensure_pharmacy_signup_requests_table()
     ensure_returns_tables()
+    ensure_sales_rollup_tables()
+    ensure_keyset_pagination_indexes()
+    ensure_pos_sales_tables()
+    ensure_pos_catalog_versioning()
+    ensure_pos_sync_tables()
+    ensure_purchase_order_receiving()
+    ensure_expiry_risk_index()
+    ensure_product_ved_class()
+    ensure_tenant_storage_usage()
+    ensure_support_search()
+    ensure_announcement_feed_version()
+    ensure_live_events()
+    ensure_inventory_snapshots()
+    ensure_user_identity_changes()
+    ensure_reorder_forecast_rates()
 
 
 _run_schema_bootstrap()
@@ -464,6 +499,10 @@ app.register_blueprint(announcements_bp)
 from routes.inventory import inventory_bp
 app.register_blueprint(inventory_bp)
 
+# Live events (server-sent events fed by LISTEN/NOTIFY)
+from routes.events import events_bp
+app.register_blueprint(events_bp)
+
 # =========================
 # INITIALIZE AI SERVICES AT STARTUP
 # =========================
@@ -12,7 +12,22 @@ from .schema import (
     ensure_announcements_table,
     ensure_subscription_plans_table,
     ensure_subscription_status_enum,
-    ensure_subscription_payment_fields
+    ensure_subscription_payment_fields,
+    ensure_sales_rollup_tables,
+    ensure_keyset_pagination_indexes,
+    ensure_pos_sales_tables,
+    ensure_pos_catalog_versioning,
+    ensure_pos_sync_tables,
+    ensure_purchase_order_receiving,
+    ensure_expiry_risk_index,
+    ensure_product_ved_class,
+    ensure_tenant_storage_usage,
+    ensure_support_search,
+    ensure_announcement_feed_version,
+    ensure_live_events,
+    ensure_inventory_snapshots,
+    ensure_user_identity_changes,
+    ensure_reorder_forecast_rates
 )
 
 __all__ = [
@@ -29,5 +44,20 @@ __all__ = [
     'ensure_subscription_plans_table',
     'ensure_subscription_status_enum',
     'ensure_subscription_payment_fields',
+    'ensure_sales_rollup_tables',
+    'ensure_keyset_pagination_indexes',
+    'ensure_pos_sales_tables',
+    'ensure_pos_catalog_versioning',
+    'ensure_pos_sync_tables',
+    'ensure_purchase_order_receiving',
+    'ensure_expiry_risk_index',
+    'ensure_product_ved_class',
+    'ensure_tenant_storage_usage',
+    'ensure_support_search',
+    'ensure_announcement_feed_version',
+    'ensure_live_events',
+    'ensure_inventory_snapshots',
+    'ensure_user_identity_changes',
+    'ensure_reorder_forecast_rates',
 ]
 
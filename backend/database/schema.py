@@ -1,5 +1,5 @@
 """Database schema initialization functions"""
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from sqlalchemy.exc import OperationalError
 from dotenv import load_dotenv
 import os
@@ -11,10 +11,9 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 load_dotenv()
-from utils.helpers import get_database_url
+from utils.helpers import get_engine
 
-DATABASE_URL = get_database_url()
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = get_engine()
 
 
 def _is_deadlock_error(e):
@@ -76,9 +75,20 @@ def ensure_returns_tables() -> None:
 					quantity int not null check (quantity > 0),
 					unit_price numeric(12,2) not null check (unit_price >= 0),
 					total_refund numeric(12,2) generated always as (quantity * unit_price) stored,
+					restored_quantity int check (restored_quantity >= 0),
 					created_at timestamptz default now()
 				)
 			"""))
+			# Units put back into batch stock (services/returns.py); NULL on lines recorded before it was tracked.
+			# The return route calls this too, so the ALTER (and its table lock) only runs when the column is missing
+			has_restored_quantity = conn.execute(text("""
+				SELECT 1 FROM information_schema.columns WHERE table_name = 'return_items' AND column_name = 'restored_quantity'
+			""")).first() is not None
+			if not has_restored_quantity:
+				conn.execute(text("ALTER TABLE return_items ADD COLUMN IF NOT EXISTS restored_quantity int check (restored_quantity >= 0)"))
+			# Returnable-quantity checks look up prior returns of a sale
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_returns_sale ON returns(sale_id)")
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_return_items_return ON return_items(return_id)")
 			
 			# Create triggers for updated_at
 			conn.execute(text("""
@@ -352,7 +362,7 @@ def ensure_announcements_table() -> None:
 						title text not null,
 						content text not null,
 						type text default 'info' check (type in ('info', 'warning', 'urgent', 'update')),
-						is_pinned boolean default false,
+						is_pinned boolean not null default false,
 						is_active boolean default true,
 						created_by bigint not null references users(id) on delete set null,
 						created_at timestamptz default now(),
@@ -378,6 +388,15 @@ def ensure_announcements_table() -> None:
 	# Create indexes and triggers with retry logic
 	try:
 		with engine.begin() as conn:
+			# is_pinned leads the listing keyset; a NULL there makes the row comparison NULL and pages skip rows
+			nullable = conn.execute(text("""
+				SELECT is_nullable = 'YES' FROM information_schema.columns
+				WHERE table_name = 'announcements' AND column_name = 'is_pinned'
+			""")).scalar()
+			if nullable:
+				conn.execute(text("UPDATE announcements SET is_pinned = false WHERE is_pinned IS NULL"))
+				_execute_with_retry(conn, "ALTER TABLE announcements ALTER COLUMN is_pinned SET NOT NULL")
+
 			# Create indexes with retry
 			index_sqls = [
 				"CREATE INDEX IF NOT EXISTS idx_announcements_is_active ON announcements(is_active, created_at DESC)",
@@ -518,3 +537,1036 @@ def ensure_subscription_payment_fields():
 	except Exception as e:
 		print(f'[ensure_subscription_payment_fields] Error: {e}')
 
+
+
+def ensure_sales_rollup_tables() -> None:
+	"""
+	Ensure the daily sales rollup tables exist.
+	When the tables are created for the first time they are backfilled from
+	sales/sale_items/returns so reports read complete history immediately.
+	Sales and returns append their pharmacy totals to
+	sales_rollup_pharmacy_deltas (see services/sales_rollup.py).
+	"""
+	# The rollups read sale_items.unit_cost
+	ensure_pos_sales_tables()
+	try:
+		with engine.begin() as conn:
+			is_new = conn.execute(text("select to_regclass('public.sales_rollup_product_daily') is null")).scalar()
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS sales_rollup_product_daily (
+					pharmacy_id bigint not null references pharmacies(id) on delete cascade,
+					product_id bigint not null references products(id) on delete cascade,
+					day date not null,
+					quantity_sold numeric(14,2) not null default 0,
+					revenue numeric(14,2) not null default 0,
+					cost numeric(14,2) not null default 0,
+					sale_lines int not null default 0,
+					quantity_returned numeric(14,2) not null default 0,
+					refund_amount numeric(14,2) not null default 0,
+					updated_at timestamptz default now(),
+					primary key (pharmacy_id, product_id, day)
+				)
+			"""))
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS sales_rollup_pharmacy_daily (
+					pharmacy_id bigint not null references pharmacies(id) on delete cascade,
+					day date not null,
+					sale_count int not null default 0,
+					quantity_sold numeric(14,2) not null default 0,
+					revenue numeric(14,2) not null default 0,
+					cost numeric(14,2) not null default 0,
+					total_amount numeric(14,2) not null default 0,
+					return_count int not null default 0,
+					quantity_returned numeric(14,2) not null default 0,
+					refund_amount numeric(14,2) not null default 0,
+					updated_at timestamptz default now(),
+					primary key (pharmacy_id, day)
+				)
+			"""))
+			conn.execute(text("CREATE INDEX IF NOT EXISTS idx_sales_rollup_product_day ON sales_rollup_product_daily(product_id, day)"))
+			# Append-only: one row per sale or return statement, folded into the daily rows on read
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS sales_rollup_pharmacy_deltas (
+					id bigserial primary key,
+					pharmacy_id bigint not null references pharmacies(id) on delete cascade,
+					day date not null,
+					sale_count int not null default 0,
+					quantity_sold numeric(14,2) not null default 0,
+					revenue numeric(14,2) not null default 0,
+					cost numeric(14,2) not null default 0,
+					total_amount numeric(14,2) not null default 0,
+					return_count int not null default 0,
+					quantity_returned numeric(14,2) not null default 0,
+					refund_amount numeric(14,2) not null default 0
+				)
+			"""))
+			conn.execute(text("CREATE INDEX IF NOT EXISTS idx_sales_rollup_pharmacy_deltas_ph ON sales_rollup_pharmacy_deltas(pharmacy_id)"))
+			if is_new:
+				from services.sales_rollup import rebuild_sales_rollups
+				rebuild_sales_rollups(conn)
+				print('[ensure_sales_rollup_tables] Rollup tables created and backfilled')
+	except Exception as e:
+		print(f"[ensure_sales_rollup_tables] Error: {e}")
+
+
+# (table, index name, columns) backing keyset pagination; columns match each listing's ORDER BY
+KEYSET_INDEXES = [
+	('support_tickets', 'idx_support_tickets_keyset', '(created_at DESC, id DESC)'),
+	('support_tickets', 'idx_support_tickets_pharmacy_keyset', '(pharmacy_id, created_at DESC, id DESC)'),
+	('announcements', 'idx_announcements_keyset', '(is_pinned DESC, created_at DESC, id DESC)'),
+	('sales', 'idx_sales_pharmacy_keyset', '(pharmacy_id, created_at DESC, id DESC)'),
+	('purchase_orders', 'idx_purchase_orders_keyset', '(pharmacy_id, created_at DESC, id DESC)'),
+	('subscriptions', 'idx_subscriptions_keyset', '(created_at DESC, id DESC)'),
+]
+
+
+def ensure_keyset_pagination_indexes() -> None:
+	"""Ensure the composite indexes used by keyset-paginated list endpoints exist"""
+	for table, index_name, columns in KEYSET_INDEXES:
+		try:
+			with engine.begin() as conn:
+				# Some tables (purchase_orders) are created lazily by their routes
+				if conn.execute(text("select to_regclass(:t) is null"), {'t': f'public.{table}'}).scalar():
+					continue
+				_execute_with_retry(conn, f"CREATE INDEX IF NOT EXISTS {index_name} ON {table}{columns}")
+		except Exception as e:
+			print(f"[ensure_keyset_pagination_indexes] Error creating {index_name}: {e}")
+
+
+def ensure_pos_sales_tables() -> None:
+	"""
+	Ensure the tables used by set-based POS sale recording exist:
+	sale_item_allocations (which batches each sale line consumed),
+	pos_bulk_sale_requests (idempotency keys and stored results of bulk uploads)
+	and sale_idempotency (per-sale idempotency keys and stored receipts).
+	sale_items.unit_cost records the cost of each line when it was sold.
+	"""
+	try:
+		with engine.begin() as conn:
+			conn.execute(text("ALTER TABLE inventory_batches ADD COLUMN IF NOT EXISTS disposed_quantity int not null default 0 check (disposed_quantity >= 0)"))
+			has_unit_cost = conn.execute(text("""
+				SELECT 1 FROM information_schema.columns WHERE table_name = 'sale_items' AND column_name = 'unit_cost'
+			""")).first() is not None
+			if not has_unit_cost:
+				conn.execute(text("ALTER TABLE sale_items ADD COLUMN IF NOT EXISTS unit_cost numeric(12,2)"))
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS sale_item_allocations (
+					id bigserial primary key,
+					sale_item_id bigint not null references sale_items(id) on delete cascade,
+					batch_id bigint not null references inventory_batches(id) on delete cascade,
+					quantity int not null check (quantity > 0),
+					returned_quantity int not null default 0 check (returned_quantity >= 0),
+					created_at timestamptz default now()
+				)
+			"""))
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS pos_bulk_sale_requests (
+					pharmacy_id bigint not null references pharmacies(id) on delete cascade,
+					idempotency_key text not null,
+					user_id bigint references users(id) on delete set null,
+					sale_count int not null default 0,
+					request_hash text,
+					response jsonb,
+					created_at timestamptz default now(),
+					primary key (pharmacy_id, idempotency_key)
+				)
+			"""))
+			conn.execute(text("ALTER TABLE pos_bulk_sale_requests ADD COLUMN IF NOT EXISTS request_hash text"))
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS sale_idempotency (
+					pharmacy_id bigint not null references pharmacies(id) on delete cascade,
+					idempotency_key text not null,
+					request_hash text not null,
+					sale_id bigint references sales(id) on delete cascade,
+					response jsonb,
+					created_at timestamptz not null default now(),
+					constraint uq_sale_idempotency_key unique (pharmacy_id, idempotency_key)
+				)
+			"""))
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_sale_idempotency_created_at ON sale_idempotency(created_at)")
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_pos_bulk_sale_requests_created_at ON pos_bulk_sale_requests(created_at)")
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_sale_item_allocations_item ON sale_item_allocations(sale_item_id)")
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_sale_item_allocations_batch ON sale_item_allocations(batch_id)")
+			if not has_unit_cost:
+				# Past lines: cost of the batches they consumed, else today's product cost (the best left)
+				conn.execute(text("""
+					UPDATE sale_items si
+					SET unit_cost = COALESCE(
+						(SELECT CASE WHEN bool_and(b.cost_price IS NOT NULL)
+						             THEN SUM(a.quantity * b.cost_price) / NULLIF(SUM(a.quantity), 0) END
+						 FROM sale_item_allocations a
+						 JOIN inventory_batches b ON b.id = a.batch_id
+						 WHERE a.sale_item_id = si.id),
+						(SELECT p.cost_price FROM products p WHERE p.id = si.product_id)
+					)
+				"""))
+	except Exception as e:
+		print(f"[ensure_pos_sales_tables] Error: {e}")
+
+
+def ensure_pos_catalog_versioning() -> None:
+	"""
+	Ensure per-pharmacy POS catalog versions are maintained by the database.
+	Statement-level triggers on products and inventory_batches stamp every
+	changed product with a new pharmacy catalog version, so the delta feed can
+	return "what changed since version N" no matter which code path wrote.
+	The triggers only note the products in pos_catalog_pending, a row private
+	to the transaction. A deferred constraint trigger bumps the per-pharmacy
+	version and stamps the products at commit time. Writers of one pharmacy
+	then share the version row lock only while committing, and versions still
+	follow commit order.
+	"""
+	# The products trigger compares these columns
+	ensure_products_location_column()
+	ensure_products_reorder_supplier_columns()
+	try:
+		with engine.begin() as conn:
+			is_new = conn.execute(text("select to_regclass('public.pos_catalog_versions') is null")).scalar()
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS pos_catalog_versions (
+					pharmacy_id bigint primary key references pharmacies(id) on delete cascade,
+					version bigint not null default 1,
+					rolled_over_on date not null default current_date,
+					updated_at timestamptz default now()
+				)
+			"""))
+			# No FK to products: rows of deleted products remain as tombstones for the delta feed
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS pos_catalog_product_versions (
+					product_id bigint primary key,
+					pharmacy_id bigint not null,
+					version bigint not null
+				)
+			"""))
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_pos_catalog_product_versions_ph ON pos_catalog_product_versions(pharmacy_id, version)")
+			# Products changed by open transactions; rows live from the first change until that commit
+			conn.execute(text("""
+				CREATE UNLOGGED TABLE IF NOT EXISTS pos_catalog_pending (
+					txid bigint not null,
+					pharmacy_id bigint not null,
+					product_ids bigint[] not null,
+					primary key (txid, pharmacy_id)
+				)
+			"""))
+			conn.execute(text("""
+				CREATE OR REPLACE FUNCTION pos_catalog_touch(p_pharmacy_ids bigint[], p_product_ids bigint[])
+				RETURNS void AS $$
+				BEGIN
+					INSERT INTO pos_catalog_pending AS q (txid, pharmacy_id, product_ids)
+					SELECT txid_current(), u.pharmacy_id, array_agg(DISTINCT u.product_id)
+					FROM unnest(p_pharmacy_ids, p_product_ids) AS u(pharmacy_id, product_id)
+					WHERE u.pharmacy_id IS NOT NULL
+					GROUP BY u.pharmacy_id
+					ON CONFLICT (txid, pharmacy_id) DO UPDATE SET product_ids = ARRAY(SELECT DISTINCT unnest(q.product_ids || excluded.product_ids));
+				END
+				$$ LANGUAGE plpgsql
+			"""))
+			# Runs at commit: the first event of a transaction flushes all its pharmacies in id order
+			# (a fixed lock order), later events of the same transaction find nothing left
+			conn.execute(text("""
+				CREATE OR REPLACE FUNCTION pos_catalog_flush()
+				RETURNS trigger AS $$
+				DECLARE
+					pending record;
+					new_version bigint;
+				BEGIN
+					FOR pending IN
+						WITH flushed AS (
+							DELETE FROM pos_catalog_pending WHERE txid = NEW.txid
+							RETURNING pharmacy_id, product_ids
+						)
+						SELECT pharmacy_id, product_ids FROM flushed ORDER BY pharmacy_id
+					LOOP
+						INSERT INTO pos_catalog_versions AS v (pharmacy_id, version)
+						VALUES (pending.pharmacy_id, 1)
+						ON CONFLICT (pharmacy_id) DO UPDATE SET version = v.version + 1, updated_at = now()
+						RETURNING version INTO new_version;
+						INSERT INTO pos_catalog_product_versions AS pv (product_id, pharmacy_id, version)
+						SELECT DISTINCT u.product_id, pending.pharmacy_id, new_version
+						FROM unnest(pending.product_ids) AS u(product_id)
+						ON CONFLICT (product_id) DO UPDATE SET version = excluded.version, pharmacy_id = excluded.pharmacy_id;
+					END LOOP;
+					RETURN NULL;
+				END
+				$$ LANGUAGE plpgsql
+			"""))
+			conn.execute(text("""
+				CREATE OR REPLACE FUNCTION pos_catalog_products_changed()
+				RETURNS trigger AS $$
+				BEGIN
+					IF TG_OP = 'INSERT' THEN
+						PERFORM pos_catalog_touch(array_agg(pharmacy_id), array_agg(id)) FROM new_rows;
+					ELSIF TG_OP = 'UPDATE' THEN
+						PERFORM pos_catalog_touch(array_agg(n.pharmacy_id) || array_agg(o.pharmacy_id), array_agg(n.id) || array_agg(o.id))
+						FROM new_rows n JOIN old_rows o ON o.id = n.id
+						WHERE (n.name, n.unit_price, n.cost_price, n.category_id, n.location, n.reorder_point,
+								n.preferred_supplier_id, n.is_active, n.pharmacy_id)
+							IS DISTINCT FROM (o.name, o.unit_price, o.cost_price, o.category_id, o.location, o.reorder_point,
+								o.preferred_supplier_id, o.is_active, o.pharmacy_id);
+					ELSE
+						PERFORM pos_catalog_touch(array_agg(pharmacy_id), array_agg(id)) FROM old_rows;
+					END IF;
+					RETURN NULL;
+				END
+				$$ LANGUAGE plpgsql
+			"""))
+			conn.execute(text("""
+				CREATE OR REPLACE FUNCTION pos_catalog_batches_changed()
+				RETURNS trigger AS $$
+				BEGIN
+					IF TG_OP = 'INSERT' THEN
+						PERFORM pos_catalog_touch(array_agg(p.pharmacy_id), array_agg(p.id))
+						FROM products p WHERE p.id IN (SELECT product_id FROM new_rows);
+					ELSIF TG_OP = 'UPDATE' THEN
+						PERFORM pos_catalog_touch(array_agg(p.pharmacy_id), array_agg(p.id))
+						FROM products p WHERE p.id IN (
+							SELECT n.product_id FROM new_rows n JOIN old_rows o ON o.id = n.id
+							WHERE (n.quantity, n.sold_quantity, n.disposed_quantity, n.expiration_date, n.product_id)
+								IS DISTINCT FROM (o.quantity, o.sold_quantity, o.disposed_quantity, o.expiration_date, o.product_id)
+						);
+					ELSE
+						PERFORM pos_catalog_touch(array_agg(p.pharmacy_id), array_agg(p.id))
+						FROM products p WHERE p.id IN (SELECT product_id FROM old_rows);
+					END IF;
+					RETURN NULL;
+				END
+				$$ LANGUAGE plpgsql
+			"""))
+			_execute_with_retry(conn, "DROP TRIGGER IF EXISTS trg_pos_catalog_flush ON pos_catalog_pending")
+			_execute_with_retry(conn, """CREATE CONSTRAINT TRIGGER trg_pos_catalog_flush
+				AFTER INSERT ON pos_catalog_pending
+				DEFERRABLE INITIALLY DEFERRED
+				FOR EACH ROW EXECUTE FUNCTION pos_catalog_flush()""")
+			# Transition tables allow only one event per trigger
+			for table, function, events in (
+				('products', 'pos_catalog_products_changed', ('insert', 'update', 'delete')),
+				('inventory_batches', 'pos_catalog_batches_changed', ('insert', 'update', 'delete')),
+			):
+				for event in events:
+					referencing = {
+						'insert': 'NEW TABLE AS new_rows',
+						'update': 'OLD TABLE AS old_rows NEW TABLE AS new_rows',
+						'delete': 'OLD TABLE AS old_rows',
+					}[event]
+					trigger = f"trg_pos_catalog_{table}_{event}"
+					_execute_with_retry(conn, f"DROP TRIGGER IF EXISTS {trigger} ON {table}")
+					_execute_with_retry(conn, f"""CREATE TRIGGER {trigger}
+						AFTER {event.upper()} ON {table}
+						REFERENCING {referencing}
+						FOR EACH STATEMENT EXECUTE FUNCTION {function}()""")
+			if is_new:
+				conn.execute(text("""
+					INSERT INTO pos_catalog_versions (pharmacy_id, version)
+					SELECT id, 1 FROM pharmacies
+					ON CONFLICT (pharmacy_id) DO NOTHING
+				"""))
+				conn.execute(text("""
+					INSERT INTO pos_catalog_product_versions (product_id, pharmacy_id, version)
+					SELECT id, pharmacy_id, 1 FROM products WHERE pharmacy_id IS NOT NULL
+					ON CONFLICT (product_id) DO NOTHING
+				"""))
+				print('[ensure_pos_catalog_versioning] Catalog versions created and seeded')
+	except Exception as e:
+		print(f"[ensure_pos_catalog_versioning] Error: {e}")
+
+
+def ensure_pos_sync_tables() -> None:
+	"""
+	Ensure the offline sync tables exist: pos_sync_journal (one row per
+	journal entry a terminal uploaded, with its reconciliation result) and
+	pos_sync_terminals (the contiguous sequence acknowledged per terminal).
+	"""
+	try:
+		with engine.begin() as conn:
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS pos_sync_terminals (
+					pharmacy_id bigint not null references pharmacies(id) on delete cascade,
+					terminal_id text not null,
+					acknowledged_through bigint not null default 0,
+					last_user_id bigint references users(id) on delete set null,
+					last_synced_at timestamptz default now(),
+					primary key (pharmacy_id, terminal_id)
+				)
+			"""))
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS pos_sync_journal (
+					pharmacy_id bigint not null references pharmacies(id) on delete cascade,
+					terminal_id text not null,
+					seq bigint not null,
+					status text not null check (status in ('applied', 'adjusted', 'conflict', 'invalid')),
+					sale_id bigint references sales(id) on delete set null,
+					result jsonb,
+					client_created_at timestamptz,
+					received_at timestamptz default now(),
+					resolved_at timestamptz,
+					primary key (pharmacy_id, terminal_id, seq)
+				)
+			"""))
+			_execute_with_retry(conn, """
+				CREATE INDEX IF NOT EXISTS idx_pos_sync_journal_unresolved
+				ON pos_sync_journal(pharmacy_id, received_at)
+				WHERE status IN ('adjusted', 'conflict') AND resolved_at IS NULL
+			""")
+	except Exception as e:
+		print(f"[ensure_pos_sync_tables] Error: {e}")
+
+
+# Also run by the routes that create the purchase order tables lazily; cheap when the table exists
+PURCHASE_ORDER_RECEIPTS_DDL = """
+	CREATE TABLE IF NOT EXISTS purchase_order_receipts (
+		id bigserial primary key,
+		po_id bigint not null references purchase_orders(id) on delete cascade,
+		receipt_key text,
+		received_by bigint references users(id) on delete set null,
+		received_at timestamptz default now(),
+		lines int not null default 0,
+		units int not null default 0,
+		result jsonb,
+		unique (po_id, receipt_key)
+	)
+"""
+
+
+def ensure_purchase_order_receiving() -> None:
+	"""
+	Ensure purchase_order_items tracks received quantity and expiry per item and
+	purchase_order_receipts records each delivery (receipt_key makes retries
+	idempotent). Also adds the purchase_orders columns older tables lack. Skipped
+	until the purchase order tables exist; tables created lazily by the routes
+	already have every column.
+	"""
+	try:
+		with engine.begin() as conn:
+			if conn.execute(text("select to_regclass('public.purchase_order_items') is null")).scalar():
+				return
+			conn.execute(text("ALTER TABLE purchase_orders ADD COLUMN IF NOT EXISTS expected_delivery_at date"))
+			conn.execute(text("ALTER TABLE purchase_orders ADD COLUMN IF NOT EXISTS notes text"))
+			conn.execute(text("ALTER TABLE purchase_orders ADD COLUMN IF NOT EXISTS updated_by bigint references users(id)"))
+			has_received_quantity = conn.execute(text("""
+				SELECT 1 FROM information_schema.columns WHERE table_name = 'purchase_order_items' AND column_name = 'received_quantity'
+			""")).first() is not None
+			if not has_received_quantity:
+				conn.execute(text("ALTER TABLE purchase_order_items ADD COLUMN IF NOT EXISTS received_quantity int not null default 0"))
+				conn.execute(text("ALTER TABLE purchase_order_items ADD COLUMN IF NOT EXISTS expiration_date date"))
+				# Orders received before receiving was tracked count as fully received, so receiving
+				# them again books nothing. Runs once, with the column, so later items are not touched.
+				conn.execute(text("""
+					UPDATE purchase_order_items i
+					SET received_quantity = i.quantity
+					FROM purchase_orders po
+					WHERE po.id = i.po_id AND po.status = 'received'
+				"""))
+			_execute_with_retry(conn, PURCHASE_ORDER_RECEIPTS_DDL)
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_purchase_order_receipts_po ON purchase_order_receipts(po_id)")
+	except Exception as e:
+		print(f"[ensure_purchase_order_receiving] Error: {e}")
+
+
+def ensure_expiry_risk_index() -> None:
+	"""
+	Ensure batch_expiry_risk holds one row per dated batch with its on-hand
+	quantity, days to expiry, 28-day sell-through velocity and the quantity
+	projected to be left unsold at expiry (batches are sold first-expiring-first).
+	Statement-level triggers on inventory_batches refresh the touched products
+	whenever stock is received, sold, returned or disposed; the day rollover is
+	services.expiry_risk.roll_over_expiry_risk. Widgets read the at-risk rows
+	through a partial index.
+	"""
+	ensure_sales_rollup_tables()
+	from services.expiry_risk import EXPIRY_RISK_HORIZON_DAYS, VELOCITY_WINDOW_DAYS
+	try:
+		with engine.begin() as conn:
+			is_new = conn.execute(text("select to_regclass('public.batch_expiry_risk') is null")).scalar()
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS batch_expiry_risk (
+					batch_id bigint primary key references inventory_batches(id) on delete cascade,
+					pharmacy_id bigint not null,
+					product_id bigint not null,
+					expiration_date date not null,
+					on_hand int not null default 0,
+					batch_cost numeric(12,2),
+					daily_velocity numeric(12,3) not null default 0,
+					days_to_expiry int not null,
+					projected_unsold int not null default 0,
+					at_risk boolean not null default false,
+					as_of date not null default current_date
+				)
+			"""))
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS expiry_risk_state (
+					pharmacy_id bigint primary key references pharmacies(id) on delete cascade,
+					rolled_over_on date not null default current_date,
+					updated_at timestamptz default now()
+				)
+			"""))
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_batch_expiry_risk_product ON batch_expiry_risk(product_id)")
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_batch_expiry_risk_on_hand ON batch_expiry_risk(pharmacy_id, product_id) WHERE on_hand > 0")
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_batch_expiry_risk_at_risk ON batch_expiry_risk(pharmacy_id, expiration_date) WHERE at_risk")
+			# Velocity counts full days only, so it changes at the day rollover and not with every sale
+			conn.execute(text(f"""
+				CREATE OR REPLACE FUNCTION expiry_risk_refresh(p_product_ids bigint[])
+				RETURNS void AS $$
+				BEGIN
+					INSERT INTO batch_expiry_risk (batch_id, pharmacy_id, product_id, expiration_date, on_hand,
+						batch_cost, daily_velocity, days_to_expiry, projected_unsold, at_risk, as_of)
+					WITH batches AS (
+						SELECT b.id, b.product_id, p.pharmacy_id, b.expiration_date, b.cost_price,
+							GREATEST(b.quantity - COALESCE(b.sold_quantity, 0) - COALESCE(b.disposed_quantity, 0), 0) AS on_hand
+						FROM inventory_batches b
+						JOIN products p ON p.id = b.product_id
+						WHERE b.product_id = ANY(p_product_ids)
+						  AND b.expiration_date IS NOT NULL
+						  AND p.pharmacy_id IS NOT NULL
+					), velocity AS (
+						SELECT d.product_id,
+							GREATEST(SUM(d.quantity_sold - d.quantity_returned), 0) / {VELOCITY_WINDOW_DAYS}.0 AS per_day
+						FROM sales_rollup_product_daily d
+						WHERE d.product_id = ANY(p_product_ids)
+						  AND d.day >= CURRENT_DATE - {VELOCITY_WINDOW_DAYS} AND d.day < CURRENT_DATE
+						GROUP BY d.product_id
+					), ranked AS (
+						SELECT bt.*, COALESCE(v.per_day, 0) AS per_day,
+							bt.expiration_date - CURRENT_DATE AS days_left,
+							-- Unexpired stock that sells before this batch (FEFO)
+							COALESCE(SUM(bt.on_hand) FILTER (WHERE bt.expiration_date > CURRENT_DATE) OVER (
+								PARTITION BY bt.product_id ORDER BY bt.expiration_date, bt.id
+								ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS ahead
+						FROM batches bt
+						LEFT JOIN velocity v ON v.product_id = bt.product_id
+					), projected AS (
+						SELECT rk.*,
+							CASE WHEN rk.days_left <= 0 THEN rk.on_hand
+								ELSE CEIL(GREATEST(rk.on_hand - GREATEST(rk.per_day * rk.days_left - rk.ahead, 0), 0))::int
+							END AS unsold
+						FROM ranked rk
+					)
+					SELECT id, pharmacy_id, product_id, expiration_date, on_hand, cost_price, per_day, days_left, unsold,
+						on_hand > 0 AND (days_left <= {EXPIRY_RISK_HORIZON_DAYS} OR unsold > 0), CURRENT_DATE
+					FROM projected
+					ORDER BY id
+					ON CONFLICT (batch_id) DO UPDATE SET
+						pharmacy_id = excluded.pharmacy_id, product_id = excluded.product_id,
+						expiration_date = excluded.expiration_date, on_hand = excluded.on_hand,
+						batch_cost = excluded.batch_cost, daily_velocity = excluded.daily_velocity,
+						days_to_expiry = excluded.days_to_expiry, projected_unsold = excluded.projected_unsold,
+						at_risk = excluded.at_risk, as_of = excluded.as_of;
+					-- Batches that lost their expiry date or moved to another product
+					DELETE FROM batch_expiry_risk r
+					WHERE r.product_id = ANY(p_product_ids)
+					  AND NOT EXISTS (
+						SELECT 1 FROM inventory_batches b
+						WHERE b.id = r.batch_id AND b.product_id = r.product_id AND b.expiration_date IS NOT NULL
+					  );
+				END
+				$$ LANGUAGE plpgsql
+			"""))
+			conn.execute(text("""
+				CREATE OR REPLACE FUNCTION expiry_risk_batches_changed()
+				RETURNS trigger AS $$
+				BEGIN
+					IF TG_OP = 'INSERT' THEN
+						PERFORM expiry_risk_refresh(array_agg(DISTINCT product_id)) FROM new_rows;
+					ELSIF TG_OP = 'UPDATE' THEN
+						PERFORM expiry_risk_refresh(array_agg(DISTINCT c.product_id))
+						FROM (
+							SELECT n.product_id, o.product_id AS old_product_id FROM new_rows n JOIN old_rows o ON o.id = n.id
+							WHERE (n.quantity, n.sold_quantity, n.disposed_quantity, n.expiration_date, n.product_id, n.cost_price)
+								IS DISTINCT FROM (o.quantity, o.sold_quantity, o.disposed_quantity, o.expiration_date, o.product_id, o.cost_price)
+						) changed
+						CROSS JOIN LATERAL (VALUES (changed.product_id), (changed.old_product_id)) AS c(product_id);
+					ELSE
+						PERFORM expiry_risk_refresh(array_agg(DISTINCT product_id)) FROM old_rows;
+					END IF;
+					RETURN NULL;
+				END
+				$$ LANGUAGE plpgsql
+			"""))
+			# Transition tables allow only one event per trigger
+			for event in ('insert', 'update', 'delete'):
+				referencing = {
+					'insert': 'NEW TABLE AS new_rows',
+					'update': 'OLD TABLE AS old_rows NEW TABLE AS new_rows',
+					'delete': 'OLD TABLE AS old_rows',
+				}[event]
+				trigger = f"trg_expiry_risk_inventory_batches_{event}"
+				_execute_with_retry(conn, f"DROP TRIGGER IF EXISTS {trigger} ON inventory_batches")
+				_execute_with_retry(conn, f"""CREATE TRIGGER {trigger}
+					AFTER {event.upper()} ON inventory_batches
+					REFERENCING {referencing}
+					FOR EACH STATEMENT EXECUTE FUNCTION expiry_risk_batches_changed()""")
+			if is_new:
+				conn.execute(text("""
+					SELECT expiry_risk_refresh(array_agg(DISTINCT product_id))
+					FROM inventory_batches WHERE expiration_date IS NOT NULL
+				"""))
+				conn.execute(text("""
+					INSERT INTO expiry_risk_state (pharmacy_id)
+					SELECT id FROM pharmacies
+					ON CONFLICT (pharmacy_id) DO NOTHING
+				"""))
+				print('[ensure_expiry_risk_index] Expiry risk index created and backfilled')
+	except Exception as e:
+		print(f"[ensure_expiry_risk_index] Error: {e}")
+
+
+def ensure_product_ved_class() -> None:
+	"""
+	Ensure products.ved_class holds each product's VED class (V/E/D), so the
+	ABC/VED analytics read a column instead of matching keywords per request.
+	A products trigger classifies rows whose name or category changes, a
+	product_categories trigger reclassifies products of a renamed category,
+	and rows that disagree with the current rules are fixed on startup.
+	"""
+	from services.abc_ved import ved_classify_sql
+	try:
+		with engine.begin() as conn:
+			_execute_with_retry(conn, "ALTER TABLE products ADD COLUMN IF NOT EXISTS ved_class char(1)")
+			conn.execute(text(ved_classify_sql()))
+			conn.execute(text("""
+				CREATE OR REPLACE FUNCTION products_set_ved_class()
+				RETURNS trigger AS $$
+				BEGIN
+					NEW.ved_class := ved_classify(NEW.name, (SELECT name FROM product_categories WHERE id = NEW.category_id));
+					RETURN NEW;
+				END
+				$$ LANGUAGE plpgsql
+			"""))
+			conn.execute(text("""
+				CREATE OR REPLACE FUNCTION product_categories_reclassify_ved()
+				RETURNS trigger AS $$
+				BEGIN
+					UPDATE products p SET ved_class = ved_classify(p.name, NEW.name)
+					WHERE p.category_id = NEW.id AND p.ved_class IS DISTINCT FROM ved_classify(p.name, NEW.name);
+					RETURN NULL;
+				END
+				$$ LANGUAGE plpgsql
+			"""))
+			_execute_with_retry(conn, "DROP TRIGGER IF EXISTS trg_products_ved_class ON products")
+			_execute_with_retry(conn, """CREATE TRIGGER trg_products_ved_class
+				BEFORE INSERT OR UPDATE OF name, category_id ON products
+				FOR EACH ROW EXECUTE FUNCTION products_set_ved_class()""")
+			_execute_with_retry(conn, "DROP TRIGGER IF EXISTS trg_product_categories_ved_class ON product_categories")
+			_execute_with_retry(conn, """CREATE TRIGGER trg_product_categories_ved_class
+				AFTER UPDATE OF name ON product_categories
+				FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+				EXECUTE FUNCTION product_categories_reclassify_ved()""")
+			# Backfill, and pick up keyword list changes shipped since the last start
+			updated = conn.execute(text("""
+				UPDATE products p SET ved_class = c.ved_class
+				FROM (
+					SELECT p2.id, ved_classify(p2.name, pc.name) AS ved_class
+					FROM products p2
+					LEFT JOIN product_categories pc ON pc.id = p2.category_id
+				) c
+				WHERE c.id = p.id AND p.ved_class IS DISTINCT FROM c.ved_class
+			""")).rowcount
+			if updated:
+				print(f'[ensure_product_ved_class] Classified {updated} product(s)')
+	except Exception as e:
+		print(f"[ensure_product_ved_class] Error: {e}")
+
+
+def ensure_tenant_storage_usage() -> None:
+	"""
+	Ensure the tenant storage accounting tables and row-count triggers exist
+	(see services/storage_accounting.py). Tables that do not exist yet are
+	skipped and picked up on a later start. Row counts are backfilled exactly
+	on creation.
+	"""
+	from services.storage_accounting import existing_tables, recount, trigger_function_sql
+	try:
+		with engine.begin() as conn:
+			is_new = conn.execute(text("select to_regclass('public.tenant_storage_usage') is null")).scalar()
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS tenant_row_count_deltas (
+					id bigserial primary key,
+					pharmacy_id bigint not null,
+					table_name text not null,
+					delta bigint not null
+				)
+			"""))
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS tenant_row_counts (
+					pharmacy_id bigint not null references pharmacies(id) on delete cascade,
+					table_name text not null,
+					row_count bigint not null default 0,
+					updated_at timestamptz default now(),
+					primary key (pharmacy_id, table_name)
+				)
+			"""))
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS tenant_storage_usage (
+					pharmacy_id bigint not null references pharmacies(id) on delete cascade,
+					table_name text not null,
+					category text not null,
+					row_count bigint not null default 0,
+					avg_row_bytes numeric(12,2) not null default 0,
+					size_bytes bigint not null default 0,
+					refreshed_at timestamptz default now(),
+					primary key (pharmacy_id, table_name)
+				)
+			"""))
+			new_tables = []
+			for _, table, parent in existing_tables(conn):
+				trigger_exists = conn.execute(text("""
+					select exists (select 1 from pg_trigger where tgname = :name)
+				"""), {'name': f"trg_tenant_rows_{table}_insert"}).scalar()
+				if not trigger_exists:
+					new_tables.append(table)
+				conn.execute(text(trigger_function_sql(table, parent)))
+				# Transition tables allow only one event per trigger
+				for event, referencing in (('insert', 'NEW TABLE AS new_rows'), ('delete', 'OLD TABLE AS old_rows')):
+					trigger = f"trg_tenant_rows_{table}_{event}"
+					_execute_with_retry(conn, f"DROP TRIGGER IF EXISTS {trigger} ON {table}")
+					_execute_with_retry(conn, f"""CREATE TRIGGER {trigger}
+						AFTER {event.upper()} ON {table}
+						REFERENCING {referencing}
+						FOR EACH STATEMENT EXECUTE FUNCTION tenant_rows_{table}_changed()""")
+			# Counts start exact for every table that just got its triggers
+			if new_tables:
+				recount(conn, new_tables)
+			if is_new:
+				print('[ensure_tenant_storage_usage] Storage accounting tables created; run scripts/refresh_tenant_storage.py to fill them')
+	except Exception as e:
+		print(f"[ensure_tenant_storage_usage] Error: {e}")
+
+
+def ensure_support_search() -> None:
+	"""
+	Ensure the full-text search columns and GIN indexes on support tickets,
+	ticket messages and announcements (see services/text_search.py). The
+	``search_vector`` columns are generated, so they never drift from the text.
+	"""
+	from services.text_search import vector_sql
+	searchable = (
+		('support_tickets', vector_sql(('ticket_number', 'A'), ('subject', 'A'), ('description', 'B'))),
+		('support_ticket_messages', vector_sql(('message', 'C'))),
+		('announcements', vector_sql(('title', 'A'), ('content', 'B'))),
+	)
+	try:
+		with engine.begin() as conn:
+			for table, vector in searchable:
+				if conn.execute(text("select to_regclass(:t) is null"), {'t': f'public.{table}'}).scalar():
+					continue
+				_execute_with_retry(conn, f"""
+					ALTER TABLE {table}
+					ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({vector}) STORED
+				""")
+				_execute_with_retry(conn, f"CREATE INDEX IF NOT EXISTS idx_{table}_search_vector ON {table} USING gin (search_vector)")
+	except Exception as e:
+		print(f"[ensure_support_search] Error: {e}")
+
+
+def ensure_announcement_feed_version() -> None:
+	"""
+	Ensure the announcement feed version counter and the statement trigger that
+	bumps it on every change to announcements (see services/announcement_feed.py).
+	"""
+	try:
+		with engine.begin() as conn:
+			if conn.execute(text("select to_regclass('public.announcements') is null")).scalar():
+				return
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS announcement_feed_version (
+					id int primary key default 1 check (id = 1),
+					version bigint not null default 0,
+					updated_at timestamptz default now()
+				)
+			"""))
+			conn.execute(text("INSERT INTO announcement_feed_version (id) VALUES (1) ON CONFLICT (id) DO NOTHING"))
+			conn.execute(text("""
+				CREATE OR REPLACE FUNCTION announcement_feed_bump()
+				RETURNS trigger AS $$
+				BEGIN
+					UPDATE announcement_feed_version SET version = version + 1, updated_at = now() WHERE id = 1;
+					RETURN NULL;
+				END
+				$$ LANGUAGE plpgsql
+			"""))
+			_execute_with_retry(conn, "DROP TRIGGER IF EXISTS trg_announcement_feed_bump ON announcements")
+			_execute_with_retry(conn, """CREATE TRIGGER trg_announcement_feed_bump
+				AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON announcements
+				FOR EACH STATEMENT EXECUTE FUNCTION announcement_feed_bump()""")
+	except Exception as e:
+		print(f"[ensure_announcement_feed_version] Error: {e}")
+
+
+def ensure_live_events() -> None:
+	"""
+	Ensure the live event log and the triggers that fill it (see
+	services/live_events.py). Batch changes log per-pharmacy stock deltas and
+	low-stock crossings, new sales log a sale event and approved inventory
+	requests log their approval. Every logged event is announced with NOTIFY.
+	Ids follow insertion, not commit order, so each event also records the
+	id of its writing transaction; readers resume from a transaction horizon.
+	"""
+	from services.live_events import CHANNEL, MAX_EVENT_ITEMS
+	try:
+		with engine.begin() as conn:
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS live_events (
+					id bigserial primary key,
+					pharmacy_id bigint not null,
+					kind text not null,
+					data jsonb not null default '{}'::jsonb,
+					created_at timestamptz not null default now(),
+					txid bigint not null default txid_current()
+				)
+			"""))
+			_execute_with_retry(conn, "ALTER TABLE live_events ADD COLUMN IF NOT EXISTS txid bigint not null default txid_current()")
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_live_events_pharmacy_id ON live_events(pharmacy_id, id)")
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_live_events_pharmacy_txid ON live_events(pharmacy_id, txid)")
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_live_events_txid ON live_events(txid, id)")
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_live_events_created_at ON live_events(created_at)")
+			# Small events travel in the notification itself; large ones are fetched by id
+			conn.execute(text(f"""
+				CREATE OR REPLACE FUNCTION live_events_notify()
+				RETURNS trigger AS $$
+				DECLARE
+					payload text := json_build_object(
+						'id', NEW.id, 'pharmacy_id', NEW.pharmacy_id, 'kind', NEW.kind,
+						'data', NEW.data, 'created_at', NEW.created_at
+					)::text;
+				BEGIN
+					IF octet_length(payload) > 7000 THEN
+						payload := json_build_object('id', NEW.id, 'pharmacy_id', NEW.pharmacy_id)::text;
+					END IF;
+					PERFORM pg_notify('{CHANNEL}', payload);
+					RETURN NULL;
+				END
+				$$ LANGUAGE plpgsql
+			"""))
+			_execute_with_retry(conn, "DROP TRIGGER IF EXISTS trg_live_events_notify ON live_events")
+			_execute_with_retry(conn, """CREATE TRIGGER trg_live_events_notify
+				AFTER INSERT ON live_events
+				FOR EACH ROW EXECUTE FUNCTION live_events_notify()""")
+
+			# Sellable stock as the POS sees it: received - sold - disposed, excluding expired batches
+			conn.execute(text(f"""
+				CREATE OR REPLACE FUNCTION live_events_stock_changed(p_product_ids bigint[], p_changes bigint[])
+				RETURNS void AS $$
+					WITH delta AS (
+						SELECT d.product_id, SUM(d.change)::bigint AS change
+						FROM unnest(p_product_ids, p_changes) AS d(product_id, change)
+						GROUP BY d.product_id
+						HAVING SUM(d.change) <> 0
+					), stock AS (
+						SELECT p.pharmacy_id, p.id AS product_id, p.name, d.change,
+						       COALESCE(p.reorder_point, 10) AS reorder_point,
+						       COALESCE((
+						           SELECT SUM(b.quantity - COALESCE(b.sold_quantity, 0) - COALESCE(b.disposed_quantity, 0))
+						           FROM inventory_batches b
+						           WHERE b.product_id = p.id
+						             AND (b.expiration_date IS NULL OR b.expiration_date > CURRENT_DATE)
+						       ), 0)::bigint AS current_stock,
+						       row_number() OVER (PARTITION BY p.pharmacy_id ORDER BY p.id) AS n
+						FROM delta d
+						JOIN products p ON p.id = d.product_id
+					)
+					INSERT INTO live_events (pharmacy_id, kind, data)
+					SELECT pharmacy_id, 'stock', jsonb_build_object(
+						'count', count(*),
+						'truncated', count(*) > {MAX_EVENT_ITEMS},
+						'products', jsonb_agg(jsonb_build_object(
+							'product_id', product_id, 'current_stock', current_stock, 'change', change
+						) ORDER BY product_id) FILTER (WHERE n <= {MAX_EVENT_ITEMS})
+					)
+					FROM stock
+					GROUP BY pharmacy_id
+					UNION ALL
+					SELECT pharmacy_id, 'low_stock', jsonb_build_object(
+						'product_id', product_id, 'name', name, 'current_stock', current_stock,
+						'previous_stock', current_stock - change, 'reorder_point', reorder_point
+					)
+					FROM stock
+					WHERE current_stock <= reorder_point AND current_stock - change > reorder_point
+				$$ LANGUAGE sql
+			"""))
+			on_hand = """CASE WHEN expiration_date IS NULL OR expiration_date > CURRENT_DATE
+				THEN quantity - COALESCE(sold_quantity, 0) - COALESCE(disposed_quantity, 0) ELSE 0 END"""
+			conn.execute(text(f"""
+				CREATE OR REPLACE FUNCTION live_events_batches_changed()
+				RETURNS trigger AS $$
+				BEGIN
+					IF TG_OP = 'INSERT' THEN
+						PERFORM live_events_stock_changed(array_agg(product_id), array_agg({on_hand})) FROM new_rows;
+					ELSIF TG_OP = 'UPDATE' THEN
+						PERFORM live_events_stock_changed(array_agg(c.product_id), array_agg(c.change))
+						FROM (
+							SELECT product_id, {on_hand} AS change FROM new_rows
+							UNION ALL
+							SELECT product_id, -({on_hand}) FROM old_rows
+						) c;
+					ELSE
+						PERFORM live_events_stock_changed(array_agg(product_id), array_agg(-({on_hand}))) FROM old_rows;
+					END IF;
+					RETURN NULL;
+				END
+				$$ LANGUAGE plpgsql
+			"""))
+			conn.execute(text(f"""
+				CREATE OR REPLACE FUNCTION live_events_sales_inserted()
+				RETURNS trigger AS $$
+				BEGIN
+					INSERT INTO live_events (pharmacy_id, kind, data)
+					SELECT pharmacy_id, 'sale', jsonb_build_object(
+						'count', count(*),
+						'total_amount', SUM(total_amount),
+						'sales', jsonb_agg(jsonb_build_object(
+							'id', id, 'sale_number', sale_number, 'total_amount', total_amount,
+							'user_id', user_id, 'status', status, 'created_at', created_at
+						) ORDER BY id DESC) FILTER (WHERE n <= {MAX_EVENT_ITEMS})
+					)
+					FROM (
+						SELECT s.*, row_number() OVER (PARTITION BY s.pharmacy_id ORDER BY s.id DESC) AS n
+						FROM new_rows s
+						WHERE s.pharmacy_id IS NOT NULL
+					) s
+					GROUP BY pharmacy_id;
+					RETURN NULL;
+				END
+				$$ LANGUAGE plpgsql
+			"""))
+			conn.execute(text("""
+				CREATE OR REPLACE FUNCTION live_events_requests_approved()
+				RETURNS trigger AS $$
+				BEGIN
+					INSERT INTO live_events (pharmacy_id, kind, data)
+					SELECT n.pharmacy_id, 'inventory_request', jsonb_build_object(
+						'id', n.id, 'product_id', n.product_id, 'quantity_change', n.quantity_change,
+						'reason', n.reason, 'status', n.status, 'approved_by', n.approved_by, 'decided_at', n.decided_at
+					)
+					FROM new_rows n
+					JOIN old_rows o ON o.id = n.id
+					WHERE n.status = 'approved' AND o.status IS DISTINCT FROM 'approved';
+					RETURN NULL;
+				END
+				$$ LANGUAGE plpgsql
+			"""))
+
+			# Transition tables allow only one event per trigger
+			referencing = {
+				'insert': 'NEW TABLE AS new_rows',
+				'update': 'OLD TABLE AS old_rows NEW TABLE AS new_rows',
+				'delete': 'OLD TABLE AS old_rows',
+			}
+			triggers = [
+				('inventory_batches', event, 'live_events_batches_changed') for event in ('insert', 'update', 'delete')
+			] + [
+				('sales', 'insert', 'live_events_sales_inserted'),
+				('inventory_adjustment_requests', 'update', 'live_events_requests_approved'),
+			]
+			for table, event, function in triggers:
+				if conn.execute(text("select to_regclass(:t) is null"), {'t': f'public.{table}'}).scalar():
+					continue
+				trigger = f"trg_live_events_{table}_{event}"
+				_execute_with_retry(conn, f"DROP TRIGGER IF EXISTS {trigger} ON {table}")
+				_execute_with_retry(conn, f"""CREATE TRIGGER {trigger}
+					AFTER {event.upper()} ON {table}
+					REFERENCING {referencing[event]}
+					FOR EACH STATEMENT EXECUTE FUNCTION {function}()""")
+	except Exception as e:
+		print(f"[ensure_live_events] Error: {e}")
+
+
+def ensure_inventory_snapshots() -> None:
+	"""
+	Ensure the daily inventory snapshot tables exist (see
+	services/inventory_snapshots.py). They are filled per pharmacy on first
+	read, or by scripts/snapshot_inventory.py.
+	"""
+	try:
+		with engine.begin() as conn:
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS inventory_daily_snapshots (
+					product_id bigint not null references products(id) on delete cascade,
+					day date not null,
+					pharmacy_id bigint not null,
+					closing_stock bigint not null,
+					received bigint not null default 0,
+					sold bigint not null default 0,
+					returned bigint not null default 0,
+					disposed bigint not null default 0,
+					primary key (product_id, day)
+				)
+			"""))
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_inventory_snapshots_pharmacy_day ON inventory_daily_snapshots(pharmacy_id, day)")
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS inventory_snapshot_state (
+					pharmacy_id bigint primary key references pharmacies(id) on delete cascade,
+					recorded_through date,
+					updated_at timestamptz default now()
+				)
+			"""))
+	except Exception as e:
+		print(f"[ensure_inventory_snapshots] Error: {e}")
+
+
+def ensure_user_identity_changes() -> None:
+	"""
+	Ensure user_identity_changes and the triggers that stamp it when a user's
+	role, pharmacy or active flag changes or the user is deleted (see
+	services/identity.py). Tokens issued before a stamp stop being trusted.
+	"""
+	try:
+		with engine.begin() as conn:
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS user_identity_changes (
+					user_id bigint primary key,
+					changed_at timestamptz not null default now()
+				)
+			"""))
+			_execute_with_retry(conn, "CREATE INDEX IF NOT EXISTS idx_user_identity_changes_changed_at ON user_identity_changes(changed_at)")
+			# clock_timestamp(): a long transaction must not stamp the change before the token it revokes
+			conn.execute(text("""
+				CREATE OR REPLACE FUNCTION user_identity_changed()
+				RETURNS trigger AS $$
+				BEGIN
+					INSERT INTO user_identity_changes (user_id, changed_at)
+					VALUES (OLD.id, clock_timestamp())
+					ON CONFLICT (user_id) DO UPDATE SET changed_at = excluded.changed_at;
+					RETURN NULL;
+				END;
+				$$ LANGUAGE plpgsql
+			"""))
+			conn.execute(text("DROP TRIGGER IF EXISTS trg_user_identity_updated ON users"))
+			conn.execute(text("""
+				CREATE TRIGGER trg_user_identity_updated
+				AFTER UPDATE OF role, pharmacy_id, is_active ON users
+				FOR EACH ROW
+				WHEN (OLD.role IS DISTINCT FROM NEW.role
+					OR OLD.pharmacy_id IS DISTINCT FROM NEW.pharmacy_id
+					OR OLD.is_active IS DISTINCT FROM NEW.is_active)
+				EXECUTE FUNCTION user_identity_changed()
+			"""))
+			conn.execute(text("DROP TRIGGER IF EXISTS trg_user_identity_deleted ON users"))
+			conn.execute(text("""
+				CREATE TRIGGER trg_user_identity_deleted
+				AFTER DELETE ON users
+				FOR EACH ROW
+				EXECUTE FUNCTION user_identity_changed()
+			"""))
+	except Exception as e:
+		print(f"[ensure_user_identity_changes] Error: {e}")
+
+
+def ensure_reorder_forecast_rates() -> None:
+	"""
+	Ensure reorder_forecast_rates exists: one forecast mean daily demand per
+	product with a trained model, written by scripts/run_reorder_engine.py and
+	read by the reorder engine in place of the rolling rate (services/reorder.py).
+	"""
+	try:
+		with engine.begin() as conn:
+			conn.execute(text("""
+				CREATE TABLE IF NOT EXISTS reorder_forecast_rates (
+					pharmacy_id bigint not null references pharmacies(id) on delete cascade,
+					product_id bigint not null references products(id) on delete cascade,
+					daily_rate double precision not null check (daily_rate >= 0),
+					horizon_days int not null,
+					computed_at timestamptz not null default now(),
+					primary key (pharmacy_id, product_id)
+				)
+			"""))
+	except Exception as e:
+		print(f"[ensure_reorder_forecast_rates] Error: {e}")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Flask app serving only the live events stream (/api/events/stream).
+
+A gthread worker spends one thread per open stream, so the main app caps
+streams at LIVE_EVENTS_MAX_STREAMS and keeps its threads for the API. This
+app runs the same blueprint under gevent, where an open stream is a greenlet
+waiting on its queue, so one worker holds thousands of them:
+
+    gunicorn events_app:app --worker-class gevent --worker-connections 2000
+
+The gevent worker monkey-patches the standard library before this module is
+imported; psycopg detects that and waits cooperatively. Point the frontend at
+it with REACT_APP_EVENTS_BASE. The schema is bootstrapped by the main app.
+"""
+
+import os
+import logging
+from datetime import timedelta
+from flask import Flask, jsonify
+from flask_cors import CORS
+from flask_jwt_extended import JWTManager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Streams are greenlets here, not threads; allow as many as the worker accepts connections
+os.environ.setdefault('LIVE_EVENTS_MAX_STREAMS', os.getenv('EVENTS_WORKER_CONNECTIONS', '2000'))
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=False, allow_headers=["Content-Type", "Authorization", "Last-Event-ID"], methods=["GET", "OPTIONS"])
+# Must match app.py: the tokens are issued there
+app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'dev-secret')
+app.config['SECRET_KEY'] = os.getenv('APP_SECRET_KEY', 'dev-app-secret')
+app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+jwt = JWTManager(app)
+
+
+@jwt.unauthorized_loader
+def _jwt_unauthorized(err):
+    return jsonify({'success': False, 'error': 'Missing or invalid authorization header'}), 401
+
+@jwt.invalid_token_loader
+def _jwt_invalid(err):
+    return jsonify({'success': False, 'error': 'Invalid token'}), 401
+
+@jwt.expired_token_loader
+def _jwt_expired(jwt_header, jwt_payload):
+    return jsonify({'success': False, 'error': 'Token expired'}), 401
+
+
+from routes.events import events_bp, live_event_hub  # noqa: E402
+from services.live_events import MAX_STREAMS  # noqa: E402
+
+app.register_blueprint(events_bp)
+
+
+@app.get('/api/health')
+def health():
+    return jsonify({
+        'status': 'healthy',
+        'service': 'Live events',
+        'streams': live_event_hub.subscriber_count(),
+        'max_streams': MAX_STREAMS,
+    })
@@ -51,15 +51,13 @@ class ForecastingService:
     """Simplified forecasting service with multi-model comparison"""
 
     def __init__(self, db_connection_string: Optional[str] = None) -> None:
-        if db_connection_string is None:
-            from utils.helpers import get_database_url
-            db_connection_string = get_database_url()
         self.db_connection_string = db_connection_string
-        self.engine: Optional[Engine] = (
-            create_engine(self.db_connection_string)
-            if self.db_connection_string
-            else None
-        )
+        if db_connection_string is None:
+            # The app's shared engine and pool
+            from utils.helpers import get_engine
+            self.engine: Optional[Engine] = get_engine()
+        else:
+            self.engine = create_engine(db_connection_string) if db_connection_string else None
         # Models directory - use relative to this file's location
         base_dir = os.path.dirname(os.path.abspath(__file__))
         self.models_dir = os.path.join(base_dir, 'ai_models')
@@ -78,7 +76,7 @@ class ForecastingService:
         category_id: Optional[int] = None,
         days: int = 365,
     ) -> pd.DataFrame:
-        """Get historical sales data from database"""
+        """Get historical sales data (seeded history + daily sales rollup for the last 30 days)"""
         if not self.engine:
             return pd.DataFrame()
 
@@ -107,15 +105,12 @@ class ForecastingService:
                 ),
                 recent_sales AS (
                     SELECT 
-                        DATE(s.created_at) AS sale_date,
-                        SUM(si.quantity) AS quantity
-                    FROM sales s
-                    JOIN sale_items si ON s.id = si.sale_id
-                    WHERE s.pharmacy_id = :ph AND si.product_id = :pid
-                      AND s.status = 'completed'
-                      AND DATE(s.created_at) >= :recent_cutoff
-                      AND DATE(s.created_at) <= :end
-                    GROUP BY DATE(s.created_at)
+                        r.day AS sale_date,
+                        r.quantity_sold AS quantity
+                    FROM sales_rollup_product_daily r
+                    WHERE r.pharmacy_id = :ph AND r.product_id = :pid
+                      AND r.day >= :recent_cutoff
+                      AND r.day <= :end
                 ),
                 combined AS (
                     SELECT sale_date, quantity FROM historical_data
@@ -144,16 +139,14 @@ class ForecastingService:
                 ),
                 recent_sales AS (
                     SELECT 
-                        DATE(s.created_at) AS sale_date,
-                        SUM(si.quantity) AS quantity
-                    FROM sales s
-                    JOIN sale_items si ON s.id = si.sale_id
-                    JOIN products p ON p.id = si.product_id
-                    WHERE s.pharmacy_id = :ph AND p.category_id = :cid
-                      AND s.status = 'completed'
-                      AND DATE(s.created_at) >= :recent_cutoff
-                      AND DATE(s.created_at) <= :end
-                    GROUP BY DATE(s.created_at)
+                        r.day AS sale_date,
+                        SUM(r.quantity_sold) AS quantity
+                    FROM sales_rollup_product_daily r
+                    JOIN products p ON p.id = r.product_id
+                    WHERE r.pharmacy_id = :ph AND p.category_id = :cid
+                      AND r.day >= :recent_cutoff
+                      AND r.day <= :end
+                    GROUP BY r.day
                 ),
                 combined AS (
                     SELECT sale_date, quantity FROM historical_data
@@ -535,6 +528,7 @@ class ForecastingService:
                 models.append({
                     'target_id': data.get('target_id'),
                     'target_name': data.get('target_name'),
+                    'target_type': data.get('model_type', 'product'),
                     'model_type': data.get('meta', {}).get('type') or data.get('model_type'),
                     'accuracy_percentage': metrics.get('accuracy'),
                     'mae': metrics.get('mae'),
@@ -1,7 +1,7 @@
 """Admin routes - User, Pharmacy, Subscription, and Signup Request management"""
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from dotenv import load_dotenv
 import bcrypt
 import os
@@ -13,16 +13,19 @@ from datetime import datetime
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 load_dotenv()
-from utils.helpers import get_database_url
+from utils.helpers import get_current_user, get_engine
+from utils.sql_profiler import profiler_snapshot, explain_slow_query, clear_profiler_buffers
+from utils.pagination import Keyset, KeysetPage, InvalidCursor
+from services.storage_accounting import STORAGE_LIMIT_GB, storage_breakdown
+from services.identity import identity_cache
 
-DATABASE_URL = get_database_url()
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = get_engine()
 
 admin_bp = Blueprint('admin', __name__)
 
 def _require_admin(conn, user_id):
 	"""Helper to check if user is admin"""
-	me = conn.execute(text('select id, role from users where id = :id'), {'id': user_id}).mappings().first()
+	me = get_current_user(conn, user_id)
 	if not me or me['role'] != 'admin':
 		from flask import abort
 		abort(403, description='Forbidden')
@@ -127,6 +130,7 @@ def admin_update_user_status(user_id):
 				
 				if not row:
 					return jsonify({'success': False, 'error': 'User not found'}), 404
+				identity_cache.forget(user_id)
 				
 				return jsonify({'success': True, 'user': dict(row)})
 		except Exception as e:
@@ -144,9 +148,15 @@ def admin_list_pharmacies():
 	with engine.connect() as conn:
 		_require_admin(conn, user_id)
 		rows = conn.execute(text('''
-			select id, name, address, phone, email, license_number, owner_name, is_active, created_at, updated_at
-			from pharmacies
-			order by name asc
+			select ph.id, ph.name, ph.address, ph.phone, ph.email, ph.license_number, ph.owner_name, ph.is_active,
+				ph.created_at, ph.updated_at, coalesce(u.size_bytes, 0) as storage_bytes, u.refreshed_at as storage_refreshed_at
+			from pharmacies ph
+			left join (
+				select pharmacy_id, sum(size_bytes) as size_bytes, max(refreshed_at) as refreshed_at
+				from tenant_storage_usage
+				group by pharmacy_id
+			) u on u.pharmacy_id = ph.id
+			order by ph.name asc
 		''')).mappings().all()
 		return jsonify({'success': True, 'pharmacies': [dict(r) for r in rows]})
 
@@ -205,12 +215,14 @@ def admin_deactivate_pharmacy(pharmacy_id):
 					return jsonify({'success': False, 'error': 'Pharmacy not found'}), 404
 				
 				# Deactivate all users associated with this pharmacy (except admin accounts)
-				users_deactivated = conn.execute(text('''
+				deactivated_ids = conn.execute(text('''
 					update users
 					set is_active = false, updated_at = now()
 					where pharmacy_id = :pharmacy_id and is_active = true and role != 'admin'
 					returning id
-				'''), {'pharmacy_id': pharmacy_id}).rowcount
+				'''), {'pharmacy_id': pharmacy_id}).scalars().all()
+				users_deactivated = len(deactivated_ids)
+				identity_cache.forget(*deactivated_ids)
 				
 				# Deactivate the pharmacy
 				conn.execute(text('''
@@ -272,65 +284,29 @@ def admin_get_pharmacy_storage(pharmacy_id):
 		if not pharmacy:
 			return jsonify({'success': False, 'error': 'Pharmacy not found'}), 404
 		
-		# Calculate general storage usage by category
-		storage_stats = conn.execute(text('''
-			with table_stats as (
-				select 
-					'products' as category_name,
-					count(*) as record_count,
-					200 as avg_bytes_per_record
-				from products where pharmacy_id = :pid
-				union all
-				select 
-					'inventory' as category_name,
-					count(*) as record_count,
-					150 as avg_bytes_per_record
-				from inventory_batches b
-				join products p on p.id = b.product_id
-				where p.pharmacy_id = :pid
-				union all
-				select 
-					'transactions' as category_name,
-					count(*) as record_count,
-					400 as avg_bytes_per_record
-				from sales where pharmacy_id = :pid
-				union all
-				select 
-					'users' as category_name,
-					count(*) as record_count,
-					150 as avg_bytes_per_record
-				from users where pharmacy_id = :pid
-				union all
-				select 
-					'support' as category_name,
-					count(*) as record_count,
-					225 as avg_bytes_per_record
-				from support_tickets where pharmacy_id = :pid
-			)
-			select 
-				category_name,
-				(record_count * avg_bytes_per_record) as size_bytes,
-				pg_size_pretty((record_count * avg_bytes_per_record)::bigint) as total_size
-			from table_stats
-			where record_count > 0
-			order by size_bytes desc
-		'''), {'pid': pharmacy_id}).mappings().all()
+		# Usage by category as of the last storage accounting run (scripts/refresh_tenant_storage.py)
+		storage_stats = storage_breakdown(conn, pharmacy_id)
+		refreshed_at = max((row['refreshed_at'] for row in storage_stats if row['refreshed_at']), default=None)
 		
 		# Calculate totals
-		total_size_bytes = sum(row['size_bytes'] or 0 for row in storage_stats)
-		storage_limit_gb = 10
+		total_size_bytes = int(sum(row['size_bytes'] or 0 for row in storage_stats))
+		storage_limit_gb = STORAGE_LIMIT_GB
 		storage_limit_bytes = storage_limit_gb * 1024 * 1024 * 1024
 		usage_percentage = (total_size_bytes / storage_limit_bytes * 100) if storage_limit_bytes > 0 else 0
 		
 		return jsonify({
 			'success': True,
 			'pharmacy': dict(pharmacy),
-			'storage_breakdown': [dict(row) for row in storage_stats],
+			'storage_breakdown': [
+				{k: row[k] for k in ('category_name', 'record_count', 'size_bytes', 'total_size')}
+				for row in storage_stats
+			],
 			'summary': {
 				'total_size_bytes': total_size_bytes,
 				'total_size_pretty': f"{total_size_bytes / (1024*1024):.2f} MB" if total_size_bytes > 0 else "0 MB",
 				'storage_limit_gb': storage_limit_gb,
-				'usage_percentage': round(usage_percentage, 2)
+				'usage_percentage': round(usage_percentage, 2),
+				'refreshed_at': refreshed_at.isoformat() if refreshed_at else None
 			}
 		})
 
@@ -650,10 +626,13 @@ def admin_delete_subscription_plan(plan_id):
 # SUBSCRIPTION MANAGEMENT
 # =========================
 
+SUBSCRIPTIONS_KEYSET = Keyset('subscriptions', [('s.created_at', 'created_at'), ('s.id', 'id')])
+
+
 @admin_bp.get('/api/admin/subscriptions')
 @jwt_required()
 def admin_list_subscriptions():
-	"""List all subscriptions with pharmacy information (admin only) - supports filtering, search, and pagination"""
+	"""List all subscriptions with pharmacy information (admin only) - supports filtering, search, and keyset pagination"""
 	user_id = get_jwt_identity()
 	
 	# Get query parameters
@@ -661,19 +640,16 @@ def admin_list_subscriptions():
 	status_filter = request.args.get('status', 'all')
 	plan_filter = request.args.get('plan', 'all')
 	pharmacy_filter = request.args.get('pharmacy_id', 'all')
-	page = int(request.args.get('page', 1))
-	per_page = int(request.args.get('per_page', 10))
+	try:
+		page = KeysetPage.from_request(SUBSCRIPTIONS_KEYSET, default_limit=10, limit_arg='per_page', default_count='exact')
+	except InvalidCursor as e:
+		return jsonify({'success': False, 'error': str(e)}), 400
 	
 	with engine.connect() as conn:
 		_require_admin(conn, user_id)
 		
-		# Build query with filters
-		query = '''
-			select 
-				s.id, s.pharmacy_id, s.plan, s.status, s.start_date, s.end_date, s.price,
-				s.billing_cycle_months, s.next_billing_at, s.xendit_payment_id, s.gcash_payment_id, 
-				s.payment_method, s.created_at, s.updated_at,
-				p.name as pharmacy_name
+		# Build filters (shared by the page query and the count)
+		from_where = '''
 			from subscriptions s
 			left join pharmacies p on p.id = s.pharmacy_id
 			where 1=1
@@ -682,53 +658,53 @@ def admin_list_subscriptions():
 		
 		# Search filter (pharmacy name or plan)
 		if search:
-			query += ' and (lower(p.name) like :search or lower(s.plan::text) like :search)'
+			from_where += ' and (lower(p.name) like :search or lower(s.plan::text) like :search)'
 			params['search'] = f'%{search.lower()}%'
 		
 		# Status filter
 		if status_filter != 'all':
-			query += ' and s.status::text = :status'
+			from_where += ' and s.status::text = :status'
 			params['status'] = status_filter.lower()
 		
 		# Plan filter
 		if plan_filter != 'all':
-			query += ' and lower(s.plan::text) = :plan'
+			from_where += ' and lower(s.plan::text) = :plan'
 			params['plan'] = plan_filter.lower()
 		
 		# Pharmacy filter
 		if pharmacy_filter != 'all':
 			try:
 				pharmacy_id = int(pharmacy_filter)
-				query += ' and s.pharmacy_id = :pharmacy_id'
+				from_where += ' and s.pharmacy_id = :pharmacy_id'
 				params['pharmacy_id'] = pharmacy_id
 			except (ValueError, TypeError):
 				pass
 		
-		# Get total count for pagination
-		count_query = query.replace('select \n\t\t\t\ts.id, s.pharmacy_id, s.plan, s.status, s.start_date, s.end_date, s.price,\n\t\t\t\ts.billing_cycle_months, s.next_billing_at, s.xendit_payment_id, s.gcash_payment_id, \n\t\t\t\ts.payment_method, s.created_at, s.updated_at,\n\t\t\t\tp.name as pharmacy_name', 'select count(*) as total')
-		total_result = conn.execute(text(count_query), params).mappings().first()
-		total = total_result['total'] if total_result else 0
-		
-		# Add ordering and pagination
-		query += ' order by s.created_at desc'
-		offset = (page - 1) * per_page
-		query += ' limit :limit offset :offset'
-		params['limit'] = per_page
-		params['offset'] = offset
+		total = page.total(conn, from_where, params, table='subscriptions', filtered=bool(params))
 		
-		rows = conn.execute(text(query), params).mappings().all()
-		
-		total_pages = (total + per_page - 1) // per_page if per_page > 0 else 0
+		rows = conn.execute(text(f'''
+			select 
+				s.id, s.pharmacy_id, s.plan, s.status, s.start_date, s.end_date, s.price,
+				s.billing_cycle_months, s.next_billing_at, s.xendit_payment_id, s.gcash_payment_id, 
+				s.payment_method, s.created_at, s.updated_at,
+				p.name as pharmacy_name
+			{from_where}
+			and {page.condition(params)}
+			order by {page.order_by()}
+			{page.limit_clause(params)}
+		'''), params).mappings().all()
+		rows, pagination = page.finish(rows, total)
+		
+		per_page = page.limit
+		if total is not None:
+			pagination['total_pages'] = (total + per_page - 1) // per_page
+		pagination['page'] = request.args.get('page', 1, type=int)
+		pagination['per_page'] = per_page
 		
 		return jsonify({
 			'success': True,
 			'subscriptions': [dict(r) for r in rows],
-			'pagination': {
-				'page': page,
-				'per_page': per_page,
-				'total': total,
-				'total_pages': total_pages
-			}
+			'pagination': pagination
 		})
 
 @admin_bp.post('/api/admin/subscriptions')
@@ -994,3 +970,41 @@ def admin_delete_subscription(subscription_id):
 		except Exception as e:
 			return jsonify({'success': False, 'error': str(e)}), 400
 
+
+# =========================
+# DEBUG: SQL PROFILING
+# =========================
+
+@admin_bp.get('/api/admin/debug/sql')
+@jwt_required()
+def admin_sql_profile():
+	"""Slow-query ring buffer and recent per-request SQL profiles (admin only)"""
+	user_id = get_jwt_identity()
+	with engine.connect() as conn:
+		_require_admin(conn, user_id)
+	return jsonify({'success': True, **profiler_snapshot()})
+
+@admin_bp.post('/api/admin/debug/sql/slow/<int:entry_id>/explain')
+@jwt_required()
+def admin_sql_explain(entry_id):
+	"""Capture EXPLAIN (ANALYZE, BUFFERS) for a buffered slow query (admin only)"""
+	user_id = get_jwt_identity()
+	with engine.connect() as conn:
+		_require_admin(conn, user_id)
+	try:
+		entry, error = explain_slow_query(engine, entry_id)
+	except Exception as e:
+		return jsonify({'success': False, 'error': str(e)}), 400
+	if error:
+		return jsonify({'success': False, 'error': error}), 404 if error == 'Slow query not found' else 400
+	return jsonify({'success': True, 'query': entry})
+
+@admin_bp.delete('/api/admin/debug/sql')
+@jwt_required()
+def admin_sql_profile_clear():
+	"""Clear the SQL profiler buffers (admin only)"""
+	user_id = get_jwt_identity()
+	with engine.connect() as conn:
+		_require_admin(conn, user_id)
+	clear_profiler_buffers()
+	return jsonify({'success': True})
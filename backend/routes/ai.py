@@ -4,7 +4,7 @@ import requests
 import time
 from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from dotenv import load_dotenv
 import pandas as pd
 import numpy as np
@@ -28,7 +28,7 @@ from services.advanced_conversational_ai import advanced_conversational_ai
 from services.advanced_intent_classifier import advanced_intent_classifier
 from services.ultra_advanced_ai import ultra_advanced_ai
 from services.ai_metrics import record_feedback as record_feedback_metric
-from utils.helpers import get_database_url
+from utils.helpers import get_engine
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -37,8 +37,7 @@ logger = logging.getLogger(__name__)
 ai_bp = Blueprint('ai', __name__, url_prefix='/api/ai')
 
 # Database connection
-DATABASE_URL = get_database_url()
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = get_engine()
 
 # Cache for medical information (in production, use Redis)
 medical_cache = {}
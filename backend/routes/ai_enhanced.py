@@ -7,7 +7,7 @@ import os
 import time
 import pandas as pd
 from flask import Blueprint, request, jsonify
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from dotenv import load_dotenv
 import logging
 
@@ -65,10 +65,9 @@ from pathlib import Path
 
 # Add parent directory to path to import utils
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
-from utils.helpers import get_database_url
+from utils.helpers import get_engine
 
-DATABASE_URL = get_database_url()
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = get_engine()
 
 @ai_enhanced_bp.route('/build-index', methods=['POST'])
 def build_semantic_index():
@@ -1,7 +1,7 @@
 """Authentication routes"""
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from dotenv import load_dotenv
 import bcrypt
 import os
@@ -15,10 +15,10 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 load_dotenv()
-from utils.helpers import get_database_url
+from utils.helpers import get_engine
+from services.identity import identity_claims
 
-DATABASE_URL = get_database_url()
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = get_engine()
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -248,7 +248,7 @@ def login():
 		return jsonify({'error': 'Invalid credentials'}), 401
 
 	user = {k: row[k] for k in ['id','email','username','role','pharmacy_id']}
-	token = create_access_token(identity=str(row['id']))
+	token = create_access_token(identity=str(row['id']), additional_claims=identity_claims(row))
 	return jsonify({'user': user, 'access_token': token})
 
 
@@ -0,0 +1,61 @@
+"""Live pharmacy events (server-sent events) blueprint"""
+from flask import Blueprint, Response, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from dotenv import load_dotenv
+import sys
+from pathlib import Path
+
+# Add parent directory to path to import utils
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+load_dotenv()
+from utils.helpers import get_current_user, get_engine
+from services.live_events import EVENT_KINDS, MAX_STREAMS, LiveEventHub
+
+engine = get_engine()
+
+events_bp = Blueprint('events', __name__, url_prefix='/api/events')
+
+# One LISTEN connection per worker, shared by every subscriber of the process
+live_event_hub = LiveEventHub(engine)
+
+
+@events_bp.get('/stream')
+@jwt_required(locations=['headers', 'query_string'])
+def event_stream():
+	"""
+	Server-sent events of the caller's pharmacy: ``stock``, ``low_stock``, ``sale``
+	and ``inventory_request`` (see services/live_events.py), plus ``resync`` when
+	the client must refetch instead. EventSource cannot send headers, so the
+	token may be passed as ``?jwt=``. ``?kinds=stock,sale`` limits the kinds.
+	Reconnects resume from ``Last-Event-ID`` (or ``?last_event_id=``).
+	Answers 503 while the worker already serves ``LIVE_EVENTS_MAX_STREAMS``
+	streams; clients keep polling meanwhile. Deployed on its own under gevent
+	by events_app.py, which sets that cap to the worker's connection limit.
+	"""
+	kinds = None
+	if request.args.get('kinds'):
+		kinds = {k.strip() for k in request.args['kinds'].split(',') if k.strip()}
+		unknown = sorted(kinds - set(EVENT_KINDS))
+		if unknown:
+			return jsonify({'success': False, 'error': f"Unknown event kinds: {', '.join(unknown)}"}), 400
+	last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+	try:
+		last_event_id = int(last_event_id) if last_event_id else None
+	except ValueError:
+		return jsonify({'success': False, 'error': 'Last-Event-ID must be an integer'}), 400
+
+	with engine.connect() as conn:
+		me = get_current_user(conn, get_jwt_identity())
+	if not me or me['pharmacy_id'] is None:
+		return jsonify({'success': False, 'error': 'Forbidden'}), 403
+
+	if live_event_hub.subscriber_count() >= MAX_STREAMS:
+		return jsonify({'success': False, 'error': 'Too many live event streams, retry later'}), 503, {'Retry-After': '60'}
+
+	subscription = live_event_hub.subscribe(int(me['pharmacy_id']), last_event_id, kinds)
+	return Response(
+		live_event_hub.stream(subscription),
+		mimetype='text/event-stream',
+		headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+	)
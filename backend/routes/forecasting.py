@@ -7,32 +7,27 @@ from pathlib import Path
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from forecasting_service import ForecastingService
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from dotenv import load_dotenv
 
 # Add parent directory to path to import utils
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 load_dotenv()
-from utils.helpers import get_database_url
+from utils.helpers import get_current_user, get_engine
 
-DATABASE_URL = get_database_url()
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = get_engine()
 
 forecasting_bp = Blueprint('forecasting', __name__, url_prefix='/api/forecasting')
-forecasting_service = ForecastingService(DATABASE_URL)
+forecasting_service = ForecastingService()
 
 
 def _get_user_pharmacy_id(user_id):
     """Helper to get user's pharmacy_id"""
-    with engine.connect() as conn:
-        user_row = conn.execute(
-            text('SELECT pharmacy_id FROM users WHERE id = :id'),
-            {'id': user_id}
-        ).mappings().first()
-        if not user_row:
-            return None
-        return user_row['pharmacy_id']
+    user_row = get_current_user(engine, user_id)
+    if not user_row:
+        return None
+    return user_row['pharmacy_id']
 
 
 @forecasting_bp.route('/train', methods=['POST'])
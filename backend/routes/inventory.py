@@ -5,17 +5,17 @@ import sys
 from pathlib import Path
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from dotenv import load_dotenv
 
 # Add parent directory to path to import utils
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 load_dotenv()
-from utils.helpers import get_database_url
+from utils.helpers import get_current_user, get_engine
+from utils.result_cache import invalidates_analytics
 
-DATABASE_URL = get_database_url()
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = get_engine()
 
 inventory_bp = Blueprint('inventory', __name__, url_prefix='/api/inventory')
 
@@ -38,7 +38,7 @@ def create_inventory_request():
     except (ValueError, TypeError):
         return jsonify({'success': False, 'error': 'Invalid quantity value'}), 400
     with engine.begin() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me:
             return jsonify({'success': False, 'error': 'User not found'}), 404
         prod = conn.execute(text('select id, pharmacy_id from products where id = :pid'), {'pid': product_id}).mappings().first()
@@ -62,7 +62,7 @@ def list_inventory_requests():
     page = max(page, 1)
     page_size = max(min(page_size, 100), 1)
     with engine.connect() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me:
             return jsonify({'success': False, 'error': 'User not found'}), 404
         params = {'ph': me['pharmacy_id']}
@@ -104,10 +104,11 @@ def list_inventory_requests():
 
 @inventory_bp.post('/requests/<int:req_id>/approve')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def approve_inventory_request(req_id: int):
     user_id = get_jwt_identity()
     with engine.begin() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin','staff'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         req = conn.execute(text('select * from inventory_adjustment_requests where id = :id'), {'id': req_id}).mappings().first()
@@ -162,7 +163,7 @@ def approve_inventory_request(req_id: int):
 def reject_inventory_request(req_id: int):
     user_id = get_jwt_identity()
     with engine.begin() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin','staff'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         req = conn.execute(text('select * from inventory_adjustment_requests where id = :id'), {'id': req_id}).mappings().first()
@@ -182,7 +183,7 @@ def update_inventory_request(req_id: int):
     user_id = get_jwt_identity()
     data = request.get_json(force=True) or {}
     with engine.begin() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me:
             return jsonify({'success': False, 'error': 'User not found'}), 404
         req = conn.execute(text('select id, requested_by, status, pharmacy_id from inventory_adjustment_requests where id = :id'), {'id': req_id}).mappings().first()
@@ -1,19 +1,40 @@
 """Manager routes blueprint"""
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, send_file, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from dotenv import load_dotenv
 import bcrypt
+import json
+import logging
 import os
 import time
 from datetime import datetime, timedelta
 from collections import defaultdict
 from utils.helpers import get_current_user, require_manager_or_admin, date_range_params
+from services.period_report import DEFAULT_TOP_K, PERIOD_GRAINS, period_report
+from services.po_receiving import (
+    PurchaseOrderCancelled, PurchaseOrderNotFound, ReceivingError, ReceivingQuantityError,
+    apply_item_edits, parse_receipt_lines, receive_purchase_order
+)
+from services.reorder import (
+    DEFAULT_REVIEW_DAYS, DEFAULT_SERVICE_Z,
+    compute_plan, create_draft_orders, group_by_supplier, load_forecast_rates, load_inputs
+)
+from services.abc_ved import classify as classify_abc_ved
+from services.expiry_risk import ensure_current, expiry_alerts, product_risk_rows, window_predicate
+from services.inventory_snapshots import HISTORY_GRAINS, inventory_history as snapshot_history
+from services.disposal import DEFAULT_CHUNK_PRODUCTS, DISPOSAL_REASON, DisposalStats, iter_dispose_expired
+from services.sales_rollup import fold_pharmacy_deltas
+from services.returns import ReturnNotFound, ReturnQuantityError, ReturnValidationError, parse_return_items, record_return
+from services.report_export import ReportQuery, check_format, export_filename, export_jobs, stream_report, EXPORT_FORMATS
+from utils.result_cache import bump_generation, cached_analytics, invalidates_analytics
+from utils.pagination import InvalidCursor, Keyset, KeysetPage
 from database.schema import (
 	ensure_returns_tables,
 	ensure_products_reorder_supplier_columns,
 	ensure_inventory_expiration_column,
-	ensure_announcements_table
+	ensure_announcements_table,
+	PURCHASE_ORDER_RECEIPTS_DDL
 )
 
 load_dotenv()
@@ -23,10 +44,10 @@ from pathlib import Path
 
 # Add parent directory to path to import utils
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
-from utils.helpers import get_database_url
+from utils.helpers import get_engine
 
-DATABASE_URL = get_database_url()
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = get_engine()
+logger = logging.getLogger(__name__)
 
 manager_bp = Blueprint('manager', __name__, url_prefix='/api/manager')
 
@@ -45,7 +66,7 @@ def create_inventory_request():
 	if qty is None or product_id is None:
 		return jsonify({'success': False, 'error': 'product_id and quantity_change are required'}), 400
 	with engine.begin() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me:
 			return jsonify({'success': False, 'error': 'User not found'}), 404
 		# verify product belongs to same pharmacy
@@ -71,7 +92,7 @@ def list_inventory_requests():
 	page_size = max(min(page_size, 100), 1)
 	with engine.connect() as conn:
 		_ensure_batches_table(conn)
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me:
 			return jsonify({'success': False, 'error': 'User not found'}), 404
 		params = {'ph': me['pharmacy_id']}
@@ -114,10 +135,11 @@ def list_inventory_requests():
 
 @manager_bp.post('/api/inventory/requests/<int:req_id>/approve')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def approve_inventory_request(req_id: int):
 	user_id = get_jwt_identity()
 	with engine.begin() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('manager','admin','staff'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		req = conn.execute(text('select * from inventory_adjustment_requests where id = :id'), {'id': req_id}).mappings().first()
@@ -172,7 +194,7 @@ def approve_inventory_request(req_id: int):
 def reject_inventory_request(req_id: int):
 	user_id = get_jwt_identity()
 	with engine.begin() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('manager','admin','staff'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		req = conn.execute(text('select * from inventory_adjustment_requests where id = :id'), {'id': req_id}).mappings().first()
@@ -189,6 +211,7 @@ def reject_inventory_request(req_id: int):
 
 @manager_bp.patch('/inventory/<int:product_id>')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def manager_update_inventory(product_id: int):
 	data = request.get_json(force=True) or {}
 	user_id = get_jwt_identity()
@@ -196,7 +219,7 @@ def manager_update_inventory(product_id: int):
 	if new_stock is None or int(new_stock) < 0:
 		return jsonify({'success': False, 'error': 'current_stock must be provided and non-negative'}), 400
 	with engine.begin() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('manager','admin','staff'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		prod = conn.execute(text('select id, pharmacy_id from products where id = :pid'), {'pid': product_id}).mappings().first()
@@ -213,6 +236,7 @@ def manager_update_inventory(product_id: int):
 
 @manager_bp.post('/products')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def manager_create_product():
 	data = request.get_json(force=True) or {}
 	name = (data.get('name') or '').strip()
@@ -224,7 +248,7 @@ def manager_create_product():
 		return jsonify({'success': False, 'error': 'name, unit_price, cost_price, category_id are required'}), 400
 	user_id = get_jwt_identity()
 	with engine.begin() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('manager','admin','staff'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		ensure_products_reorder_supplier_columns()
@@ -244,11 +268,12 @@ def manager_create_product():
 
 @manager_bp.patch('/products/<int:product_id>')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def manager_update_product(product_id: int):
 	data = request.get_json(force=True) or {}
 	user_id = get_jwt_identity()
 	with engine.begin() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('staff','manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		fields = {}
@@ -287,10 +312,11 @@ def manager_update_product(product_id: int):
 
 @manager_bp.delete('/products/<int:product_id>')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def manager_deactivate_product(product_id: int):
 	user_id = get_jwt_identity()
 	with engine.begin() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('staff','manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		row = conn.execute(text('''
@@ -308,7 +334,7 @@ def manager_list_products():
 	status = request.args.get('status', 'active')  # active | inactive | all
 	user_id = get_jwt_identity()
 	with engine.connect() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('staff','manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		where_status = ''
@@ -338,10 +364,11 @@ def manager_list_products():
 
 @manager_bp.post('/products/<int:product_id>/reactivate')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def manager_reactivate_product(product_id: int):
 	user_id = get_jwt_identity()
 	with engine.begin() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('staff','manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		row = conn.execute(text('''
@@ -355,10 +382,11 @@ def manager_reactivate_product(product_id: int):
 
 @manager_bp.delete('/products/<int:product_id>/hard')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def manager_hard_delete_product(product_id: int):
 	user_id = get_jwt_identity()
 	with engine.begin() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('staff','manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		try:
@@ -380,7 +408,7 @@ def create_category():
 		return jsonify({'success': False, 'error': 'name is required'}), 400
 	user_id = get_jwt_identity()
 	with engine.begin() as conn:
-		me = conn.execute(text('select id, role from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		row = conn.execute(text('''
@@ -492,21 +520,21 @@ def change_password():
 
 @manager_bp.get('/analytics/overview')
 @jwt_required()
+@cached_analytics(engine, 'analytics_overview', ('sales', 'inventory'))
 def analytics_overview():
 	user_id = get_jwt_identity()
 	frm, to = date_range_params()
 	with engine.connect() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('staff','manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		params = {'ph': me['pharmacy_id'], 'from': frm, 'to': to}
+		fold_pharmacy_deltas(conn, me['pharmacy_id'])
 		# Turnover: approx COGS / avg inventory value (using cost_price * stock)
 		cogs = conn.execute(text('''
-			select coalesce(sum(si.quantity * p.cost_price),0) as cogs
-			from sale_items si
-			join sales s on s.id = si.sale_id
-			join products p on p.id = si.product_id
-			where s.pharmacy_id = :ph and s.created_at between :from and :to
+			select coalesce(sum(r.cost),0) as cogs
+			from sales_rollup_pharmacy_daily r
+			where r.pharmacy_id = :ph and r.day between cast(:from as date) and cast(:to as date)
 		'''), params).scalar() or 0
 		inv_val = conn.execute(text('''
 			select coalesce(sum(i.current_stock * p.cost_price),0) as inv_val
@@ -555,27 +583,10 @@ def analytics_overview():
 def analytics_expiry_alerts():
 	user_id = get_jwt_identity()
 	with engine.connect() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('staff','manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
-		rows = conn.execute(text('''
-			select 
-				p.id as product_id,
-				p.name,
-				sum(case when b.quantity > 0 then b.quantity else 0 end) as total_quantity,
-				min(b.expiration_date) filter (where b.expiration_date <= (current_date + interval '30 days')) as next_expiration,
-				sum(case when b.expiration_date <= (current_date + interval '30 days') then b.quantity * coalesce(b.cost_price, p.cost_price) else 0 end) as value_at_risk
-			from products p
-			join inventory_batches b on b.product_id = p.id
-			where p.pharmacy_id = :ph 
-			  and p.is_active = true
-			  and b.quantity > 0
-			  and b.expiration_date is not null
-			  and b.expiration_date <= (current_date + interval '30 days')
-			group by p.id, p.name
-			having min(b.expiration_date) is not null
-			order by next_expiration asc
-		'''), {'ph': me['pharmacy_id']}).mappings().all()
+		rows = expiry_alerts(conn, me['pharmacy_id'], days=30)
 		alerts = []
 		for r in rows:
 			next_exp = r['next_expiration']
@@ -584,19 +595,21 @@ def analytics_expiry_alerts():
 				'name': r['name'],
 				'current_stock': int(r['total_quantity'] or 0),
 				'expiration_date': next_exp.isoformat() if next_exp else None,
-				'value_at_risk': float(r['value_at_risk'] or 0.0)
+				'value_at_risk': float(r['value_at_risk'] or 0.0),
+				'projected_unsold': int(r['projected_unsold'] or 0)
 			})
 		return jsonify({'success': True, 'alerts': alerts})
 
 # --- Manager: set expiration for a product's inventory ---
 @manager_bp.patch('/inventory/expiration/<int:product_id>')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def set_inventory_expiration(product_id: int):
 	data = request.get_json(force=True) or {}
 	exp = data.get('expiration_date')  # ISO date string
 	user_id = get_jwt_identity()
 	with engine.begin() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('staff','manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		prod = conn.execute(text('select id, pharmacy_id from products where id = :pid'), {'pid': product_id}).mappings().first()
@@ -616,7 +629,7 @@ def sustainability_inventory_utilization():
 	user_id = get_jwt_identity()
 	frm, to = date_range_params()
 	with engine.connect() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('staff','manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		
@@ -644,29 +657,18 @@ def sustainability_inventory_utilization():
 				where p.pharmacy_id = :ph and p.is_active = true
 				group by p.id
 			),
-			sales_data as (
+			rollup_data as (
+				-- Daily rollup: returns are booked against the day of the original sale
 				select 
-					si.product_id,
-					sum(si.quantity) as total_sold,
-					sum(si.total_price) as total_revenue
-				from sale_items si
-				join sales s on s.id = si.sale_id
-				where s.pharmacy_id = :ph
-				  and s.status = 'completed'
-				  and s.created_at between :from and :to
-				group by si.product_id
-			),
-			returns_data as (
-				select 
-					ri.product_id,
-					sum(ri.quantity) as total_returned,
-					sum(ri.total_refund) as total_refunded
-				from return_items ri
-				join returns r on r.id = ri.return_id
+					r.product_id,
+					sum(r.quantity_sold) as total_sold,
+					sum(r.revenue) as total_revenue,
+					sum(r.quantity_returned) as total_returned,
+					sum(r.refund_amount) as total_refunded
+				from sales_rollup_product_daily r
 				where r.pharmacy_id = :ph
-				  and coalesce(r.status, 'completed') = 'completed'
-				  and r.created_at between :from and :to
-				group by ri.product_id
+				  and r.day between cast(:from as date) and cast(:to as date)
+				group by r.product_id
 			)
 			select 
 				p.id,
@@ -676,17 +678,16 @@ def sustainability_inventory_utilization():
 				pc.name as category_name,
 				coalesce(ci.current_stock, 0) as current_stock,
 				coalesce(ci.inventory_value, 0) as inventory_value,
-				coalesce(sd.total_sold, 0) as total_sold,
-				coalesce(sd.total_revenue, 0) as total_revenue,
+				coalesce(rd.total_sold, 0) as total_sold,
+				coalesce(rd.total_revenue, 0) as total_revenue,
 				coalesce(rd.total_returned, 0) as total_returned,
 				coalesce(rd.total_refunded, 0) as total_refunded
 			from products p
 			left join product_categories pc on pc.id = p.category_id
 			left join current_inventory ci on ci.product_id = p.id
-			left join sales_data sd on sd.product_id = p.id
-			left join returns_data rd on rd.product_id = p.id
+			left join rollup_data rd on rd.product_id = p.id
 			where p.pharmacy_id = :ph and p.is_active = true
-			order by coalesce(sd.total_sold, 0) desc
+			order by coalesce(rd.total_sold, 0) desc
 		''')
 		
 		products = [dict(r) for r in conn.execute(movement_query, params).mappings().all()]
@@ -765,7 +766,7 @@ def sustainability_expiry_risk():
 	"""Calculate expiry risk index and categorize products by expiry risk"""
 	user_id = get_jwt_identity()
 	with engine.connect() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('staff','manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		
@@ -810,111 +811,17 @@ def sustainability_expiry_risk():
 		if keyword_state:
 			state_filter = keyword_state
 
-		params = {
-			'ph': me['pharmacy_id'],
-			'soon_window': soon_window,
-			'include_zero': include_zero,
-			'category_id': None,
-			'search': None,
-		}
-		if category_id:
-			try:
-				params['category_id'] = int(category_id)
-			except (TypeError, ValueError):
-				params['category_id'] = None
-		if search_term:
-			params['search'] = f"%{search_term}%"
-
-		params['critical_window'] = critical_window
-		params['soon_window'] = soon_window
-		params['medium_window'] = medium_window
-
-		# Build query with conditional filters to avoid type ambiguity
-		base_query = '''
-			with product_data as (
-				select 
-					p.id,
-					p.name,
-					pc.name as category_name,
-					p.location,
-					sum(case when b.quantity > 0 then b.quantity else 0 end) as total_quantity,
-					sum(case when b.quantity > 0 then b.quantity * coalesce(b.cost_price, p.cost_price) else 0 end) as total_value,
-					sum(case when b.expiration_date <= current_date then b.quantity * coalesce(b.cost_price, p.cost_price) else 0 end) as expired_value,
-					sum(case when b.expiration_date > current_date and b.expiration_date <= current_date + make_interval(days => :soon_window) then b.quantity * coalesce(b.cost_price, p.cost_price) else 0 end) as expiring_soon_value,
-					sum(case when b.expiration_date <= current_date then b.quantity else 0 end) as expired_quantity,
-					sum(case when b.expiration_date > current_date and b.expiration_date <= current_date + make_interval(days => :soon_window) then b.quantity else 0 end) as expiring_soon_quantity,
-					min(b.expiration_date) as next_expiration,
-					(min(b.expiration_date) - current_date)::int as days_to_expiry
-				from products p
-				join inventory_batches b on b.product_id = p.id
-				left join product_categories pc on pc.id = p.category_id
-				where p.pharmacy_id = :ph
-				  and p.is_active = true
-				  and b.expiration_date is not null
-				  and (b.quantity > 0 or :include_zero)
-		'''
-		
-		# Add category filter if provided
-		if params.get('category_id'):
-			base_query += ' and p.category_id = :category_id'
-		else:
-			# Remove category_id from params to avoid type ambiguity
-			params.pop('category_id', None)
-		
-		# Add search filter if provided
-		if params.get('search'):
-			base_query += ' and (lower(p.name) like :search or lower(coalesce(pc.name, \'\')) like :search)'
-		else:
-			# Remove search from params to avoid type ambiguity
-			params.pop('search', None)
-		
-		base_query += '''
-				group by p.id, p.name, pc.name, p.location
-			)
-			select 
-				id,
-				name,
-				category_name,
-				location,
-				total_quantity,
-				total_value,
-				expired_value,
-				expiring_soon_value,
-				expired_quantity,
-				expiring_soon_quantity,
-				next_expiration,
-				days_to_expiry,
-				case 
-					when days_to_expiry is null or expired_quantity > 0 or (days_to_expiry < 0) then 'critical'
-					when days_to_expiry <= :critical_window then 'critical'
-					when days_to_expiry <= :soon_window then 'high'
-					when days_to_expiry <= :medium_window then 'medium'
-					else 'low'
-				end as risk_level,
-				case 
-					when days_to_expiry is null or days_to_expiry < 0 or expired_quantity > 0 then 'expired'
-					when days_to_expiry <= :soon_window then 'expiring'
-					else 'healthy'
-				end as expiry_state
-			from product_data
-			where 
-				(:state_filter = 'all' or 
-				 case 
-					when days_to_expiry is null or days_to_expiry < 0 or expired_quantity > 0 then 'expired'
-					when days_to_expiry <= :soon_window then 'expiring'
-					else 'healthy'
-				 end = :state_filter)
-				and (:status_filter = 'all' or
-				 case 
-					when days_to_expiry is null or expired_quantity > 0 or (days_to_expiry < 0) then 'critical'
-					when days_to_expiry <= :critical_window then 'critical'
-					when days_to_expiry <= :soon_window then 'high'
-					when days_to_expiry <= :medium_window then 'medium'
-					else 'low'
-				 end = :status_filter)
-		'''
-		
-		rows = conn.execute(text(base_query), {**params, 'state_filter': state_filter, 'status_filter': status_filter}).mappings().all()
+		try:
+			category_id = int(category_id) if category_id else None
+		except (TypeError, ValueError):
+			category_id = None
+
+		rows = product_risk_rows(
+			conn, me['pharmacy_id'],
+			soon_window=soon_window, medium_window=medium_window, critical_window=critical_window,
+			state_filter=state_filter, status_filter=status_filter, category_id=category_id,
+			search=f"%{search_term}%" if search_term else None, include_zero=include_zero,
+		)
 
 		critical_risk = []
 		high_risk = []
@@ -956,6 +863,9 @@ def sustainability_expiry_risk():
 				'next_expiration': next_exp.isoformat() if next_exp else None,
 				'risk_level': risk_level,
 				'expiry_state': expiry_state,
+				'projected_unsold_quantity': int(row['projected_unsold_quantity'] or 0),
+				'projected_unsold_value': round(float(row['projected_unsold_value'] or 0.0), 2),
+				'daily_velocity': float(row['daily_velocity'] or 0.0),
 			}
 
 			total_value_sum += total_value
@@ -1013,7 +923,7 @@ def sustainability_waste_reduction():
 			conn.rollback()
 			pass
 		
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('staff','manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		
@@ -1339,6 +1249,7 @@ def sustainability_waste_reduction():
 
 @manager_bp.get('/sustainability/dashboard')
 @jwt_required()
+@cached_analytics(engine, 'sustainability_dashboard', ('sales', 'inventory', 'batches'))
 def sustainability_dashboard():
 	"""Comprehensive sustainability dashboard with all key metrics"""
 	user_id = get_jwt_identity()
@@ -1351,23 +1262,24 @@ def sustainability_dashboard():
 			conn.rollback()
 			pass
 		
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('staff','manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
 		
 		params = {'ph': me['pharmacy_id'], 'from': frm, 'to': to}
+		ensure_current(conn, me['pharmacy_id'])
+		fold_pharmacy_deltas(conn, me['pharmacy_id'])
+		expiring_30_days = window_predicate(30)
 		
 		# Get all sustainability metrics in one query
-		metrics_query = text('''
+		metrics_query = text(f'''
 			with sales_data as (
 				select 
-					coalesce(sum(si.quantity * coalesce(p.cost_price, 0)), 0) as cogs,
-					coalesce(sum(si.total_price), 0) as revenue,
-					count(distinct s.id) as total_sales
-				from sale_items si
-				join sales s on s.id = si.sale_id
-				join products p on p.id = si.product_id
-				where s.pharmacy_id = :ph and s.status = 'completed' and s.created_at between :from and :to
+					coalesce(sum(r.cost), 0) as cogs,
+					coalesce(sum(r.revenue), 0) as revenue,
+					coalesce(sum(r.sale_count), 0) as total_sales
+				from sales_rollup_pharmacy_daily r
+				where r.pharmacy_id = :ph and r.day between cast(:from as date) and cast(:to as date)
 			),
 			inventory_data as (
 				select 
@@ -1384,42 +1296,17 @@ def sustainability_dashboard():
 				where p.pharmacy_id = :ph and p.is_active = true
 			),
 			expiry_data as (
+				-- At-risk rows of the expiry-risk index: on-hand stock expiring within 30 days or already expired
 				select 
-					count(distinct case 
-						when b.expiration_date <= current_date 
-						and (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) > 0 
-						then p.id 
-					end) as expired_count,
-					count(distinct case 
-						when b.expiration_date <= (current_date + interval '30 days') 
-						and b.expiration_date > current_date 
-						and (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) > 0 
-						then p.id 
-					end) as expiring_soon_count,
+					count(distinct case when r.expiration_date <= current_date then r.product_id end) as expired_count,
+					count(distinct case when r.expiration_date > current_date then r.product_id end) as expiring_soon_count,
 					-- Count distinct products that are EITHER expired OR expiring (not double-counting)
-					-- Only count products with available (non-disposed) expired/expiring quantities
-					count(distinct case when (
-						(b.expiration_date <= current_date and (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) > 0) or
-						(b.expiration_date <= (current_date + interval '30 days') 
-						 and b.expiration_date > current_date 
-						 and (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) > 0)
-					) then p.id end) as at_risk_count,
-					coalesce(sum(case 
-						when b.expiration_date <= current_date 
-						and (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) > 0
-						then (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) * coalesce(b.cost_price, p.cost_price, 0) 
-						else 0 
-					end), 0) as expired_value,
-					coalesce(sum(case 
-						when b.expiration_date <= (current_date + interval '30 days') 
-						and b.expiration_date > current_date 
-						and (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) > 0
-						then (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) * coalesce(b.cost_price, p.cost_price, 0) 
-						else 0 
-					end), 0) as expiring_value
-				from products p
-				join inventory_batches b on b.product_id = p.id
-				where p.pharmacy_id = :ph and p.is_active = true and b.expiration_date is not null
+					count(distinct r.product_id) as at_risk_count,
+					coalesce(sum(case when r.expiration_date <= current_date then r.on_hand * coalesce(r.batch_cost, p.cost_price, 0) else 0 end), 0) as expired_value,
+					coalesce(sum(case when r.expiration_date > current_date then r.on_hand * coalesce(r.batch_cost, p.cost_price, 0) else 0 end), 0) as expiring_value
+				from batch_expiry_risk r
+				join products p on p.id = r.product_id
+				where r.pharmacy_id = :ph and p.is_active = true and {expiring_30_days}
 			),
 			waste_data as (
 				-- Count disposed products in the period (for historical tracking)
@@ -1506,10 +1393,16 @@ def sustainability_dashboard():
 
 @manager_bp.post('/api/pos/process-return')
 @jwt_required()
+@invalidates_analytics(engine, 'returns', 'sales', 'inventory', 'batches')
 def process_return():
+    """
+    Return items of a sale. Quantities are checked against what the sale has
+    left to return, and stock goes back to the batches the sale consumed
+    (see services/returns.py).
+    """
     try:
         user_id = get_jwt_identity()
-        data = request.get_json()
+        data = request.get_json() or {}
         
         # Validate required fields
         required_fields = ['sale_id', 'reason', 'items', 'user_id', 'pharmacy_id']
@@ -1517,100 +1410,27 @@ def process_return():
             if field not in data:
                 return jsonify({'success': False, 'error': f'Missing required field: {field}'}), 400
         
-        sale_id = data['sale_id']
-        reason = data['reason']
-        items = data['items']
-        pharmacy_id = data['pharmacy_id']
-        
-        if not items or len(items) == 0:
-            return jsonify({'success': False, 'error': 'No items to return'}), 400
+        try:
+            lines = parse_return_items(data['items'])
+        except ReturnValidationError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         # Ensure returns tables exist (using centralized function)
         ensure_returns_tables()
         
         with engine.begin() as conn:
-            # Verify sale exists and belongs to pharmacy
-            sale_check = conn.execute(text("""
-                SELECT id, sale_number FROM sales 
-                WHERE id = :sale_id AND pharmacy_id = :pharmacy_id
-            """), {"sale_id": sale_id, "pharmacy_id": pharmacy_id}).fetchone()
-            
-            if not sale_check:
-                return jsonify({'success': False, 'error': 'Sale not found'}), 404
-            
-            # Generate return number
-            return_number = f"RET-{sale_check[1]}-{int(time.time())}"
-            
-            # Calculate total refund amount
-            total_refund = sum(item['quantity'] * item['unit_price'] for item in items)
-            
-            # Create return record
-            return_result = conn.execute(text("""
-                INSERT INTO returns (return_number, sale_id, pharmacy_id, user_id, reason, total_refund_amount, status)
-                VALUES (:return_number, :sale_id, :pharmacy_id, :user_id, :reason, :total_refund, 'completed')
-                RETURNING id
-            """), {
-                "return_number": return_number,
-                "sale_id": sale_id,
-                "pharmacy_id": pharmacy_id,
-                "user_id": user_id,
-                "reason": reason,
-                "total_refund": total_refund
-            })
-            
-            return_id = return_result.fetchone()[0]
-            
-            # Create return items and update inventory
-            for item in items:
-                product_id = item['product_id']
-                quantity = item['quantity']
-                unit_price = item['unit_price']
-                
-                # Insert return item
-                conn.execute(text("""
-                    INSERT INTO return_items (return_id, product_id, quantity, unit_price)
-                    VALUES (:return_id, :product_id, :quantity, :unit_price)
-                """), {
-                    "return_id": return_id,
-                    "product_id": product_id,
-                    "quantity": quantity,
-                    "unit_price": unit_price
-                })
-                
-                # Check if inventory record exists
-                inventory_check = conn.execute(text("""
-                    SELECT current_stock FROM inventory WHERE product_id = :product_id
-                """), {"product_id": product_id}).fetchone()
-                
-                if inventory_check:
-                    # Update existing inventory - add back to stock
-                    inventory_result = conn.execute(text("""
-                        UPDATE inventory 
-                        SET current_stock = current_stock + :quantity,
-                            last_updated = now()
-                        WHERE product_id = :product_id
-                    """), {
-                        "product_id": product_id,
-                        "quantity": quantity
-                    })
-                else:
-                    # Create new inventory record
-                    conn.execute(text("""
-                        INSERT INTO inventory (product_id, current_stock, last_updated)
-                        VALUES (:product_id, :quantity, now())
-                    """), {
-                        "product_id": product_id,
-                        "quantity": quantity
-                    })
-            
-            return jsonify({
-                'success': True, 
-                'message': 'Return processed successfully',
-                'return_id': return_id,
-                'return_number': return_number,
-                'total_refund': total_refund
-            })
-            
+            result = record_return(conn, data['pharmacy_id'], user_id, data['sale_id'], data['reason'], lines)
+
+        return jsonify({
+            'success': True,
+            'message': 'Return processed successfully',
+            **result
+        })
+    
+    except ReturnNotFound as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except ReturnQuantityError as e:
+        return jsonify({'success': False, 'error': str(e), 'conflicts': e.conflicts}), 409
     except Exception as e:
         return jsonify({'success': False, 'error': f'Failed to process return: {str(e)}'}), 500
 
@@ -1800,6 +1620,10 @@ def get_returned_items():
 
 def _ensure_suppliers_and_po_tables(conn) -> None:
     """Ensure suppliers and purchase order tables exist (normalized)"""
+    # Called on hot paths: once the tables exist, startup (ensure_purchase_order_receiving) keeps
+    # them current, and re-running the DDL here would only queue behind the tables' locks
+    if conn.execute(text("select to_regclass('public.purchase_order_items') is not null")).scalar():
+        return
     # Create suppliers table (matches schema.sql)
     conn.execute(text("""
         CREATE TABLE IF NOT EXISTS suppliers (
@@ -1830,19 +1654,12 @@ def _ensure_suppliers_and_po_tables(conn) -> None:
             created_by bigint not null references users(id),
             expected_delivery_at date,
             notes text,
+            updated_by bigint references users(id),
             created_at timestamptz default now(),
             updated_at timestamptz default now(),
             unique(pharmacy_id, po_number)
         );
     """))
-    
-    # Add expected_delivery_at, notes, and updated_by columns if they don't exist (for existing tables)
-    try:
-        conn.execute(text("ALTER TABLE purchase_orders ADD COLUMN IF NOT EXISTS expected_delivery_at date;"))
-        conn.execute(text("ALTER TABLE purchase_orders ADD COLUMN IF NOT EXISTS notes text;"))
-        conn.execute(text("ALTER TABLE purchase_orders ADD COLUMN IF NOT EXISTS updated_by bigint references users(id);"))
-    except Exception:
-        pass
     conn.execute(text("""
         CREATE TABLE IF NOT EXISTS purchase_order_items (
             id bigserial primary key,
@@ -1851,9 +1668,12 @@ def _ensure_suppliers_and_po_tables(conn) -> None:
             quantity int not null check (quantity > 0),
             unit_cost numeric(12,2) not null check (unit_cost >= 0),
             total_cost numeric(12,2) not null check (total_cost >= 0),
+            received_quantity int not null default 0,
+            expiration_date date,
             created_at timestamptz default now()
         );
     """))
+    conn.execute(text(PURCHASE_ORDER_RECEIPTS_DDL))
     
     # Create indexes for suppliers and purchase orders (if not exist)
     try:
@@ -1864,6 +1684,7 @@ def _ensure_suppliers_and_po_tables(conn) -> None:
         conn.execute(text("CREATE INDEX IF NOT EXISTS idx_purchase_orders_status ON purchase_orders(status)"))
         conn.execute(text("CREATE INDEX IF NOT EXISTS idx_purchase_order_items_po ON purchase_order_items(po_id)"))
         conn.execute(text("CREATE INDEX IF NOT EXISTS idx_purchase_order_items_product ON purchase_order_items(product_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_purchase_order_receipts_po ON purchase_order_receipts(po_id)"))
     except Exception:
         pass
 
@@ -1964,11 +1785,12 @@ def _ensure_disposed_products_table(conn) -> None:
 
 @manager_bp.get('/inventory/dashboard')
 @jwt_required()
+@cached_analytics(engine, 'inventory_dashboard', ('inventory', 'batches'))
 def inventory_dashboard():
     """Return inventory KPIs for dashboard: totals, low stock, expiry, suppliers, waste ratio."""
     user_id = get_jwt_identity()
     with engine.begin() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me:
             return jsonify({'success': False, 'error': 'User not found'}), 404
         ph = me['pharmacy_id']
@@ -2051,51 +1873,43 @@ def inventory_dashboard():
 @manager_bp.get('/inventory/history')
 @jwt_required()
 def inventory_history():
-    """Return end-of-month inventory snapshots for the last N months.
-    Query params: months (default 6)
+    """Return stock history per product from the daily inventory snapshots.
+    Query params: from, to (YYYY-MM-DD; default the last `months` months, 1-24, default 6),
+    grain (month|week|day, default month), product_id (optional)
     """
     user_id = get_jwt_identity()
-    months = int(request.args.get('months', 6))
-    months = max(1, min(months, 24))
+    grain = (request.args.get('grain') or 'month').lower()
+    if grain not in HISTORY_GRAINS:
+        return jsonify({'success': False, 'error': f"grain must be one of: {', '.join(HISTORY_GRAINS)}"}), 400
+    product_id = request.args.get('product_id', type=int)
+    try:
+        today = datetime.now().date()
+        date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else today
+        if request.args.get('from'):
+            date_from = datetime.strptime(request.args['from'], '%Y-%m-%d').date()
+        else:
+            months = max(1, min(int(request.args.get('months', 6)), 24))
+            start = date_to.replace(day=1)
+            for _ in range(months - 1):
+                start = (start - timedelta(days=1)).replace(day=1)
+            date_from = start
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid date range'}), 400
+    if date_from > date_to:
+        return jsonify({'success': False, 'error': 'from must not be after to'}), 400
+    # Daily series for every product would be ~365 points each; keep those per product or short
+    if grain == 'day' and product_id is None and (date_to - date_from).days > 92:
+        return jsonify({'success': False, 'error': 'Daily history over more than 92 days needs a product_id'}), 400
     with engine.connect() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        try:
+            _ensure_disposed_products_table(conn)
+        except Exception:
+            conn.rollback()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
-        # Approximate EOM by aggregating current batches received before each month end minus sales (optional simplified)
-        # For simplicity, we'll compute snapshots from current inventory and extrapolate backwards using returns/sales deltas if available.
-        # If historical_sales_daily exists, we can subtract cumulative sold qty per product.
-        rows = conn.execute(text('''
-            with months as (
-                select (date_trunc('month', current_date) - (interval '1 month' * g))::date as month_start,
-                       (date_trunc('month', current_date) - (interval '1 month' * g) + interval '1 month - 1 day')::date as month_end
-                from generate_series(0, :m-1) g
-            )
-            select m.month_start, m.month_end,
-                   p.id as product_id, p.name,
-                   coalesce(i.current_stock,0) as current_stock,
-                   coalesce(p.reorder_point,0) as reorder_point,
-                   pc.name as category_name
-            from months m
-            cross join products p
-            left join inventory i on i.product_id = p.id
-            left join product_categories pc on pc.id = p.category_id
-            where p.pharmacy_id = :ph and p.is_active = true
-            order by m.month_start desc, p.name asc
-        '''), {'m': months, 'ph': me['pharmacy_id']}).mappings().all()
-        # Format result grouped by month
-        by_month = {}
-        for r in rows:
-            key = r['month_start'].isoformat()
-            by_month.setdefault(key, {'from': key, 'to': r['month_end'].isoformat(), 'items': []})
-            by_month[key]['items'].append({
-                'product_id': r['product_id'],
-                'name': r['name'],
-                'category_name': r['category_name'],
-                'current_stock': int(r['current_stock']),
-                'reorder_point': int(r['reorder_point'] or 0),
-            })
-        ordered = sorted(by_month.values(), key=lambda x: x['from'], reverse=True)
-        return jsonify({'success': True, 'months': ordered})
+        result = snapshot_history(conn, me['pharmacy_id'], date_from, date_to, grain=grain, product_id=product_id)
+        return jsonify({'success': True, **result})
 
 
 @manager_bp.get('/batches/<int:product_id>')
@@ -2118,7 +1932,7 @@ def list_batches(product_id):
                 conn.rollback()
                 pass
             
-            me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+            me = get_current_user(conn, user_id)
             if not me or me['role'] not in ('manager','admin'):
                 return jsonify({'success': False, 'error': 'Forbidden'}), 403
             
@@ -2159,6 +1973,7 @@ def list_batches(product_id):
 
 @manager_bp.post('/dispose-expired/<int:product_id>')
 @jwt_required()
+@invalidates_analytics(engine, 'batches', 'inventory')
 def dispose_expired_product(product_id):
     """Dispose expired products - remove from batches and record in disposed_products table"""
     user_id = get_jwt_identity()
@@ -2172,7 +1987,7 @@ def dispose_expired_product(product_id):
         _ensure_batches_table(conn)
         _ensure_disposed_products_table(conn)
         
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin','staff'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
@@ -2283,6 +2098,66 @@ def dispose_expired_product(product_id):
         })
 
 
+@manager_bp.post('/dispose-expired')
+@jwt_required()
+def dispose_expired_bulk():
+    """
+    Dispose all expired on-hand stock of the pharmacy, or of ``product_ids``,
+    with set-based statements per chunk of products. With ``stream: true`` the
+    response is NDJSON: one progress line per committed chunk, then the totals.
+    """
+    user_id = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    product_ids = data.get('product_ids')
+    if product_ids is not None:
+        try:
+            product_ids = [int(pid) for pid in product_ids]
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'product_ids must be a list of product ids'}), 400
+        if not product_ids:
+            return jsonify({'success': False, 'error': 'product_ids is empty'}), 400
+    try:
+        chunk_products = int(data.get('chunk_size') or DEFAULT_CHUNK_PRODUCTS)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'chunk_size must be a number'}), 400
+    reason = str(data.get('reason') or DISPOSAL_REASON).strip()
+
+    with engine.begin() as conn:
+        me = get_current_user(conn, user_id)
+        if not me or me['role'] not in ('manager', 'admin'):
+            return jsonify({'success': False, 'error': 'Forbidden'}), 403
+        _ensure_batches_table(conn)
+        _ensure_disposed_products_table(conn)
+    pharmacy_id = me['pharmacy_id']
+
+    sweep = iter_dispose_expired(engine, pharmacy_id, user_id, product_ids, chunk_products, reason)
+    if not data.get('stream'):
+        stats = DisposalStats()
+        try:
+            for stats in sweep:
+                pass
+        finally:
+            # Chunks commit one by one: a sweep that fails midway has still changed stock
+            if stats.chunks:
+                bump_generation(pharmacy_id, 'batches', 'inventory')
+        return jsonify({'success': True, 'result': stats.as_dict()})
+
+    def progress():
+        stats = DisposalStats()
+        try:
+            for stats in sweep:
+                # Each chunk is committed, so caches must not wait for the whole sweep
+                bump_generation(pharmacy_id, 'batches', 'inventory')
+                yield json.dumps({'type': 'progress', **stats.as_dict()}) + '\n'
+        except Exception:
+            logger.exception("Disposing expired stock stopped for pharmacy %s after %s chunk(s)", pharmacy_id, stats.chunks)
+            yield json.dumps({'type': 'error', 'error': 'Disposal stopped; committed chunks stay disposed', **stats.as_dict()}) + '\n'
+            return
+        yield json.dumps({'type': 'done', 'success': True, **stats.as_dict()}) + '\n'
+
+    return Response(stream_with_context(progress()), mimetype='application/x-ndjson')
+
+
 @manager_bp.get('/disposed-products')
 @jwt_required()
 def list_disposed_products():
@@ -2297,7 +2172,7 @@ def list_disposed_products():
     with engine.connect() as conn:
         _ensure_disposed_products_table(conn)
         
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('staff','manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
@@ -2310,16 +2185,40 @@ def list_disposed_products():
         
         if date_from:
             # Include the entire day from 00:00:00
-            conditions.append('dp.disposed_at::date >= :date_from::date')
+            conditions.append('dp.disposed_at::date >= cast(:date_from as date)')
             params['date_from'] = date_from
         
         if date_to:
             # Include the entire day up to 23:59:59
-            conditions.append('dp.disposed_at::date <= :date_to::date')
+            conditions.append('dp.disposed_at::date <= cast(:date_to as date)')
             params['date_to'] = date_to
         
         where_clause = ' and '.join(conditions)
         
+        disposed_select = f'''
+            select 
+                dp.id, dp.product_id, dp.batch_id, dp.batch_number,
+                dp.quantity_disposed, dp.cost_price, dp.total_cost,
+                dp.disposed_at, dp.expiration_date, dp.location,
+                p.name as product_name, p.location as product_location,
+                pc.name as category_name,
+                u.first_name || ' ' || u.last_name as disposed_by_name,
+                u.role as disposed_by_role
+            from disposed_products dp
+            join products p on p.id = dp.product_id
+            left join product_categories pc on pc.id = p.category_id
+            left join users u on u.id = dp.disposed_by
+            left join inventory_batches b on b.id = dp.batch_id
+            where {where_clause}
+            order by dp.disposed_at desc
+        '''
+        
+        # Exports stream every filtered row, not just the current page
+        export_params = {k: v for k, v in params.items() if k != 'offset' and k != 'limit'}
+        export = _export_report(ReportQuery('disposed_products', disposed_select, export_params), me)
+        if export is not None:
+            return export
+        
         # Get total count and summary statistics (for all filtered items, not just current page)
         summary_params = {k: v for k, v in params.items() if k != 'offset' and k != 'limit'}
         summary = conn.execute(text(f'''
@@ -2339,24 +2238,7 @@ def list_disposed_products():
         
         # Get disposed products (paginated)
         query_params = {k: v for k, v in params.items()}
-        disposed = conn.execute(text(f'''
-            select 
-                dp.id, dp.product_id, dp.batch_id, dp.batch_number,
-                dp.quantity_disposed, dp.cost_price, dp.total_cost,
-                dp.disposed_at, dp.expiration_date, dp.location,
-                p.name as product_name, p.location as product_location,
-                pc.name as category_name,
-                u.first_name || ' ' || u.last_name as disposed_by_name,
-                u.role as disposed_by_role
-            from disposed_products dp
-            join products p on p.id = dp.product_id
-            left join product_categories pc on pc.id = p.category_id
-            left join users u on u.id = dp.disposed_by
-            left join inventory_batches b on b.id = dp.batch_id
-            where {where_clause}
-            order by dp.disposed_at desc
-            limit :limit offset :offset
-        '''), query_params).mappings().all()
+        disposed = conn.execute(text(disposed_select + ' limit :limit offset :offset'), query_params).mappings().all()
         
         return jsonify({
             'success': True,
@@ -2371,6 +2253,7 @@ def list_disposed_products():
 
 @manager_bp.post('/batches/<int:product_id>')
 @jwt_required()
+@invalidates_analytics(engine, 'batches', 'inventory')
 def create_batch(product_id):
     """Create a new batch (delivery) for a product."""
     user_id = get_jwt_identity()
@@ -2382,7 +2265,7 @@ def create_batch(product_id):
     with engine.connect() as conn:
         _ensure_batches_table(conn)
         
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
@@ -2484,6 +2367,7 @@ def create_batch(product_id):
 
 @manager_bp.patch('/batches/<int:batch_id>')
 @jwt_required()
+@invalidates_analytics(engine, 'batches', 'inventory')
 def update_batch(batch_id):
     """Update a batch (delivery)."""
     user_id = get_jwt_identity()
@@ -2496,7 +2380,7 @@ def update_batch(batch_id):
         _ensure_batches_table(conn)
         _ensure_suppliers_and_po_tables(conn)
         
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
@@ -2615,13 +2499,14 @@ def update_batch(batch_id):
 
 @manager_bp.delete('/batches/<int:batch_id>')
 @jwt_required()
+@invalidates_analytics(engine, 'batches', 'inventory')
 def delete_batch(batch_id):
     """Delete a batch (delivery)."""
     user_id = get_jwt_identity()
     with engine.connect() as conn:
         _ensure_batches_table(conn)
         _ensure_suppliers_and_po_tables(conn)
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
@@ -2664,7 +2549,7 @@ def delete_batch(batch_id):
 def list_suppliers():
     user_id = get_jwt_identity()
     with engine.begin() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('staff','manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         _ensure_suppliers_and_po_tables(conn)
@@ -2677,6 +2562,7 @@ def list_suppliers():
 
 @manager_bp.post('/suppliers')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def create_supplier():
     import re
     data = request.get_json(force=True) or {}
@@ -2733,7 +2619,7 @@ def create_supplier():
     
     user_id = get_jwt_identity()
     with engine.begin() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         _ensure_suppliers_and_po_tables(conn)
@@ -2763,12 +2649,13 @@ def create_supplier():
 
 @manager_bp.patch('/suppliers/<int:supplier_id>')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def update_supplier(supplier_id: int):
     import re
     data = request.get_json(force=True) or {}
     user_id = get_jwt_identity()
     with engine.begin() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         _ensure_suppliers_and_po_tables(conn)
@@ -2873,12 +2760,13 @@ def update_supplier(supplier_id: int):
 
 @manager_bp.patch('/api/inventory/requests/<int:req_id>')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def update_inventory_request(req_id: int):
     """Allow the requester to edit their pending request (quantity_change, reason)."""
     user_id = get_jwt_identity()
     data = request.get_json(force=True) or {}
     with engine.begin() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me:
             return jsonify({'success': False, 'error': 'User not found'}), 404
         req = conn.execute(text('select id, requested_by, status from inventory_adjustment_requests where id = :id'), {'id': req_id}).mappings().first()
@@ -2904,6 +2792,7 @@ def update_inventory_request(req_id: int):
 
 @manager_bp.delete('/api/inventory/requests/<int:req_id>')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def delete_inventory_request(req_id: int):
     """Allow the requester to delete their pending request."""
     user_id = get_jwt_identity()
@@ -2921,10 +2810,11 @@ def delete_inventory_request(req_id: int):
 
 @manager_bp.delete('/suppliers/<int:supplier_id>')
 @jwt_required()
+@invalidates_analytics(engine, 'inventory')
 def delete_supplier(supplier_id: int):
     user_id = get_jwt_identity()
     with engine.begin() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         _ensure_suppliers_and_po_tables(conn)
@@ -2943,7 +2833,7 @@ def create_purchase_order():
         return jsonify({'success': False, 'error': 'supplier_id and items are required'}), 400
     user_id = get_jwt_identity()
     with engine.begin() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         _ensure_suppliers_and_po_tables(conn)
@@ -2971,15 +2861,31 @@ def create_purchase_order():
         return jsonify({'success': True, 'po_id': po_id, 'po_number': row['po_number']})
 
 
+PURCHASE_ORDERS_KEYSET = Keyset('purchase_orders', [('po.created_at', 'created_at'), ('po.id', 'id')])
+
+
 @manager_bp.get('/purchase-orders')
 @jwt_required()
 def list_purchase_orders():
     user_id = get_jwt_identity()
+    try:
+        page = KeysetPage.from_request(PURCHASE_ORDERS_KEYSET, default_limit=200)
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     with engine.connect() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('staff','manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
-        rows = conn.execute(text('''
+        params = {'ph': me['pharmacy_id']}
+        total = page.total(conn, 'from purchase_orders po where po.pharmacy_id = :ph', params)
+        rows = conn.execute(text(f'''
+            with page as (
+                select po.id
+                from purchase_orders po
+                where po.pharmacy_id = :ph and {page.condition(params)}
+                order by {page.order_by()}
+                {page.limit_clause(params)}
+            )
             select po.id, po.po_number, po.status, po.expected_delivery_at, po.created_at, po.updated_at,
                    s.name as supplier_name,
                    coalesce(sum(i.quantity),0) as total_items,
@@ -2993,24 +2899,25 @@ def list_purchase_orders():
                    editor.first_name as editor_first_name,
                    editor.last_name as editor_last_name,
                    editor.role as editor_role
-            from purchase_orders po
+            from page
+            join purchase_orders po on po.id = page.id
             join suppliers s on s.id = po.supplier_id
             left join purchase_order_items i on i.po_id = po.id
             left join users creator on creator.id = po.created_by
             left join users editor on editor.id = po.updated_by
-            where po.pharmacy_id = :ph
             group by po.id, s.name, creator.id, creator.username, creator.first_name, creator.last_name, creator.role,
                      editor.id, editor.username, editor.first_name, editor.last_name, editor.role
-            order by po.created_at desc
-            limit 200
-        '''), {'ph': me['pharmacy_id']}).mappings().all()
+            order by {page.order_by()}
+        '''), params).mappings().all()
+        rows, pagination = page.finish(rows, total)
         
         # Get items for each purchase order
         po_ids = [r['id'] for r in rows]
         items_map = {}
         if po_ids:
             items_rows = conn.execute(text('''
-                select poi.po_id, poi.product_id, poi.quantity, poi.unit_cost
+                select poi.po_id, poi.id, poi.product_id, poi.quantity, poi.unit_cost,
+                       poi.received_quantity, poi.expiration_date
                 from purchase_order_items poi
                 where poi.po_id = ANY(:po_ids)
             '''), {'po_ids': po_ids}).mappings().all()
@@ -3019,8 +2926,11 @@ def list_purchase_orders():
                 if po_id not in items_map:
                     items_map[po_id] = []
                 items_map[po_id].append({
+                    'item_id': it['id'],
                     'product_id': it['product_id'],
                     'quantity': it['quantity'],
+                    'received_quantity': it['received_quantity'],
+                    'expiration_date': it['expiration_date'].isoformat() if it['expiration_date'] else None,
                     'unit_cost': float(it['unit_cost'])
                 })
         
@@ -3083,144 +2993,175 @@ def list_purchase_orders():
                     po_dict['updated_at'] = str(updated_at)
             purchase_orders.append(po_dict)
         
-        return jsonify({'success': True, 'purchase_orders': purchase_orders})
+        return jsonify({'success': True, 'purchase_orders': purchase_orders, 'pagination': pagination})
 
 
 @manager_bp.patch('/purchase-orders/<int:po_id>')
 @jwt_required()
+@invalidates_analytics(engine, 'batches', 'inventory')
 def update_purchase_order(po_id: int):
     data = request.get_json(force=True) or {}
     user_id = get_jwt_identity()
+    new_status = (data.get('status') or '').lower() or None
+    try:
+        default_expiration = _receipt_date(data.get('default_expiration_date'))
+    except ReceivingError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     with engine.begin() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
         # Check if PO exists and belongs to pharmacy
-        po = conn.execute(text('select id, status from purchase_orders where id = :id and pharmacy_id = :ph'), {'id': po_id, 'ph': me['pharmacy_id']}).mappings().first()
+        po = conn.execute(text('select id, status from purchase_orders where id = :id and pharmacy_id = :ph for update'), {'id': po_id, 'ph': me['pharmacy_id']}).mappings().first()
         if not po:
             return jsonify({'success': False, 'error': 'Purchase order not found'}), 404
+        # Refuse before any edit is written: returning from this block commits
+        if new_status == 'received' and po['status'] == 'cancelled':
+            return jsonify({'success': False, 'error': 'A cancelled purchase order cannot be received'}), 409
         
-        # Track if anything was updated
         items_updated = False
-        
-        # Update items if provided
         if 'items' in data and isinstance(data['items'], list):
-            for item in data['items']:
-                product_id = item.get('product_id')
-                quantity = item.get('quantity')
-                if product_id and quantity and quantity > 0:
-                    # Check if item exists
-                    existing = conn.execute(text('select id, unit_cost from purchase_order_items where po_id = :po and product_id = :pid'), {'po': po_id, 'pid': int(product_id)}).mappings().first()
-                    if existing:
-                        # Update existing item
-                        unit_cost = existing['unit_cost']
-                        conn.execute(text('''
-                            update purchase_order_items
-                            set quantity = :q, total_cost = :q * :uc
-                            where po_id = :po and product_id = :pid
-                        '''), {'po': po_id, 'pid': int(product_id), 'q': int(quantity), 'uc': float(unit_cost)})
-                        items_updated = True
-                    else:
-                        # Insert new item
-                        unit_cost = item.get('unit_cost', 0)
-                        conn.execute(text('''
-                            insert into purchase_order_items (po_id, product_id, quantity, unit_cost, total_cost)
-                            values (:po, :pid, :q, :uc, :tc)
-                        '''), {'po': po_id, 'pid': int(product_id), 'q': int(quantity), 'uc': float(unit_cost), 'tc': float(unit_cost) * int(quantity)})
-                        items_updated = True
-        
-        # Update status and when received create batches and bump inventory
-        # Also update updated_at if items were changed or status changed
-        new_status = (data.get('status') or '').lower() or None
+            items_updated = apply_item_edits(conn, po_id, data['items'])
+        
+        # Receiving sets the status itself (received / partially_received)
         update_fields = []
         update_params = {'id': po_id, 'ph': me['pharmacy_id']}
-        
-        if new_status:
+        if new_status and new_status != 'received':
             update_fields.append('status = :st')
             update_params['st'] = new_status
-        
         if 'expected_delivery_at' in data:
             update_fields.append('expected_delivery_at = :eta')
             update_params['eta'] = data.get('expected_delivery_at')
-        
-        # Always update updated_at and updated_by if items changed or status/eta changed
-        if items_updated or new_status or 'expected_delivery_at' in data:
+        if update_fields or items_updated:
             update_fields.append('updated_at = now()')
             update_fields.append('updated_by = :updater')
             update_params['updater'] = user_id
-        
-        if update_fields:
             update_query = f"update purchase_orders set {', '.join(update_fields)} where id = :id and pharmacy_id = :ph"
             conn.execute(text(update_query), update_params)
+        
         if new_status == 'received':
-            _ensure_batches_table(conn)
-            items = conn.execute(text('select product_id, quantity, unit_cost from purchase_order_items where po_id = :po'), {'po': po_id}).mappings().all()
-            import uuid as _uuid
-            for it in items:
-                batch_no = f"B-{str(_uuid.uuid4())[:8].upper()}"
-                conn.execute(text('''
-                    insert into inventory_batches (product_id, batch_number, quantity, expiration_date)
-                    values (:pid, :bn, :q, :exp)
-                    on conflict (product_id, batch_number) do update set quantity = inventory_batches.quantity + excluded.quantity
-                '''), {'pid': it['product_id'], 'bn': batch_no, 'q': it['quantity'], 'exp': data.get('default_expiration_date')})
-                
-                # Calculate available stock (delivered - sold - disposed, excluding expired)
-                available_stock = conn.execute(text('''
-                    select coalesce(sum(quantity - sold_quantity - coalesce(disposed_quantity, 0)),0) 
-                    from inventory_batches 
-                    where product_id = :pid 
-                    and (expiration_date is null or expiration_date > current_date)
-                '''), {'pid': it['product_id']}).scalar() or 0
-                
-                # Get old stock before update
-                old_inv = conn.execute(text('select current_stock from inventory where product_id = :pid'), {'pid': it['product_id']}).mappings().first()
-                old_stock = int(old_inv['current_stock']) if old_inv else 0
-                
-                # Update inventory with available stock
-                conn.execute(text('''
-                    insert into inventory (product_id, current_stock, reserved_stock)
-                    values (:pid, :available, 0)
-                    on conflict (product_id) do update set current_stock = :available, last_updated = now()
-                '''), {'pid': it['product_id'], 'available': available_stock})
-                
-                new_stock = available_stock
-                
-                # If stock increased, mark approved requests as delivered only if quantity matches
-                if new_stock > old_stock:
-                    stock_increase = new_stock - old_stock
-                    # Find approved requests for this product that haven't been delivered yet
-                    approved_requests = conn.execute(text('''
-                        select id, quantity_change, status
-                        from inventory_adjustment_requests
-                        where product_id = :pid 
-                        and status = 'approved'
-                        and quantity_change > 0
-                        order by created_at asc
-                    '''), {'pid': it['product_id']}).mappings().all()
-                    
-                    # Mark requests as delivered only if stock increase matches the requested quantity
-                    remaining_increase = stock_increase
-                    for req in approved_requests:
-                        if remaining_increase <= 0:
-                            break
-                        if req['status'] == 'approved':
-                            requested_qty = int(req['quantity_change'])
-                            # Only mark as delivered if the stock increase matches or exceeds the requested quantity
-                            if remaining_increase >= requested_qty:
-                                # Mark this request as delivered
-                                conn.execute(text('''
-                                    update inventory_adjustment_requests
-                                    set status = 'delivered', decided_at = now()
-                                    where id = :req_id and status = 'approved'
-                                '''), {'req_id': req['id']})
-                                remaining_increase -= requested_qty
-                            else:
-                                # Not enough stock increase to fulfill this request, stop checking
-                                break
+            # Receives everything still outstanding; an already received order gains nothing
+            receipt = receive_purchase_order(
+                conn, me['pharmacy_id'], po_id, user_id,
+                default_expiration=default_expiration,
+                receipt_key=request.headers.get('Idempotency-Key') or data.get('receipt_key'),
+            )
+            return jsonify({'success': True, 'receipt': receipt})
         return jsonify({'success': True})
 
 
+def _receipt_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value)[:10]).date()
+    except ValueError:
+        raise ReceivingError('default_expiration_date must be a date (YYYY-MM-DD)')
+
+
+@manager_bp.post('/purchase-orders/<int:po_id>/receive')
+@jwt_required()
+@invalidates_analytics(engine, 'batches', 'inventory')
+def receive_purchase_order_delivery(po_id: int):
+    """
+    Book a (partial) delivery: ``lines`` of ``{item_id or product_id, quantity,
+    expiration_date, unit_cost, batch_number}``; without ``lines`` everything
+    outstanding is received. Send an Idempotency-Key header (or
+    ``receipt_key``) so a retried delivery is booked once.
+    """
+    data = request.get_json(silent=True) or {}
+    user_id = get_jwt_identity()
+    try:
+        lines = parse_receipt_lines(data['lines']) if data.get('lines') is not None else None
+        default_expiration = _receipt_date(data.get('default_expiration_date'))
+    except ReceivingError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    with engine.begin() as conn:
+        me = get_current_user(conn, user_id)
+        if not me or me['role'] not in ('manager', 'admin'):
+            return jsonify({'success': False, 'error': 'Forbidden'}), 403
+        try:
+            receipt = receive_purchase_order(
+                conn, me['pharmacy_id'], po_id, user_id, lines,
+                default_expiration=default_expiration,
+                receipt_key=request.headers.get('Idempotency-Key') or data.get('receipt_key'),
+            )
+        except PurchaseOrderNotFound as e:
+            return jsonify({'success': False, 'error': str(e)}), 404
+        except PurchaseOrderCancelled as e:
+            return jsonify({'success': False, 'error': str(e)}), 409
+        except ReceivingQuantityError as e:
+            return jsonify({'success': False, 'error': str(e), 'conflicts': e.conflicts}), 409
+    return jsonify({'success': True, 'receipt': receipt})
+
+
+
+def _reorder_drafts(conn, pharmacy_id):
+    """Run the reorder engine with the request's review_days / service_z / use_forecasts options."""
+    review_days = float(request.args.get('review_days') or DEFAULT_REVIEW_DAYS)
+    service_z = float(request.args.get('service_z') or DEFAULT_SERVICE_Z)
+    rates = None
+    if request.args.get('use_forecasts', 'true').lower() in ('1', 'true', 'yes'):
+        # Stored by the hourly job (scripts/run_reorder_engine.py); no model runs in the request
+        rates = load_forecast_rates(conn, pharmacy_id)
+    inputs = load_inputs(conn, pharmacy_id)
+    plan = compute_plan(inputs, review_days=review_days, service_z=service_z, forecast_rates=rates)
+    return len(inputs), group_by_supplier(plan)
+
+
+@manager_bp.get('/reorder/suggestions')
+@jwt_required()
+def get_reorder_suggestions():
+    """Reorder suggestions for every active product, grouped by supplier as draft purchase orders"""
+    user_id = get_jwt_identity()
+    with engine.connect() as conn:
+        me = get_current_user(conn, user_id)
+        if not me or me['role'] not in ('manager', 'admin'):
+            return jsonify({'success': False, 'error': 'Forbidden'}), 403
+        try:
+            evaluated, drafts = _reorder_drafts(conn, me['pharmacy_id'])
+        except ValueError:
+            return jsonify({'success': False, 'error': 'review_days and service_z must be numbers'}), 400
+    return jsonify({
+        'success': True,
+        'generated_at': datetime.now().isoformat(),
+        'products_evaluated': evaluated,
+        'lines': sum(len(d['lines']) for d in drafts),
+        'suppliers': drafts,
+    })
+
+
+@manager_bp.post('/reorder/drafts')
+@jwt_required()
+def create_reorder_drafts():
+    """
+    Create ``draft`` purchase orders from the current suggestions, one per
+    supplier (optionally only ``supplier_ids``). Products without a preferred
+    supplier are reported, not ordered.
+    """
+    user_id = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    with engine.begin() as conn:
+        me = get_current_user(conn, user_id)
+        if not me or me['role'] not in ('manager', 'admin'):
+            return jsonify({'success': False, 'error': 'Forbidden'}), 403
+        _ensure_suppliers_and_po_tables(conn)
+        try:
+            _, drafts = _reorder_drafts(conn, me['pharmacy_id'])
+            only = {int(s) for s in data['supplier_ids']} if data.get('supplier_ids') else None
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Invalid reorder options'}), 400
+        if only is not None:
+            drafts = [d for d in drafts if d['supplier_id'] in only]
+        created = create_draft_orders(conn, me['pharmacy_id'], user_id, drafts)
+        unassigned = next((d for d in drafts if d['supplier_id'] is None), None)
+    return jsonify({
+        'success': True,
+        'purchase_orders': created,
+        'unassigned': unassigned['lines'] if unassigned else [],
+    })
+
 
 @manager_bp.get('/api/forecasting/accuracy')
 @jwt_required()
@@ -3231,7 +3172,7 @@ def get_forecasting_accuracy():
         
         # Get user's pharmacy_id
         with engine.begin() as conn:
-            user_row = conn.execute(text('select pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+            user_row = get_current_user(conn, user_id)
             if not user_row:
                 return jsonify({'success': False, 'error': 'User not found'}), 404
             pharmacy_id = user_row['pharmacy_id']
@@ -3280,7 +3221,7 @@ def get_forecastable_categories():
         
         # Get user's pharmacy_id
         with engine.begin() as conn:
-            user_row = conn.execute(text('select pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+            user_row = get_current_user(conn, user_id)
             if not user_row:
                 return jsonify({'success': False, 'error': 'User not found'}), 404
             pharmacy_id = user_row['pharmacy_id']
@@ -3319,6 +3260,74 @@ def get_forecastable_categories():
 # REPORTING ENDPOINTS
 # ===============================
 
+def _export_report(query, me):
+    """
+    Stream ``query`` as CSV/Parquet (``?format=``) through a server-side cursor,
+    or queue it as a background export job when ``?async=true``.
+    Returns None when the caller asked for the regular JSON response.
+    """
+    fmt = (request.args.get('format') or 'json').lower()
+    if fmt == 'json':
+        return None
+    error = check_format(fmt)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        job = export_jobs.submit(engine, query, fmt, {'pharmacy_id': me['pharmacy_id'], 'user_id': me['id']})
+        return jsonify({'success': True, 'job': _public_export_job(job)}), 202
+
+    return Response(
+        stream_with_context(stream_report(engine, query, fmt)),
+        mimetype=EXPORT_FORMATS[fmt][0],
+        headers={'Content-Disposition': f'attachment; filename="{export_filename(query.name, fmt)}"'},
+    )
+
+
+def _public_export_job(job):
+    return {k: v for k, v in job.items() if k not in ('file_name', 'user_id')}
+
+
+def _load_export_job(job_id):
+    user_id = get_jwt_identity()
+    with engine.connect() as conn:
+        me = get_current_user(conn, user_id)
+    if not me or me['role'] not in ('staff','manager','admin'):
+        return None, (jsonify({'success': False, 'error': 'Forbidden'}), 403)
+    job = export_jobs.get(job_id)
+    # Staff can only see their own exports; managers see every export of the pharmacy
+    if not job or job.get('pharmacy_id') != me['pharmacy_id'] or (me['role'] == 'staff' and job.get('user_id') != me['id']):
+        return None, (jsonify({'success': False, 'error': 'Export job not found'}), 404)
+    return job, None
+
+
+@manager_bp.get('/reports/exports/<job_id>')
+@jwt_required()
+def get_report_export_job(job_id):
+    """Status of a background report export"""
+    job, error = _load_export_job(job_id)
+    if error:
+        return error
+    return jsonify({'success': True, 'job': _public_export_job(job)})
+
+
+@manager_bp.get('/reports/exports/<job_id>/download')
+@jwt_required()
+def download_report_export(job_id):
+    """Download the file of a completed background report export"""
+    job, error = _load_export_job(job_id)
+    if error:
+        return error
+    if job['status'] != 'completed':
+        return jsonify({'success': False, 'error': f"Export is {job['status']}", 'job': _public_export_job(job)}), 409
+    return send_file(
+        export_jobs.file_path(job),
+        mimetype=EXPORT_FORMATS[job['format']][0],
+        as_attachment=True,
+        download_name=job['download_name'],
+    )
+
+
 @manager_bp.get('/reports/stock')
 @jwt_required()
 def get_stock_report():
@@ -3329,7 +3338,7 @@ def get_stock_report():
     status = request.args.get('status', 'all')  # all, in_stock, low_stock, out_of_stock
     
     with engine.connect() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
@@ -3404,16 +3413,17 @@ def get_stock_report():
                 ), 0) asc, p.name
         ''')
         
-        stock_data = conn.execute(query, params).mappings().all()
-        
         # Filter by status if specified
-        if status != 'all':
-            if status == 'out_of_stock':
-                stock_data = [row for row in stock_data if row['stock_status'] == 'Out of Stock']
-            elif status == 'low_stock':
-                stock_data = [row for row in stock_data if row['stock_status'] == 'Low Stock']
-            elif status == 'in_stock':
-                stock_data = [row for row in stock_data if row['stock_status'] == 'In Stock']
+        status_label = {'out_of_stock': 'Out of Stock', 'low_stock': 'Low Stock', 'in_stock': 'In Stock'}.get(status)
+        row_filter = (lambda row: row._mapping['stock_status'] == status_label) if status_label else None
+        
+        export = _export_report(ReportQuery('stock_report', query.text, params, row_filter), me)
+        if export is not None:
+            return export
+        
+        stock_data = conn.execute(query, params).mappings().all()
+        if status_label:
+            stock_data = [row for row in stock_data if row['stock_status'] == status_label]
         
         return jsonify({'success': True, 'data': [dict(row) for row in stock_data]})
 
@@ -3428,7 +3438,7 @@ def get_low_stock_report():
     alert_level = request.args.get('alert_level', 'all')  # all, critical, low, out_of_stock
     
     with engine.connect() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
@@ -3498,7 +3508,7 @@ def get_expired_report():
     status = request.args.get('status', 'all')  # expired | expiring | all
     category_id = request.args.get('category_id')
     with engine.connect() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
@@ -3548,6 +3558,11 @@ def get_expired_report():
             group by p.id, p.name, pc.name, p.location
             order by estimated_loss desc, p.name
         ''')
+        
+        export = _export_report(ReportQuery('expired_report', query.text, params), me)
+        if export is not None:
+            return export
+        
         expired_data = conn.execute(query, params).mappings().all()
         
         return jsonify({'success': True, 'data': [dict(row) for row in expired_data]})
@@ -3563,7 +3578,7 @@ def get_sales_staff_report():
     date_to = request.args.get('date_to')
     
     with engine.connect() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
@@ -3620,38 +3635,48 @@ def get_sales_date_report():
     date_to = request.args.get('date_to')
     
     with engine.connect() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
-        # Build query conditions
-        conditions = ['s.pharmacy_id = :pharmacy_id', 's.status = \'completed\'']
+        fold_pharmacy_deltas(conn, me['pharmacy_id'])
+        # Build query conditions (totals come from the daily rollup, staff from sales)
+        rollup_conditions = ['r.pharmacy_id = :pharmacy_id', 'r.sale_count > 0']
+        staff_conditions = ['s.pharmacy_id = :pharmacy_id', 's.status = \'completed\'']
         params = {'pharmacy_id': me['pharmacy_id']}
         
         if date_from:
-            conditions.append('date(s.created_at) >= :date_from')
+            rollup_conditions.append('r.day >= cast(:date_from as date)')
+            staff_conditions.append('s.created_at >= cast(:date_from as date)')
             params['date_from'] = date_from
             
         if date_to:
-            conditions.append('date(s.created_at) <= :date_to')
+            rollup_conditions.append('r.day <= cast(:date_to as date)')
+            staff_conditions.append('s.created_at < cast(:date_to as date) + 1')
             params['date_to'] = date_to
         
-        where_clause = ' and '.join(conditions)
-        
         sales_data = conn.execute(text(f'''
+            with staff as (
+                select 
+                    s.created_at::date as sale_date,
+                    count(distinct s.user_id) as staff_count,
+                    string_agg(distinct u.first_name || ' ' || u.last_name, ', ') as staff_names
+                from sales s
+                left join users u on s.user_id = u.id
+                where {' and '.join(staff_conditions)}
+                group by s.created_at::date
+            )
             select 
-                date(s.created_at) as sale_date,
-                count(s.id) as total_sales,
-                sum(s.total_amount) as daily_revenue,
-                avg(s.total_amount) as avg_sale_amount,
-                count(distinct s.user_id) as staff_count,
-                sum(si.quantity) as total_items_sold,
-                string_agg(distinct u.first_name || ' ' || u.last_name, ', ') as staff_names
-            from sales s
-            left join sale_items si on s.id = si.sale_id
-            left join users u on s.user_id = u.id
-            where {where_clause}
-            group by date(s.created_at)
+                r.day as sale_date,
+                r.sale_count as total_sales,
+                r.total_amount as daily_revenue,
+                round(r.total_amount / nullif(r.sale_count, 0), 2) as avg_sale_amount,
+                coalesce(st.staff_count, 0) as staff_count,
+                r.quantity_sold as total_items_sold,
+                st.staff_names
+            from sales_rollup_pharmacy_daily r
+            left join staff st on st.sale_date = r.day
+            where {' and '.join(rollup_conditions)}
             order by sale_date desc
         '''), params).mappings().all()
         
@@ -3668,7 +3693,7 @@ def get_sales_detailed_report():
     date_to = request.args.get('date_to')
     
     with engine.connect() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
@@ -3691,7 +3716,7 @@ def get_sales_detailed_report():
         where_clause = ' and '.join(conditions)
         
         # Get detailed sales data
-        sales_data = conn.execute(text(f'''
+        query = text(f'''
             select 
                 s.id as sale_id,
                 s.sale_number,
@@ -3714,7 +3739,13 @@ def get_sales_detailed_report():
             where {where_clause}
             group by s.id, s.sale_number, s.created_at, u.first_name, u.last_name, u.pharmacy_id, p.name, s.subtotal, s.tax_amount, s.discount_amount, s.total_amount, s.payment_method
             order by s.created_at desc, s.sale_number
-        '''), params).mappings().all()
+        ''')
+        
+        export = _export_report(ReportQuery('sales_detailed_report', query.text, params), me)
+        if export is not None:
+            return export
+        
+        sales_data = conn.execute(query, params).mappings().all()
         
         return jsonify({'success': True, 'data': [dict(row) for row in sales_data]})
 
@@ -3722,15 +3753,15 @@ def get_sales_detailed_report():
 @manager_bp.get('/reports/sales-period')
 @jwt_required()
 def get_sales_period_report():
-    """Generate detailed sales report by period (day/week/month) for specific staff with all medicines"""
+    """Generate detailed sales report by period (day/week/month/quarter) for specific staff with all medicines"""
     user_id = get_jwt_identity()
     staff_id = request.args.get('staff_id')
-    period = request.args.get('period', 'day')  # day, week, month
+    period = request.args.get('period', 'day')  # day, week, month, quarter
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
     
     with engine.connect() as conn:
-        me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me['role'] not in ('manager','admin'):
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
@@ -3747,118 +3778,16 @@ def get_sales_period_report():
         if not staff_check:
             return jsonify({'success': False, 'error': 'Staff not found or access denied'}), 403
         
-        # Build date grouping based on period
-        if period == 'day':
-            date_group = 'date(s.created_at)'
-            date_format = 'YYYY-MM-DD'
-        elif period == 'week':
-            date_group = 'date_trunc(\'week\', s.created_at)::date'
-            date_format = 'YYYY-MM-DD (Week)'
-        elif period == 'month':
-            date_group = 'date_trunc(\'month\', s.created_at)::date'
-            date_format = 'YYYY-MM'
-        else:
-            return jsonify({'success': False, 'error': 'Invalid period. Use day, week, or month'}), 400
-        
-        # Build query conditions
-        conditions = [
-            's.pharmacy_id = :pharmacy_id', 
-            's.status = \'completed\'',
-            's.user_id = :staff_id'
-        ]
-        params = {
-            'pharmacy_id': me['pharmacy_id'],
-            'staff_id': staff_id
-        }
-        
-        if date_from:
-            conditions.append('s.created_at >= :date_from')
-            params['date_from'] = date_from
-            
-        if date_to:
-            conditions.append('s.created_at <= :date_to')
-            params['date_to'] = date_to
-        
-        where_clause = ' and '.join(conditions)
-        
-        # Get sales summary data - calculate revenue from sale_items to get accurate totals
-        sales_summary = conn.execute(text(f'''
-            select 
-                {date_group} as period_date,
-                count(distinct s.id) as total_sales,
-                sum(si.total_price) as period_revenue,
-                avg(s.total_amount) as avg_sale_amount
-            from sales s
-            left join sale_items si on s.id = si.sale_id
-            where {where_clause}
-            group by {date_group}
-            order by period_date desc
-        '''), params).mappings().all()
-        
-        # Get detailed items data separately
-        items_data = conn.execute(text(f'''
-            select 
-                {date_group} as period_date,
-                count(si.id) as total_items_sold,
-                sum(si.quantity) as total_quantity,
-                array_agg(distinct s.id order by s.id) as sale_ids,
-                array_agg(distinct s.sale_number order by s.sale_number) as sale_numbers,
-                array_agg(distinct s.created_at order by s.created_at) as sale_times
-            from sales s
-            left join sale_items si on s.id = si.sale_id
-            where {where_clause}
-            group by {date_group}
-            order by period_date desc
-        '''), params).mappings().all()
+        if period not in PERIOD_GRAINS:
+            return jsonify({'success': False, 'error': 'Invalid period. Use day, week, month or quarter'}), 400
+        try:
+            top_k = int(request.args.get('top', DEFAULT_TOP_K))
+        except (TypeError, ValueError):
+            top_k = DEFAULT_TOP_K
+        date_format = PERIOD_GRAINS[period][2]
         
-        # Combine the data
-        sales_data = []
-        for summary in sales_summary:
-            items = next((item for item in items_data if item['period_date'] == summary['period_date']), {})
-            combined = {
-                'period_date': summary['period_date'],
-                'total_sales': summary['total_sales'],
-                'period_revenue': summary['period_revenue'],
-                'avg_sale_amount': summary['avg_sale_amount'],
-                'total_items_sold': items.get('total_items_sold', 0),
-                'total_quantity': items.get('total_quantity', 0),
-                'sale_ids': items.get('sale_ids', []),
-                'sale_numbers': items.get('sale_numbers', []),
-                'sale_times': items.get('sale_times', [])
-            }
-            sales_data.append(combined)
-        
-        # Get detailed medicine breakdown for each period
-        detailed_medicines = []
-        for period_data in sales_data:
-            period_date = period_data['period_date']
-            sale_ids = period_data['sale_ids']
-            
-            # Get all medicines sold in this period
-            medicine_data = conn.execute(text('''
-                select 
-                    si.sale_id,
-                    s.sale_number,
-                    s.created_at as sale_time,
-                    si.quantity,
-                    si.unit_price,
-                    si.total_price,
-                    p.name as product_name,
-                    p.id as product_id,
-                    pc.name as category_name
-                from sale_items si
-                join sales s on si.sale_id = s.id
-                join products p on si.product_id = p.id
-                left join product_categories pc on p.category_id = pc.id
-                where si.sale_id = ANY(:sale_ids)
-                order by s.created_at, p.name
-            '''), {'sale_ids': sale_ids}).mappings().all()
-            
-            detailed_medicines.append({
-                'period_date': period_date,
-                'period_summary': dict(period_data),
-                'medicines': [dict(med) for med in medicine_data]
-            })
+        # Totals, previous-period comparison, top medicines and line items per period in one query
+        report = period_report(conn, me['pharmacy_id'], staff_check['id'], period, date_from, date_to, top_k)
         
         # Get staff information
         staff_info = {
@@ -3869,7 +3798,8 @@ def get_sales_period_report():
         
         return jsonify({
             'success': True, 
-            'data': detailed_medicines,
+            'data': report['periods'],
+            'totals': report['totals'],
             'staff_info': staff_info,
             'period': period,
             'date_format': date_format
@@ -3880,13 +3810,14 @@ def get_sales_period_report():
 
 @manager_bp.get('/analytics/abc-ved')
 @jwt_required()
+@cached_analytics(engine, 'analytics_abc_ved', ('sales', 'inventory'))
 def analytics_abc_ved():
 	"""Compute ABC classes by consumption value and VED classes by criticality,
 	then return the ABC–VED matrix along with item-level classifications.
 
 	Defaults:
 	- ABC thresholds: A = top 70% value, B = next 20% (to 90%), C = remaining 10%
-	- VED rules: heuristic keyword/category mapping; can be refined later.
+	- VED rules: keyword/category mapping kept in products.ved_class (services/abc_ved.py).
 	"""
 	user_id = get_jwt_identity()
 	frm, to = date_range_params()
@@ -3901,82 +3832,11 @@ def analytics_abc_ved():
 	bth = max(ath, min(0.98, bth))
 
 	with engine.connect() as conn:
-		me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+		me = get_current_user(conn, user_id)
 		if not me or me['role'] not in ('staff','manager','admin'):
 			return jsonify({'success': False, 'error': 'Forbidden'}), 403
-
-		params = {'ph': me['pharmacy_id'], 'from': frm, 'to': to}
-
-		# Aggregate consumption (quantity sold) and value over the period
-		qry = text('''
-			with sales_agg as (
-				select si.product_id,
-				       sum(si.quantity) as total_qty
-				from sale_items si
-				join sales s on s.id = si.sale_id
-				where s.pharmacy_id = :ph
-				  and coalesce(s.status, 'completed') = 'completed'
-				  and s.created_at between :from and :to
-				group by si.product_id
-			)
-			select p.id,
-			       p.name,
-			       pc.name as category_name,
-			       coalesce(sa.total_qty, 0) as total_qty,
-			       coalesce(p.cost_price, 0) as cost_price,
-			       coalesce(sa.total_qty, 0) * coalesce(p.cost_price, 0) as consumption_value
-			from products p
-			left join product_categories pc on pc.id = p.category_id
-			left join sales_agg sa on sa.product_id = p.id
-			where p.pharmacy_id = :ph and p.is_active = true
-		''')
-
-		rows = [dict(r) for r in conn.execute(qry, params).mappings().all()]
-
-	# Compute ABC by cumulative value share
-	total_value = sum(max(0.0, float(r.get('consumption_value') or 0)) for r in rows) or 0.0
-	rows.sort(key=lambda r: float(r.get('consumption_value') or 0), reverse=True)
-	cum = 0.0
-	for r in rows:
-		val = max(0.0, float(r.get('consumption_value') or 0))
-		share = (val / total_value) if total_value > 0 else 0.0
-		cum += share
-		if cum <= ath:
-			r['abc_class'] = 'A'
-		elif cum <= bth:
-			r['abc_class'] = 'B'
-		else:
-			r['abc_class'] = 'C'
-
-	# Heuristic VED tagging (can be replaced with DB-driven tags later)
-	def _infer_ved(name: str, category: str) -> str:
-		name_l = (name or '').lower()
-		cat_l = (category or '').lower()
-		vital_keywords = [
-			'insulin', 'epinephrine', 'adrenaline', 'antibiotic', 'cef', 'cillin', 'metformin',
-			'amoxicillin', 'azithromycin', 'salbutamol', 'albuterol', 'antihypertensive', 'losartan',
-			'telmisartan', 'amlodipine', 'anticonvulsant', 'antiepileptic', 'warfarin', 'heparin'
-		]
-		desirable_keywords = ['supplement', 'vitamin', 'cosmetic', 'herbal', 'lotion']
-		vital_cats = ['antibiotics', 'cardio', 'antihypertensive', 'asthma', 'diabetes']
-		desirable_cats = ['vitamins', 'supplements', 'cosmetics']
-		if any(k in name_l for k in vital_keywords) or any(k in cat_l for k in vital_cats):
-			return 'V'
-		if any(k in name_l for k in desirable_keywords) or any(k in cat_l for k in desirable_cats):
-			return 'D'
-		return 'E'
-
-	for r in rows:
-		r['ved_class'] = _infer_ved(r.get('name'), r.get('category_name'))
-		r['matrix_cell'] = f"{r['abc_class']}-{r['ved_class']}"
-
-	# Build matrix summary
-	matrix_counts = {}
-	for abc in ('A','B','C'):
-		for ved in ('V','E','D'):
-			matrix_counts[f'{abc}-{ved}'] = 0
-	for r in rows:
-		matrix_counts[r['matrix_cell']] = matrix_counts.get(r['matrix_cell'], 0) + 1
+		# Consumption from the daily rollup; ABC by window sum and VED from products.ved_class, all in SQL
+		rows, matrix_counts = classify_abc_ved(conn, me['pharmacy_id'], frm, to, ath, bth)
 
 	return jsonify({
 		'success': True,
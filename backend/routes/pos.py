@@ -1,10 +1,10 @@
 """POS routes blueprint"""
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from dotenv import load_dotenv
 import os
-import uuid
+import json
 import sys
 from pathlib import Path
 from datetime import datetime, timedelta
@@ -13,10 +13,21 @@ from datetime import datetime, timedelta
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 load_dotenv()
-from utils.helpers import get_database_url
+from utils.helpers import get_current_user, get_engine
+from services.pos_sales import MAX_BULK_SALES, SaleOutcome, SaleValidationError, parse_sale, record_sales
+from services.pos_catalog import (
+	catalog_changes, catalog_etag, catalog_feed, catalog_version, etag_matches, parse_fields
+)
+from services.receipts import MAX_BATCH_RECEIPTS, render_receipts
+from services.pos_sync import parse_journal, resolve_entries, sync_journal, terminal_status
+from services.sale_idempotency import (
+	MAX_KEY_LENGTH, IdempotencyConflict, claim_key, purge_due, purge_expired_keys,
+	recent_keys, request_fingerprint, store_response
+)
+from utils.result_cache import bump_generation
+from utils.pagination import InvalidCursor, Keyset, KeysetPage
 
-DATABASE_URL = get_database_url()
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = get_engine()
 
 pos_bp = Blueprint('pos', __name__, url_prefix='/api/pos')
 
@@ -125,238 +136,385 @@ def get_pos_categories():
 		rows = [dict(r) for r in conn.execute(query).mappings().all()]
 	return jsonify({'success': True, 'categories': rows})
 
+class _SaleRejected(Exception):
+	"""Raised inside the sale transaction to roll it back when the sale cannot be recorded."""
+
+	def __init__(self, outcome):
+		super().__init__(outcome.error)
+		self.outcome = outcome
+
+
 @pos_bp.post('/process-sale')
 @jwt_required()
 def process_sale():
-	"""Process a complete sale transaction"""
+	"""
+	Process a complete sale transaction.
+	Send an Idempotency-Key header (or ``idempotency_key`` in the body) to make
+	retries safe: a repeated key returns the original receipt without selling again.
+	"""
 	try:
-		data = request.get_json()
+		data = request.get_json() or {}
 		user_id = get_jwt_identity()
+		idempotency_key = str(request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '').strip()[:MAX_KEY_LENGTH]
+		fingerprint = request_fingerprint(data) if idempotency_key else None
 		
-		# Get user details
-		user_sql = text('select id, pharmacy_id from users where id = :user_id')
-		with engine.connect() as conn:
-			user_row = conn.execute(user_sql, {'user_id': user_id}).mappings().first()
-		if not user_row:
+		# Keys are scoped by pharmacy in memory as in sale_idempotency, so any cashier's retry matches
+		me = get_current_user(engine, user_id)
+		if not me:
 			return jsonify({'success': False, 'error': 'User not found'}), 404
+		pharmacy_id = me['pharmacy_id']
 		
-		# Validate required fields
-		required_fields = ['items', 'payment_method']
-		for field in required_fields:
-			if field not in data:
-				return jsonify({'success': False, 'error': f'Missing required field: {field}'}), 400
-		
-		items = data['items']
-		payment_method = data['payment_method']
-		pharmacy_id = user_row['pharmacy_id']
-		customer_name = data.get('customer_name', '')
-		discount_amount = data.get('discount_amount', 0)
-		tax_rate = data.get('tax_rate', 0.12)  # 12% VAT
+		# Recently completed keys are answered from memory, before any database work
+		if idempotency_key:
+			cached = recent_keys.get(pharmacy_id, idempotency_key)
+			if cached is not None:
+				if cached[0] != fingerprint:
+					return jsonify({'success': False, 'error': 'Idempotency-Key was already used with a different request'}), 422
+				return jsonify({**cached[1], 'replayed': True})
 		
-		if not items or len(items) == 0:
-			return jsonify({'success': False, 'error': 'No items in cart'}), 400
-		
-		# Calculate totals
-		subtotal = sum(item['quantity'] * item['unit_price'] for item in items)
-		tax_amount = subtotal * tax_rate
-		total_amount = subtotal + tax_amount - discount_amount
-		
-		# Generate sale number
-		sale_number = f"POS{datetime.now().strftime('%Y%m%d')}{str(uuid.uuid4())[:8].upper()}"
+		try:
+			sale = parse_sale(data)
+		except SaleValidationError as e:
+			return jsonify({'success': False, 'error': str(e)}), 400
 		
 		with engine.begin() as conn:
-			# Create sale record
-			sale_sql = text('''
-				INSERT INTO sales (
-					sale_number, pharmacy_id, user_id, subtotal, tax_amount, discount_amount, 
-					payment_method, status, notes, created_at
-				) VALUES (:sale_number, :pharmacy_id, :user_id, :subtotal, :tax_amount, :discount_amount, 
-					:payment_method, 'completed', :notes, :created_at)
-				RETURNING id
-			''')
-			
-			sale_result = conn.execute(sale_sql, {
-				'sale_number': sale_number,
-				'pharmacy_id': pharmacy_id,
-				'user_id': user_id,
-				'subtotal': subtotal,
-				'tax_amount': tax_amount,
-				'discount_amount': discount_amount,
-				'payment_method': payment_method,
-				'notes': f"Customer: {customer_name}" if customer_name else None,
-				'created_at': datetime.now()
-			})
-			sale_id = sale_result.scalar()
+			# Get user details
+			user_row = conn.execute(text('select id, pharmacy_id, first_name, last_name from users where id = :user_id'), {'user_id': user_id}).mappings().first()
+			if not user_row:
+				return jsonify({'success': False, 'error': 'User not found'}), 404
+			pharmacy_id = user_row['pharmacy_id']
 			
-			# Create sale items and update inventory
-			for item in items:
-				product_id = item['product_id']
-				quantity = item['quantity']
-				unit_price = item['unit_price']
-				total_price = quantity * unit_price
-				
-				# Create sale item
-				item_sql = text('''
-					INSERT INTO sale_items (sale_id, product_id, quantity, unit_price, created_at)
-					VALUES (:sale_id, :product_id, :quantity, :unit_price, :created_at)
-				''')
-				conn.execute(item_sql, {
-					'sale_id': sale_id,
-					'product_id': product_id,
-					'quantity': quantity,
-					'unit_price': unit_price,
-					'created_at': datetime.now()
-				})
-				
-				# Track sold items from batches (FIFO - oldest batches first)
-				# Ensure batches table exists
+			if idempotency_key:
 				try:
-					conn.execute(text("""
-						CREATE TABLE IF NOT EXISTS inventory_batches (
-							id bigserial primary key,
-							product_id bigint not null references products(id) on delete cascade,
-							batch_number text not null,
-							quantity int not null check (quantity >= 0),
-							sold_quantity int not null default 0 check (sold_quantity >= 0),
-							expiration_date date,
-							delivery_date date,
-							supplier_id bigint references suppliers(id),
-							cost_price numeric(12, 2),
-							received_at timestamptz default now(),
-							unique(product_id, batch_number)
-						);
-					"""))
-					conn.execute(text("ALTER TABLE inventory_batches ADD COLUMN IF NOT EXISTS sold_quantity int not null default 0;"))
-				except Exception:
-					pass
-				
-				# Get available batches (FIFO - oldest first, not expired, not fully sold)
-				# Only include batches that are not expired
-				batches = conn.execute(text('''
-					SELECT id, quantity, sold_quantity, (quantity - sold_quantity) as available
-					FROM inventory_batches
-					WHERE product_id = :pid
-					AND (expiration_date IS NULL OR expiration_date > CURRENT_DATE)
-					AND (quantity - sold_quantity) > 0
-					ORDER BY received_at ASC
-				'''), {'pid': product_id}).mappings().all()
-				
-				# Check if we have enough available stock (excluding expired)
-				total_available = sum(int(batch['available']) for batch in batches)
-				if total_available < quantity:
-					raise ValueError(f'Insufficient available stock. Available: {total_available}, Requested: {quantity}')
-				
-				# Allocate sold quantity to batches (FIFO)
-				remaining_to_sell = quantity
-				for batch in batches:
-					if remaining_to_sell <= 0:
-						break
-					available = int(batch['available'])
-					if available > 0:
-						sell_from_batch = min(remaining_to_sell, available)
-						conn.execute(text('''
-							UPDATE inventory_batches
-							SET sold_quantity = sold_quantity + :sell_qty
-							WHERE id = :batch_id
-						'''), {'sell_qty': sell_from_batch, 'batch_id': batch['id']})
-						remaining_to_sell -= sell_from_batch
-				
-				# Update inventory (available stock = delivered - sold - disposed, excluding expired)
-				# Calculate available stock from batches (only non-expired batches)
-				# Note: Disposed expired products don't affect this since expired batches are already excluded
-				available_stock = conn.execute(text('''
-					SELECT COALESCE(SUM(quantity - sold_quantity - COALESCE(disposed_quantity, 0)), 0) as available
-					FROM inventory_batches
-					WHERE product_id = :pid
-					AND (expiration_date IS NULL OR expiration_date > CURRENT_DATE)
-				'''), {'pid': product_id}).scalar() or 0
-				
-				inventory_sql = text('''
-					UPDATE inventory 
-					SET current_stock = :available_stock,
-						last_updated = :last_updated
-					WHERE product_id = :product_id
-				''')
-				conn.execute(inventory_sql, {
-					'available_stock': available_stock,
-					'last_updated': datetime.now(),
-					'product_id': product_id
-				})
-		
-		# Get sale details for receipt
-		receipt_query = text('''
-			SELECT 
-				s.id, s.sale_number, s.subtotal, s.tax_amount, s.discount_amount, 
-				s.total_amount, s.payment_method, s.created_at,
-				u.first_name, u.last_name
-			FROM sales s
-			JOIN users u ON s.user_id = u.id
-			WHERE s.id = :sale_id
-		''')
-		
-		items_query = text('''
-			SELECT 
-				si.quantity, si.unit_price, si.total_price,
-				p.name as product_name
-			FROM sale_items si
-			JOIN products p ON si.product_id = p.id
-			WHERE si.sale_id = :sale_id
-			ORDER BY si.id
-		''')
+					stored = claim_key(conn, pharmacy_id, idempotency_key, fingerprint)
+				except IdempotencyConflict as e:
+					return jsonify({'success': False, 'error': str(e)}), 422
+				if stored is not None:
+					recent_keys.put(pharmacy_id, idempotency_key, fingerprint, stored)
+					return jsonify({**stored, 'replayed': True})
+			
+			# Allocate FIFO from non-expired batches and write the sale (services/pos_sales.py)
+			outcome = record_sales(conn, pharmacy_id, user_id, [sale])[0]
+			if outcome.status != 'created':
+				# Roll back (releasing the idempotency key) so the client can fix the cart and retry
+				raise _SaleRejected(outcome)
+			sale_id = outcome.sale_id
+			
+			# The receipt is assembled from the INSERT ... RETURNING rows; the sale is not read back
+			response = {
+				'success': True,
+				'sale': {**outcome.receipt, 'cashier': f"{user_row['first_name']} {user_row['last_name']}"},
+			}
+			if idempotency_key:
+				store_response(conn, pharmacy_id, idempotency_key, sale_id, response)
 		
-		with engine.connect() as conn:
-			sale_data = conn.execute(receipt_query, {'sale_id': sale_id}).mappings().first()
-			sale_items = [dict(r) for r in conn.execute(items_query, {'sale_id': sale_id}).mappings().all()]
+		if idempotency_key:
+			recent_keys.put(pharmacy_id, idempotency_key, fingerprint, response)
+			if purge_due():
+				with engine.begin() as conn:
+					purge_expired_keys(conn)
+		bump_generation(pharmacy_id, 'sales', 'inventory', 'batches')
+		catalog_feed.forget_version(pharmacy_id)
+		return jsonify({**response, 'replayed': False})
 		
-		return jsonify({
-			'success': True,
-			'sale': {
-				'id': sale_data['id'],
-				'sale_number': sale_data['sale_number'],
-				'subtotal': float(sale_data['subtotal']),
-				'tax_amount': float(sale_data['tax_amount']),
-				'discount_amount': float(sale_data['discount_amount']),
-				'total_amount': float(sale_data['total_amount']),
-				'payment_method': sale_data['payment_method'],
-				'created_at': sale_data['created_at'].isoformat(),
-				'cashier': f"{sale_data['first_name']} {sale_data['last_name']}",
-				'items': [
-					{
-						'product_name': item['product_name'],
-						'quantity': item['quantity'],
-						'unit_price': float(item['unit_price']),
-						'total_price': float(item['total_price'])
-					}
-					for item in sale_items
-				]
+	except _SaleRejected as e:
+		outcome = e.outcome
+		return jsonify({'success': False, 'error': outcome.error, 'conflicts': outcome.conflicts}), 409
+	except Exception as e:
+		return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@pos_bp.post('/sales/bulk')
+@jwt_required()
+def process_sales_bulk():
+	"""
+	Record a batch of sales (e.g. a terminal catching up after being offline).
+	The batch is keyed by ``idempotency_key`` (body or Idempotency-Key header):
+	re-sending the same key returns the stored results instead of selling again,
+	and re-using it for a different batch is rejected with 422.
+	Each sale succeeds or fails on its own; see services/pos_sales.py.
+	"""
+	data = request.get_json(silent=True) or {}
+	idempotency_key = str(data.get('idempotency_key') or request.headers.get('Idempotency-Key') or '').strip()
+	raw_sales = data.get('sales')
+	if not idempotency_key:
+		return jsonify({'success': False, 'error': 'idempotency_key is required'}), 400
+	if not isinstance(raw_sales, list) or not raw_sales:
+		return jsonify({'success': False, 'error': 'sales must be a non-empty list'}), 400
+	if len(raw_sales) > MAX_BULK_SALES:
+		return jsonify({'success': False, 'error': f'At most {MAX_BULK_SALES} sales per batch'}), 400
+
+	user_id = get_jwt_identity()
+	fingerprint = request_fingerprint(data)
+	try:
+		with engine.begin() as conn:
+			user_row = get_current_user(conn, user_id)
+			if not user_row:
+				return jsonify({'success': False, 'error': 'User not found'}), 404
+			pharmacy_id = user_row['pharmacy_id']
+
+			# Claim the key; a concurrent request with the same key waits here until we commit
+			claimed = conn.execute(text('''
+				INSERT INTO pos_bulk_sale_requests (pharmacy_id, idempotency_key, user_id, sale_count, request_hash)
+				VALUES (:ph, :key, :uid, :n, :hash)
+				ON CONFLICT (pharmacy_id, idempotency_key) DO NOTHING
+				RETURNING 1
+			'''), {'ph': pharmacy_id, 'key': idempotency_key, 'uid': user_id, 'n': len(raw_sales), 'hash': fingerprint}).first()
+			if not claimed:
+				stored = conn.execute(text('''
+					SELECT request_hash, response FROM pos_bulk_sale_requests
+					WHERE pharmacy_id = :ph AND idempotency_key = :key
+				'''), {'ph': pharmacy_id, 'key': idempotency_key}).mappings().first()
+				if stored is None or stored['response'] is None:
+					return jsonify({'success': False, 'error': 'Batch with this idempotency_key is still being processed'}), 409
+				# Rows stored before request_hash existed have none to compare
+				if stored['request_hash'] is not None and stored['request_hash'] != fingerprint:
+					return jsonify({'success': False, 'error': 'idempotency_key was already used with a different batch'}), 422
+				return jsonify({**stored['response'], 'replayed': True})
+
+			outcomes = [None] * len(raw_sales)
+			valid, positions = [], []
+			for idx, raw in enumerate(raw_sales):
+				try:
+					valid.append(parse_sale(raw))
+					positions.append(idx)
+				except SaleValidationError as e:
+					outcomes[idx] = SaleOutcome(index=idx, client_ref=(raw or {}).get('client_ref') if isinstance(raw, dict) else None,
+						status='failed', error=str(e))
+			for idx, outcome in zip(positions, record_sales(conn, pharmacy_id, user_id, valid)):
+				outcome.index = idx
+				outcomes[idx] = outcome
+
+			results = [o.as_dict() for o in outcomes]
+			if data.get('include_receipts'):
+				for result, outcome in zip(results, outcomes):
+					if outcome.receipt is not None:
+						result['receipt'] = outcome.receipt
+			created = sum(1 for o in outcomes if o.status == 'created')
+			response = {
+				'success': True,
+				'idempotency_key': idempotency_key,
+				'summary': {'total': len(outcomes), 'created': created, 'failed': len(outcomes) - created},
+				'results': results,
 			}
-		})
-		
+			conn.execute(text('''
+				UPDATE pos_bulk_sale_requests SET response = CAST(:response AS jsonb)
+				WHERE pharmacy_id = :ph AND idempotency_key = :key
+			'''), {'response': json.dumps(response), 'ph': pharmacy_id, 'key': idempotency_key})
 	except Exception as e:
 		return jsonify({'success': False, 'error': str(e)}), 500
 
+	if purge_due():
+		with engine.begin() as conn:
+			purge_expired_keys(conn)
+	if created:
+		bump_generation(pharmacy_id, 'sales', 'inventory', 'batches')
+		catalog_feed.forget_version(pharmacy_id)
+	return jsonify({**response, 'replayed': False})
+
+@pos_bp.post('/sync/journal')
+@jwt_required()
+def sync_offline_journal():
+	"""
+	Upload a terminal's offline sale journal:
+	``{terminal_id, on_conflict: 'reject'|'clamp', entries: [{seq, created_at, items, payment_method, ...}]}``.
+	Entries are replayed in seq order; re-sent entries return their stored result.
+	See services/pos_sync.py.
+	"""
+	try:
+		terminal_id, entries, policy = parse_journal(request.get_json(silent=True) or {})
+	except SaleValidationError as e:
+		return jsonify({'success': False, 'error': str(e)}), 400
+
+	user_id = get_jwt_identity()
+	try:
+		with engine.begin() as conn:
+			me = get_current_user(conn, user_id)
+			if not me:
+				return jsonify({'success': False, 'error': 'User not found'}), 404
+			pharmacy_id = me['pharmacy_id']
+			result = sync_journal(conn, pharmacy_id, me['id'], terminal_id, entries, policy)
+		with engine.begin() as conn:
+			result['catalog_version'] = catalog_version(conn, pharmacy_id)
+	except Exception as e:
+		return jsonify({'success': False, 'error': str(e)}), 500
+
+	if result['summary']['applied'] or result['summary']['adjusted']:
+		bump_generation(pharmacy_id, 'sales', 'inventory', 'batches')
+		catalog_feed.forget_version(pharmacy_id)
+	return jsonify({'success': True, **result})
+
+@pos_bp.get('/sync/status')
+@jwt_required()
+def sync_status():
+	"""Acknowledged sequence per terminal and unresolved offline conflicts (optionally ``?terminal_id=``)."""
+	user_id = get_jwt_identity()
+	with engine.connect() as conn:
+		me = get_current_user(conn, user_id)
+		if not me:
+			return jsonify({'success': False, 'error': 'User not found'}), 404
+		limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+		status = terminal_status(conn, me['pharmacy_id'], request.args.get('terminal_id'), limit=limit)
+	return jsonify({'success': True, **status})
+
+@pos_bp.post('/sync/resolve')
+@jwt_required()
+def sync_resolve():
+	"""Mark offline conflicts as reconciled: ``{terminal_id, seqs: [...]}`` (managers only)."""
+	data = request.get_json(silent=True) or {}
+	terminal_id = str(data.get('terminal_id') or '').strip()
+	seqs = data.get('seqs')
+	if not terminal_id or not isinstance(seqs, list) or not seqs:
+		return jsonify({'success': False, 'error': 'terminal_id and seqs are required'}), 400
+	user_id = get_jwt_identity()
+	try:
+		with engine.begin() as conn:
+			me = get_current_user(conn, user_id)
+			if not me or me['role'] not in ('manager', 'admin'):
+				return jsonify({'success': False, 'error': 'Forbidden'}), 403
+			resolved = resolve_entries(conn, me['pharmacy_id'], terminal_id, seqs)
+	except (TypeError, ValueError):
+		return jsonify({'success': False, 'error': 'seqs must be integers'}), 400
+	return jsonify({'success': True, 'resolved': resolved})
+
+@pos_bp.get('/catalog')
+@jwt_required()
+def pos_catalog():
+	"""
+	Full compact catalog of the caller's pharmacy, precomputed per catalog
+	version and compressed (gzip, or brotli when available). Send the ETag
+	back as If-None-Match: an unchanged catalog returns 304 with no body.
+	``?fields=name,unit_price,current_stock`` projects columns (``id`` is always kept).
+	"""
+	try:
+		fields = parse_fields(request.args.get('fields'))
+	except ValueError as e:
+		return jsonify({'success': False, 'error': str(e)}), 400
+	me = get_current_user(engine, get_jwt_identity())
+	pharmacy_id = me['pharmacy_id'] if me else None
+	if pharmacy_id is None:
+		return jsonify({'success': False, 'error': 'User not found'}), 404
+
+	version = catalog_feed.current_version(engine, pharmacy_id)
+	etag = catalog_etag(pharmacy_id, version, fields)
+	headers = {
+		'Vary': 'Accept-Encoding, Authorization',
+		'Cache-Control': 'private, no-cache',
+		'X-Catalog-Version': str(version),
+	}
+	if etag_matches(request.headers.get('If-None-Match'), etag):
+		return Response(status=304, headers={**headers, 'ETag': f'"{etag}"'})
+
+	payload = catalog_feed.payload(engine, pharmacy_id, version, fields)
+	encoding, body = payload.select(request.headers.get('Accept-Encoding', ''))
+	headers['ETag'] = payload.etag_for(encoding)
+	headers['X-Catalog-Version'] = str(payload.version)
+	if encoding != 'identity':
+		headers['Content-Encoding'] = encoding
+	return Response(body, status=200, mimetype='application/json', headers=headers)
+
+@pos_bp.get('/catalog/changes')
+@jwt_required()
+def pos_catalog_changes():
+	"""
+	Compact catalog delta since ``?since=<version>`` (0 or omitted: full catalog).
+	Returns ``{version, full, fields, products: [[...], ...], removed: [ids]}``;
+	the client stores ``version`` and sends it as ``since`` next time.
+	Accepts the same ``?fields=`` projection as /catalog.
+	"""
+	try:
+		since = int(request.args.get('since', 0) or 0)
+	except ValueError:
+		return jsonify({'success': False, 'error': 'since must be an integer version'}), 400
+	try:
+		fields = parse_fields(request.args.get('fields'))
+	except ValueError as e:
+		return jsonify({'success': False, 'error': str(e)}), 400
+	user_id = get_jwt_identity()
+	with engine.begin() as conn:
+		me = get_current_user(conn, user_id)
+		if not me:
+			return jsonify({'success': False, 'error': 'User not found'}), 404
+		changes = catalog_changes(conn, me['pharmacy_id'], since, fields)
+	return jsonify({'success': True, 'since': since, **changes})
+
+@pos_bp.post('/receipts/batch')
+@jwt_required()
+def pos_receipts_batch():
+	"""
+	Render stored receipts for reprints and audits in one query:
+	``{sale_ids: [...]}`` and/or ``{sale_numbers: [...]}``, or a ``{date_from, date_to}``
+	range (ISO dates, date_to exclusive), at most 500 receipts per call.
+	"""
+	data = request.get_json(silent=True) or {}
+	sale_ids = data.get('sale_ids')
+	sale_numbers = data.get('sale_numbers')
+	date_from = data.get('date_from')
+	date_to = data.get('date_to')
+	for name, value in (('sale_ids', sale_ids), ('sale_numbers', sale_numbers)):
+		if value is not None and (not isinstance(value, list) or len(value) > MAX_BATCH_RECEIPTS):
+			return jsonify({'success': False, 'error': f'{name} must be a list of at most {MAX_BATCH_RECEIPTS}'}), 400
+	if sale_ids is None and sale_numbers is None and not (date_from and date_to):
+		return jsonify({'success': False, 'error': 'Provide sale_ids, sale_numbers or date_from and date_to'}), 400
+	try:
+		date_from = datetime.fromisoformat(date_from) if date_from else None
+		date_to = datetime.fromisoformat(date_to) if date_to else None
+		limit = int(data.get('limit', MAX_BATCH_RECEIPTS))
+	except (TypeError, ValueError):
+		return jsonify({'success': False, 'error': 'Invalid date_from, date_to or limit'}), 400
+
+	user_id = get_jwt_identity()
+	try:
+		with engine.connect() as conn:
+			me = get_current_user(conn, user_id)
+			if not me:
+				return jsonify({'success': False, 'error': 'User not found'}), 404
+			receipts = render_receipts(conn, me['pharmacy_id'], sale_ids=sale_ids, sale_numbers=sale_numbers,
+				date_from=date_from, date_to=date_to, limit=limit)
+	except (TypeError, ValueError):
+		return jsonify({'success': False, 'error': 'sale_ids must be integers'}), 400
+	except Exception as e:
+		return jsonify({'success': False, 'error': str(e)}), 500
+	return jsonify({'success': True, 'count': len(receipts), 'receipts': receipts})
+
+
+TRANSACTIONS_KEYSET = Keyset('pos_transactions', [('s.created_at', 'created_at'), ('s.id', 'id')])
+
+
 @pos_bp.get('/transactions')
 @jwt_required()
 def pos_transactions():
 	try:
 		user_id = get_jwt_identity()
+		try:
+			page = KeysetPage.from_request(TRANSACTIONS_KEYSET, default_limit=50)
+		except InvalidCursor as e:
+			return jsonify({'success': False, 'error': str(e)}), 400
 		with engine.connect() as conn:
 			# First check if user exists
-			me = conn.execute(text('select id, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+			me = get_current_user(conn, user_id)
 			if not me:
 				return jsonify({'success': False, 'error': 'User not found'}), 404
 			
 			# Ensure returns tables exist (using centralized function)
 			ensure_returns_tables()
 			
-			# Get optional limit and date filter from query params
-			limit = int(request.args.get('limit', 50))  # Default 50 instead of 100
+			# Page size/cursor come from the keyset page; optional date filter from query params
 			days = int(request.args.get('days', 30))  # Default last 30 days
 			date_from = datetime.now() - timedelta(days=days)
 			date_from = date_from.replace(hour=0, minute=0, second=0, microsecond=0)
 			
-			# Now get transactions with return info and staff names - optimized with date filter
-			sales_rows = conn.execute(text('''
+			# Page the sale ids first (index range scan from the cursor), then attach
+			# return info and staff names for just that page
+			params = {'ph': me['pharmacy_id'], 'date_from': date_from}
+			sales_rows = conn.execute(text(f'''
+				WITH page AS (
+					SELECT s.id
+					FROM sales s
+					WHERE s.pharmacy_id = :ph AND s.created_at >= :date_from AND {page.condition(params)}
+					ORDER BY {page.order_by()}
+					{page.limit_clause(params)}
+				)
 				SELECT 
 					s.id, s.sale_number, s.subtotal, s.discount_amount, s.total_amount,
 					s.user_id,
@@ -371,12 +529,26 @@ def pos_transactions():
 					lr.editor_username as last_editor_username,
 					lr.editor_first_name as last_editor_first_name,
 					lr.editor_last_name as last_editor_last_name,
-					lr.updated_at as last_return_updated_at
-				FROM sales s
+					lr.updated_at as last_return_updated_at,
+					COALESCE(it.items, '[]'::json) AS items
+				FROM page
+				JOIN sales s ON s.id = page.id
+				LEFT JOIN LATERAL (
+					SELECT json_agg(json_build_object(
+						'name', p.name,
+						'quantity', si.quantity,
+						'unit_price', si.unit_price,
+						'total_price', si.quantity * si.unit_price,
+						'product_id', si.product_id
+					) ORDER BY si.id) AS items
+					FROM sale_items si
+					JOIN products p ON p.id = si.product_id
+					WHERE si.sale_id = s.id
+				) it ON true
 				LEFT JOIN (
 					SELECT sale_id, count(*) AS return_count, sum(total_refund_amount) AS total_returned_amount
 					FROM returns 
-					WHERE pharmacy_id = :ph
+					WHERE pharmacy_id = :ph AND sale_id IN (SELECT id FROM page)
 					GROUP BY sale_id
 				) r ON r.sale_id = s.id
 				LEFT JOIN users u ON u.id = s.user_id
@@ -388,37 +560,17 @@ def pos_transactions():
 						   uu.last_name AS editor_last_name
 					FROM returns r1
 					LEFT JOIN users uu ON uu.id = r1.user_id
-					WHERE r1.pharmacy_id = :ph
+					WHERE r1.pharmacy_id = :ph AND r1.sale_id IN (SELECT id FROM page)
 					AND r1.updated_at = (
 						SELECT MAX(r2.updated_at) FROM returns r2 WHERE r2.sale_id = r1.sale_id AND r2.pharmacy_id = r1.pharmacy_id
 					)
 				) lr ON lr.sale_id = s.id
-				WHERE s.pharmacy_id = :ph AND s.created_at >= :date_from
-				ORDER BY s.created_at DESC
-				LIMIT :limit
-			'''), {'ph': me['pharmacy_id'], 'date_from': date_from, 'limit': limit}).mappings().all()
-
-			# Batch fetch all items for all sales in one query (much faster)
-			sale_ids = [s['id'] for s in sales_rows]
-			items_map = {}
-			if sale_ids:
-				items_rows = conn.execute(text('''
-					select si.sale_id, si.quantity, si.unit_price, (si.quantity * si.unit_price) as total_price,
-						   p.name as product_name, si.product_id
-					from sale_items si
-					join products p on p.id = si.product_id
-					where si.sale_id = ANY(:sale_ids)
-					order by si.sale_id, si.id
-				'''), {'sale_ids': sale_ids}).mappings().all()
-				for it in items_rows:
-					sid = it['sale_id']
-					if sid not in items_map:
-						items_map[sid] = []
-					items_map[sid].append(it)
+				ORDER BY {page.order_by()}
+			'''), params).mappings().all()
+			sales_rows, pagination = page.finish(sales_rows)
 
 			transactions = []
 			for s in sales_rows:
-				items = items_map.get(s['id'], [])
 				total_amount = float(s['total_amount'])
 				transactions.append({
 					'id': s['id'],
@@ -440,17 +592,10 @@ def pos_transactions():
 					# last return editor fields
 					'last_edited_by': ('{} {}'.format(s.get('last_editor_first_name') or '', s.get('last_editor_last_name') or '').strip() or s.get('last_editor_username')),
 					'last_edited_at': (s.get('last_return_updated_at').isoformat() if s.get('last_return_updated_at') else None),
-					'items': [
-						{
-							'name': it['product_name'],
-							'quantity': it['quantity'],
-							'unit_price': float(it['unit_price']),
-							'total_price': float(it['total_price']),
-							'product_id': it['product_id']
-						} for it in items
-					]
+					# Items are aggregated per sale in the page query (json numbers arrive as floats)
+					'items': s['items']
 				})
-			return jsonify({'success': True, 'transactions': transactions})
+			return jsonify({'success': True, 'transactions': transactions, 'pagination': pagination})
 	except Exception as e:
 		print(f"Error in pos_transactions: {e}")
 		return jsonify({'success': False, 'error': str(e)}), 500
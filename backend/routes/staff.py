@@ -1,16 +1,17 @@
 """Staff management routes blueprint"""
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from dotenv import load_dotenv
 import bcrypt
 import os
 import re
-from utils.helpers import get_current_user, require_manager_or_admin, get_database_url
+from utils.helpers import get_current_user, require_manager_or_admin, get_engine
+from services.expiry_risk import product_risk_rows
+from services.identity import identity_cache
 
 load_dotenv()
-DATABASE_URL = get_database_url()
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = get_engine()
 
 # Validation constants (matching frontend)
 MAX_EMAIL_LENGTH = 255
@@ -254,6 +255,7 @@ def update_staff(staff_id: int):
 		row = conn.execute(sql, params).mappings().first()
 		if not row:
 			return jsonify({'success': False, 'error': 'Staff not found or not allowed'}), 404
+		identity_cache.forget(staff_id)
 		return jsonify({'success': True, 'user': dict(row)})
 
 
@@ -272,6 +274,7 @@ def delete_staff(staff_id: int):
 		'''), {'id': staff_id, 'me': int(user_id), 'ph': me['pharmacy_id']}).first()
 		if not row:
 			return jsonify({'success': False, 'error': 'Staff not found or not allowed'}), 404
+		identity_cache.forget(staff_id)
 		return jsonify({'success': True})
 
 
@@ -289,7 +292,7 @@ def staff_sustainability_expiry_risk():
 	try:
 		user_id = get_jwt_identity()
 		with engine.connect() as conn:
-			me = conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+			me = get_current_user(conn, user_id)
 			if not me or me['role'] not in ('staff','manager','admin'):
 				return jsonify({'success': False, 'error': 'Forbidden'}), 403
 
@@ -334,103 +337,17 @@ def staff_sustainability_expiry_risk():
 			if keyword_state:
 				state_filter = keyword_state
 
-			params = {
-				'ph': me['pharmacy_id'],
-				'soon_window': soon_window,
-				'include_zero': include_zero,
-			}
-			if category_id:
-				try:
-					params['category_id'] = int(category_id)
-				except (TypeError, ValueError):
-					pass
-			if search_term:
-				params['search'] = f"%{search_term}%"
-
-			params['critical_window'] = critical_window
-			params['soon_window'] = soon_window
-			params['medium_window'] = medium_window
-
-			# Build query with conditional filters to avoid type ambiguity
-			base_query = '''
-			with product_data as (
-				select 
-					p.id,
-					p.name,
-					pc.name as category_name,
-					p.location,
-					sum(case when b.quantity > 0 then (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) else 0 end) as total_quantity,
-					sum(case when b.quantity > 0 then (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) * coalesce(b.cost_price, p.cost_price) else 0 end) as total_value,
-					sum(case when b.expiration_date <= current_date and (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) > 0 then (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) * coalesce(b.cost_price, p.cost_price) else 0 end) as expired_value,
-					sum(case when b.expiration_date > current_date and b.expiration_date <= current_date + make_interval(days => :soon_window) and (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) > 0 then (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) * coalesce(b.cost_price, p.cost_price) else 0 end) as expiring_soon_value,
-					sum(case when b.expiration_date <= current_date and (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) > 0 then (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) else 0 end) as expired_quantity,
-					sum(case when b.expiration_date > current_date and b.expiration_date <= current_date + make_interval(days => :soon_window) and (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) > 0 then (b.quantity - coalesce(b.sold_quantity, 0) - coalesce(b.disposed_quantity, 0)) else 0 end) as expiring_soon_quantity,
-					min(b.expiration_date) as next_expiration,
-					(min(b.expiration_date) - current_date)::int as days_to_expiry
-				from products p
-				join inventory_batches b on b.product_id = p.id
-				left join product_categories pc on pc.id = p.category_id
-				where p.pharmacy_id = :ph
-				  and p.is_active = true
-				  and b.expiration_date is not null
-				  and (b.quantity > 0 or :include_zero)
-			'''
-			
-			# Add category filter if provided
-			if params.get('category_id'):
-				base_query += ' and p.category_id = :category_id'
-			
-			# Add search filter if provided
-			if params.get('search'):
-				base_query += ' and (lower(p.name) like :search or lower(coalesce(pc.name, \'\')) like :search)'
-			
-			base_query += '''
-				group by p.id, p.name, pc.name, p.location
+			try:
+				category_id = int(category_id) if category_id else None
+			except (TypeError, ValueError):
+				category_id = None
+
+			rows = product_risk_rows(
+				conn, me['pharmacy_id'],
+				soon_window=soon_window, medium_window=medium_window, critical_window=critical_window,
+				state_filter=state_filter, status_filter=status_filter, category_id=category_id,
+				search=f"%{search_term}%" if search_term else None, include_zero=include_zero,
 			)
-			select 
-				id,
-				name,
-				category_name,
-				location,
-				total_quantity,
-				total_value,
-				expired_value,
-				expiring_soon_value,
-				expired_quantity,
-				expiring_soon_quantity,
-				next_expiration,
-				days_to_expiry,
-				case 
-					when days_to_expiry is null or expired_quantity > 0 or (days_to_expiry < 0) then 'critical'
-					when days_to_expiry <= :critical_window then 'critical'
-					when days_to_expiry <= :soon_window then 'high'
-					when days_to_expiry <= :medium_window then 'medium'
-					else 'low'
-				end as risk_level,
-				case 
-					when days_to_expiry is null or days_to_expiry < 0 or expired_quantity > 0 then 'expired'
-					when days_to_expiry <= :soon_window then 'expiring'
-					else 'healthy'
-				end as expiry_state
-			from product_data
-			where 
-				(:state_filter = 'all' or 
-				 case 
-					when days_to_expiry is null or days_to_expiry < 0 or expired_quantity > 0 then 'expired'
-					when days_to_expiry <= :soon_window then 'expiring'
-					else 'healthy'
-				 end = :state_filter)
-				and (:status_filter = 'all' or
-				 case 
-					when days_to_expiry is null or expired_quantity > 0 or (days_to_expiry < 0) then 'critical'
-					when days_to_expiry <= :critical_window then 'critical'
-					when days_to_expiry <= :soon_window then 'high'
-					when days_to_expiry <= :medium_window then 'medium'
-					else 'low'
-				 end = :status_filter)
-			'''
-			
-			rows = conn.execute(text(base_query), {**params, 'state_filter': state_filter, 'status_filter': status_filter}).mappings().all()
 
 			critical_risk, high_risk, medium_risk, low_risk = [], [], [], []
 			total_value_sum = 0.0
@@ -470,6 +387,9 @@ def staff_sustainability_expiry_risk():
 					'next_expiration': next_exp.isoformat() if next_exp else None,
 					'risk_level': row['risk_level'],
 					'expiry_state': expiry_state,
+					'projected_unsold_quantity': int(row['projected_unsold_quantity'] or 0),
+					'projected_unsold_value': float(row['projected_unsold_value'] or 0.0),
+					'daily_velocity': float(row['daily_velocity'] or 0.0),
 				}
 				total_value_sum += item['total_value']
 				expired_value_sum += item['expired_value']
@@ -538,7 +458,7 @@ def staff_list_batches(product_id: int):
 				# If helper functions don't exist, tables may already be created
 				pass
 
-			me = conn.execute(text('select id, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+			me = get_current_user(conn, user_id)
 			if not me:
 				return jsonify({'success': False, 'error': 'User not found'}), 404
 
@@ -4,9 +4,9 @@ import os
 import json
 from datetime import datetime, timezone
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
 from flask_jwt_extended import get_jwt_identity, jwt_required
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,15 +16,30 @@ from pathlib import Path
 
 # Add parent directory to path to import utils
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
-from utils.helpers import get_database_url
+from utils.helpers import get_current_user, get_engine
+from utils.pagination import InvalidCursor, Keyset, KeysetPage
+from services.announcement_feed import announcement_feed, audience_of
+from services.pos_catalog import etag_matches
+from services.text_search import (
+    SEARCH_CONFIG,
+    date_range_sql,
+    prefix_query,
+    search_announcements,
+    search_tickets,
+)
 
-DATABASE_URL = get_database_url()
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = get_engine()
 
 support_bp = Blueprint("support", __name__, url_prefix="/api/support")
 announcements_bp = Blueprint("announcements", __name__, url_prefix="/api/announcements")
 
+TICKETS_KEYSET = Keyset("support_tickets", [("t.created_at", "created_at"), ("t.id", "id")])
+ANNOUNCEMENTS_KEYSET = Keyset(
+    "announcements",
+    [("a.is_pinned", "is_pinned"), ("a.created_at", "created_at"), ("a.id", "id")],
+)
+
 def _generate_ticket_number(conn, pharmacy_id: int) -> str:
     """Generate a unique ticket number for the given pharmacy."""
 
@@ -48,10 +63,7 @@ def create_support_ticket():
     data = request.get_json() or {}
 
     with engine.connect() as conn:
-        me = conn.execute(
-            text("select id, role, pharmacy_id from users where id = :id"),
-            {"id": user_id},
-        ).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me["role"] not in ("manager", "admin"):
             return jsonify({"success": False, "error": "Forbidden"}), 403
 
@@ -115,11 +127,18 @@ def create_support_ticket():
 @support_bp.get("/tickets")
 @jwt_required()
 def list_support_tickets():
-    """List support tickets (role-aware filtering)."""
+    """List support tickets (role-aware filtering, keyset pagination)."""
 
     user_id = get_jwt_identity()
     status = request.args.get("status", "all")
     type_filter = request.args.get("type", "all")
+    search_query = prefix_query(request.args.get("search", ""))
+    date_from = request.args.get("date_from", "").strip()
+    date_to = request.args.get("date_to", "").strip()
+    try:
+        page = KeysetPage.from_request(TICKETS_KEYSET, default_limit=100)
+    except InvalidCursor as e:
+        return jsonify({"success": False, "error": str(e)}), 400
 
     with engine.connect() as conn:
         me = conn.execute(
@@ -135,40 +154,69 @@ def list_support_tickets():
         if not me:
             return jsonify({"success": False, "error": "Forbidden"}), 403
 
-        query = """
-            SELECT
-                t.id, t.ticket_number, t.pharmacy_id, t.type, t.subject,
-                t.status, t.priority, t.created_at, t.updated_at,
-                t.resolved_at, t.closed_at,
-                u1.first_name || ' ' || u1.last_name as created_by_name,
-                u2.first_name || ' ' || u2.last_name as assigned_to_name,
-                p.name as pharmacy_name,
-                (SELECT COUNT(*) FROM support_ticket_messages WHERE ticket_id = t.id) as message_count,
-                (SELECT MAX(created_at) FROM support_ticket_messages WHERE ticket_id = t.id) as last_message_at
+        from_where = """
             FROM support_tickets t
-            LEFT JOIN users u1 ON u1.id = t.created_by
-            LEFT JOIN users u2 ON u2.id = t.assigned_to
-            LEFT JOIN pharmacies p ON p.id = t.pharmacy_id
             WHERE 1=1
         """
         params = {}
 
         if me["role"] == "manager":
-            query += " AND t.pharmacy_id = :pharmacy_id"
+            from_where += " AND t.pharmacy_id = :pharmacy_id"
             params["pharmacy_id"] = me["pharmacy_id"]
 
         if status != "all":
-            query += " AND t.status = :status"
+            from_where += " AND t.status = :status"
             params["status"] = status
 
         if type_filter != "all":
-            query += " AND t.type = :type"
+            from_where += " AND t.type = :type"
             params["type"] = type_filter
 
-        query += " ORDER BY t.created_at DESC"
+        if search_query:
+            visible = "" if me["role"] == "admin" else " AND (m.is_internal = false OR m.user_id = :user_id)"
+            from_where += f"""
+                AND (t.search_vector @@ to_tsquery('{SEARCH_CONFIG}', :search_q)
+                     OR EXISTS (SELECT 1 FROM support_ticket_messages m
+                                WHERE m.ticket_id = t.id
+                                  AND m.search_vector @@ to_tsquery('{SEARCH_CONFIG}', :search_q){visible}))
+            """
+            params["search_q"] = search_query
+            if visible:
+                params["user_id"] = user_id
+
+        for condition in date_range_sql("t.created_at", params, date_from, date_to):
+            from_where += f" AND {condition}"
+
+        total = page.total(conn, from_where, params, table="support_tickets", filtered=bool(params))
+
+        # Page the ticket ids first so the joins and message aggregates only run for the page
+        query = f"""
+            WITH page AS (
+                SELECT t.id, t.created_at
+                {from_where}
+                AND {page.condition(params)}
+                ORDER BY {page.order_by()}
+                {page.limit_clause(params)}
+            )
+            SELECT
+                t.id, t.ticket_number, t.pharmacy_id, t.type, t.subject,
+                t.status, t.priority, t.created_at, t.updated_at,
+                t.resolved_at, t.closed_at,
+                u1.first_name || ' ' || u1.last_name as created_by_name,
+                u2.first_name || ' ' || u2.last_name as assigned_to_name,
+                p.name as pharmacy_name,
+                (SELECT COUNT(*) FROM support_ticket_messages WHERE ticket_id = t.id) as message_count,
+                (SELECT MAX(created_at) FROM support_ticket_messages WHERE ticket_id = t.id) as last_message_at
+            FROM page
+            JOIN support_tickets t ON t.id = page.id
+            LEFT JOIN users u1 ON u1.id = t.created_by
+            LEFT JOIN users u2 ON u2.id = t.assigned_to
+            LEFT JOIN pharmacies p ON p.id = t.pharmacy_id
+            ORDER BY {page.order_by()}
+        """
 
-        rows = conn.execute(text(query), params).mappings().all()
-        return jsonify({"success": True, "tickets": [dict(row) for row in rows]})
+        rows, pagination = page.finish(conn.execute(text(query), params).mappings().all(), total)
+        return jsonify({"success": True, "tickets": [dict(row) for row in rows], "pagination": pagination})
 
 
 @support_bp.get("/tickets/<int:ticket_id>")
@@ -179,10 +227,7 @@ def get_support_ticket(ticket_id: int):
     user_id = get_jwt_identity()
 
     with engine.connect() as conn:
-        me = conn.execute(
-            text("select id, role, pharmacy_id from users where id = :id"),
-            {"id": user_id},
-        ).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me:
             return jsonify({"success": False, "error": "Forbidden"}), 403
 
@@ -241,10 +286,7 @@ def delete_support_ticket(ticket_id: int):
     user_id = get_jwt_identity()
 
     with engine.begin() as conn:
-        me = conn.execute(
-            text("select id, role, pharmacy_id from users where id = :id"),
-            {"id": user_id},
-        ).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me:
             return jsonify({"success": False, "error": "Forbidden"}), 403
 
@@ -290,10 +332,7 @@ def add_ticket_message(ticket_id: int):
         }), 400
 
     with engine.connect() as conn:
-        me = conn.execute(
-            text("select id, role, pharmacy_id from users where id = :id"),
-            {"id": user_id},
-        ).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me:
             return jsonify({"success": False, "error": "Forbidden"}), 403
 
@@ -402,10 +441,7 @@ def update_support_ticket(ticket_id: int):
     data = request.get_json() or {}
 
     with engine.connect() as conn:
-        me = conn.execute(
-            text("select id, role, pharmacy_id from users where id = :id"),
-            {"id": user_id},
-        ).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me:
             return jsonify({"success": False, "error": "Forbidden"}), 403
 
@@ -485,10 +521,7 @@ def get_ticket_stats():
     user_id = get_jwt_identity()
 
     with engine.connect() as conn:
-        me = conn.execute(
-            text("select role from users where id = :id"),
-            {"id": user_id},
-        ).mappings().first()
+        me = get_current_user(conn, user_id)
         if not me or me["role"] != "admin":
             return jsonify({"success": False, "error": "Forbidden"}), 403
 
@@ -513,6 +546,53 @@ def get_ticket_stats():
         return jsonify({"success": True, "stats": dict(stats)})
 
 
+@support_bp.get("/search")
+@jwt_required()
+def search_support():
+    """Ranked full-text search over tickets (with their messages) or announcements, with highlighted snippets."""
+
+    user_id = get_jwt_identity()
+    query = request.args.get("q", "").strip()
+    kind = request.args.get("kind", "tickets")
+    date_from = request.args.get("date_from", "").strip() or None
+    date_to = request.args.get("date_to", "").strip() or None
+    try:
+        limit = int(request.args.get("limit", 20))
+    except ValueError:
+        return jsonify({"success": False, "error": "limit must be an integer"}), 400
+    if kind not in ("tickets", "announcements"):
+        return jsonify({"success": False, "error": "kind must be tickets or announcements"}), 400
+    if not prefix_query(query):
+        return jsonify({"success": True, "kind": kind, "results": []})
+
+    with engine.connect() as conn:
+        me = get_current_user(conn, user_id)
+        if not me:
+            return jsonify({"success": False, "error": "Forbidden"}), 403
+
+        if kind == "announcements":
+            results = search_announcements(
+                conn, query, active_only=me["role"] != "admin",
+                date_from=date_from, date_to=date_to, limit=limit,
+            )
+        else:
+            if me["role"] not in ("manager", "admin"):
+                return jsonify({"success": False, "error": "Forbidden"}), 403
+            status = request.args.get("status", "all")
+            type_filter = request.args.get("type", "all")
+            results = search_tickets(
+                conn, query,
+                pharmacy_id=me["pharmacy_id"] if me["role"] == "manager" else None,
+                user_id=me["id"],
+                include_internal=me["role"] == "admin",
+                status=None if status == "all" else status,
+                ticket_type=None if type_filter == "all" else type_filter,
+                date_from=date_from, date_to=date_to, limit=limit,
+            )
+
+        return jsonify({"success": True, "kind": kind, "results": results})
+
+
 @announcements_bp.post("")
 @jwt_required()
 def create_announcement():
@@ -566,17 +646,13 @@ def create_announcement():
         ).mappings().first()
 
         conn.commit()
+        announcement_feed.forget_version()
         return jsonify({"success": True, "announcement": dict(result)})
 
 
-@announcements_bp.get("")
-@jwt_required()
-def list_announcements():
-    """List announcements with pagination and filtering."""
+def _announcement_listing(conn, audience: str, page: KeysetPage) -> dict:
+    """One page of announcements for ``audience`` (admin sees every status) as a response dict."""
 
-    user_id = get_jwt_identity()
-    page = request.args.get("page", 1, type=int)
-    per_page = request.args.get("per_page", 10, type=int)
     type_filter = request.args.get("type", "all")
     status_filter = request.args.get("status", "all")
     pinned_filter = request.args.get("pinned", "all")
@@ -584,99 +660,109 @@ def list_announcements():
     date_from = request.args.get("date_from", "").strip()
     date_to = request.args.get("date_to", "").strip()
 
-    page = max(1, page)
-    per_page = min(max(1, per_page), 100)
-    offset = (page - 1) * per_page
+    where_conditions = []
+    params = {}
 
-    with engine.connect() as conn:
-        me = conn.execute(
-            text("SELECT role FROM users WHERE id = :id"),
-            {"id": user_id},
-        ).mappings().first()
-        if not me:
-            return jsonify({"success": False, "error": "Forbidden"}), 403
+    if audience != "admin":
+        where_conditions.append("a.is_active = true")
+        where_conditions.append("(a.expires_at IS NULL OR a.expires_at > now())")
+    else:
+        if status_filter == "active":
+            where_conditions.append(
+                "a.is_active = true AND (a.expires_at IS NULL OR a.expires_at > now())"
+            )
+        elif status_filter == "inactive":
+            where_conditions.append("a.is_active = false")
+        elif status_filter == "expired":
+            where_conditions.append("a.expires_at IS NOT NULL AND a.expires_at <= now()")
+
+    if type_filter != "all" and type_filter in ("info", "warning", "urgent", "update"):
+        where_conditions.append("a.type = :type_filter")
+        params["type_filter"] = type_filter
+
+    if pinned_filter == "pinned":
+        where_conditions.append("a.is_pinned = true")
+    elif pinned_filter == "unpinned":
+        where_conditions.append("a.is_pinned = false")
+
+    search_query = prefix_query(search)
+    if search_query:
+        where_conditions.append(f"a.search_vector @@ to_tsquery('{SEARCH_CONFIG}', :search_q)")
+        params["search_q"] = search_query
+
+    where_conditions += date_range_sql("a.created_at", params, date_from, date_to)
+
+    where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
+
+    from_where = f"""
+        FROM announcements a
+        WHERE {where_clause}
+    """
+    # The listing is cached until the feed changes, so the count must come from the same snapshot
+    total = page.total(
+        conn, from_where, params, table="announcements", filtered=bool(where_conditions), count_ttl=0
+    )
+
+    query = text(
+        f"""
+        SELECT
+            a.id, a.title, a.content, a.type, a.is_pinned, a.is_active,
+            a.created_at, a.updated_at, a.expires_at,
+            u.first_name || ' ' || u.last_name as created_by_name
+        FROM announcements a
+        LEFT JOIN users u ON u.id = a.created_by
+        WHERE {where_clause} AND {page.condition(params)}
+        ORDER BY {page.order_by()}
+        {page.limit_clause(params)}
+        """
+    )
 
-        where_conditions = []
-        params = {}
+    rows, pagination = page.finish(conn.execute(query, params).mappings().all(), total)
+    per_page = page.limit
+    if total is not None:
+        pagination["total_pages"] = (total + per_page - 1) // per_page
+    pagination["page"] = request.args.get("page", 1, type=int)
+    pagination["per_page"] = per_page
 
-        if me["role"] != "admin":
-            where_conditions.append("a.is_active = true")
-            where_conditions.append("(a.expires_at IS NULL OR a.expires_at > now())")
-        else:
-            if status_filter == "active":
-                where_conditions.append(
-                    "a.is_active = true AND (a.expires_at IS NULL OR a.expires_at > now())"
-                )
-            elif status_filter == "inactive":
-                where_conditions.append("a.is_active = false")
-            elif status_filter == "expired":
-                where_conditions.append("a.expires_at IS NOT NULL AND a.expires_at <= now()")
-
-        if type_filter != "all" and type_filter in ("info", "warning", "urgent", "update"):
-            where_conditions.append("a.type = :type_filter")
-            params["type_filter"] = type_filter
-
-        if pinned_filter == "pinned":
-            where_conditions.append("a.is_pinned = true")
-        elif pinned_filter == "unpinned":
-            where_conditions.append("a.is_pinned = false")
-
-        if search:
-            where_conditions.append("(a.title ILIKE :search OR a.content ILIKE :search)")
-            params["search"] = f"%{search}%"
-
-        if date_from:
-            where_conditions.append("DATE(a.created_at) >= :date_from")
-            params["date_from"] = date_from
-
-        if date_to:
-            where_conditions.append("DATE(a.created_at) <= :date_to")
-            params["date_to"] = date_to
-
-        where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
-
-        total_result = conn.execute(
-            text(
-                f"""
-                SELECT COUNT(*) as total
-                FROM announcements a
-                WHERE {where_clause}
-                """
-            ),
-            params,
-        ).mappings().first()
-        total = total_result["total"] if total_result else 0
+    return {
+        "success": True,
+        "announcements": [dict(r) for r in rows],
+        "pagination": pagination,
+    }
 
-        query = text(
-            f"""
-            SELECT
-                a.id, a.title, a.content, a.type, a.is_pinned, a.is_active,
-                a.created_at, a.updated_at, a.expires_at,
-                u.first_name || ' ' || u.last_name as created_by_name
-            FROM announcements a
-            LEFT JOIN users u ON u.id = a.created_by
-            WHERE {where_clause}
-            ORDER BY a.is_pinned DESC, a.created_at DESC
-            LIMIT :limit OFFSET :offset
-            """
-        )
-        params["limit"] = per_page
-        params["offset"] = offset
-
-        rows = conn.execute(query, params).mappings().all()
 
-        return jsonify(
-            {
-                "success": True,
-                "announcements": [dict(r) for r in rows],
-                "pagination": {
-                    "page": page,
-                    "per_page": per_page,
-                    "total": total,
-                    "total_pages": (total + per_page - 1) // per_page if per_page > 0 else 0,
-                },
-            }
+@announcements_bp.get("")
+@jwt_required()
+def list_announcements():
+    """
+    List announcements with keyset pagination and filtering. Listings are served
+    from the announcement feed cache; send the ETag back as If-None-Match to get
+    a 304 while the listing is unchanged.
+    """
+
+    me = get_current_user(engine, get_jwt_identity())
+    role = me["role"] if me else None
+    if role is None:
+        return jsonify({"success": False, "error": "Forbidden"}), 403
+    audience = audience_of(role)
+
+    try:
+        page = KeysetPage.from_request(
+            ANNOUNCEMENTS_KEYSET, default_limit=10, limit_arg="per_page", default_count="exact"
         )
+    except InvalidCursor as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    version = announcement_feed.current_version(engine)
+    entry = announcement_feed.entry(
+        engine, version, audience,
+        announcement_feed.params_key(audience, request.args.lists()),
+        lambda conn: _announcement_listing(conn, audience, page),
+    )
+    headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if etag_matches(request.headers.get("If-None-Match"), entry.etag.strip('"')):
+        return Response(status=304, headers=headers)
+    return Response(entry.body, status=200, mimetype="application/json", headers=headers)
 
 
 @announcements_bp.patch("/<int:announcement_id>")
@@ -734,6 +820,7 @@ def update_announcement(announcement_id: int):
         query = f"UPDATE announcements SET {', '.join(updates)} WHERE id = :announcement_id"
         conn.execute(text(query), params)
         conn.commit()
+        announcement_feed.forget_version()
 
         return jsonify({"success": True, "message": "Announcement updated"})
 
@@ -755,6 +842,7 @@ def delete_announcement(announcement_id: int):
 
         conn.execute(text("DELETE FROM announcements WHERE id = :id"), {"id": announcement_id})
         conn.commit()
+        announcement_feed.forget_version()
 
     return jsonify({"success": True, "message": "Announcement deleted"})
 
@@ -0,0 +1,109 @@
+"""
+ABC/VED classification in SQL.
+
+ABC ranks a pharmacy's active products by consumption value (quantity sold in
+the period from ``sales_rollup_product_daily`` times cost price) and assigns
+classes from the running share of the total, computed with a window sum in
+the same statement: A while the running share is within ``a_threshold``, B
+within ``b_threshold``, C for the rest.
+
+VED (vital / essential / desirable) is not matched per request.
+``products.ved_class`` is kept by the database (see
+``database.schema.ensure_product_ved_class``): a trigger classifies a product
+when its name or category changes and a category rename reclassifies its
+products, using :func:`ved_classify_sql` built from the keyword lists below.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+VITAL_KEYWORDS = (
+    "insulin", "epinephrine", "adrenaline", "antibiotic", "cef", "cillin", "metformin",
+    "amoxicillin", "azithromycin", "salbutamol", "albuterol", "antihypertensive", "losartan",
+    "telmisartan", "amlodipine", "anticonvulsant", "antiepileptic", "warfarin", "heparin",
+)
+DESIRABLE_KEYWORDS = ("supplement", "vitamin", "cosmetic", "herbal", "lotion")
+VITAL_CATEGORIES = ("antibiotics", "cardio", "antihypertensive", "asthma", "diabetes")
+DESIRABLE_CATEGORIES = ("vitamins", "supplements", "cosmetics")
+
+ABC_CLASSES = ("A", "B", "C")
+VED_CLASSES = ("V", "E", "D")
+
+
+def _patterns(words: Sequence[str]) -> str:
+    """``ARRAY['%word%', ...]`` literal for ``LIKE ANY``."""
+    return "ARRAY[" + ", ".join("'%" + w.lower().replace("'", "''") + "%'" for w in words) + "]"
+
+
+def ved_classify_sql() -> str:
+    """``CREATE FUNCTION ved_classify(name, category)``: 'V', 'D' or 'E' (the default)."""
+    return f"""
+        CREATE OR REPLACE FUNCTION ved_classify(p_name text, p_category text)
+        RETURNS char(1) AS $$
+            SELECT CASE
+                WHEN lower(coalesce(p_name, '')) LIKE ANY ({_patterns(VITAL_KEYWORDS)})
+                  OR lower(coalesce(p_category, '')) LIKE ANY ({_patterns(VITAL_CATEGORIES)}) THEN 'V'
+                WHEN lower(coalesce(p_name, '')) LIKE ANY ({_patterns(DESIRABLE_KEYWORDS)})
+                  OR lower(coalesce(p_category, '')) LIKE ANY ({_patterns(DESIRABLE_CATEGORIES)}) THEN 'D'
+                ELSE 'E'
+            END
+        $$ LANGUAGE sql IMMUTABLE
+    """
+
+
+_CLASSIFY_SQL = """
+    WITH consumption AS (
+        SELECT p.id,
+               p.name,
+               pc.name AS category_name,
+               COALESCE(sa.total_qty, 0) AS total_qty,
+               COALESCE(p.cost_price, 0) AS cost_price,
+               COALESCE(sa.total_qty, 0) * COALESCE(p.cost_price, 0) AS consumption_value,
+               COALESCE(p.ved_class, 'E') AS ved_class
+        FROM products p
+        LEFT JOIN product_categories pc ON pc.id = p.category_id
+        LEFT JOIN (
+            SELECT r.product_id, SUM(r.quantity_sold)::bigint AS total_qty
+            FROM sales_rollup_product_daily r
+            WHERE r.pharmacy_id = :ph
+              AND r.day BETWEEN CAST(:from AS date) AND CAST(:to AS date)
+            GROUP BY r.product_id
+        ) sa ON sa.product_id = p.id
+        WHERE p.pharmacy_id = :ph AND p.is_active = true
+    ), ranked AS (
+        SELECT c.*,
+               SUM(GREATEST(c.consumption_value, 0)) OVER (
+                   ORDER BY c.consumption_value DESC, c.id ROWS UNBOUNDED PRECEDING) AS cum_value,
+               SUM(GREATEST(c.consumption_value, 0)) OVER () AS total_value
+        FROM consumption c
+    ), classified AS (
+        SELECT id, name, category_name, total_qty, cost_price, consumption_value, ved_class,
+               CASE
+                   WHEN total_value <= 0 OR cum_value <= CAST(:ath AS numeric) * total_value THEN 'A'
+                   WHEN cum_value <= CAST(:bth AS numeric) * total_value THEN 'B'
+                   ELSE 'C'
+               END AS abc_class
+        FROM ranked
+    )
+    SELECT id, name, category_name, total_qty, cost_price, consumption_value,
+           abc_class, ved_class, abc_class || '-' || ved_class AS matrix_cell
+    FROM classified
+    ORDER BY consumption_value DESC, id
+"""
+
+
+def classify(conn: Connection, pharmacy_id: int, frm: Any, to: Any,
+             a_threshold: float = 0.7, b_threshold: float = 0.9) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """Item-level ABC/VED classes (highest consumption first) and the ABC-VED matrix counts."""
+    rows = conn.execute(text(_CLASSIFY_SQL), {
+        "ph": pharmacy_id, "from": frm, "to": to, "ath": a_threshold, "bth": b_threshold,
+    }).mappings().all()
+    items = [dict(r) for r in rows]
+    matrix_counts = {f"{abc}-{ved}": 0 for abc in ABC_CLASSES for ved in VED_CLASSES}
+    for item in items:
+        matrix_counts[item["matrix_cell"]] = matrix_counts.get(item["matrix_cell"], 0) + 1
+    return items, matrix_counts
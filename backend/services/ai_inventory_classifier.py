@@ -4,9 +4,7 @@ AI-Powered Inventory Classifier
 Automatically categorizes medicines and builds semantic search index
 """
 
-import os
 import json
-import pandas as pd
 import numpy as np
 from typing import Dict, List, Optional, Tuple
 import logging
@@ -19,6 +17,8 @@ except ImportError:
     # Fallback for when ultra_advanced_ai is not available (optional dependency)
     ultra_advanced_ai = None
 
+from .bulk_loader import iter_inventory_csv, coerce_price, coerce_quantity
+
 logger = logging.getLogger(__name__)
 
 class MedicineClassifier:
@@ -182,41 +182,35 @@ class AIInventoryManager:
         print("⚠️  WARNING: CSV mode is deprecated. This method should not be used in production.")
         print("🔍 Building semantic index from CSV datasets...")
         
-        csv_files = [
-            'TABLETS AND CAPSULES.csv',
-            'SYRUP AND SUSPENSION.csv',
-            'OTHERS.csv',
-            'SUPPLIES.csv',
-            'AMPULES AND VIALS DEXTROSE.csv',
-            'MILK.csv'
-        ]
-        
         all_medicines = []
+        per_file: Dict[str, int] = {}
         
-        for csv_file in csv_files:
-            file_path = os.path.join(csv_directory, csv_file)
-            if os.path.exists(file_path):
-                try:
-                    df = pd.read_csv(file_path)
-                    print(f"  📁 Processing {csv_file}: {len(df)} items")
-                    
-                    for _, row in df.iterrows():
-                        medicine_info = {
-                            'name': row['name'],
-                            'quantity': row.get('quantity', 0),
-                            'cost_price': row.get('cost_price', 0),
-                            'unit_price': row.get('unit_price', 0),
-                            'category': row.get('category', ''),
-                            'location': row.get('location', ''),
-                            'source_file': csv_file,
-                            'ai_categories': self.classifier.classify_medicine(row['name']),
-                            'medicine_info': self.classifier.get_medicine_info(row['name'])
-                        }
-                        
-                        all_medicines.append(medicine_info)
-                        
-                except Exception as e:
-                    print(f"  ❌ Error processing {csv_file}: {e}")
+        # Stream rows with the same reader the bulk CSV import uses
+        try:
+            for row in iter_inventory_csv(csv_directory):
+                name = (row.get('name') or '').strip()
+                if not name:
+                    continue
+                csv_file = row['source_file']
+                medicine_info = {
+                    'name': name,
+                    'quantity': coerce_quantity(row.get('quantity')),
+                    'cost_price': coerce_price(row.get('cost_price')) or 0,
+                    'unit_price': coerce_price(row.get('unit_price')) or 0,
+                    'category': row.get('category') or '',
+                    'location': row.get('location') or '',
+                    'source_file': csv_file,
+                    'ai_categories': self.classifier.classify_medicine(name),
+                    'medicine_info': self.classifier.get_medicine_info(name)
+                }
+                
+                all_medicines.append(medicine_info)
+                per_file[csv_file] = per_file.get(csv_file, 0) + 1
+        except Exception as e:
+            print(f"  ❌ Error processing CSV files: {e}")
+        
+        for csv_file, count in per_file.items():
+            print(f"  📁 Processed {csv_file}: {count} items")
         
         print(f"  ✅ Total medicines indexed: {len(all_medicines)}")
         
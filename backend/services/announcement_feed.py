@@ -0,0 +1,158 @@
+"""
+Cached announcement feed.
+
+Announcements change a few times a week but are listed on every page load.
+:data:`announcement_feed` keeps the serialized response of every listing it
+has served. An entry is keyed by the feed version, the audience and the
+normalized query string. Admins are one audience and everyone else is the
+other. Non-admins always get the active, unexpired feed, so ``status`` is
+not part of their key.
+
+``announcement_feed_version`` (see
+``database.schema.ensure_announcement_feed_version``) holds a single counter.
+A statement trigger bumps it on every insert, update, delete or truncate of
+``announcements``, so entries of other versions stop matching in every
+worker. Each process re-reads the version at most every
+``ANNOUNCEMENT_FEED_VERSION_TTL`` seconds. The writing process forgets its
+copy at once (:meth:`AnnouncementFeed.forget_version`).
+
+Announcements also drop out of the feed when ``expires_at`` passes, without
+any write. Every entry records when the earliest future ``expires_at`` falls,
+read in the same snapshot it was built from, and is not served after that
+moment. This check needs no query.
+
+The caller's role comes from ``services.identity``. In the steady state, a
+listing or a conditional GET (``If-None-Match`` against the entry's ETag) is
+answered without touching Postgres.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from utils.fast_json import dumps_bytes
+
+FEED_VERSION_TTL = float(os.getenv("ANNOUNCEMENT_FEED_VERSION_TTL", "2"))
+FEED_CACHE_SIZE = int(os.getenv("ANNOUNCEMENT_FEED_CACHE_SIZE", "256"))
+
+# Query parameters that only admins can use; other audiences never see them in their key
+ADMIN_ONLY_PARAMS = ("status",)
+
+
+def feed_version(conn: Connection) -> int:
+    return int(conn.execute(text("SELECT version FROM announcement_feed_version WHERE id = 1")).scalar() or 0)
+
+
+def next_expiry(conn: Connection) -> Optional[float]:
+    """Epoch seconds of the earliest ``expires_at`` still in the future, or None."""
+    value = conn.execute(text("""
+        SELECT extract(epoch FROM min(expires_at)) FROM announcements WHERE expires_at > now()
+    """)).scalar()
+    return float(value) if value is not None else None
+
+
+def audience_of(role: Optional[str]) -> str:
+    return "admin" if role == "admin" else "member"
+
+
+@dataclass(frozen=True)
+class FeedEntry:
+    """One serialized listing; ``valid_until`` is epoch seconds (None: until the next version)."""
+
+    body: bytes
+    etag: str
+    valid_until: Optional[float]
+
+    def fresh(self, now: float) -> bool:
+        return self.valid_until is None or now < self.valid_until
+
+
+class AnnouncementFeed:
+    """
+    Per-process cache of announcement listings and the current feed version.
+    Each listing is built once, even when concurrent requests miss it.
+    """
+
+    def __init__(self, max_entries: int = FEED_CACHE_SIZE, version_ttl: float = FEED_VERSION_TTL) -> None:
+        self.max_entries = max_entries
+        self.version_ttl = version_ttl
+        self._entries: "OrderedDict[Tuple[int, str, str], FeedEntry]" = OrderedDict()
+        self._version: Optional[Tuple[float, int]] = None
+        self._lock = threading.Lock()
+        self._builds: Dict[Tuple[int, str, str], threading.Lock] = {}
+
+    def current_version(self, engine: Engine) -> int:
+        now = time.monotonic()
+        cached = self._version
+        if cached and cached[0] > now:
+            return cached[1]
+        with engine.connect() as conn:
+            version = feed_version(conn)
+        self._remember_version(version)
+        return version
+
+    def _remember_version(self, version: int) -> None:
+        with self._lock:
+            if self._version is None or self._version[1] <= version:
+                self._version = (time.monotonic() + self.version_ttl, version)
+
+    def forget_version(self) -> None:
+        """Make the next request re-read the version (call after writes in this process)."""
+        with self._lock:
+            self._version = None
+
+    @staticmethod
+    def params_key(audience: str, args: Iterable[Tuple[str, Iterable[str]]]) -> str:
+        items = sorted((k, list(v)) for k, v in args if audience == "admin" or k not in ADMIN_ONLY_PARAMS)
+        return hashlib.sha1(json.dumps(items, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+    def entry(self, engine: Engine, version: int, audience: str, params_key: str,
+              build: Callable[[Connection], Dict[str, Any]]) -> FeedEntry:
+        """The cached listing, or a new one from ``build(conn)`` (a JSON-ready dict)."""
+        key = (version, audience, params_key)
+        with self._lock:
+            found = self._entries.get(key)
+            if found is not None and found.fresh(time.time()):
+                self._entries.move_to_end(key)
+                return found
+            build_lock = self._builds.setdefault(key, threading.Lock())
+        with build_lock:
+            with self._lock:
+                found = self._entries.get(key)
+                if found is not None and found.fresh(time.time()):
+                    return found
+            # One snapshot for the listing, its version and its expiry deadline
+            with engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+                built_version = feed_version(conn)
+                valid_until = next_expiry(conn)
+                body = dumps_bytes(build(conn))
+            entry = FeedEntry(body, f'"a{built_version}-{hashlib.sha1(body).hexdigest()[:16]}"', valid_until)
+            with self._lock:
+                # Listings of older versions are unreachable once a newer one exists
+                for stale in [k for k in self._entries if k[0] < built_version]:
+                    del self._entries[stale]
+                self._entries[key] = entry
+                self._entries[(built_version, audience, params_key)] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                self._builds.pop(key, None)
+        self._remember_version(built_version)
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+
+announcement_feed = AnnouncementFeed()
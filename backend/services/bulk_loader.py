@@ -0,0 +1,439 @@
+"""
+Bulk loading engine built on psycopg3 ``COPY ... FROM STDIN``.
+
+Rows are streamed from any iterable into a temporary staging table in chunks
+of ``chunk_rows`` and then merged into the real tables with set-based SQL,
+so memory stays constant no matter how many rows are loaded.  Used by the
+dummy sales seeder and the product/batch CSV import.
+"""
+
+from __future__ import annotations
+
+import csv
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from .sales_rollup import apply_sales
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_ROWS = int(os.getenv("BULK_LOAD_CHUNK_ROWS", "50000"))
+
+# Inventory export files consumed by the CSV import and the semantic index.
+INVENTORY_CSV_FILES: Tuple[str, ...] = (
+    "TABLETS AND CAPSULES.csv",
+    "SYRUP AND SUSPENSION.csv",
+    "OTHERS.csv",
+    "SUPPLIES.csv",
+    "AMPULES AND VIALS DEXTROSE.csv",
+    "MILK.csv",
+)
+
+
+@dataclass
+class LoadStats:
+    """Row counts and throughput of a bulk load."""
+
+    label: str
+    rows: int = 0
+    merged: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+    extra: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "label": self.label,
+            "rows": self.rows,
+            "merged": self.merged,
+            "chunks": self.chunks,
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+            **self.extra,
+        }
+
+    def __str__(self) -> str:
+        return (
+            f"{self.label}: {self.rows} rows in {self.seconds:.2f}s "
+            f"({self.rows_per_second:,.0f} rows/s, {self.chunks} chunk(s))"
+        )
+
+
+def _chunks(rows: Iterable[Sequence[Any]], size: int) -> Iterator[List[Sequence[Any]]]:
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def insertable_columns(conn: Connection, table: str) -> Set[str]:
+    """Columns of ``table`` that accept explicit values (not generated)."""
+    rows = conn.execute(
+        text(
+            """
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_schema = 'public'
+              AND table_name = :table
+              AND is_generated <> 'ALWAYS'
+            """
+        ),
+        {"table": table},
+    ).fetchall()
+    return {row[0] for row in rows}
+
+
+def copy_rows(conn: Connection, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> int:
+    """Stream ``rows`` into ``table`` with COPY on the connection's psycopg cursor."""
+    raw = conn.connection.driver_connection
+    count = 0
+    with raw.cursor() as cur:
+        with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+                count += 1
+    return count
+
+
+class BulkLoader:
+    """Chunked COPY + merge loader for sales history and inventory imports."""
+
+    def __init__(self, engine: Engine, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        self.engine = engine
+        self.chunk_rows = max(1, int(chunk_rows))
+
+    # ------------------------------------------------------------------
+    # historical_sales_daily
+    # ------------------------------------------------------------------
+    def load_historical_sales(
+        self,
+        pharmacy_id: int,
+        rows: Iterable[Tuple[int, date, float]],
+    ) -> LoadStats:
+        """Upsert ``(product_id, sale_date, quantity_sold)`` rows for a pharmacy."""
+        stats = LoadStats("historical_sales_daily")
+        started = time.perf_counter()
+        with self.engine.begin() as conn:
+            hist_columns = insertable_columns(conn, "historical_sales_daily")
+            conn.execute(
+                text(
+                    """
+                    CREATE TEMP TABLE _stage_hsd (
+                        product_id bigint not null,
+                        sale_date date not null,
+                        quantity_sold numeric(12,2) not null
+                    ) ON COMMIT DROP
+                    """
+                )
+            )
+            insert_cols = ["pharmacy_id", "product_id", "sale_date", "quantity_sold"]
+            select_expr = [":ph", "s.product_id", "s.sale_date", "s.quantity_sold"]
+            for col in ("created_at", "updated_at"):
+                if col in hist_columns:
+                    insert_cols.append(col)
+                    select_expr.append("now()")
+            # Delete-then-insert keeps the merge independent of whether the
+            # table carries the (pharmacy_id, product_id, sale_date) constraint.
+            delete_sql = text(
+                """
+                DELETE FROM historical_sales_daily h
+                USING _stage_hsd s
+                WHERE h.pharmacy_id = :ph
+                  AND h.product_id = s.product_id
+                  AND h.sale_date = s.sale_date
+                """
+            )
+            insert_sql = text(
+                f"""
+                INSERT INTO historical_sales_daily ({', '.join(insert_cols)})
+                SELECT DISTINCT ON (s.product_id, s.sale_date) {', '.join(select_expr)}
+                FROM _stage_hsd s
+                ORDER BY s.product_id, s.sale_date
+                """
+            )
+            for chunk in _chunks(rows, self.chunk_rows):
+                stats.rows += copy_rows(conn, "_stage_hsd", ("product_id", "sale_date", "quantity_sold"), chunk)
+                conn.execute(delete_sql, {"ph": pharmacy_id})
+                stats.merged += conn.execute(insert_sql, {"ph": pharmacy_id}).rowcount or 0
+                conn.execute(text("TRUNCATE _stage_hsd"))
+                stats.chunks += 1
+        stats.seconds = time.perf_counter() - started
+        logger.info("%s", stats)
+        return stats
+
+    # ------------------------------------------------------------------
+    # sales + sale_items
+    # ------------------------------------------------------------------
+    def load_sales(
+        self,
+        pharmacy_id: int,
+        user_id: int,
+        rows: Iterable[Tuple[str, datetime, int, int, float]],
+        *,
+        tax_rate: float = 0.12,
+        payment_method: str = "cash",
+        notes: Optional[str] = None,
+    ) -> LoadStats:
+        """
+        Insert single-line sales from
+        ``(sale_number, created_at, product_id, quantity, unit_price)`` rows.
+
+        Each chunk becomes one ``INSERT INTO sales ... SELECT`` whose returned
+        ids feed one ``INSERT INTO sale_items ... SELECT`` in the same statement;
+        the inserted sales are then added to the daily rollups.
+        """
+        stats = LoadStats("sales")
+        started = time.perf_counter()
+        with self.engine.begin() as conn:
+            sales_columns = insertable_columns(conn, "sales")
+            item_columns = insertable_columns(conn, "sale_items")
+            conn.execute(
+                text(
+                    """
+                    CREATE TEMP TABLE _stage_sales (
+                        sale_number text not null,
+                        created_at timestamptz not null,
+                        product_id bigint not null,
+                        quantity int not null,
+                        unit_price numeric(12,2) not null
+                    ) ON COMMIT DROP
+                    """
+                )
+            )
+
+            sale_cols = [
+                "sale_number", "pharmacy_id", "user_id", "subtotal", "tax_amount",
+                "discount_amount", "payment_method", "status", "notes", "created_at",
+            ]
+            sale_expr = [
+                "s.sale_number", ":ph", ":uid", "s.quantity * s.unit_price",
+                "s.quantity * s.unit_price * :tax", "0", ":pm", "'completed'", ":notes", "s.created_at",
+            ]
+            if "total_amount" in sales_columns:
+                sale_cols.append("total_amount")
+                sale_expr.append("s.quantity * s.unit_price * (1 + :tax)")
+            if "updated_at" in sales_columns:
+                sale_cols.append("updated_at")
+                sale_expr.append("now()")
+
+            item_cols = ["sale_id", "product_id", "quantity", "unit_price"]
+            item_expr = ["ins.id", "s.product_id", "s.quantity", "s.unit_price"]
+            if "total_price" in item_columns:
+                item_cols.append("total_price")
+                item_expr.append("s.quantity * s.unit_price")
+            if "created_at" in item_columns:
+                item_cols.append("created_at")
+                item_expr.append("s.created_at")
+            if "unit_cost" in item_columns:
+                item_cols.append("unit_cost")
+                item_expr.append("(SELECT p.cost_price FROM products p WHERE p.id = s.product_id)")
+
+            merge_sql = text(
+                f"""
+                WITH ins AS (
+                    INSERT INTO sales ({', '.join(sale_cols)})
+                    SELECT {', '.join(sale_expr)}
+                    FROM _stage_sales s
+                    RETURNING id, sale_number
+                ), items AS (
+                    INSERT INTO sale_items ({', '.join(item_cols)})
+                    SELECT {', '.join(item_expr)}
+                    FROM ins
+                    JOIN _stage_sales s ON s.sale_number = ins.sale_number
+                    RETURNING 1
+                )
+                SELECT (SELECT count(*) FROM items), array(SELECT id FROM ins)
+                """
+            )
+            params = {"ph": pharmacy_id, "uid": user_id, "tax": tax_rate, "pm": payment_method, "notes": notes}
+            for chunk in _chunks(rows, self.chunk_rows):
+                stats.rows += copy_rows(
+                    conn, "_stage_sales",
+                    ("sale_number", "created_at", "product_id", "quantity", "unit_price"),
+                    chunk,
+                )
+                item_count, sale_ids = conn.execute(merge_sql, params).one()
+                stats.merged += int(item_count or 0)
+                apply_sales(conn, sale_ids or [])
+                conn.execute(text("TRUNCATE _stage_sales"))
+                stats.chunks += 1
+        stats.seconds = time.perf_counter() - started
+        logger.info("%s", stats)
+        return stats
+
+    # ------------------------------------------------------------------
+    # products + inventory_batches (CSV import)
+    # ------------------------------------------------------------------
+    def import_inventory(
+        self,
+        pharmacy_id: int,
+        rows: Iterable[Dict[str, Any]],
+        *,
+        batch_prefix: Optional[str] = None,
+    ) -> LoadStats:
+        """
+        Import product rows (``name``, ``category``, ``quantity``,
+        ``cost_price``, ``unit_price``, ``location``) as products plus one
+        delivery batch per row with a positive quantity.
+
+        Existing products are matched by name (case-insensitive) within the
+        pharmacy and have their prices/location refreshed.
+        """
+        stats = LoadStats("inventory_import")
+        prefix = batch_prefix or f"IMPORT-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        started = time.perf_counter()
+        columns = ("name", "category", "quantity", "cost_price", "unit_price", "location", "line_no")
+
+        def as_tuples() -> Iterator[Tuple[Any, ...]]:
+            for line_no, row in enumerate(rows, 1):
+                name = str(row.get("name") or "").strip()
+                if not name:
+                    continue
+                yield (
+                    name,
+                    (str(row.get("category") or "").strip() or None),
+                    coerce_quantity(row.get("quantity")),
+                    coerce_price(row.get("cost_price")),
+                    coerce_price(row.get("unit_price")),
+                    (str(row.get("location") or "").strip() or None),
+                    line_no,
+                )
+
+        touched_products = 0
+        batches = 0
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    """
+                    CREATE TEMP TABLE _stage_inventory (
+                        name text not null,
+                        category text,
+                        quantity int not null default 0,
+                        cost_price numeric(12,2),
+                        unit_price numeric(12,2),
+                        location text,
+                        line_no bigint not null
+                    ) ON COMMIT DROP
+                    """
+                )
+            )
+            merge_statements = [
+                text(
+                    """
+                    INSERT INTO product_categories (name)
+                    SELECT DISTINCT s.category FROM _stage_inventory s
+                    WHERE s.category IS NOT NULL
+                    ON CONFLICT (name) DO NOTHING
+                    """
+                ),
+                text(
+                    """
+                    UPDATE products p
+                    SET unit_price = coalesce(s.unit_price, p.unit_price),
+                        cost_price = coalesce(s.cost_price, p.cost_price),
+                        location = coalesce(s.location, p.location),
+                        category_id = coalesce(pc.id, p.category_id)
+                    FROM (
+                        SELECT DISTINCT ON (lower(name)) *
+                        FROM _stage_inventory
+                        ORDER BY lower(name), line_no DESC
+                    ) s
+                    LEFT JOIN product_categories pc ON pc.name = s.category
+                    WHERE p.pharmacy_id = :ph AND lower(p.name) = lower(s.name)
+                    """
+                ),
+                text(
+                    """
+                    INSERT INTO products (pharmacy_id, name, category_id, unit_price, cost_price, is_active, location)
+                    SELECT :ph, s.name, pc.id, coalesce(s.unit_price, 0), coalesce(s.cost_price, 0), true, s.location
+                    FROM (
+                        SELECT DISTINCT ON (lower(name)) *
+                        FROM _stage_inventory
+                        ORDER BY lower(name), line_no DESC
+                    ) s
+                    LEFT JOIN product_categories pc ON pc.name = s.category
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM products p
+                        WHERE p.pharmacy_id = :ph AND lower(p.name) = lower(s.name)
+                    )
+                    """
+                ),
+            ]
+            batch_sql = text(
+                """
+                INSERT INTO inventory_batches (product_id, batch_number, quantity, delivery_date, cost_price)
+                SELECT p.id, :prefix || '-' || s.line_no, s.quantity, current_date, s.cost_price
+                FROM _stage_inventory s
+                JOIN products p ON p.pharmacy_id = :ph AND lower(p.name) = lower(s.name)
+                WHERE s.quantity > 0
+                ON CONFLICT (product_id, batch_number) DO NOTHING
+                """
+            )
+            stock_sql = text(
+                """
+                INSERT INTO inventory (product_id, current_stock)
+                SELECT p.id, coalesce(sum(b.quantity - b.sold_quantity - coalesce(b.disposed_quantity, 0))
+                    FILTER (WHERE b.expiration_date IS NULL OR b.expiration_date > current_date), 0)
+                FROM products p
+                LEFT JOIN inventory_batches b ON b.product_id = p.id
+                WHERE p.pharmacy_id = :ph
+                  AND lower(p.name) IN (SELECT lower(name) FROM _stage_inventory)
+                GROUP BY p.id
+                ON CONFLICT (product_id) DO UPDATE
+                SET current_stock = excluded.current_stock, last_updated = now()
+                """
+            )
+            params = {"ph": pharmacy_id, "prefix": prefix}
+            for chunk in _chunks(as_tuples(), self.chunk_rows):
+                stats.rows += copy_rows(conn, "_stage_inventory", columns, chunk)
+                for statement in merge_statements:
+                    touched_products += conn.execute(statement, params).rowcount or 0
+                batches += conn.execute(batch_sql, params).rowcount or 0
+                conn.execute(stock_sql, params)
+                conn.execute(text("TRUNCATE _stage_inventory"))
+                stats.chunks += 1
+        stats.merged = touched_products
+        stats.extra["batches"] = batches
+        stats.seconds = time.perf_counter() - started
+        logger.info("%s", stats)
+        return stats
+
+
+def iter_inventory_csv(csv_directory: str, files: Sequence[str] = INVENTORY_CSV_FILES) -> Iterator[Dict[str, Any]]:
+    """Stream rows of the inventory CSV exports one at a time, tagged with their source file."""
+    for csv_file in files:
+        file_path = os.path.join(csv_directory, csv_file)
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, newline="", encoding="utf-8-sig") as handle:
+            for row in csv.DictReader(handle):
+                row["source_file"] = csv_file
+                yield row
+
+
+def coerce_quantity(value: Any) -> int:
+    try:
+        return max(0, int(float(value)))
+    except (TypeError, ValueError):
+        return 0
+
+
+def coerce_price(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,157 @@
+"""
+Set-based disposal of expired stock.
+
+:func:`dispose_expired` sweeps every expired batch of a pharmacy (or of a
+chosen set of products) that still has stock on hand. Products are taken in
+chunks of ``chunk_products`` in id order, and each chunk is one transaction
+with two statements:
+
+1. a single data-modifying statement that locks the chunk's expired batches
+   in id order (the same order checkout and returns lock them), raises
+   ``disposed_quantity`` by the remaining stock with ``UPDATE ... FROM`` and
+   records every batch in ``disposed_products`` with ``INSERT ... SELECT``;
+2. :func:`services.pos_sales.refresh_inventory_stock` recomputing
+   ``inventory.current_stock`` of the chunk's products in one statement.
+
+A chunk that commits stays disposed, and the sweep only ever picks up stock
+that is still on hand, so an interrupted sweep is finished by running it
+again. :func:`iter_dispose_expired` yields the running totals after every
+chunk so callers can report progress.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from .pos_sales import refresh_inventory_stock
+
+DEFAULT_CHUNK_PRODUCTS = int(os.getenv("DISPOSAL_CHUNK_PRODUCTS", "500"))
+DISPOSAL_REASON = "Expired - Disposed"
+
+_AVAILABLE = "b.quantity - COALESCE(b.sold_quantity, 0) - COALESCE(b.disposed_quantity, 0)"
+
+
+@dataclass
+class DisposalStats:
+    """Running totals of a disposal sweep."""
+
+    products_total: int = 0
+    products_done: int = 0
+    chunks: int = 0
+    batches: int = 0
+    units: int = 0
+    total_cost: Decimal = Decimal("0")
+    seconds: float = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "products_total": self.products_total,
+            "products_done": self.products_done,
+            "chunks": self.chunks,
+            "batches_disposed": self.batches,
+            "units_disposed": self.units,
+            "total_cost": float(self.total_cost),
+            "seconds": round(self.seconds, 3),
+        }
+
+
+def expired_product_ids(conn: Connection, pharmacy_id: int, product_ids: Optional[Iterable[int]] = None) -> List[int]:
+    """Products of the pharmacy with expired stock still on hand, in id order."""
+    params: Dict[str, Any] = {"ph": pharmacy_id}
+    only = ""
+    if product_ids is not None:
+        only = "AND p.id = ANY(:pids)"
+        params["pids"] = sorted({int(p) for p in product_ids})
+    rows = conn.execute(text(f"""
+        SELECT DISTINCT p.id
+        FROM products p
+        JOIN inventory_batches b ON b.product_id = p.id
+        WHERE p.pharmacy_id = :ph {only}
+          AND b.expiration_date <= CURRENT_DATE
+          AND {_AVAILABLE} > 0
+        ORDER BY p.id
+    """), params).scalars().all()
+    return [int(r) for r in rows]
+
+
+def dispose_chunk(conn: Connection, pharmacy_id: int, user_id: Any, product_ids: List[int],
+                  reason: str = DISPOSAL_REASON) -> Dict[str, Any]:
+    """Dispose all expired on-hand stock of ``product_ids`` inside the caller's transaction."""
+    row = conn.execute(text(f"""
+        WITH targets AS (
+            SELECT b.id, b.product_id, b.batch_number, b.expiration_date,
+                   {_AVAILABLE} AS qty,
+                   COALESCE(b.cost_price, p.cost_price, 0) AS cost_price,
+                   p.location
+            FROM inventory_batches b
+            JOIN products p ON p.id = b.product_id
+            WHERE b.product_id = ANY(:pids)
+              AND p.pharmacy_id = :ph
+              AND b.expiration_date <= CURRENT_DATE
+              AND {_AVAILABLE} > 0
+            ORDER BY b.id
+            FOR UPDATE OF b
+        ), disposed AS (
+            UPDATE inventory_batches b
+            SET disposed_quantity = COALESCE(b.disposed_quantity, 0) + t.qty
+            FROM targets t
+            WHERE b.id = t.id
+            RETURNING b.id
+        ), recorded AS (
+            INSERT INTO disposed_products
+                (pharmacy_id, product_id, batch_id, batch_number, quantity_disposed,
+                 cost_price, total_cost, disposed_by, expiration_date, location, reason)
+            SELECT :ph, t.product_id, t.id, t.batch_number, t.qty,
+                   t.cost_price, t.cost_price * t.qty, CAST(:uid AS bigint), t.expiration_date, t.location, :reason
+            FROM targets t
+            JOIN disposed d ON d.id = t.id
+            RETURNING quantity_disposed, total_cost
+        )
+        SELECT count(*) AS batches,
+               COALESCE(SUM(quantity_disposed), 0) AS units,
+               COALESCE(SUM(total_cost), 0) AS total_cost
+        FROM recorded
+    """), {"pids": product_ids, "ph": pharmacy_id, "uid": user_id, "reason": reason}).mappings().one()
+    refresh_inventory_stock(conn, product_ids)
+    return {"batches": int(row["batches"]), "units": int(row["units"]), "total_cost": Decimal(row["total_cost"])}
+
+
+def iter_dispose_expired(engine: Engine, pharmacy_id: int, user_id: Any, product_ids: Optional[Iterable[int]] = None,
+                         chunk_products: int = DEFAULT_CHUNK_PRODUCTS,
+                         reason: str = DISPOSAL_REASON) -> Iterator[DisposalStats]:
+    """Sweep expired stock in per-chunk transactions, yielding the running totals after each chunk."""
+    started = time.perf_counter()
+    stats = DisposalStats()
+    with engine.connect() as conn:
+        todo = expired_product_ids(conn, pharmacy_id, product_ids)
+    stats.products_total = len(todo)
+    size = max(1, int(chunk_products))
+    for start in range(0, len(todo), size):
+        chunk = todo[start:start + size]
+        with engine.begin() as conn:
+            result = dispose_chunk(conn, pharmacy_id, user_id, chunk, reason)
+        stats.chunks += 1
+        stats.products_done += len(chunk)
+        stats.batches += result["batches"]
+        stats.units += result["units"]
+        stats.total_cost += result["total_cost"]
+        stats.seconds = time.perf_counter() - started
+        yield stats
+
+
+def dispose_expired(engine: Engine, pharmacy_id: int, user_id: Any, product_ids: Optional[Iterable[int]] = None,
+                    chunk_products: int = DEFAULT_CHUNK_PRODUCTS, reason: str = DISPOSAL_REASON,
+                    on_progress: Optional[Callable[[DisposalStats], None]] = None) -> DisposalStats:
+    """Run a whole sweep; see the module docstring."""
+    stats = DisposalStats()
+    for stats in iter_dispose_expired(engine, pharmacy_id, user_id, product_ids, chunk_products, reason):
+        if on_progress is not None:
+            on_progress(stats)
+    return stats
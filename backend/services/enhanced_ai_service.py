@@ -14,7 +14,7 @@ import re
 import logging
 from datetime import datetime, timedelta
 from pathlib import Path
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from dotenv import load_dotenv
 from .semantic_embeddings import SemanticEmbeddingService
 
@@ -209,9 +209,9 @@ class EnhancedAIService:
         
         # Database connection for live data
         if use_database:
-            from utils.helpers import get_database_url
+            from utils.helpers import get_database_url, get_engine
             self.database_url = get_database_url()
-            self.engine = create_engine(self.database_url, pool_pre_ping=True)
+            self.engine = get_engine()
         self.category_mappings: Dict[str, List[str]] = {}
         self.brand_mappings: Dict[str, str] = {}
         self._load_synonym_config(force=True)
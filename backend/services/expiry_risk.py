@@ -0,0 +1,205 @@
+"""
+Expiry-risk index reads and the daily rollover.
+
+``batch_expiry_risk`` (see ``database.schema.ensure_expiry_risk_index``) keeps
+one row per dated batch with its on-hand quantity, days to expiry, sell-through
+velocity over the last :data:`VELOCITY_WINDOW_DAYS` full days and the quantity
+projected to be left unsold when it expires, assuming stock sells
+first-expiring-first at that velocity. Triggers on ``inventory_batches``
+refresh a product's rows whenever its batches are received, sold, returned or
+disposed.
+
+A row is ``at_risk`` when it has stock on hand and either expires within
+:data:`EXPIRY_RISK_HORIZON_DAYS` or is projected to expire unsold. The
+expiry widgets only need those rows and read them through a partial index.
+
+Days to expiry and velocity move with the calendar, so every pharmacy is
+rolled over once a day: :func:`roll_over_expiry_risk` recomputes its rows the
+first time it is read on a new day (``scripts/roll_over_expiry_risk.py`` does
+it nightly for all pharmacies so the first reader does not pay for it).
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+EXPIRY_RISK_HORIZON_DAYS = int(os.getenv("EXPIRY_RISK_HORIZON_DAYS", "90"))
+VELOCITY_WINDOW_DAYS = 28
+
+_COST = "COALESCE(r.batch_cost, p.cost_price, 0)"
+
+
+def roll_over_expiry_risk(conn: Connection, pharmacy_id: int) -> bool:
+    """Recompute the pharmacy's rows if it was not rolled over today; True when it was done here."""
+    state = conn.execute(text("""
+        SELECT rolled_over_on < CURRENT_DATE AS due FROM expiry_risk_state WHERE pharmacy_id = :ph
+    """), {"ph": pharmacy_id}).first()
+    if state is not None and not state.due:
+        return False
+    conn.execute(text("""
+        INSERT INTO expiry_risk_state (pharmacy_id, rolled_over_on) VALUES (:ph, CURRENT_DATE - 1)
+        ON CONFLICT (pharmacy_id) DO NOTHING
+    """), {"ph": pharmacy_id})
+    due = conn.execute(text("""
+        SELECT rolled_over_on FROM expiry_risk_state
+        WHERE pharmacy_id = :ph AND rolled_over_on < CURRENT_DATE
+        FOR UPDATE
+    """), {"ph": pharmacy_id}).scalar()
+    if due is None:
+        return False  # another request rolled over first
+    conn.execute(text("""
+        SELECT expiry_risk_refresh(array_agg(p.id))
+        FROM products p
+        WHERE p.pharmacy_id = :ph
+          AND EXISTS (SELECT 1 FROM inventory_batches b WHERE b.product_id = p.id AND b.expiration_date IS NOT NULL)
+    """), {"ph": pharmacy_id})
+    conn.execute(text("""
+        UPDATE expiry_risk_state SET rolled_over_on = CURRENT_DATE, updated_at = now() WHERE pharmacy_id = :ph
+    """), {"ph": pharmacy_id})
+    return True
+
+
+def ensure_current(conn: Connection, pharmacy_id: int) -> None:
+    """Roll the pharmacy over before a read; the rollover is committed at once so reads can follow."""
+    if roll_over_expiry_risk(conn, pharmacy_id):
+        conn.commit()
+
+
+def roll_over_all(engine: Engine) -> List[int]:
+    """Roll over every pharmacy that is due, one transaction each; returns the pharmacies done."""
+    with engine.connect() as conn:
+        pharmacy_ids = conn.execute(text("SELECT id FROM pharmacies ORDER BY id")).scalars().all()
+    done = []
+    for pharmacy_id in pharmacy_ids:
+        with engine.begin() as conn:
+            if roll_over_expiry_risk(conn, int(pharmacy_id)):
+                done.append(int(pharmacy_id))
+    return done
+
+
+def window_predicate(days: int) -> str:
+    """SQL over alias ``r`` for on-hand rows expiring within ``days``; uses the at-risk index when it can."""
+    days = int(days)
+    if days <= EXPIRY_RISK_HORIZON_DAYS:
+        return f"r.at_risk AND r.expiration_date <= CURRENT_DATE + {days}"
+    return f"r.on_hand > 0 AND r.expiration_date <= CURRENT_DATE + {days}"
+
+
+_RISK_LEVEL = """
+    case
+        when days_to_expiry is null or expired_quantity > 0 or (days_to_expiry < 0) then 'critical'
+        when days_to_expiry <= :critical_window then 'critical'
+        when days_to_expiry <= :soon_window then 'high'
+        when days_to_expiry <= :medium_window then 'medium'
+        else 'low'
+    end
+"""
+
+_EXPIRY_STATE = """
+    case
+        when days_to_expiry is null or days_to_expiry < 0 or expired_quantity > 0 then 'expired'
+        when days_to_expiry <= :soon_window then 'expiring'
+        else 'healthy'
+    end
+"""
+
+
+def product_risk_rows(conn: Connection, pharmacy_id: int, *, soon_window: int, medium_window: int,
+                      critical_window: int, state_filter: str = "all", status_filter: str = "all",
+                      category_id: Optional[int] = None, search: Optional[str] = None,
+                      include_zero: bool = False) -> List[Dict[str, Any]]:
+    """
+    Per-product expiry risk of the pharmacy, one row per active product with dated
+    batches, classified into risk levels and expiry states. Quantities and values
+    are stock on hand. ``search`` is a LIKE pattern on product and category name.
+    """
+    ensure_current(conn, pharmacy_id)
+    params: Dict[str, Any] = {
+        "ph": pharmacy_id,
+        "soon_window": int(soon_window),
+        "medium_window": int(medium_window),
+        "critical_window": int(critical_window),
+        "state_filter": state_filter,
+        "status_filter": status_filter,
+    }
+    filters = []
+    if not include_zero:
+        filters.append("r.on_hand > 0")
+        # Filters that keep only products expiring within a window pick them from the at-risk rows
+        cap = None
+        if state_filter in ("expired", "expiring") or status_filter in ("critical", "high"):
+            cap = int(soon_window)
+        elif status_filter == "medium":
+            cap = int(medium_window)
+        if cap is not None and cap <= EXPIRY_RISK_HORIZON_DAYS:
+            filters.append("""r.product_id IN (
+                SELECT a.product_id FROM batch_expiry_risk a
+                WHERE a.pharmacy_id = :ph AND a.at_risk AND a.expiration_date <= CURRENT_DATE + CAST(:cap AS int)
+            )""")
+            params["cap"] = cap
+    if category_id:
+        filters.append("p.category_id = :category_id")
+        params["category_id"] = int(category_id)
+    if search:
+        filters.append("(lower(p.name) like :search or lower(coalesce(pc.name, '')) like :search)")
+        params["search"] = search
+    where = "".join(f"\n          AND {f}" for f in filters)
+    soon = "CURRENT_DATE + CAST(:soon_window AS int)"
+    rows = conn.execute(text(f"""
+        WITH product_data AS (
+            SELECT
+                p.id,
+                p.name,
+                pc.name AS category_name,
+                p.location,
+                SUM(r.on_hand) AS total_quantity,
+                SUM(r.on_hand * {_COST}) AS total_value,
+                SUM(CASE WHEN r.expiration_date <= CURRENT_DATE THEN r.on_hand * {_COST} ELSE 0 END) AS expired_value,
+                SUM(CASE WHEN r.expiration_date > CURRENT_DATE AND r.expiration_date <= {soon}
+                    THEN r.on_hand * {_COST} ELSE 0 END) AS expiring_soon_value,
+                SUM(CASE WHEN r.expiration_date <= CURRENT_DATE THEN r.on_hand ELSE 0 END) AS expired_quantity,
+                SUM(CASE WHEN r.expiration_date > CURRENT_DATE AND r.expiration_date <= {soon}
+                    THEN r.on_hand ELSE 0 END) AS expiring_soon_quantity,
+                SUM(r.projected_unsold) AS projected_unsold_quantity,
+                SUM(r.projected_unsold * {_COST}) AS projected_unsold_value,
+                MAX(r.daily_velocity) AS daily_velocity,
+                MIN(r.expiration_date) AS next_expiration,
+                (MIN(r.expiration_date) - CURRENT_DATE)::int AS days_to_expiry
+            FROM batch_expiry_risk r
+            JOIN products p ON p.id = r.product_id
+            LEFT JOIN product_categories pc ON pc.id = p.category_id
+            WHERE r.pharmacy_id = :ph
+              AND p.is_active = true{where}
+            GROUP BY p.id, p.name, pc.name, p.location
+        )
+        SELECT *, {_RISK_LEVEL} AS risk_level, {_EXPIRY_STATE} AS expiry_state
+        FROM product_data
+        WHERE (:state_filter = 'all' OR {_EXPIRY_STATE} = :state_filter)
+          AND (:status_filter = 'all' OR {_RISK_LEVEL} = :status_filter)
+    """), params).mappings().all()
+    return [dict(row) for row in rows]
+
+
+def expiry_alerts(conn: Connection, pharmacy_id: int, days: int = 30) -> List[Dict[str, Any]]:
+    """Active products with stock on hand expiring within ``days``, soonest first."""
+    ensure_current(conn, pharmacy_id)
+    rows = conn.execute(text(f"""
+        SELECT p.id AS product_id,
+               p.name,
+               SUM(r.on_hand) AS total_quantity,
+               MIN(r.expiration_date) AS next_expiration,
+               SUM(r.on_hand * {_COST}) AS value_at_risk,
+               SUM(r.projected_unsold) AS projected_unsold
+        FROM batch_expiry_risk r
+        JOIN products p ON p.id = r.product_id
+        WHERE r.pharmacy_id = :ph
+          AND p.is_active = true
+          AND {window_predicate(days)}
+        GROUP BY p.id, p.name
+        ORDER BY next_expiration ASC, p.id
+    """), {"ph": pharmacy_id}).mappings().all()
+    return [dict(row) for row in rows]
@@ -0,0 +1,251 @@
+"""
+Identity resolution for authorization checks.
+
+Almost every handler starts by looking up the caller's ``id``, ``role`` and
+``pharmacy_id``. :func:`resolve_identity` answers that lookup from three
+layers before it asks Postgres:
+
+1. A request-scoped memo on ``flask.g``. A handler and the helpers it calls
+   resolve the same user at most once per request.
+2. The JWT claims. Login embeds ``role`` and ``pharmacy_id`` in the access
+   token (:func:`identity_claims`). Claims are trusted only when the token
+   was issued after the user's last identity change.
+3. A per-process cache of looked-up rows, kept for ``IDENTITY_CACHE_TTL``
+   seconds. It serves tokens without claims, and tokens issued before a
+   change.
+
+Revocation works as before: a deleted user resolves to None, and a changed
+role or pharmacy applies to existing tokens. A trigger installed by
+``database.schema.ensure_user_identity_changes`` stamps
+``user_identity_changes`` whenever a user's role, pharmacy or active flag
+changes, or the user is deleted. Each process re-reads the stamps of the
+last token lifetime every ``IDENTITY_REVOCATION_TTL`` seconds; one thread
+reads while the others keep using the previous stamps. It then drops the
+cached rows of users whose stamp is new and stops trusting their older
+tokens. That is the longest a change takes to reach other workers. The
+writing process calls :meth:`IdentityCache.forget`, so there the change
+applies at once; its local stamp is replaced by the database's as soon as a
+read shows it.
+
+If the stamps cannot be read, claims are not trusted and rows are only kept
+for their TTL.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple, Union
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "30"))
+IDENTITY_REVOCATION_TTL = float(os.getenv("IDENTITY_REVOCATION_TTL", "5"))
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "10000"))
+
+# Claims added to access tokens at login
+IDENTITY_CLAIMS = ("role", "pharmacy_id")
+
+# Tokens are stamped by the app's clock and changes by the database's
+CLOCK_SKEW_SECONDS = 30.0
+
+DEFAULT_TOKEN_LIFETIME = timedelta(hours=24)
+
+_MISSING = object()
+
+
+def identity_claims(row: Mapping[str, Any]) -> Dict[str, Any]:
+    """Additional access-token claims for the user ``row`` (with ``role`` and ``pharmacy_id``)."""
+    return {"role": row["role"], "pharmacy_id": row["pharmacy_id"]}
+
+
+def _identity(user_id: Any, role: Any, pharmacy_id: Any) -> Dict[str, Any]:
+    return {"id": int(user_id), "role": role, "pharmacy_id": pharmacy_id}
+
+
+def _token_lifetime() -> timedelta:
+    try:
+        from flask import current_app, has_app_context
+
+        if has_app_context():
+            lifetime = current_app.config.get("JWT_ACCESS_TOKEN_EXPIRES")
+            if isinstance(lifetime, timedelta):
+                return lifetime
+    except ImportError:
+        pass
+    return DEFAULT_TOKEN_LIFETIME
+
+
+def _request_claims(user_id: Any) -> Optional[Mapping[str, Any]]:
+    """Claims of the verified JWT of this request, when it belongs to ``user_id``."""
+    try:
+        from flask import has_request_context
+        from flask_jwt_extended import get_jwt
+
+        if not has_request_context():
+            return None
+        claims = get_jwt()
+    except Exception:  # no JWT verified for this request
+        return None
+    if not claims or str(claims.get("sub")) != str(user_id):
+        return None
+    if any(name not in claims for name in IDENTITY_CLAIMS) or "iat" not in claims:
+        return None
+    return claims
+
+
+def _request_memo() -> Optional[Dict[str, Any]]:
+    try:
+        from flask import g, has_request_context
+    except ImportError:
+        return None
+    if not has_request_context():
+        return None
+    memo = g.get("_identities")
+    if memo is None:
+        memo = g._identities = {}
+    return memo
+
+
+class IdentityCache:
+    """Per-process identity rows and identity-change stamps (see the module docstring)."""
+
+    def __init__(self, ttl: float = IDENTITY_CACHE_TTL, revocation_ttl: float = IDENTITY_REVOCATION_TTL,
+                 max_entries: int = IDENTITY_CACHE_SIZE) -> None:
+        self.ttl = ttl
+        self.revocation_ttl = revocation_ttl
+        self.max_entries = max_entries
+        self._rows: Dict[str, Tuple[float, Optional[Dict[str, Any]]]] = {}
+        # user id -> epoch seconds of the last change; None while the stamps are unknown
+        self._changes: Optional[Dict[str, float]] = None
+        self._changes_until = 0.0
+        # The stamps as last read from the database, and forget() calls it has not shown yet
+        self._seen: Dict[str, float] = {}
+        self._forgotten: Dict[str, float] = {}
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def resolve(self, bind: Union[Connection, Engine], user_id: Any) -> Optional[Dict[str, Any]]:
+        """``{"id", "role", "pharmacy_id"}`` of ``user_id``, or None when the user does not exist."""
+        if user_id is None:
+            return None
+        key = str(user_id)
+        memo = _request_memo()
+        if memo is not None:
+            found = memo.get(key, _MISSING)
+            if found is not _MISSING:
+                return found
+        identity = self._resolve(bind, key)
+        if memo is not None:
+            memo[key] = identity
+        return identity
+
+    def _resolve(self, bind: Union[Connection, Engine], key: str) -> Optional[Dict[str, Any]]:
+        changes = self._current_changes(bind)
+        claims = _request_claims(key)
+        if claims is not None and changes is not None:
+            changed_at = changes.get(key)
+            if changed_at is None or float(claims["iat"]) > changed_at + CLOCK_SKEW_SECONDS:
+                return _identity(key, claims["role"], claims["pharmacy_id"])
+        now = time.monotonic()
+        cached = self._rows.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+        identity = self._load(bind, key)
+        with self._lock:
+            if len(self._rows) >= self.max_entries:
+                self._rows = {k: v for k, v in self._rows.items() if v[0] > now}
+                if len(self._rows) >= self.max_entries:
+                    self._rows.clear()
+            self._rows[key] = (now + self.ttl, identity)
+        return identity
+
+    @staticmethod
+    def _load(bind: Union[Connection, Engine], key: str) -> Optional[Dict[str, Any]]:
+        sql = text("SELECT id, role, pharmacy_id FROM users WHERE id = :id")
+        if isinstance(bind, Engine):
+            with bind.connect() as conn:
+                row = conn.execute(sql, {"id": key}).mappings().first()
+        else:
+            row = bind.execute(sql, {"id": key}).mappings().first()
+        return _identity(row["id"], row["role"], row["pharmacy_id"]) if row else None
+
+    def _current_changes(self, bind: Union[Connection, Engine]) -> Optional[Dict[str, float]]:
+        if time.monotonic() < self._changes_until:
+            return self._changes
+        with self._lock:
+            if self._refreshing:
+                return self._changes
+            self._refreshing = True
+        try:
+            return self._refresh_changes(bind)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh_changes(self, bind: Union[Connection, Engine]) -> Optional[Dict[str, float]]:
+        engine = bind if isinstance(bind, Engine) else bind.engine
+        try:
+            # Own connection: a failed read must not abort the caller's transaction
+            with engine.connect() as conn:
+                rows = conn.execute(text("""
+                    SELECT user_id, extract(epoch FROM changed_at) AS changed_at
+                    FROM user_identity_changes
+                    WHERE changed_at > now() - make_interval(secs => CAST(:lifetime AS float8))
+                """), {"lifetime": _token_lifetime().total_seconds() + CLOCK_SKEW_SECONDS}).all()
+            changes: Optional[Dict[str, float]] = {str(user_id): float(at) for user_id, at in rows}
+        except Exception as e:
+            print(f"[identity] Could not read identity changes: {e}")
+            changes = None
+        with self._lock:
+            if changes is None:
+                stale: Iterable[str] = ()
+            else:
+                stale = [k for k, at in changes.items() if self._seen.get(k) != at]
+                self._seen = dict(changes)
+            for key in stale:
+                self._rows.pop(key, None)
+            if changes is not None:
+                # A forget() is settled once the database shows a change from around that time or later
+                oldest = time.time() - _token_lifetime().total_seconds()
+                for key, forgotten_at in list(self._forgotten.items()):
+                    if forgotten_at < oldest or changes.get(key, 0.0) >= forgotten_at - CLOCK_SKEW_SECONDS:
+                        del self._forgotten[key]
+                    else:
+                        changes[key] = forgotten_at + CLOCK_SKEW_SECONDS
+            self._changes = changes
+            self._changes_until = time.monotonic() + self.revocation_ttl
+        return changes
+
+    def forget(self, *user_ids: Any) -> None:
+        """Drop ``user_ids`` after changing them in this process; their existing tokens are re-checked."""
+        now = time.time()
+        with self._lock:
+            for user_id in user_ids:
+                key = str(user_id)
+                self._rows.pop(key, None)
+                self._forgotten[key] = now
+                if self._changes is not None:
+                    self._changes[key] = now + CLOCK_SKEW_SECONDS
+        memo = _request_memo()
+        if memo is not None:
+            for user_id in user_ids:
+                memo.pop(str(user_id), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rows.clear()
+            self._changes = None
+            self._changes_until = 0.0
+            self._seen = {}
+            self._forgotten = {}
+
+
+identity_cache = IdentityCache()
+
+
+def resolve_identity(bind: Union[Connection, Engine], user_id: Any) -> Optional[Dict[str, Any]]:
+    return identity_cache.resolve(bind, user_id)
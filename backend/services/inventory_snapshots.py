@@ -0,0 +1,284 @@
+"""
+Daily inventory snapshots.
+
+``inventory_daily_snapshots`` (see
+``database.schema.ensure_inventory_snapshots``) holds one row per product and
+day on which its stock moved. A row has the units received (batches), sold
+(completed sales), returned (units of completed returns put back into
+stock, ``return_items.restored_quantity``) and disposed, plus the on-hand
+stock at the end of that day. Days without movement have no row; a
+product's stock on such a day is the closing stock of its previous row.
+
+Closing stock is anchored to the present rather than accumulated forward:
+
+    closing(d) = on_hand_now - sum(received - sold + returned - disposed after d)
+
+On-hand is the batches' ``quantity - sold_quantity - disposed_quantity``,
+the physical stock, expired batches included. So a backfill over all of
+history and a nightly run over yesterday use the same statement, and every
+run ends exactly at the live stock.
+
+:func:`record_snapshots` writes a pharmacy's rows for a day range.
+:func:`ensure_current` records every full day up to yesterday the first time
+a pharmacy is read on a new day; the first time ever, it backfills the whole
+history. ``scripts/snapshot_inventory.py`` does it nightly for all pharmacies.
+:func:`inventory_history` reads a date range by month, week or day. Today's
+movement is computed live, so the last period always closes at the current
+stock.
+"""
+
+from __future__ import annotations
+
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+HISTORY_GRAINS = ("month", "week", "day")
+
+_ON_HAND = "b.quantity - COALESCE(b.sold_quantity, 0) - COALESCE(b.disposed_quantity, 0)"
+
+# Per-product daily movement of one pharmacy from :since (NULL: all history) until now
+_FLOWS = """
+    flows AS (
+        SELECT product_id, day,
+               SUM(received) AS received, SUM(sold) AS sold,
+               SUM(returned) AS returned, SUM(disposed) AS disposed
+        FROM (
+            SELECT b.product_id, COALESCE(b.received_at::date, b.delivery_date) AS day,
+                   b.quantity AS received, 0 AS sold, 0 AS returned, 0 AS disposed
+            FROM inventory_batches b
+            JOIN products p ON p.id = b.product_id
+            WHERE p.pharmacy_id = :ph
+              AND (CAST(:since AS date) IS NULL OR COALESCE(b.received_at::date, b.delivery_date) >= CAST(:since AS date))
+            UNION ALL
+            SELECT si.product_id, s.created_at::date, 0, si.quantity, 0, 0
+            FROM sales s
+            JOIN sale_items si ON si.sale_id = s.id
+            WHERE s.pharmacy_id = :ph AND s.status = 'completed'
+              AND (CAST(:since AS date) IS NULL OR s.created_at >= CAST(:since AS date))
+            UNION ALL
+            -- Unplaced units never raised stock; lines from before tracking count in full
+            SELECT ri.product_id, r.created_at::date, 0, 0, COALESCE(ri.restored_quantity, ri.quantity), 0
+            FROM returns r
+            JOIN return_items ri ON ri.return_id = r.id
+            WHERE r.pharmacy_id = :ph AND COALESCE(r.status, 'completed') = 'completed'
+              AND COALESCE(ri.restored_quantity, ri.quantity) > 0
+              AND (CAST(:since AS date) IS NULL OR r.created_at >= CAST(:since AS date))
+            UNION ALL
+            {disposals}
+        ) movement
+        WHERE product_id IS NOT NULL AND day IS NOT NULL
+        GROUP BY product_id, day
+    )
+"""
+
+_DISPOSALS = """
+            SELECT d.product_id, d.disposed_at::date, 0, 0, 0, d.quantity_disposed
+            FROM disposed_products d
+            WHERE d.pharmacy_id = :ph
+              AND (CAST(:since AS date) IS NULL OR d.disposed_at >= CAST(:since AS date))
+"""
+# disposed_products is created by the first disposal; until then there is nothing to subtract
+_NO_DISPOSALS = "SELECT NULL::bigint, NULL::date, 0, 0, 0, 0 WHERE false"
+
+_SNAPSHOT_ROWS = f"""
+    WITH {_FLOWS}, on_hand AS (
+        SELECT b.product_id, SUM({_ON_HAND}) AS stock
+        FROM inventory_batches b
+        WHERE b.product_id IN (SELECT DISTINCT product_id FROM flows)
+        GROUP BY b.product_id
+    ), snapshot AS (
+        SELECT f.product_id, f.day, f.received, f.sold, f.returned, f.disposed,
+               COALESCE(o.stock, 0) - COALESCE(SUM(f.received - f.sold + f.returned - f.disposed) OVER (
+                   PARTITION BY f.product_id ORDER BY f.day DESC
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+               ), 0) AS closing_stock
+        FROM flows f
+        LEFT JOIN on_hand o ON o.product_id = f.product_id
+    )
+    SELECT product_id, day, closing_stock, received, sold, returned, disposed
+    FROM snapshot
+    WHERE (CAST(:day_from AS date) IS NULL OR day >= CAST(:day_from AS date))
+      AND day <= CAST(:day_to AS date)
+"""
+
+
+def _with_disposals(conn: Connection, sql: str) -> str:
+    has_disposals = conn.execute(text("SELECT to_regclass('public.disposed_products') IS NOT NULL")).scalar()
+    return sql.replace("{disposals}", _DISPOSALS if has_disposals else _NO_DISPOSALS)
+
+
+def record_snapshots(conn: Connection, pharmacy_id: int, day_from: Optional[date], day_to: date) -> int:
+    """Write the pharmacy's rows for ``day_from``..``day_to`` (``day_from`` None: all history); returns rows written."""
+    result = conn.execute(text(_with_disposals(conn, f"""
+        INSERT INTO inventory_daily_snapshots AS t
+            (product_id, day, pharmacy_id, closing_stock, received, sold, returned, disposed)
+        SELECT product_id, day, :ph, closing_stock, received, sold, returned, disposed
+        FROM ({_SNAPSHOT_ROWS}) rows
+        ON CONFLICT (product_id, day) DO UPDATE SET
+            pharmacy_id = excluded.pharmacy_id, closing_stock = excluded.closing_stock,
+            received = excluded.received, sold = excluded.sold,
+            returned = excluded.returned, disposed = excluded.disposed
+    """)), {"ph": pharmacy_id, "since": day_from, "day_from": day_from, "day_to": day_to})
+    return result.rowcount or 0
+
+
+def roll_over_snapshots(conn: Connection, pharmacy_id: int) -> bool:
+    """Record every full day not recorded yet (all history the first time); True when it was done here."""
+    conn.execute(text("""
+        INSERT INTO inventory_snapshot_state (pharmacy_id, recorded_through) VALUES (:ph, NULL)
+        ON CONFLICT (pharmacy_id) DO NOTHING
+    """), {"ph": pharmacy_id})
+    state = conn.execute(text("""
+        SELECT pharmacy_id, recorded_through FROM inventory_snapshot_state
+        WHERE pharmacy_id = :ph AND (recorded_through IS NULL OR recorded_through < CURRENT_DATE - 1)
+        FOR UPDATE
+    """), {"ph": pharmacy_id}).mappings().first()
+    if state is None:
+        return False  # up to date, or another request recorded first
+    day_from = state["recorded_through"] + timedelta(days=1) if state["recorded_through"] else None
+    yesterday = conn.execute(text("SELECT CURRENT_DATE - 1")).scalar()
+    if day_from is None:
+        conn.execute(text("DELETE FROM inventory_daily_snapshots WHERE pharmacy_id = :ph"), {"ph": pharmacy_id})
+    record_snapshots(conn, pharmacy_id, day_from, yesterday)
+    conn.execute(text("""
+        UPDATE inventory_snapshot_state SET recorded_through = :day, updated_at = now() WHERE pharmacy_id = :ph
+    """), {"ph": pharmacy_id, "day": yesterday})
+    return True
+
+
+def ensure_current(conn: Connection, pharmacy_id: int) -> None:
+    """Roll the pharmacy over before a read; the rollover is committed at once so reads can follow."""
+    if roll_over_snapshots(conn, pharmacy_id):
+        conn.commit()
+
+
+def roll_over_all(engine: Engine, rebuild: bool = False) -> List[int]:
+    """Roll over every pharmacy that is due (all of them from scratch with ``rebuild``); one transaction each."""
+    with engine.connect() as conn:
+        pharmacy_ids = conn.execute(text("SELECT id FROM pharmacies ORDER BY id")).scalars().all()
+    done = []
+    for pharmacy_id in pharmacy_ids:
+        with engine.begin() as conn:
+            if rebuild:
+                conn.execute(text("""
+                    UPDATE inventory_snapshot_state SET recorded_through = NULL WHERE pharmacy_id = :ph
+                """), {"ph": pharmacy_id})
+            if roll_over_snapshots(conn, int(pharmacy_id)):
+                done.append(int(pharmacy_id))
+    return done
+
+
+_HISTORY_SQL = f"""
+    WITH scope AS (
+        SELECT p.id, p.name, pc.name AS category_name, COALESCE(p.reorder_point, 0) AS reorder_point
+        FROM products p
+        LEFT JOIN product_categories pc ON pc.id = p.category_id
+        WHERE p.pharmacy_id = :ph AND p.is_active = true
+          AND (CAST(:product_id AS bigint) IS NULL OR p.id = CAST(:product_id AS bigint))
+    ), days AS (
+        SELECT s.product_id, s.day, s.closing_stock, s.received, s.sold, s.returned, s.disposed
+        FROM inventory_daily_snapshots s
+        WHERE s.pharmacy_id = :ph
+          AND (CAST(:product_id AS bigint) IS NULL OR s.product_id = CAST(:product_id AS bigint))
+          AND s.day >= CAST(:date_from AS date)
+          AND s.day <= LEAST(CAST(:date_to AS date), CURRENT_DATE - 1)
+        UNION ALL
+        SELECT today.product_id, today.day, today.closing_stock, today.received, today.sold, today.returned, today.disposed
+        FROM ({_SNAPSHOT_ROWS.replace(":day_from", ":today").replace(":day_to", ":today")}) today
+        WHERE CAST(:date_to AS date) >= CURRENT_DATE
+          AND (CAST(:product_id AS bigint) IS NULL OR today.product_id = CAST(:product_id AS bigint))
+    ), periods AS (
+        SELECT product_id, date_trunc(CAST(:grain AS text), day)::date AS period,
+               (array_agg(closing_stock ORDER BY day DESC))[1] AS closing_stock,
+               SUM(received) AS received, SUM(sold) AS sold,
+               SUM(returned) AS returned, SUM(disposed) AS disposed
+        FROM days
+        GROUP BY product_id, period
+    )
+    SELECT sc.id AS product_id, sc.name, sc.category_name, sc.reorder_point,
+           COALESCE(o.closing_stock, 0) AS opening_stock,
+           COALESCE(jsonb_agg(jsonb_build_array(
+               pe.period, pe.closing_stock, pe.received, pe.sold, pe.returned, pe.disposed
+           ) ORDER BY pe.period) FILTER (WHERE pe.period IS NOT NULL), '[]'::jsonb) AS periods
+    FROM scope sc
+    LEFT JOIN LATERAL (
+        SELECT s.closing_stock FROM inventory_daily_snapshots s
+        WHERE s.product_id = sc.id AND s.day < CAST(:date_from AS date)
+        ORDER BY s.day DESC
+        LIMIT 1
+    ) o ON true
+    LEFT JOIN periods pe ON pe.product_id = sc.id
+    GROUP BY sc.id, sc.name, sc.category_name, sc.reorder_point, o.closing_stock
+    ORDER BY sc.name, sc.id
+"""
+
+
+def period_starts(grain: str, date_from: date, date_to: date) -> List[date]:
+    """Start of every ``grain`` period overlapping ``date_from``..``date_to``."""
+    if grain == "month":
+        current = date_from.replace(day=1)
+    elif grain == "week":
+        current = date_from - timedelta(days=date_from.weekday())
+    else:
+        current = date_from
+    starts = []
+    while current <= date_to:
+        starts.append(current)
+        if grain == "month":
+            current = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:
+            current += timedelta(days=7 if grain == "week" else 1)
+    return starts
+
+
+def inventory_history(conn: Connection, pharmacy_id: int, date_from: date, date_to: date,
+                      grain: str = "month", product_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Stock history of the pharmacy's active products (or one product), per period:
+    closing stock and units received, sold, returned and disposed. Series are
+    columnar, one value per entry of ``periods``; periods without movement carry
+    the previous closing stock forward.
+    """
+    ensure_current(conn, pharmacy_id)
+    today = conn.execute(text("SELECT CURRENT_DATE")).scalar()
+    date_to = min(date_to, today)
+    rows = conn.execute(text(_with_disposals(conn, _HISTORY_SQL)), {
+        "ph": pharmacy_id, "product_id": product_id, "grain": grain,
+        "date_from": date_from, "date_to": date_to, "today": today, "since": today,
+    }).mappings().all()
+    starts = period_starts(grain, date_from, date_to)
+    index = {d.isoformat(): i for i, d in enumerate(starts)}
+    products = []
+    for row in rows:
+        stock = int(row["opening_stock"] or 0)
+        closing = [0] * len(starts)
+        flows = {key: [0] * len(starts) for key in ("received", "sold", "returned", "disposed")}
+        moved = {}
+        for period, closing_stock, received, sold, returned, disposed in row["periods"]:
+            i = index.get(str(period)[:10])
+            if i is not None:
+                moved[i] = int(closing_stock)
+                flows["received"][i], flows["sold"][i] = int(received), int(sold)
+                flows["returned"][i], flows["disposed"][i] = int(returned), int(disposed)
+        for i in range(len(starts)):
+            stock = moved.get(i, stock)
+            closing[i] = stock
+        products.append({
+            "product_id": row["product_id"],
+            "name": row["name"],
+            "category_name": row["category_name"],
+            "reorder_point": int(row["reorder_point"] or 0),
+            "opening_stock": int(row["opening_stock"] or 0),
+            "closing_stock": closing,
+            **flows,
+        })
+    return {
+        "grain": grain,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "periods": [d.isoformat() for d in starts],
+        "products": products,
+    }
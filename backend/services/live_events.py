@@ -0,0 +1,380 @@
+"""
+Live pharmacy events pushed over server-sent events.
+
+Write paths do not publish anything themselves. Triggers installed by
+``database.schema.ensure_live_events`` append to ``live_events``, in the same
+transaction as the change:
+
+* ``stock``: per statement, the products whose sellable stock moved (received
+  minus sold minus disposed, excluding expired batches), with their new stock
+  and the change. At most :data:`MAX_EVENT_ITEMS` products are listed;
+  ``truncated`` tells the client to refetch.
+* ``low_stock``: a product crossed its reorder point (default 10) downwards.
+* ``sale``: new sales per statement, the latest :data:`MAX_EVENT_ITEMS` listed.
+* ``inventory_request``: an inventory adjustment request was approved.
+
+A row trigger on ``live_events`` sends ``NOTIFY`` on :data:`CHANNEL`, so
+listeners hear about an event only once it is committed. Small events travel
+in the notification payload. Larger ones carry only their id and are fetched.
+
+Each worker process has one :class:`LiveEventHub`. It holds a single
+``LISTEN`` connection in a background thread, started with the first
+subscriber. The hub fans every event out to that pharmacy's subscribers
+through in-memory queues. A subscriber that falls :data:`QUEUE_SIZE` events
+behind gets a ``resync`` event instead of the backlog.
+
+Event ids come from a sequence, so a transaction can commit an event with a
+lower id than one already delivered. Ids therefore only serve to drop
+duplicates (the hub and every stream remember the ids they recently sent,
+and the id is part of the event data for clients). Positions are
+transaction ids instead. Every :data:`SWEEP_INTERVAL` seconds the listener
+re-reads the events of transactions at or above its horizon, dispatches the
+ones no notification delivered, and moves the horizon to the oldest
+transaction still in flight (``txid_snapshot_xmin``). Every event of an older
+transaction has been dispatched by then. Streams send the horizon as the SSE
+id once their queue is drained. A client that reconnects with
+``Last-Event-ID`` is replayed the events of transactions from that horizon
+on, some of which it may already have. It gets ``resync`` when that is more
+than :data:`REPLAY_LIMIT` events, or older than the retention window
+(``LIVE_EVENTS_RETENTION_HOURS``). The listener prunes older rows.
+
+Under the main app's gthread worker every open stream holds a server thread,
+so a worker serves at most :data:`MAX_STREAMS` of them and keeps its other
+threads for the API. ``events_app.py`` serves the streams from a gevent
+worker instead, where a stream is a greenlet and the cap follows the
+worker's connection limit.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import select
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Mapping, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+CHANNEL = "live_events"
+EVENT_KINDS = ("stock", "low_stock", "sale", "inventory_request")
+MAX_EVENT_ITEMS = 200
+
+HEARTBEAT_SECONDS = float(os.getenv("LIVE_EVENTS_HEARTBEAT", "15"))
+QUEUE_SIZE = int(os.getenv("LIVE_EVENTS_QUEUE_SIZE", "256"))
+REPLAY_LIMIT = int(os.getenv("LIVE_EVENTS_REPLAY_LIMIT", "500"))
+RETENTION_HOURS = int(os.getenv("LIVE_EVENTS_RETENTION_HOURS", "24"))
+MAX_STREAMS = int(os.getenv("LIVE_EVENTS_MAX_STREAMS", "32"))
+RETRY_MS = 3000
+LISTEN_TIMEOUT = 5.0
+SWEEP_INTERVAL = 5.0
+SWEEP_PAGE = 1000
+RECONNECT_DELAY = 5.0
+PRUNE_INTERVAL = 600.0
+# Recently sent event ids remembered to drop duplicates, per stream and per hub
+SENT_MEMORY = 4096
+DISPATCHED_MEMORY = 20000
+
+_EVENT_COLUMNS = "id, pharmacy_id, kind, data, created_at"
+
+
+def _event(row: Mapping[str, Any]) -> Dict[str, Any]:
+    created_at = row.get("created_at")
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    return {
+        "id": int(row["id"]),
+        "pharmacy_id": int(row["pharmacy_id"]),
+        "kind": row["kind"],
+        "data": row.get("data") or {},
+        "created_at": created_at,
+    }
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """One SSE message: the event kind as the SSE event name, its id and data as JSON.
+
+    The message carries no SSE ``id`` field; the stream sends the horizon as
+    ``Last-Event-ID`` on its own (see the module docstring).
+    """
+    data = json.dumps({"id": event["id"], "data": event["data"], "created_at": event["created_at"]},
+                      separators=(",", ":"), default=str)
+    return f"event: {event['kind']}\ndata: {data}\n\n"
+
+
+def format_horizon(horizon: int) -> str:
+    """An SSE message without data: it only sets the client's ``Last-Event-ID``."""
+    return f"id: {horizon}\n\n"
+
+
+class RecentIds:
+    """The last ``size`` ids added, for dropping duplicates."""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._ids: "OrderedDict[int, None]" = OrderedDict()
+
+    def add(self, event_id: int) -> bool:
+        """Remember ``event_id``; False when it was already there."""
+        if event_id in self._ids:
+            return False
+        self._ids[event_id] = None
+        if len(self._ids) > self.size:
+            self._ids.popitem(last=False)
+        return True
+
+
+RESYNC = "event: resync\ndata: {}\n\n"
+KEEPALIVE = ": keepalive\n\n"
+
+
+class Subscription:
+    """One SSE client: a bounded queue filled by the hub and drained by its stream."""
+
+    def __init__(self, pharmacy_id: int, last_event_id: Optional[int] = None,
+                 kinds: Optional[Iterable[str]] = None) -> None:
+        self.pharmacy_id = pharmacy_id
+        # Transaction horizon the client has every event below (its Last-Event-ID)
+        self.horizon = int(last_event_id or 0)
+        self.resume = last_event_id is not None
+        self.kinds: Optional[Set[str]] = set(kinds) if kinds else None
+        self.queue: Deque[Dict[str, Any]] = deque()
+        self.sent = RecentIds(SENT_MEMORY)
+        self.ready = threading.Event()
+        self.overflowed = False
+
+    def push(self, event: Dict[str, Any]) -> None:
+        if self.kinds is not None and event["kind"] not in self.kinds:
+            return
+        if len(self.queue) >= QUEUE_SIZE:
+            self.overflowed = True
+            self.queue.clear()
+        else:
+            self.queue.append(event)
+        self.ready.set()
+
+
+class LiveEventHub:
+    """Per-process fan-out of ``live_events`` notifications to SSE subscribers."""
+
+    def __init__(self, engine: Optional[Engine], listen: bool = True) -> None:
+        self.engine = engine
+        self.listen = listen and engine is not None
+        # Every event of a transaction below this id has been dispatched; None until the first sweep
+        self.horizon: Optional[int] = None
+        self._dispatched = RecentIds(DISPATCHED_MEMORY)
+        self._swept_at = 0.0
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._pruned_at = 0.0
+
+    # -- subscribers ---------------------------------------------------------
+
+    def subscribe(self, pharmacy_id: int, last_event_id: Optional[int] = None,
+                  kinds: Optional[Iterable[str]] = None) -> Subscription:
+        """Register a subscriber; events from now on are queued for it even before its stream starts."""
+        sub = Subscription(pharmacy_id, last_event_id, kinds)
+        with self._lock:
+            self._subscribers.setdefault(pharmacy_id, set()).add(sub)
+        self._ensure_listener()
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subscribers.get(sub.pharmacy_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.pharmacy_id]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+    def dispatch(self, event: Dict[str, Any]) -> int:
+        """Queue ``event`` for its pharmacy's subscribers; returns how many there were."""
+        event["sse"] = format_sse(event)  # serialized once for every subscriber
+        with self._lock:
+            subs = list(self._subscribers.get(event["pharmacy_id"], ()))
+        for sub in subs:
+            sub.push(event)
+        return len(subs)
+
+    def replay(self, sub: Subscription) -> Optional[List[Dict[str, Any]]]:
+        """Events of the pharmacy's transactions from the subscriber's horizon on, or None when it must resync."""
+        if not sub.resume or self.engine is None:
+            return []
+        with self.engine.connect() as conn:
+            snapshot = conn.execute(text("""
+                SELECT txid_snapshot_xmax(txid_current_snapshot()) AS xmax, (SELECT min(txid) FROM live_events) AS oldest
+            """)).mappings().one()
+            if sub.horizon > int(snapshot["xmax"]):
+                # A horizon this database never issued (restored database, old event id)
+                return None
+            rows = conn.execute(text(f"""
+                SELECT {_EVENT_COLUMNS} FROM live_events
+                WHERE pharmacy_id = :ph AND txid >= :horizon
+                ORDER BY id
+                LIMIT :limit
+            """), {"ph": sub.pharmacy_id, "horizon": sub.horizon, "limit": REPLAY_LIMIT + 1}).mappings().all()
+        oldest = snapshot["oldest"]
+        if len(rows) > REPLAY_LIMIT or (oldest is not None and int(oldest) > sub.horizon):
+            return None
+        return [_event(r) for r in rows if sub.kinds is None or r["kind"] in sub.kinds]
+
+    def stream(self, sub: Subscription) -> Iterator[str]:
+        """SSE text for ``sub``: the replay, then live events, horizons and keepalives until the client leaves."""
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            replayed = self.replay(sub)
+            if replayed is None:
+                yield RESYNC
+            else:
+                for event in replayed:
+                    sub.sent.add(event["id"])
+                    yield format_sse(event)
+            while not self._stop.is_set():
+                # Read before draining: the sweep queues its events before it moves the horizon
+                horizon = self.horizon
+                sub.ready.clear()
+                if sub.overflowed:
+                    sub.overflowed = False
+                    yield RESYNC
+                while sub.queue:
+                    event = sub.queue.popleft()
+                    # Events replayed above may also have been queued while the replay ran
+                    if sub.sent.add(event["id"]):
+                        yield event["sse"]
+                if horizon is not None and horizon > sub.horizon:
+                    sub.horizon = horizon
+                    yield format_horizon(horizon)
+                if not sub.ready.wait(HEARTBEAT_SECONDS):
+                    yield KEEPALIVE
+        finally:
+            self.unsubscribe(sub)
+
+    # -- listener ------------------------------------------------------------
+
+    def _ensure_listener(self) -> None:
+        if not self.listen or (self._listener is not None and self._listener.is_alive()):
+            return
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._stop.clear()
+            self._listener = threading.Thread(target=self._listen_forever, name="live-events-listener", daemon=True)
+            self._listener.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _listen_forever(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._listen_once()
+            except Exception as e:
+                print(f"[live_events] Listener error, reconnecting in {RECONNECT_DELAY}s: {e}")
+                self._stop.wait(RECONNECT_DELAY)
+
+    def _listen_once(self) -> None:
+        import psycopg
+
+        dsn = self.engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        with psycopg.connect(dsn, autocommit=True) as conn:
+            conn.execute(f"LISTEN {CHANNEL}")
+            # Delivers what was committed while no connection was listening
+            self._sweep()
+            while not self._stop.is_set():
+                try:
+                    notifies: Iterable[Any] = conn.notifies(timeout=LISTEN_TIMEOUT)
+                except TypeError:  # psycopg < 3.2: notifies() has no timeout
+                    notifies = self._poll_notifies(conn)
+                for notify in notifies:
+                    self._handle(notify.payload)
+                    self._maybe_sweep()
+                    if self._stop.is_set():
+                        break
+                self._maybe_sweep()
+                self._maybe_prune()
+
+    @staticmethod
+    def _poll_notifies(conn: Any) -> List[Any]:
+        """Notifications that arrive within :data:`LISTEN_TIMEOUT`, for psycopg < 3.2."""
+        received: List[Any] = []
+        handler = received.append
+        conn.add_notify_handler(handler)
+        try:
+            select.select([conn.fileno()], [], [], LISTEN_TIMEOUT)
+            conn.execute("SELECT 1")  # reads what arrived and runs the handler
+        finally:
+            conn.remove_notify_handler(handler)
+        return received
+
+    def _handle(self, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if "kind" in message:
+            events = [_event(message)]
+        else:
+            events = self._fetch([int(message["id"])])
+        for event in events:
+            if self._dispatched.add(event["id"]):
+                self.dispatch(event)
+
+    def _fetch(self, ids: List[int]) -> List[Dict[str, Any]]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT {_EVENT_COLUMNS} FROM live_events WHERE id = ANY(CAST(:ids AS bigint[])) ORDER BY id
+            """), {"ids": ids}).mappings().all()
+        return [_event(r) for r in rows]
+
+    def _maybe_sweep(self) -> None:
+        if time.monotonic() - self._swept_at >= SWEEP_INTERVAL:
+            self._sweep()
+
+    def _sweep(self) -> None:
+        """Dispatch committed events of transactions at or above the horizon that no notification
+        delivered, then move the horizon to the oldest transaction still in flight."""
+        self._swept_at = time.monotonic()
+        with self.engine.connect() as conn:
+            # Every transaction below xmin has finished, so its events are all visible below
+            xmin = int(conn.execute(text("SELECT txid_snapshot_xmin(txid_current_snapshot())")).scalar())
+            if self.horizon is None:
+                self.horizon = xmin
+                return
+            after_txid, after_id = self.horizon, 0
+            while True:
+                rows = conn.execute(text(f"""
+                    SELECT {_EVENT_COLUMNS}, txid FROM live_events
+                    WHERE (txid, id) > (:txid, :id)
+                    ORDER BY txid, id
+                    LIMIT :limit
+                """), {"txid": after_txid, "id": after_id, "limit": SWEEP_PAGE}).mappings().all()
+                for row in rows:
+                    event = _event(row)
+                    if self._dispatched.add(event["id"]):
+                        self.dispatch(event)
+                if len(rows) < SWEEP_PAGE:
+                    break
+                after_txid, after_id = int(rows[-1]["txid"]), int(rows[-1]["id"])
+        self.horizon = max(self.horizon, xmin)
+
+    def _maybe_prune(self) -> None:
+        now = time.monotonic()
+        if now - self._pruned_at < PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("""
+                    DELETE FROM live_events WHERE created_at < now() - make_interval(hours => CAST(:h AS int))
+                """), {"h": RETENTION_HOURS})
+        except Exception as e:
+            print(f"[live_events] Prune failed: {e}")
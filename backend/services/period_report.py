@@ -0,0 +1,156 @@
+"""
+Sales period report in a single statement.
+
+:func:`period_report` buckets a staff member's completed sales by day, week,
+month or quarter with ``date_trunc`` and returns, from one query:
+
+* per-period totals plus the report total, from one aggregate over
+  ``GROUPING SETS ((), (period), (period, product))``;
+* the same figures for the preceding period of the same grain, so every
+  period carries its comparison;
+* the top ``top_k`` medicines of every period by revenue, picked with
+  ``row_number()`` over the per-product grouping set;
+* the sale line items of every period, aggregated as JSON.
+
+Every grain uses the same statement; only the ``date_trunc`` field and the
+step to the preceding period are bound.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+# grain -> (date_trunc field, step back to the preceding period, display format)
+PERIOD_GRAINS = {
+    "day": ("day", "1 day", "YYYY-MM-DD"),
+    "week": ("week", "1 week", "YYYY-MM-DD (Week)"),
+    "month": ("month", "1 month", "YYYY-MM"),
+    "quarter": ("quarter", "3 months", "YYYY-Q"),
+}
+
+DEFAULT_TOP_K = 5
+
+_PERIOD_REPORT_SQL = """
+    WITH lines AS (
+        SELECT date_trunc(CAST(:grain AS text), s.created_at)::date AS period_date,
+               s.id AS sale_id, s.sale_number, s.created_at AS sale_time, s.total_amount,
+               row_number() OVER (PARTITION BY s.id ORDER BY si.id) = 1 AS first_line,
+               si.id AS item_id, si.product_id, si.quantity, si.unit_price, si.total_price,
+               p.name AS product_name, pc.name AS category_name
+        FROM sales s
+        LEFT JOIN sale_items si ON si.sale_id = s.id
+        LEFT JOIN products p ON p.id = si.product_id
+        LEFT JOIN product_categories pc ON pc.id = p.category_id
+        WHERE s.pharmacy_id = :ph
+          AND s.status = 'completed'
+          AND s.user_id = :staff_id
+          AND (CAST(:date_from AS timestamptz) IS NULL OR s.created_at >= CAST(:date_from AS timestamptz))
+          AND (CAST(:date_to AS timestamptz) IS NULL OR s.created_at <= CAST(:date_to AS timestamptz))
+    ), agg AS (
+        SELECT period_date, product_id,
+               GROUPING(period_date) AS all_periods,
+               GROUPING(product_id) AS all_products,
+               count(DISTINCT sale_id) AS total_sales,
+               sum(total_price) AS period_revenue,
+               avg(total_amount) FILTER (WHERE first_line) AS avg_sale_amount,
+               count(item_id) AS total_items_sold,
+               sum(quantity) AS total_quantity,
+               max(product_name) AS product_name,
+               max(category_name) AS category_name
+        FROM lines
+        GROUP BY GROUPING SETS ((), (period_date), (period_date, product_id))
+    ), totals AS (
+        SELECT * FROM agg WHERE all_periods = 0 AND all_products = 1
+    ), top_medicines AS (
+        SELECT period_date,
+               jsonb_agg(jsonb_build_object(
+                   'rank', rank, 'product_id', product_id, 'product_name', product_name,
+                   'category_name', category_name, 'quantity', total_quantity, 'revenue', period_revenue
+               ) ORDER BY rank) AS top_medicines
+        FROM (
+            SELECT a.*, row_number() OVER (
+                PARTITION BY a.period_date ORDER BY a.period_revenue DESC NULLS LAST, a.total_quantity DESC, a.product_id
+            ) AS rank
+            FROM agg a
+            WHERE a.all_products = 0 AND a.product_id IS NOT NULL
+        ) ranked
+        WHERE rank <= :top_k
+        GROUP BY period_date
+    ), details AS (
+        SELECT period_date,
+               array_agg(DISTINCT sale_id ORDER BY sale_id) AS sale_ids,
+               array_agg(DISTINCT sale_number ORDER BY sale_number) AS sale_numbers,
+               array_agg(DISTINCT sale_time ORDER BY sale_time) AS sale_times,
+               COALESCE(jsonb_agg(jsonb_build_object(
+                   'sale_id', sale_id, 'sale_number', sale_number, 'sale_time', sale_time,
+                   'quantity', quantity, 'unit_price', unit_price, 'total_price', total_price,
+                   'product_name', product_name, 'product_id', product_id, 'category_name', category_name
+               ) ORDER BY sale_time, product_name) FILTER (WHERE item_id IS NOT NULL), '[]'::jsonb) AS medicines
+        FROM lines
+        GROUP BY period_date
+    )
+    SELECT t.period_date, false AS is_total,
+           t.total_sales, t.period_revenue, t.avg_sale_amount, t.total_items_sold, t.total_quantity,
+           prev.total_sales AS previous_total_sales, prev.period_revenue AS previous_revenue,
+           d.sale_ids, d.sale_numbers, d.sale_times, d.medicines,
+           COALESCE(tm.top_medicines, '[]'::jsonb) AS top_medicines
+    FROM totals t
+    LEFT JOIN totals prev ON prev.period_date = (t.period_date - CAST(:step AS interval))::date
+    LEFT JOIN details d ON d.period_date = t.period_date
+    LEFT JOIN top_medicines tm ON tm.period_date = t.period_date
+    UNION ALL
+    SELECT NULL, true, total_sales, period_revenue, avg_sale_amount, total_items_sold, total_quantity,
+           NULL, NULL, NULL, NULL, NULL, NULL, NULL
+    FROM agg WHERE all_periods = 1
+    ORDER BY is_total, period_date DESC
+"""
+
+
+def _change(current: Any, previous: Any) -> Dict[str, Optional[float]]:
+    if previous is None:
+        return {"revenue_change": None, "revenue_change_pct": None}
+    current, previous = float(current or 0), float(previous or 0)
+    pct = round((current - previous) / previous * 100, 2) if previous else None
+    return {"revenue_change": round(current - previous, 2), "revenue_change_pct": pct}
+
+
+def period_report(conn: Connection, pharmacy_id: int, staff_id: int, grain: str = "day",
+                  date_from: Any = None, date_to: Any = None, top_k: int = DEFAULT_TOP_K) -> Dict[str, Any]:
+    """Periods (newest first) with summary, comparison, top medicines and line items, plus report totals."""
+    field, step, _ = PERIOD_GRAINS[grain]
+    rows = conn.execute(text(_PERIOD_REPORT_SQL), {
+        "grain": field, "step": step, "ph": pharmacy_id, "staff_id": int(staff_id),
+        "date_from": date_from or None, "date_to": date_to or None, "top_k": max(1, int(top_k)),
+    }).mappings().all()
+    periods: List[Dict[str, Any]] = []
+    totals: Dict[str, Any] = {}
+    for row in rows:
+        summary = {
+            "total_sales": row["total_sales"],
+            "period_revenue": row["period_revenue"],
+            "avg_sale_amount": row["avg_sale_amount"],
+            "total_items_sold": row["total_items_sold"] or 0,
+            "total_quantity": row["total_quantity"] or 0,
+        }
+        if row["is_total"]:
+            totals = summary
+            continue
+        summary.update({
+            "period_date": row["period_date"],
+            "sale_ids": row["sale_ids"] or [],
+            "sale_numbers": row["sale_numbers"] or [],
+            "sale_times": row["sale_times"] or [],
+            "previous_total_sales": row["previous_total_sales"],
+            "previous_revenue": row["previous_revenue"],
+            **_change(row["period_revenue"], row["previous_revenue"]),
+        })
+        periods.append({
+            "period_date": row["period_date"],
+            "period_summary": summary,
+            "top_medicines": row["top_medicines"],
+            "medicines": row["medicines"] or [],
+        })
+    return {"periods": periods, "totals": totals}
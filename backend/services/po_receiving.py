@@ -0,0 +1,338 @@
+"""
+Set-based purchase order receiving.
+
+:func:`receive_purchase_order` books a delivery against a purchase order in
+one transaction and a fixed number of statements, however many lines the
+delivery has:
+
+1. the purchase order row is locked (``FOR UPDATE``), so two receipts of the
+   same order run one after the other;
+2. the order's items are read once, and each delivered line is matched to an
+   item and checked against its outstanding quantity
+   (``quantity - received_quantity``);
+3. one multi-row ``INSERT ... SELECT FROM unnest(...)`` creates a batch per
+   line, with the line's expiry and unit cost and the order's supplier;
+4. one ``UPDATE ... FROM unnest(...)`` raises ``received_quantity`` of the
+   items, and :func:`services.pos_sales.refresh_inventory_stock` recomputes
+   ``inventory.current_stock`` of all received products in one statement;
+5. approved stock requests covered by the received quantities are marked
+   delivered with one statement, and the order becomes ``received`` or
+   ``partially_received``.
+
+Receiving is idempotent in two ways. Quantities are capped by what is still
+outstanding, so receiving a fully received order again adds nothing. A
+client ``receipt_key`` identifies one delivery, so retrying a partial receipt
+returns the stored result instead of booking it twice.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .pos_sales import refresh_inventory_stock
+
+MAX_KEY_LENGTH = 200
+
+
+class ReceivingError(ValueError):
+    """The receipt payload is malformed."""
+
+
+class PurchaseOrderNotFound(LookupError):
+    """The purchase order does not exist in the pharmacy."""
+
+
+class PurchaseOrderCancelled(ValueError):
+    """The purchase order was cancelled and cannot be received."""
+
+
+class ReceivingQuantityError(ValueError):
+    """A line asks for more than its item has outstanding."""
+
+    def __init__(self, conflicts: List[Dict[str, Any]]) -> None:
+        super().__init__("Received quantity exceeds the outstanding quantity")
+        self.conflicts = conflicts
+
+
+@dataclass
+class ReceiptLine:
+    item_id: Optional[int] = None
+    product_id: Optional[int] = None
+    quantity: Optional[int] = None  # None receives everything outstanding
+    expiration_date: Optional[date] = None
+    unit_cost: Optional[float] = None
+    batch_number: Optional[str] = None
+
+
+def _parse_date(value: Any, label: str) -> Optional[date]:
+    if value in (None, ""):
+        return None
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        raise ReceivingError(f"{label} must be a date (YYYY-MM-DD)")
+
+
+def parse_receipt_lines(raw: Any) -> List[ReceiptLine]:
+    if not isinstance(raw, list) or not raw:
+        raise ReceivingError("lines must be a non-empty list")
+    lines = []
+    for entry in raw:
+        if not isinstance(entry, dict):
+            raise ReceivingError("Each line must be an object")
+        try:
+            line = ReceiptLine(
+                item_id=int(entry["item_id"]) if entry.get("item_id") is not None else None,
+                product_id=int(entry["product_id"]) if entry.get("product_id") is not None else None,
+                quantity=int(entry["quantity"]) if entry.get("quantity") is not None else None,
+                unit_cost=float(entry["unit_cost"]) if entry.get("unit_cost") is not None else None,
+                batch_number=str(entry.get("batch_number") or "").strip() or None,
+            )
+        except (TypeError, ValueError):
+            raise ReceivingError("item_id, product_id and quantity must be integers and unit_cost a number")
+        if line.item_id is None and line.product_id is None:
+            raise ReceivingError("Each line needs item_id or product_id")
+        if line.quantity is not None and line.quantity <= 0:
+            raise ReceivingError("quantity must be positive")
+        if line.unit_cost is not None and line.unit_cost < 0:
+            raise ReceivingError("unit_cost cannot be negative")
+        line.expiration_date = _parse_date(entry.get("expiration_date"), "expiration_date")
+        lines.append(line)
+    return lines
+
+
+def apply_item_edits(conn: Connection, po_id: int, items: Sequence[Dict[str, Any]]) -> bool:
+    """
+    Set item quantities of an order from ``[{product_id, quantity, unit_cost?}]``:
+    existing products keep their unit cost, new ones are added. Two statements.
+    """
+    edits: Dict[int, Tuple[int, float]] = {}
+    for item in items:
+        try:
+            product_id, quantity = int(item.get("product_id") or 0), int(item.get("quantity") or 0)
+            unit_cost = float(item.get("unit_cost") or 0)
+        except (TypeError, ValueError):
+            continue
+        if product_id and quantity > 0:
+            edits[product_id] = (quantity, unit_cost)
+    if not edits:
+        return False
+    params = {
+        "po": po_id,
+        "pids": list(edits),
+        "qtys": [q for q, _ in edits.values()],
+        "costs": [c for _, c in edits.values()],
+    }
+    conn.execute(text("""
+        UPDATE purchase_order_items i
+        SET quantity = u.quantity, total_cost = u.quantity * i.unit_cost
+        FROM unnest(CAST(:pids AS bigint[]), CAST(:qtys AS int[])) AS u(product_id, quantity)
+        WHERE i.po_id = :po AND i.product_id = u.product_id
+    """), params)
+    conn.execute(text("""
+        INSERT INTO purchase_order_items (po_id, product_id, quantity, unit_cost, total_cost)
+        SELECT :po, u.product_id, u.quantity, u.unit_cost, u.quantity * u.unit_cost
+        FROM unnest(CAST(:pids AS bigint[]), CAST(:qtys AS int[]), CAST(:costs AS numeric[]))
+            AS u(product_id, quantity, unit_cost)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM purchase_order_items i WHERE i.po_id = :po AND i.product_id = u.product_id
+        )
+    """), params)
+    return True
+
+
+def _plan(items: Sequence[Dict[str, Any]], lines: Optional[Sequence[ReceiptLine]]
+          ) -> Tuple[List[Tuple[Dict[str, Any], ReceiptLine, int]], List[Dict[str, Any]]]:
+    """Match lines to items; returns ``([(item, line, quantity)], conflicts)``."""
+    outstanding = {item["id"]: max(int(item["quantity"]) - int(item["received_quantity"]), 0) for item in items}
+    if lines is None:
+        return [(item, ReceiptLine(item_id=item["id"]), outstanding[item["id"]])
+                for item in items if outstanding[item["id"]] > 0], []
+
+    by_id = {item["id"]: item for item in items}
+    planned, conflicts = [], []
+    for line in lines:
+        if line.item_id is not None:
+            candidates = [by_id[line.item_id]] if line.item_id in by_id else []
+        else:
+            candidates = [item for item in items if item["product_id"] == line.product_id]
+        if not candidates:
+            conflicts.append({"item_id": line.item_id, "product_id": line.product_id, "error": "Not on this purchase order"})
+            continue
+        # A product listed on several items is received into them in item order
+        wanted = line.quantity if line.quantity is not None else sum(outstanding[c["id"]] for c in candidates)
+        available = sum(outstanding[c["id"]] for c in candidates)
+        if wanted > available:
+            conflicts.append({
+                "item_id": line.item_id, "product_id": candidates[0]["product_id"],
+                "requested": wanted, "outstanding": available,
+            })
+            continue
+        for item in candidates:
+            qty = min(wanted, outstanding[item["id"]])
+            if qty <= 0:
+                continue
+            outstanding[item["id"]] -= qty
+            wanted -= qty
+            planned.append((item, line, qty))
+    return planned, conflicts
+
+
+def receive_purchase_order(conn: Connection, pharmacy_id: int, po_id: int, user_id: Any,
+                           lines: Optional[Sequence[ReceiptLine]] = None,
+                           default_expiration: Optional[date] = None,
+                           receipt_key: Optional[str] = None) -> Dict[str, Any]:
+    """Book a delivery inside the caller's transaction; see the module docstring."""
+    po = conn.execute(text("""
+        SELECT id, po_number, supplier_id, status
+        FROM purchase_orders
+        WHERE id = :id AND pharmacy_id = :ph
+        FOR UPDATE
+    """), {"id": po_id, "ph": pharmacy_id}).mappings().first()
+    if not po:
+        raise PurchaseOrderNotFound("Purchase order not found")
+    if po["status"] == "cancelled":
+        raise PurchaseOrderCancelled("A cancelled purchase order cannot be received")
+
+    receipt_key = (receipt_key or "").strip()[:MAX_KEY_LENGTH] or None
+    if receipt_key:
+        stored = conn.execute(text("""
+            SELECT result FROM purchase_order_receipts WHERE po_id = :po AND receipt_key = :key
+        """), {"po": po_id, "key": receipt_key}).scalar()
+        if stored is not None:
+            return {**stored, "replayed": True}
+
+    items = conn.execute(text("""
+        SELECT id, product_id, quantity, COALESCE(received_quantity, 0) AS received_quantity,
+               unit_cost, expiration_date
+        FROM purchase_order_items
+        WHERE po_id = :po
+        ORDER BY id
+    """), {"po": po_id}).mappings().all()
+    planned, conflicts = _plan(items, lines)
+    if conflicts:
+        raise ReceivingQuantityError(conflicts)
+
+    result: Dict[str, Any] = {"po_id": po_id, "receipt_id": None, "lines": 0, "units": 0, "batches": []}
+    if planned:
+        receipt_id = conn.execute(text("""
+            INSERT INTO purchase_order_receipts (po_id, receipt_key, received_by)
+            VALUES (:po, :key, CAST(:uid AS bigint))
+            RETURNING id
+        """), {"po": po_id, "key": receipt_key, "uid": user_id}).scalar()
+        result["receipt_id"] = receipt_id
+
+        # One batch per (product, batch number); same-lot lines are summed so the upsert touches each row once
+        batches: Dict[Tuple[int, str], Dict[str, Any]] = {}
+        for item, line, qty in planned:
+            number = line.batch_number or f"{po['po_number']}-R{receipt_id}-{item['id']}"
+            batch = batches.setdefault((item["product_id"], number), {
+                "product_id": item["product_id"], "batch_number": number, "quantity": 0,
+                "expiration_date": line.expiration_date or item["expiration_date"] or default_expiration,
+                "cost": line.unit_cost if line.unit_cost is not None else float(item["unit_cost"] or 0),
+            })
+            batch["quantity"] += qty
+        rows = list(batches.values())
+        created = conn.execute(text("""
+            INSERT INTO inventory_batches
+                (product_id, batch_number, quantity, expiration_date, delivery_date, supplier_id, cost_price)
+            SELECT u.product_id, u.batch_number, u.quantity, u.expiration_date, CURRENT_DATE, :supplier, u.cost
+            FROM unnest(CAST(:pids AS bigint[]), CAST(:numbers AS text[]), CAST(:qtys AS int[]),
+                        CAST(:exps AS date[]), CAST(:costs AS numeric[]))
+                AS u(product_id, batch_number, quantity, expiration_date, cost)
+            ON CONFLICT (product_id, batch_number) DO UPDATE
+            SET quantity = inventory_batches.quantity + excluded.quantity
+            RETURNING id, product_id, batch_number
+        """), {
+            "supplier": po["supplier_id"],
+            "pids": [r["product_id"] for r in rows],
+            "numbers": [r["batch_number"] for r in rows],
+            "qtys": [r["quantity"] for r in rows],
+            "exps": [r["expiration_date"] for r in rows],
+            "costs": [r["cost"] for r in rows],
+        }).mappings().all()
+        batch_ids = {(row["product_id"], row["batch_number"]): row["id"] for row in created}
+
+        received: Dict[int, int] = {}
+        per_item: Dict[int, Tuple[int, Optional[date]]] = {}
+        for item, line, qty in planned:
+            prev_qty, prev_exp = per_item.get(item["id"], (0, None))
+            per_item[item["id"]] = (prev_qty + qty, line.expiration_date or prev_exp)
+            received[item["product_id"]] = received.get(item["product_id"], 0) + qty
+        conn.execute(text("""
+            UPDATE purchase_order_items i
+            SET received_quantity = COALESCE(i.received_quantity, 0) + u.quantity,
+                expiration_date = COALESCE(u.expiration_date, i.expiration_date)
+            FROM unnest(CAST(:ids AS bigint[]), CAST(:qtys AS int[]), CAST(:exps AS date[]))
+                AS u(id, quantity, expiration_date)
+            WHERE i.id = u.id
+        """), {
+            "ids": list(per_item),
+            "qtys": [q for q, _ in per_item.values()],
+            "exps": [e for _, e in per_item.values()],
+        })
+
+        refresh_inventory_stock(conn, received)
+        _deliver_requests(conn, pharmacy_id, received)
+
+        result.update({
+            "lines": len(per_item),
+            "units": sum(received.values()),
+            "batches": [
+                {"batch_id": batch_ids.get((r["product_id"], r["batch_number"])), "product_id": r["product_id"],
+                 "batch_number": r["batch_number"], "quantity": r["quantity"],
+                 "expiration_date": r["expiration_date"].isoformat() if r["expiration_date"] else None}
+                for r in rows
+            ],
+        })
+
+    complete = conn.execute(text("""
+        SELECT COALESCE(bool_and(COALESCE(received_quantity, 0) >= quantity), true)
+        FROM purchase_order_items WHERE po_id = :po
+    """), {"po": po_id}).scalar()
+    result["status"] = "received" if complete else "partially_received"
+    conn.execute(text("""
+        UPDATE purchase_orders
+        SET status = :status, updated_at = now(), updated_by = CAST(:uid AS bigint)
+        WHERE id = :po
+    """), {"status": result["status"], "uid": user_id, "po": po_id})
+
+    if result["receipt_id"] is not None:
+        conn.execute(text("""
+            UPDATE purchase_order_receipts
+            SET lines = :lines, units = :units, result = CAST(:result AS jsonb)
+            WHERE id = :id
+        """), {"lines": result["lines"], "units": result["units"], "id": result["receipt_id"],
+               "result": json.dumps(result, default=str)})
+    return {**result, "replayed": False}
+
+
+def _deliver_requests(conn: Connection, pharmacy_id: int, received: Dict[int, int]) -> None:
+    """
+    Mark approved restock requests delivered, oldest first per product, while
+    the received quantity covers them in full (the first one that does not fit
+    stops that product).
+    """
+    pids = sorted(received)
+    conn.execute(text("""
+        UPDATE inventory_adjustment_requests r
+        SET status = 'delivered', decided_at = now()
+        FROM (
+            SELECT q.id, q.product_id,
+                   SUM(q.quantity_change) OVER (PARTITION BY q.product_id ORDER BY q.created_at, q.id) AS covered
+            FROM inventory_adjustment_requests q
+            WHERE q.product_id = ANY(:pids) AND q.pharmacy_id = :ph
+              AND q.status = 'approved' AND q.quantity_change > 0
+        ) c
+        JOIN unnest(CAST(:pids AS bigint[]), CAST(:qtys AS int[])) AS u(product_id, quantity)
+            ON u.product_id = c.product_id
+        WHERE r.id = c.id AND c.covered <= u.quantity
+    """), {"pids": pids, "qtys": [received[p] for p in pids], "ph": pharmacy_id})
@@ -0,0 +1,318 @@
+"""
+Versioned POS catalog and its delta feed.
+
+Every pharmacy has a catalog version in ``pos_catalog_versions``. Triggers
+installed by ``ensure_pos_catalog_versioning`` bump it whenever a product's
+POS-visible fields or any of its batches change, and stamp the product in
+``pos_catalog_product_versions`` with the new version. The bump happens when
+the writing transaction commits, so a version never becomes visible before
+the changes it covers, and concurrent checkouts do not queue on the version
+row for the length of their transactions. A terminal that last
+synced at version ``N`` therefore only needs the products stamped above ``N``:
+:func:`catalog_changes` returns those rows (or their ids, for products that
+were deleted or deactivated) instead of the whole catalog.
+
+Stock also changes without a write when a batch passes its expiration date.
+:func:`roll_over_expiry` stamps those products once per pharmacy per day,
+lazily, the first time the catalog is read that day.
+
+Rows are compact: a ``fields`` header and one list per product.
+
+:data:`catalog_feed` serves the full catalog as a precomputed payload per
+(pharmacy, version, field projection): the JSON body is built and compressed
+(gzip, and brotli when installed) once, then reused until the version moves.
+Its strong ETag is derived from those three values, so a terminal whose copy
+is current gets a 304 without any query once the version has been looked up
+(the current version is cached for ``POS_CATALOG_VERSION_TTL`` seconds).
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from utils.fast_json import accepted_encodings, dumps_bytes
+
+try:  # optional: brotli is served to clients that accept it, gzip otherwise
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+CATALOG_VERSION_TTL = float(os.getenv("POS_CATALOG_VERSION_TTL", "2"))
+CATALOG_CACHE_SIZE = int(os.getenv("POS_CATALOG_CACHE_SIZE", "64"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 6
+
+CATALOG_FIELDS = (
+    "id", "name", "unit_price", "cost_price", "category_name", "current_stock",
+    "location", "reorder_point", "preferred_supplier_id",
+)
+
+_CATALOG_SELECT = """
+    SELECT
+        p.id, p.name, p.unit_price, p.cost_price,
+        pc.name AS category_name,
+        COALESCE((
+            SELECT SUM(b.quantity - COALESCE(b.sold_quantity, 0) - COALESCE(b.disposed_quantity, 0))
+            FROM inventory_batches b
+            WHERE b.product_id = p.id
+              AND (b.expiration_date IS NULL OR b.expiration_date > CURRENT_DATE)
+        ), 0) AS current_stock,
+        p.location,
+        COALESCE(p.reorder_point, 0) AS reorder_point,
+        p.preferred_supplier_id
+    FROM products p
+    LEFT JOIN product_categories pc ON p.category_id = pc.id
+"""
+
+
+def _compact(value: Any) -> Any:
+    # Numeric columns come back as Decimal; the feed ships plain JSON numbers
+    if value is not None and not isinstance(value, (int, float, str, bool)):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return str(value)
+    return value
+
+
+def _rows(rows: Sequence[Any], fields: Sequence[str]) -> List[List[Any]]:
+    return [[_compact(row[f]) for f in fields] for row in rows]
+
+
+def roll_over_expiry(conn: Connection, pharmacy_id: int) -> None:
+    """Stamp products whose batches expired since the pharmacy's last rollover."""
+    state = conn.execute(text("""
+        SELECT rolled_over_on < CURRENT_DATE AS due FROM pos_catalog_versions WHERE pharmacy_id = :ph
+    """), {"ph": pharmacy_id}).first()
+    if state is None or not state.due:
+        return
+    last = conn.execute(text("""
+        SELECT rolled_over_on FROM pos_catalog_versions
+        WHERE pharmacy_id = :ph AND rolled_over_on < CURRENT_DATE
+        FOR UPDATE
+    """), {"ph": pharmacy_id}).scalar()
+    if last is None:
+        return  # another request rolled over first
+    # A batch expired on day D when expiration_date <= D (stock counts expiration_date > CURRENT_DATE)
+    conn.execute(text("""
+        SELECT pos_catalog_touch(array_agg(p.pharmacy_id), array_agg(p.id))
+        FROM products p
+        WHERE p.pharmacy_id = :ph
+          AND EXISTS (
+              SELECT 1 FROM inventory_batches b
+              WHERE b.product_id = p.id AND b.expiration_date > :last AND b.expiration_date <= CURRENT_DATE
+          )
+    """), {"ph": pharmacy_id, "last": last})
+    conn.execute(text("""
+        UPDATE pos_catalog_versions SET rolled_over_on = CURRENT_DATE WHERE pharmacy_id = :ph
+    """), {"ph": pharmacy_id})
+
+
+def catalog_version(conn: Connection, pharmacy_id: int) -> int:
+    """Current catalog version of the pharmacy (0 before anything was versioned)."""
+    version = conn.execute(
+        text("SELECT version FROM pos_catalog_versions WHERE pharmacy_id = :ph"), {"ph": pharmacy_id}
+    ).scalar()
+    return int(version or 0)
+
+
+def full_catalog(conn: Connection, pharmacy_id: int, fields: Sequence[str] = CATALOG_FIELDS) -> Dict[str, Any]:
+    """Every active product of the pharmacy, compact, with the version it reflects."""
+    roll_over_expiry(conn, pharmacy_id)
+    # Read the version first: anything committed after it is picked up by the next delta
+    version = catalog_version(conn, pharmacy_id)
+    rows = conn.execute(text(_CATALOG_SELECT + """
+        WHERE p.pharmacy_id = :ph AND p.is_active = true
+        ORDER BY p.id
+    """), {"ph": pharmacy_id}).mappings().all()
+    return {"version": version, "full": True, "fields": list(fields), "products": _rows(rows, fields), "removed": []}
+
+
+def catalog_changes(conn: Connection, pharmacy_id: int, since: int,
+                    fields: Sequence[str] = CATALOG_FIELDS) -> Dict[str, Any]:
+    """
+    Products changed after version ``since``: current rows of those still
+    active in ``products`` and the ids of those removed or deactivated.
+    ``since`` <= 0 returns the full catalog.
+    """
+    if since <= 0:
+        return full_catalog(conn, pharmacy_id, fields)
+    roll_over_expiry(conn, pharmacy_id)
+    version = catalog_version(conn, pharmacy_id)
+    if since > version:
+        # A version this pharmacy never issued (reset database, wrong tenant): start over
+        return full_catalog(conn, pharmacy_id, fields)
+    if since == version:
+        return {"version": version, "full": False, "fields": list(fields), "products": [], "removed": []}
+
+    changed = conn.execute(text("""
+        SELECT product_id FROM pos_catalog_product_versions
+        WHERE pharmacy_id = :ph AND version > :since AND version <= :version
+    """), {"ph": pharmacy_id, "since": since, "version": version}).scalars().all()
+    rows = []
+    if changed:
+        rows = conn.execute(text(_CATALOG_SELECT + """
+            WHERE p.id = ANY(:ids) AND p.pharmacy_id = :ph AND p.is_active = true
+            ORDER BY p.id
+        """), {"ids": list(changed), "ph": pharmacy_id}).mappings().all()
+    present = {row["id"] for row in rows}
+    return {
+        "version": version,
+        "full": False,
+        "fields": list(fields),
+        "products": _rows(rows, fields),
+        "removed": sorted(pid for pid in changed if pid not in present),
+    }
+
+
+def parse_fields(raw: Optional[str]) -> Tuple[str, ...]:
+    """Validate a comma separated ``fields`` projection; ``id`` is always included."""
+    if not raw:
+        return CATALOG_FIELDS
+    wanted = {f.strip() for f in raw.split(",") if f.strip()}
+    unknown = sorted(wanted - set(CATALOG_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown catalog fields: {', '.join(unknown)}")
+    return tuple(f for f in CATALOG_FIELDS if f == "id" or f in wanted)
+
+
+def catalog_etag(pharmacy_id: int, version: int, fields: Sequence[str]) -> str:
+    """Strong validator of one catalog representation (without quotes or encoding suffix)."""
+    digest = hashlib.sha1(",".join(fields).encode("utf-8")).hexdigest()[:8]
+    return f"c{pharmacy_id}-{version}-{digest}"
+
+
+ENCODING_SUFFIX = {"identity": "", "gzip": "-gz", "br": "-br"}
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison, and any encoding of the same catalog is a match."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        candidate = candidate.strip('"')
+        for suffix in ("-gz", "-br"):
+            if candidate.endswith(suffix):
+                candidate = candidate[: -len(suffix)]
+        if candidate == etag:
+            return True
+    return False
+
+
+@dataclass(frozen=True)
+class CatalogPayload:
+    """One catalog representation, serialized and compressed once."""
+
+    pharmacy_id: int
+    version: int
+    etag: str
+    bodies: Dict[str, bytes]
+
+    def select(self, accept_encoding: str) -> Tuple[str, bytes]:
+        """Pick the smallest encoding the client accepts: ``(encoding, body)``."""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding, self.bodies[encoding]
+        return "identity", self.bodies["identity"]
+
+    def etag_for(self, encoding: str) -> str:
+        return f'"{self.etag}{ENCODING_SUFFIX[encoding]}"'
+
+
+def build_payload(conn: Connection, pharmacy_id: int, fields: Sequence[str] = CATALOG_FIELDS) -> CatalogPayload:
+    data = full_catalog(conn, pharmacy_id, fields)
+    raw = dumps_bytes({"success": True, **data})
+    bodies = {"identity": raw, "gzip": gzip.compress(raw, compresslevel=GZIP_LEVEL)}
+    if brotli is not None:
+        bodies["br"] = brotli.compress(raw, quality=BROTLI_QUALITY)
+    version = data["version"]
+    return CatalogPayload(pharmacy_id, version, catalog_etag(pharmacy_id, version, fields), bodies)
+
+
+class CatalogFeed:
+    """
+    Per-process cache of catalog payloads and current versions. Payloads of
+    one key are built once even under concurrent misses.
+    """
+
+    def __init__(self, max_entries: int = CATALOG_CACHE_SIZE, version_ttl: float = CATALOG_VERSION_TTL) -> None:
+        self.max_entries = max_entries
+        self.version_ttl = version_ttl
+        self._payloads: "OrderedDict[Tuple[int, int, Tuple[str, ...]], CatalogPayload]" = OrderedDict()
+        self._versions: Dict[int, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+        self._builds: Dict[Tuple[int, Tuple[str, ...]], threading.Lock] = {}
+
+    def current_version(self, engine: Engine, pharmacy_id: int) -> int:
+        now = time.monotonic()
+        cached = self._versions.get(pharmacy_id)
+        if cached and cached[0] > now:
+            return cached[1]
+        with engine.begin() as conn:
+            roll_over_expiry(conn, pharmacy_id)
+            version = catalog_version(conn, pharmacy_id)
+        self._remember_version(pharmacy_id, version)
+        return version
+
+    def _remember_version(self, pharmacy_id: int, version: int) -> None:
+        with self._lock:
+            cached = self._versions.get(pharmacy_id)
+            if cached is None or cached[1] <= version:
+                self._versions[pharmacy_id] = (time.monotonic() + self.version_ttl, version)
+
+    def forget_version(self, pharmacy_id: int) -> None:
+        """Make the next request re-read the version (call after writes in this process)."""
+        with self._lock:
+            self._versions.pop(pharmacy_id, None)
+
+    def payload(self, engine: Engine, pharmacy_id: int, version: int,
+                fields: Sequence[str] = CATALOG_FIELDS) -> CatalogPayload:
+        fields = tuple(fields)
+        key = (pharmacy_id, version, fields)
+        with self._lock:
+            found = self._payloads.get(key)
+            if found is not None:
+                self._payloads.move_to_end(key)
+                return found
+            build_lock = self._builds.setdefault((pharmacy_id, fields), threading.Lock())
+        with build_lock:
+            with self._lock:
+                found = self._payloads.get(key)
+                if found is not None:
+                    return found
+            with engine.begin() as conn:
+                built = build_payload(conn, pharmacy_id, fields)
+            with self._lock:
+                # Older versions of this projection are unreachable once a newer one exists
+                for stale in [k for k in self._payloads if k[0] == pharmacy_id and k[2] == fields and k[1] < built.version]:
+                    del self._payloads[stale]
+                self._payloads[key] = built
+                self._payloads[(pharmacy_id, built.version, fields)] = built
+                while len(self._payloads) > self.max_entries:
+                    self._payloads.popitem(last=False)
+        self._remember_version(pharmacy_id, built.version)
+        return built
+
+    def clear(self) -> None:
+        with self._lock:
+            self._payloads.clear()
+            self._versions.clear()
+
+
+catalog_feed = CatalogFeed()
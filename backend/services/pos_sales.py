@@ -0,0 +1,454 @@
+"""
+Set-based sale recording for the POS.
+
+:func:`record_sales` writes any number of sales in a fixed number of
+statements, no matter how many sales or lines it is given:
+
+1. one ``SELECT ... FOR UPDATE`` locks every non-expired batch of the products
+   involved (in id order, so concurrent writers cannot deadlock),
+2. FIFO allocation runs in memory against that locked snapshot, sale by sale,
+   so a sale that would oversell is rejected without touching the others,
+3. sales, sale items and the sale-item-to-batch allocations are inserted with
+   ``INSERT ... SELECT FROM unnest(...)`` multi-row inserts, batch
+   ``sold_quantity`` is bumped with one ``UPDATE ... FROM``, and the
+   ``inventory`` stock of the touched products is recomputed once.
+
+If the set-based write itself fails (e.g. a constraint violation on one sale),
+each sale is retried under its own savepoint so the failure stays isolated.
+
+The allocations recorded in ``sale_item_allocations`` let returns restore stock
+to the batches a sale actually consumed. Each created sale also carries its
+receipt, assembled from the ``RETURNING`` rows (see services/receipts.py).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .bulk_loader import insertable_columns
+from .receipts import receipt_from_rows
+from .sales_rollup import apply_sales
+
+logger = logging.getLogger(__name__)
+
+MAX_BULK_SALES = int(os.getenv("POS_BULK_MAX_SALES", "500"))
+DEFAULT_TAX_RATE = 0.12
+
+
+class SaleValidationError(ValueError):
+    """The sale payload is malformed."""
+
+
+@dataclass
+class SaleLine:
+    product_id: int
+    quantity: int
+    unit_price: float
+
+    @property
+    def total_price(self) -> float:
+        return self.quantity * self.unit_price
+
+
+@dataclass
+class SaleInput:
+    """One sale as submitted by a terminal."""
+
+    items: List[SaleLine]
+    payment_method: str
+    customer_name: str = ""
+    discount_amount: float = 0.0
+    tax_rate: float = DEFAULT_TAX_RATE
+    created_at: Optional[datetime] = None
+    client_ref: Optional[str] = None
+
+    @property
+    def subtotal(self) -> float:
+        return sum(line.total_price for line in self.items)
+
+    @property
+    def tax_amount(self) -> float:
+        return self.subtotal * self.tax_rate
+
+    @property
+    def total_amount(self) -> float:
+        return self.subtotal + self.tax_amount - self.discount_amount
+
+    @property
+    def notes(self) -> Optional[str]:
+        return f"Customer: {self.customer_name}" if self.customer_name else None
+
+
+@dataclass
+class SaleOutcome:
+    """Result of one sale in a :func:`record_sales` call."""
+
+    index: int
+    client_ref: Optional[str] = None
+    status: str = "pending"
+    sale_id: Optional[int] = None
+    sale_number: Optional[str] = None
+    error: Optional[str] = None
+    conflicts: List[Dict[str, Any]] = field(default_factory=list)
+    allocations: List[List[Tuple[int, int]]] = field(default_factory=list, repr=False)
+    receipt: Optional[Dict[str, Any]] = field(default=None, repr=False)
+
+    def as_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"index": self.index, "status": self.status}
+        if self.client_ref is not None:
+            out["client_ref"] = self.client_ref
+        if self.sale_id is not None:
+            out["sale_id"] = self.sale_id
+            out["sale_number"] = self.sale_number
+        if self.error:
+            out["error"] = self.error
+        if self.conflicts:
+            out["conflicts"] = self.conflicts
+        return out
+
+
+def _number(value: Any, name: str, cast=float):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise SaleValidationError(f"Invalid {name}: {value!r}")
+
+
+def parse_sale(payload: Dict[str, Any]) -> SaleInput:
+    """Validate a process-sale style payload into a :class:`SaleInput`."""
+    if not isinstance(payload, dict):
+        raise SaleValidationError("Sale must be an object")
+    for name in ("items", "payment_method"):
+        if name not in payload:
+            raise SaleValidationError(f"Missing required field: {name}")
+    raw_items = payload["items"]
+    if not raw_items or not isinstance(raw_items, list):
+        raise SaleValidationError("No items in cart")
+
+    items = []
+    for raw in raw_items:
+        if not isinstance(raw, dict) or "product_id" not in raw or "quantity" not in raw or "unit_price" not in raw:
+            raise SaleValidationError("Each item needs product_id, quantity and unit_price")
+        quantity = _number(raw["quantity"], "quantity", int)
+        if quantity <= 0:
+            raise SaleValidationError(f"Quantity must be positive for product {raw['product_id']}")
+        items.append(SaleLine(
+            product_id=_number(raw["product_id"], "product_id", int),
+            quantity=quantity,
+            unit_price=_number(raw["unit_price"], "unit_price"),
+        ))
+
+    created_at = payload.get("created_at")
+    if created_at:
+        try:
+            created_at = datetime.fromisoformat(str(created_at).replace("Z", "+00:00"))
+        except ValueError:
+            raise SaleValidationError(f"Invalid created_at: {created_at!r}")
+
+    return SaleInput(
+        items=items,
+        payment_method=str(payload["payment_method"]),
+        customer_name=payload.get("customer_name") or "",
+        discount_amount=_number(payload.get("discount_amount", 0) or 0, "discount_amount"),
+        tax_rate=_number(payload.get("tax_rate", DEFAULT_TAX_RATE), "tax_rate"),
+        created_at=created_at or None,
+        client_ref=payload.get("client_ref"),
+    )
+
+
+def new_sale_number() -> str:
+    return f"POS{datetime.now().strftime('%Y%m%d')}{str(uuid.uuid4())[:8].upper()}"
+
+
+def lock_available_batches(conn: Connection, product_ids: Iterable[int]) -> Dict[int, List[List[int]]]:
+    """
+    Lock the non-expired batches of ``product_ids`` and return
+    ``{product_id: [[batch_id, available], ...]}`` in FIFO order.
+    """
+    ids = sorted({int(p) for p in product_ids})
+    if not ids:
+        return {}
+    rows = conn.execute(text("""
+        SELECT id, product_id, received_at,
+               quantity - sold_quantity - COALESCE(disposed_quantity, 0) AS available
+        FROM inventory_batches
+        WHERE product_id = ANY(:pids)
+          AND (expiration_date IS NULL OR expiration_date > CURRENT_DATE)
+        ORDER BY id
+        FOR UPDATE
+    """), {"pids": ids}).mappings().all()
+    pool: Dict[int, List[Tuple[Any, int, int]]] = {}
+    for row in rows:
+        if row["available"] > 0:
+            pool.setdefault(row["product_id"], []).append((row["received_at"], row["id"], int(row["available"])))
+    return {
+        pid: [[batch_id, available] for _, batch_id, available in sorted(batches, key=lambda b: (b[0] is None, b[0], b[1]))]
+        for pid, batches in pool.items()
+    }
+
+
+def allocate_fifo(sale: SaleInput, pool: Dict[int, List[List[int]]],
+                  clamp: bool = False) -> Tuple[Optional[List[List[Tuple[int, int]]]], List[Dict[str, Any]]]:
+    """
+    Allocate every line of ``sale`` from ``pool`` (oldest batch first).
+    Returns ``(allocations per line, [])`` and consumes the pool, or
+    ``(None, conflicts)`` leaving the pool untouched when stock is short.
+
+    With ``clamp`` a short sale is reduced in place to what is still
+    available (lines that drop to zero are removed) and allocated, returning
+    ``(allocations, conflicts)``; it only fails when nothing is left.
+    """
+    requested: Dict[int, int] = {}
+    for line in sale.items:
+        requested[line.product_id] = requested.get(line.product_id, 0) + line.quantity
+    conflicts = []
+    for product_id, quantity in requested.items():
+        available = sum(b[1] for b in pool.get(product_id, ()))
+        if available < quantity:
+            conflicts.append({"product_id": product_id, "requested": quantity, "available": available})
+    if conflicts:
+        if not clamp:
+            return None, conflicts
+        left = {c["product_id"]: c["available"] for c in conflicts}
+        for line in sale.items:
+            if line.product_id in left:
+                line.quantity = min(line.quantity, left[line.product_id])
+                left[line.product_id] -= line.quantity
+        sale.items = [line for line in sale.items if line.quantity > 0]
+        if not sale.items:
+            return None, conflicts
+
+    allocations = []
+    for line in sale.items:
+        remaining = line.quantity
+        taken = []
+        for batch in pool.get(line.product_id, ()):
+            if remaining <= 0:
+                break
+            if batch[1] <= 0:
+                continue
+            qty = min(remaining, batch[1])
+            batch[1] -= qty
+            remaining -= qty
+            taken.append((batch[0], qty))
+        allocations.append(taken)
+    return allocations, conflicts
+
+
+def refresh_inventory_stock(conn: Connection, product_ids: Iterable[int]) -> None:
+    """Recompute ``inventory.current_stock`` from non-expired batches for the given products."""
+    ids = sorted({int(p) for p in product_ids})
+    if not ids:
+        return
+    conn.execute(text("""
+        INSERT INTO inventory (product_id, current_stock)
+        SELECT pid, COALESCE(SUM(b.quantity - b.sold_quantity - COALESCE(b.disposed_quantity, 0))
+            FILTER (WHERE b.expiration_date IS NULL OR b.expiration_date > CURRENT_DATE), 0)
+        FROM unnest(CAST(:pids AS bigint[])) AS pid
+        LEFT JOIN inventory_batches b ON b.product_id = pid
+        GROUP BY pid
+        ON CONFLICT (product_id) DO UPDATE
+        SET current_stock = excluded.current_stock, last_updated = now()
+    """), {"pids": ids})
+
+
+_column_cache: Dict[str, set] = {}
+
+
+def _columns(conn: Connection, table: str) -> set:
+    if table not in _column_cache:
+        _column_cache[table] = insertable_columns(conn, table)
+    return _column_cache[table]
+
+
+def _write_sales(conn: Connection, pharmacy_id: int, user_id: int,
+                 planned: Sequence[Tuple[SaleInput, SaleOutcome]], product_names: Dict[int, str]) -> None:
+    """Insert sales, lines and allocations for already-allocated sales with multi-row inserts."""
+    now = datetime.now()
+    numbers = [new_sale_number() for _ in planned]
+
+    sale_cols = ["sale_number", "pharmacy_id", "user_id", "subtotal", "tax_amount", "discount_amount",
+                 "payment_method", "status", "notes", "created_at"]
+    sale_expr = ["u.sale_number", ":ph", ":uid", "u.subtotal", "u.tax_amount", "u.discount_amount",
+                 "u.payment_method", "'completed'", "u.notes", "u.created_at"]
+    if "total_amount" in _columns(conn, "sales"):
+        sale_cols.append("total_amount")
+        sale_expr.append("u.subtotal + u.tax_amount - u.discount_amount")
+    sale_rows = conn.execute(text(f"""
+        INSERT INTO sales ({', '.join(sale_cols)})
+        SELECT {', '.join(sale_expr)}
+        FROM unnest(
+            CAST(:sale_number AS text[]), CAST(:subtotal AS numeric[]), CAST(:tax_amount AS numeric[]),
+            CAST(:discount_amount AS numeric[]), CAST(:payment_method AS text[]), CAST(:notes AS text[]),
+            CAST(:created_at AS timestamptz[])
+        ) AS u(sale_number, subtotal, tax_amount, discount_amount, payment_method, notes, created_at)
+        RETURNING id, sale_number, subtotal, tax_amount, discount_amount, payment_method, created_at
+    """), {
+        "ph": pharmacy_id,
+        "uid": user_id,
+        "sale_number": numbers,
+        "subtotal": [sale.subtotal for sale, _ in planned],
+        "tax_amount": [sale.tax_amount for sale, _ in planned],
+        "discount_amount": [sale.discount_amount for sale, _ in planned],
+        "payment_method": [sale.payment_method for sale, _ in planned],
+        "notes": [sale.notes for sale, _ in planned],
+        "created_at": [sale.created_at or now for sale, _ in planned],
+    }).all()
+    sales_by_number = {row.sale_number: row for row in sale_rows}
+    for number, (_, outcome) in zip(numbers, planned):
+        outcome.sale_id = sales_by_number[number].id
+        outcome.sale_number = number
+
+    item_cols = ["sale_id", "product_id", "quantity", "unit_price"]
+    item_expr = ["u.sale_id", "u.product_id", "u.quantity", "u.unit_price"]
+    item_columns = _columns(conn, "sale_items")
+    if "total_price" in item_columns:
+        item_cols.append("total_price")
+        item_expr.append("u.quantity * u.unit_price")
+    if "created_at" in item_columns:
+        item_cols.append("created_at")
+        item_expr.append("u.created_at")
+    # Cost at the time of sale; refined below to the cost of the batches the line consumed
+    if "unit_cost" in item_columns:
+        item_cols.append("unit_cost")
+        item_expr.append("(SELECT p.cost_price FROM products p WHERE p.id = u.product_id)")
+    lines = [(outcome.sale_id, line, sale.created_at or now) for sale, outcome in planned for line in sale.items]
+    item_rows = conn.execute(text(f"""
+        INSERT INTO sale_items ({', '.join(item_cols)})
+        SELECT {', '.join(item_expr)}
+        FROM unnest(
+            CAST(:sale_id AS bigint[]), CAST(:product_id AS bigint[]), CAST(:quantity AS int[]),
+            CAST(:unit_price AS numeric[]), CAST(:created_at AS timestamptz[])
+        ) WITH ORDINALITY AS u(sale_id, product_id, quantity, unit_price, created_at, ord)
+        ORDER BY u.ord
+        RETURNING id, sale_id, product_id, quantity, unit_price
+    """), {
+        "sale_id": [sale_id for sale_id, _, _ in lines],
+        "product_id": [line.product_id for _, line, _ in lines],
+        "quantity": [line.quantity for _, line, _ in lines],
+        "unit_price": [line.unit_price for _, line, _ in lines],
+        "created_at": [ts for _, _, ts in lines],
+    }).all()
+
+    # Ids are assigned in insertion order, so repeated (sale, product) lines pair up by id order.
+    item_ids: Dict[Tuple[int, int], List[int]] = {}
+    items_by_sale: Dict[int, List[Any]] = {}
+    for row in sorted(item_rows, key=lambda r: r.id):
+        item_ids.setdefault((row.sale_id, row.product_id), []).append(row.id)
+        items_by_sale.setdefault(row.sale_id, []).append(row._mapping)
+    for number, (_, outcome) in zip(numbers, planned):
+        outcome.receipt = receipt_from_rows(
+            sales_by_number[number]._mapping, items_by_sale.get(outcome.sale_id, []), product_names
+        )
+
+    alloc_item, alloc_batch, alloc_qty = [], [], []
+    for sale, outcome in planned:
+        for line, taken in zip(sale.items, outcome.allocations):
+            sale_item_id = item_ids[(outcome.sale_id, line.product_id)].pop(0)
+            for batch_id, qty in taken:
+                alloc_item.append(sale_item_id)
+                alloc_batch.append(batch_id)
+                alloc_qty.append(qty)
+
+    if alloc_item:
+        line_costs = ""
+        if "unit_cost" in item_columns:
+            line_costs = """, line_costs AS (
+                UPDATE sale_items si
+                SET unit_cost = c.unit_cost
+                FROM (
+                    SELECT a.sale_item_id,
+                           SUM(a.quantity * b.cost_price) / SUM(a.quantity) AS unit_cost
+                    FROM alloc a
+                    JOIN inventory_batches b ON b.id = a.batch_id
+                    GROUP BY a.sale_item_id
+                    HAVING bool_and(b.cost_price IS NOT NULL)
+                ) c
+                WHERE si.id = c.sale_item_id
+            )"""
+        conn.execute(text(f"""
+            WITH alloc AS (
+                INSERT INTO sale_item_allocations (sale_item_id, batch_id, quantity)
+                SELECT * FROM unnest(CAST(:item AS bigint[]), CAST(:batch AS bigint[]), CAST(:qty AS int[]))
+                RETURNING sale_item_id, batch_id, quantity
+            ){line_costs}
+            UPDATE inventory_batches b
+            SET sold_quantity = b.sold_quantity + d.quantity
+            FROM (SELECT batch_id, SUM(quantity) AS quantity FROM alloc GROUP BY batch_id) d
+            WHERE b.id = d.batch_id
+        """), {"item": alloc_item, "batch": alloc_batch, "qty": alloc_qty})
+
+    refresh_inventory_stock(conn, {line.product_id for sale, _ in planned for line in sale.items})
+    apply_sales(conn, [outcome.sale_id for _, outcome in planned])
+
+
+def record_sales(conn: Connection, pharmacy_id: int, user_id: int,
+                 sales: Sequence[SaleInput], clamp: bool = False) -> List[SaleOutcome]:
+    """
+    Validate, allocate and insert ``sales`` inside the caller's transaction.
+    Each sale succeeds or fails on its own; see the module docstring. With
+    ``clamp`` short sales are reduced to the available stock instead of
+    rejected (see :func:`allocate_fifo`); their outcome keeps the conflicts.
+    """
+    outcomes = [SaleOutcome(index=i, client_ref=sale.client_ref) for i, sale in enumerate(sales)]
+    product_ids = {line.product_id for sale in sales for line in sale.items}
+
+    names: Dict[int, str] = {}
+    if product_ids:
+        names = {
+            row.id: row.name for row in conn.execute(text("""
+                SELECT id, name FROM products
+                WHERE id = ANY(:pids) AND pharmacy_id = :ph AND COALESCE(is_active, true)
+            """), {"pids": sorted(product_ids), "ph": pharmacy_id})
+        }
+    known = set(names)
+    pool = lock_available_batches(conn, product_ids & known)
+
+    planned: List[Tuple[SaleInput, SaleOutcome]] = []
+    for sale, outcome in zip(sales, outcomes):
+        unknown = sorted({line.product_id for line in sale.items} - known)
+        if unknown:
+            outcome.status = "failed"
+            outcome.error = f"Unknown or inactive products: {unknown}"
+            continue
+        allocations, conflicts = allocate_fifo(sale, pool, clamp=clamp)
+        outcome.conflicts = conflicts
+        if allocations is None:
+            outcome.status = "failed"
+            outcome.error = "Insufficient available stock"
+            continue
+        outcome.allocations = allocations
+        planned.append((sale, outcome))
+
+    if not planned:
+        return outcomes
+
+    try:
+        with conn.begin_nested():
+            _write_sales(conn, pharmacy_id, user_id, planned, names)
+    except Exception as exc:
+        logger.warning("Set-based sale write failed (%s); retrying %d sales one by one", exc, len(planned))
+        for sale, outcome in planned:
+            outcome.sale_id = outcome.sale_number = outcome.receipt = None
+            try:
+                with conn.begin_nested():
+                    _write_sales(conn, pharmacy_id, user_id, [(sale, outcome)], names)
+            except Exception as single_exc:
+                outcome.sale_id = outcome.sale_number = outcome.receipt = None
+                outcome.status = "failed"
+                outcome.error = str(single_exc).splitlines()[0][:300]
+                continue
+            outcome.status = "created"
+        return outcomes
+
+    for _, outcome in planned:
+        outcome.status = "created"
+    return outcomes
@@ -0,0 +1,219 @@
+"""
+Offline sale journals uploaded by POS terminals.
+
+While a branch is offline its terminal keeps selling and appends each sale to
+a local journal with a per-terminal sequence number and the local timestamp.
+Once it reconnects it uploads the journal (in one or several batches) and
+:func:`sync_journal` reconciles it:
+
+* the terminal's row in ``pos_sync_terminals`` is locked, so two uploads from
+  one terminal are applied one after the other;
+* entries already in ``pos_sync_journal`` are answered from their stored
+  result, so re-uploading after a lost response is harmless;
+* new entries are replayed in sequence order through
+  :func:`services.pos_sales.record_sales`, the same batch-locking FIFO path as
+  online sales, keeping their local ``created_at``;
+* an entry that would oversell is a stock conflict. Under the ``reject``
+  policy it is recorded as ``conflict`` and no sale is written; under
+  ``clamp`` the sale is reduced to what is left and recorded as ``adjusted``.
+  Either way the conflict stays listed for a manager until resolved.
+
+The response acknowledges the highest contiguous sequence number, so the
+terminal can drop those entries and re-send anything in ``missing``.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .pos_sales import SaleInput, SaleValidationError, parse_sale, record_sales
+
+MAX_JOURNAL_ENTRIES = int(os.getenv("POS_SYNC_MAX_ENTRIES", "500"))
+CONFLICT_POLICIES = ("reject", "clamp")
+MAX_TERMINAL_ID_LENGTH = 100
+
+
+def parse_journal(payload: Dict[str, Any]) -> Tuple[str, List[Tuple[int, Dict[str, Any]]], str]:
+    """Validate an upload into ``(terminal_id, [(seq, entry), ...] sorted by seq, policy)``."""
+    if not isinstance(payload, dict):
+        raise SaleValidationError("Body must be an object")
+    terminal_id = str(payload.get("terminal_id") or "").strip()
+    if not terminal_id or len(terminal_id) > MAX_TERMINAL_ID_LENGTH:
+        raise SaleValidationError("terminal_id is required")
+    policy = payload.get("on_conflict") or "reject"
+    if policy not in CONFLICT_POLICIES:
+        raise SaleValidationError(f"on_conflict must be one of: {', '.join(CONFLICT_POLICIES)}")
+    raw_entries = payload.get("entries")
+    if not isinstance(raw_entries, list) or not raw_entries:
+        raise SaleValidationError("entries must be a non-empty list")
+    if len(raw_entries) > MAX_JOURNAL_ENTRIES:
+        raise SaleValidationError(f"At most {MAX_JOURNAL_ENTRIES} entries per upload")
+
+    entries: Dict[int, Dict[str, Any]] = {}
+    for raw in raw_entries:
+        if not isinstance(raw, dict):
+            raise SaleValidationError("Each entry must be an object")
+        try:
+            seq = int(raw.get("seq"))
+        except (TypeError, ValueError):
+            raise SaleValidationError(f"Invalid seq: {raw.get('seq')!r}")
+        if seq <= 0:
+            raise SaleValidationError("seq must be positive")
+        if seq in entries:
+            raise SaleValidationError(f"Duplicate seq {seq} in upload")
+        entries[seq] = raw
+    return terminal_id, sorted(entries.items()), policy
+
+
+def _outcome_status(outcome) -> str:
+    if outcome.status == "created":
+        return "adjusted" if outcome.conflicts else "applied"
+    return "conflict"
+
+
+def sync_journal(conn: Connection, pharmacy_id: int, user_id: int, terminal_id: str,
+                 entries: Sequence[Tuple[int, Dict[str, Any]]], policy: str = "reject") -> Dict[str, Any]:
+    """Reconcile one journal upload inside the caller's transaction; see the module docstring."""
+    acknowledged = conn.execute(text("""
+        INSERT INTO pos_sync_terminals (pharmacy_id, terminal_id, last_user_id)
+        VALUES (:ph, :terminal, :uid)
+        ON CONFLICT (pharmacy_id, terminal_id) DO UPDATE
+        SET last_user_id = excluded.last_user_id, last_synced_at = now()
+        RETURNING acknowledged_through
+    """), {"ph": pharmacy_id, "terminal": terminal_id, "uid": user_id}).scalar()
+
+    seqs = [seq for seq, _ in entries]
+    stored = {
+        row["seq"]: row for row in conn.execute(text("""
+            SELECT seq, status, sale_id, result FROM pos_sync_journal
+            WHERE pharmacy_id = :ph AND terminal_id = :terminal AND seq = ANY(:seqs)
+        """), {"ph": pharmacy_id, "terminal": terminal_id, "seqs": seqs}).mappings()
+    }
+
+    results: Dict[int, Dict[str, Any]] = {}
+    for seq in seqs:
+        if seq in stored:
+            row = stored[seq]
+            results[seq] = dict(row["result"] or {}, seq=seq, status=row["status"], duplicate=True)
+
+    replay: List[Tuple[int, SaleInput]] = []
+    created_at: Dict[int, Any] = {}
+    for seq, raw in entries:
+        if seq in results:
+            continue
+        try:
+            sale = parse_sale(raw)
+        except SaleValidationError as exc:
+            results[seq] = {"seq": seq, "status": "invalid", "error": str(exc)}
+            continue
+        sale.client_ref = f"{terminal_id}:{seq}"
+        created_at[seq] = sale.created_at
+        replay.append((seq, sale))
+
+    if replay:
+        outcomes = record_sales(conn, pharmacy_id, user_id, [sale for _, sale in replay], clamp=policy == "clamp")
+        for (seq, _), outcome in zip(replay, outcomes):
+            result: Dict[str, Any] = {"seq": seq, "status": _outcome_status(outcome)}
+            if outcome.sale_id is not None:
+                result["sale_id"] = outcome.sale_id
+                result["sale_number"] = outcome.sale_number
+            if outcome.error:
+                result["error"] = outcome.error
+            if outcome.conflicts:
+                result["conflicts"] = outcome.conflicts
+            results[seq] = result
+
+    new = [results[seq] for seq, _ in entries if not results[seq].get("duplicate")]
+    if new:
+        conn.execute(text("""
+            INSERT INTO pos_sync_journal (pharmacy_id, terminal_id, seq, status, sale_id, result, client_created_at)
+            SELECT :ph, :terminal, u.seq, u.status, u.sale_id, CAST(u.result AS jsonb), u.client_created_at
+            FROM unnest(
+                CAST(:seq AS bigint[]), CAST(:status AS text[]), CAST(:sale_id AS bigint[]),
+                CAST(:result AS text[]), CAST(:client_created_at AS timestamptz[])
+            ) AS u(seq, status, sale_id, result, client_created_at)
+            ON CONFLICT (pharmacy_id, terminal_id, seq) DO NOTHING
+        """), {
+            "ph": pharmacy_id,
+            "terminal": terminal_id,
+            "seq": [r["seq"] for r in new],
+            "status": [r["status"] for r in new],
+            "sale_id": [r.get("sale_id") for r in new],
+            "result": [json.dumps({k: v for k, v in r.items() if k not in ("seq", "status")}, default=str) for r in new],
+            "client_created_at": [created_at.get(r["seq"]) for r in new],
+        })
+
+    acknowledged, missing = _advance_acknowledgement(conn, pharmacy_id, terminal_id, int(acknowledged or 0))
+    return {
+        "terminal_id": terminal_id,
+        "acknowledged_through": acknowledged,
+        "missing": missing,
+        "results": [results[seq] for seq in seqs],
+        "summary": {
+            status: sum(1 for r in results.values() if r["status"] == status)
+            for status in ("applied", "adjusted", "conflict", "invalid")
+        },
+    }
+
+
+def _advance_acknowledgement(conn: Connection, pharmacy_id: int, terminal_id: str,
+                             acknowledged: int) -> Tuple[int, List[int]]:
+    """Move the terminal's acknowledged sequence over every contiguous entry; return it and the gaps above it."""
+    seen = conn.execute(text("""
+        SELECT seq FROM pos_sync_journal
+        WHERE pharmacy_id = :ph AND terminal_id = :terminal AND seq > :ack
+        ORDER BY seq
+    """), {"ph": pharmacy_id, "terminal": terminal_id, "ack": acknowledged}).scalars().all()
+    through = acknowledged
+    for seq in seen:
+        if seq != through + 1:
+            break
+        through = seq
+    if through != acknowledged:
+        conn.execute(text("""
+            UPDATE pos_sync_terminals SET acknowledged_through = :through
+            WHERE pharmacy_id = :ph AND terminal_id = :terminal
+        """), {"ph": pharmacy_id, "terminal": terminal_id, "through": through})
+    received = set(seen)
+    highest = seen[-1] if seen else through
+    missing = [seq for seq in range(through + 1, highest) if seq not in received][:1000]
+    return through, missing
+
+
+def terminal_status(conn: Connection, pharmacy_id: int, terminal_id: Optional[str] = None,
+                    limit: int = 100) -> Dict[str, Any]:
+    """Acknowledged sequence per terminal and the unresolved conflicts of the pharmacy."""
+    params: Dict[str, Any] = {"ph": pharmacy_id, "limit": limit}
+    terminal_filter = ""
+    if terminal_id:
+        terminal_filter = " AND terminal_id = :terminal"
+        params["terminal"] = terminal_id
+    terminals = conn.execute(text(f"""
+        SELECT terminal_id, acknowledged_through, last_synced_at FROM pos_sync_terminals
+        WHERE pharmacy_id = :ph{terminal_filter}
+        ORDER BY terminal_id
+    """), params).mappings().all()
+    conflicts = conn.execute(text(f"""
+        SELECT terminal_id, seq, status, sale_id, result, client_created_at, received_at
+        FROM pos_sync_journal
+        WHERE pharmacy_id = :ph{terminal_filter}
+          AND status IN ('adjusted', 'conflict') AND resolved_at IS NULL
+        ORDER BY received_at, terminal_id, seq
+        LIMIT :limit
+    """), params).mappings().all()
+    return {"terminals": [dict(r) for r in terminals], "unresolved": [dict(r) for r in conflicts]}
+
+
+def resolve_entries(conn: Connection, pharmacy_id: int, terminal_id: str, seqs: Sequence[int]) -> int:
+    """Mark reconciled conflicts as handled by a manager."""
+    result = conn.execute(text("""
+        UPDATE pos_sync_journal SET resolved_at = now()
+        WHERE pharmacy_id = :ph AND terminal_id = :terminal AND seq = ANY(:seqs)
+          AND status IN ('adjusted', 'conflict') AND resolved_at IS NULL
+    """), {"ph": pharmacy_id, "terminal": terminal_id, "seqs": [int(s) for s in seqs]})
+    return result.rowcount or 0
@@ -0,0 +1,158 @@
+"""
+Sale receipts.
+
+Receipts are built from data the database already handed back:
+
+* at checkout, :func:`services.pos_sales.record_sales` gets the sale and item
+  rows back from ``INSERT ... RETURNING`` and the product names from its
+  product check, and :func:`receipt_from_rows` assembles the receipt, so the
+  sale is never read again after it was written;
+* for reprints and audits, :func:`render_receipts` renders any number of
+  stored sales with one query (items aggregated per sale with ``json_agg``).
+
+Both produce the same shape as the ``sale`` object of ``/api/pos/process-sale``.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+MAX_BATCH_RECEIPTS = 500
+
+
+def _money(value: Any) -> float:
+    return float(value or 0)
+
+
+def _customer(notes: Optional[str]) -> Optional[str]:
+    if notes and notes.startswith("Customer: "):
+        return notes[len("Customer: "):]
+    return None
+
+
+def cashier_name(first_name: Optional[str], last_name: Optional[str], username: Optional[str] = None) -> str:
+    return f"{first_name or ''} {last_name or ''}".strip() or (username or "")
+
+
+def receipt_from_rows(sale: Mapping[str, Any], items: Sequence[Mapping[str, Any]],
+                      product_names: Mapping[int, str], cashier: Optional[str] = None) -> Dict[str, Any]:
+    """Receipt from RETURNING rows of sales and sale_items (items in insertion order)."""
+    subtotal = Decimal(sale["subtotal"])
+    tax_amount = Decimal(sale["tax_amount"])
+    discount_amount = Decimal(sale["discount_amount"] or 0)
+    created_at = sale["created_at"]
+    receipt = {
+        "id": sale["id"],
+        "sale_number": sale["sale_number"],
+        "subtotal": float(subtotal),
+        "tax_amount": float(tax_amount),
+        "discount_amount": float(discount_amount),
+        "total_amount": float(subtotal + tax_amount - discount_amount),
+        "payment_method": sale["payment_method"],
+        "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+        "items": [
+            {
+                "product_name": product_names.get(item["product_id"]),
+                "quantity": item["quantity"],
+                "unit_price": _money(item["unit_price"]),
+                "total_price": float(item["quantity"] * Decimal(item["unit_price"])),
+            }
+            for item in items
+        ],
+    }
+    if cashier is not None:
+        receipt["cashier"] = cashier
+    return receipt
+
+
+def render_receipts(conn: Connection, pharmacy_id: int, sale_ids: Optional[Iterable[int]] = None,
+                    sale_numbers: Optional[Iterable[str]] = None, date_from: Optional[datetime] = None,
+                    date_to: Optional[datetime] = None, limit: int = MAX_BATCH_RECEIPTS) -> List[Dict[str, Any]]:
+    """
+    Receipts of stored sales of the pharmacy, oldest first, in one query.
+    Select by ids, by sale numbers, and/or by a created_at range; returns are
+    summarized per sale for audits.
+    """
+    conditions = ["s.pharmacy_id = :ph"]
+    params: Dict[str, Any] = {"ph": pharmacy_id, "limit": min(max(int(limit), 1), MAX_BATCH_RECEIPTS)}
+    selectors = []
+    if sale_ids is not None:
+        selectors.append("s.id = ANY(:ids)")
+        params["ids"] = [int(i) for i in sale_ids]
+    if sale_numbers is not None:
+        selectors.append("s.sale_number = ANY(:numbers)")
+        params["numbers"] = [str(n) for n in sale_numbers]
+    if selectors:
+        conditions.append(f"({' OR '.join(selectors)})")
+    if date_from is not None:
+        conditions.append("s.created_at >= :date_from")
+        params["date_from"] = date_from
+    if date_to is not None:
+        conditions.append("s.created_at < :date_to")
+        params["date_to"] = date_to
+
+    rows = conn.execute(text(f"""
+        SELECT s.id, s.sale_number, s.subtotal, s.tax_amount, s.discount_amount,
+               s.payment_method, s.created_at, s.notes,
+               u.first_name, u.last_name, u.username,
+               COALESCE(it.items, '[]'::json) AS items,
+               COALESCE(r.return_count, 0) AS return_count,
+               COALESCE(r.total_refund, 0) AS total_refund
+        FROM sales s
+        LEFT JOIN users u ON u.id = s.user_id
+        LEFT JOIN LATERAL (
+            SELECT json_agg(json_build_object(
+                       'product_id', si.product_id,
+                       'product_name', p.name,
+                       'quantity', si.quantity,
+                       'unit_price', si.unit_price,
+                       'total_price', si.quantity * si.unit_price
+                   ) ORDER BY si.id) AS items
+            FROM sale_items si
+            LEFT JOIN products p ON p.id = si.product_id
+            WHERE si.sale_id = s.id
+        ) it ON true
+        LEFT JOIN LATERAL (
+            SELECT count(*) AS return_count, sum(rt.total_refund_amount) AS total_refund
+            FROM returns rt
+            WHERE rt.sale_id = s.id
+        ) r ON true
+        WHERE {' AND '.join(conditions)}
+        ORDER BY s.created_at, s.id
+        LIMIT :limit
+    """), params).mappings().all()
+
+    receipts = []
+    for row in rows:
+        subtotal = Decimal(row["subtotal"])
+        tax_amount = Decimal(row["tax_amount"] or 0)
+        discount_amount = Decimal(row["discount_amount"] or 0)
+        receipts.append({
+            "id": row["id"],
+            "sale_number": row["sale_number"],
+            "subtotal": float(subtotal),
+            "tax_amount": float(tax_amount),
+            "discount_amount": float(discount_amount),
+            "total_amount": float(subtotal + tax_amount - discount_amount),
+            "payment_method": row["payment_method"],
+            "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+            "cashier": cashier_name(row["first_name"], row["last_name"], row["username"]),
+            "customer_name": _customer(row["notes"]),
+            "items": [
+                {
+                    "product_id": item["product_id"],
+                    "product_name": item["product_name"],
+                    "quantity": item["quantity"],
+                    "unit_price": _money(item["unit_price"]),
+                    "total_price": _money(item["total_price"]),
+                }
+                for item in row["items"]
+            ],
+            "returns": {"count": int(row["return_count"]), "total_refund": _money(row["total_refund"])},
+        })
+    return receipts
@@ -0,0 +1,338 @@
+"""
+Forecast-driven reorder suggestions.
+
+:func:`load_inputs` reads everything the engine needs for every active
+product of a pharmacy in one query:
+
+* stock on hand from non-expired ``inventory_batches``;
+* quantity already on order: the outstanding quantity of purchase order
+  items that are not received or cancelled, drafts included, so re-running
+  the engine does not order the same gap twice;
+* the preferred supplier and its lead time (``suppliers.lead_time_days``,
+  default :data:`DEFAULT_LEAD_TIME_DAYS`);
+* net units sold per day over the last 7 and 28 full days from
+  ``sales_rollup_product_daily``, with the sum of squares for the spread.
+
+:func:`compute_plan` then evaluates all products at once with numpy. Daily
+demand is a blend of the 7- and 28-day rates, replaced by the
+``ForecastingService`` mean forecast for products that have a trained model.
+Model inference is far slower than the rest of the engine, so it never runs
+in a request: the hourly job (scripts/run_reorder_engine.py) calls
+:func:`predict_forecast_rates` outside any transaction and
+:func:`store_forecast_rates` keeps one mean daily rate per product in
+``reorder_forecast_rates``. The job and the API both read them back with
+:func:`load_forecast_rates`, so they plan with the same demand. The rate is
+per day; :func:`compute_plan` scales it by lead time plus review period.
+The order-up-to level covers demand over lead time plus the review period,
+plus safety stock ``z * sigma * sqrt(lead time)``, and never falls below
+the product's own ``reorder_point``. A product is suggested when its
+position (on hand plus on order) is below that level.
+
+:func:`group_by_supplier` shapes the suggestions as one draft purchase order
+per supplier, and :func:`create_draft_orders` writes them as ``draft``
+purchase orders with multi-row inserts.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+DEFAULT_LEAD_TIME_DAYS = int(os.getenv("REORDER_DEFAULT_LEAD_TIME_DAYS", "7"))
+DEFAULT_REVIEW_DAYS = int(os.getenv("REORDER_REVIEW_DAYS", "7"))
+DEFAULT_SERVICE_Z = float(os.getenv("REORDER_SERVICE_Z", "1.65"))  # ~95% cycle service level
+FORECAST_HORIZON_DAYS = int(os.getenv("REORDER_FORECAST_HORIZON_DAYS", str(DEFAULT_LEAD_TIME_DAYS + DEFAULT_REVIEW_DAYS)))
+FORECAST_MAX_AGE_HOURS = float(os.getenv("REORDER_FORECAST_MAX_AGE_HOURS", "6"))
+
+SHORT_WINDOW_DAYS = 7
+LONG_WINDOW_DAYS = 28
+SHORT_WEIGHT = 0.6
+
+CLOSED_PO_STATUSES = ("received", "cancelled", "canceled", "rejected")
+UNASSIGNED = "unassigned"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReorderInputs:
+    """Column arrays, one entry per active product, ordered by product id."""
+
+    product_id: np.ndarray
+    name: List[str]
+    supplier_id: np.ndarray  # -1 when the product has no preferred supplier
+    supplier_name: List[Optional[str]]
+    lead_time: np.ndarray
+    reorder_point: np.ndarray
+    unit_cost: np.ndarray
+    on_hand: np.ndarray
+    on_order: np.ndarray
+    sold_short: np.ndarray
+    sold_long: np.ndarray
+    sold_long_sq: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.product_id)
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Sequence[Any]]) -> "ReorderInputs":
+        cols = list(zip(*rows)) if rows else [()] * 12
+
+        def num(i, dtype=np.float64):
+            return np.fromiter((v or 0 for v in cols[i]), dtype=dtype, count=len(rows))
+
+        return cls(
+            product_id=num(0, np.int64),
+            name=list(cols[1]),
+            supplier_id=np.fromiter((-1 if v is None else v for v in cols[2]), dtype=np.int64, count=len(rows)),
+            supplier_name=list(cols[3]),
+            lead_time=num(4),
+            reorder_point=num(5),
+            unit_cost=num(6),
+            on_hand=num(7),
+            on_order=num(8),
+            sold_short=num(9),
+            sold_long=num(10),
+            sold_long_sq=num(11),
+        )
+
+
+@dataclass
+class ReorderPlan:
+    """Per-product results of :func:`compute_plan` (same order as the inputs)."""
+
+    inputs: ReorderInputs
+    daily_demand: np.ndarray
+    forecasted: np.ndarray
+    days_of_cover: np.ndarray
+    order_up_to: np.ndarray
+    order_quantity: np.ndarray
+
+    @property
+    def suggested(self) -> np.ndarray:
+        return np.flatnonzero(self.order_quantity > 0)
+
+
+def _tables(conn: Connection) -> Dict[str, bool]:
+    # Supplier and purchase order tables are created lazily by their routes
+    row = conn.execute(text("""
+        SELECT to_regclass('public.suppliers') IS NOT NULL,
+               to_regclass('public.purchase_order_items') IS NOT NULL
+    """)).one()
+    return {"suppliers": bool(row[0]), "purchase_orders": bool(row[1])}
+
+
+def load_inputs(conn: Connection, pharmacy_id: int) -> ReorderInputs:
+    tables = _tables(conn)
+    supplier_join = (
+        "LEFT JOIN suppliers s ON s.id = p.preferred_supplier_id"
+        if tables["suppliers"] else
+        "LEFT JOIN (SELECT NULL::bigint AS id, NULL::text AS name, NULL::int AS lead_time_days) s ON false"
+    )
+    on_order = f"""
+        LEFT JOIN (
+            SELECT i.product_id, SUM(GREATEST(i.quantity - COALESCE(i.received_quantity, 0), 0)) AS quantity
+            FROM purchase_order_items i
+            JOIN purchase_orders po ON po.id = i.po_id
+            WHERE po.pharmacy_id = :ph AND po.status <> ALL(CAST(:closed AS text[]))
+            GROUP BY i.product_id
+        ) oo ON oo.product_id = p.id
+    """ if tables["purchase_orders"] else "LEFT JOIN (SELECT NULL::bigint AS product_id, 0 AS quantity) oo ON false"
+    rows = conn.execute(text(f"""
+        WITH stock AS (
+            SELECT b.product_id,
+                   SUM(b.quantity - COALESCE(b.sold_quantity, 0) - COALESCE(b.disposed_quantity, 0)) AS on_hand
+            FROM inventory_batches b
+            JOIN products p ON p.id = b.product_id
+            WHERE p.pharmacy_id = :ph
+              AND (b.expiration_date IS NULL OR b.expiration_date > CURRENT_DATE)
+            GROUP BY b.product_id
+        ), demand AS (
+            SELECT product_id,
+                   SUM(net) FILTER (WHERE day >= CURRENT_DATE - CAST(:short_days AS int)) AS sold_short,
+                   SUM(net) AS sold_long,
+                   SUM(net * net) AS sold_long_sq
+            FROM (
+                SELECT product_id, day, quantity_sold - quantity_returned AS net
+                FROM sales_rollup_product_daily
+                WHERE pharmacy_id = :ph
+                  AND day >= CURRENT_DATE - CAST(:long_days AS int) AND day < CURRENT_DATE
+            ) d
+            GROUP BY product_id
+        )
+        SELECT p.id, p.name, p.preferred_supplier_id, s.name,
+               COALESCE(s.lead_time_days, CAST(:lead_time AS int)), COALESCE(p.reorder_point, 0), COALESCE(p.cost_price, 0),
+               GREATEST(COALESCE(st.on_hand, 0), 0), COALESCE(oo.quantity, 0),
+               COALESCE(d.sold_short, 0), COALESCE(d.sold_long, 0), COALESCE(d.sold_long_sq, 0)
+        FROM products p
+        {supplier_join}
+        LEFT JOIN stock st ON st.product_id = p.id
+        LEFT JOIN demand d ON d.product_id = p.id
+        {on_order}
+        WHERE p.pharmacy_id = :ph AND COALESCE(p.is_active, true)
+        ORDER BY p.id
+    """), {
+        "ph": pharmacy_id, "closed": list(CLOSED_PO_STATUSES), "lead_time": DEFAULT_LEAD_TIME_DAYS,
+        "short_days": SHORT_WINDOW_DAYS, "long_days": LONG_WINDOW_DAYS,
+    }).all()
+    return ReorderInputs.from_rows(rows)
+
+
+def compute_plan(inputs: ReorderInputs, review_days: float = DEFAULT_REVIEW_DAYS,
+                 service_z: float = DEFAULT_SERVICE_Z,
+                 forecast_rates: Optional[Mapping[int, float]] = None) -> ReorderPlan:
+    """Evaluate every product in one vectorized pass; see the module docstring."""
+    short_rate = inputs.sold_short / SHORT_WINDOW_DAYS
+    long_rate = inputs.sold_long / LONG_WINDOW_DAYS
+    demand = np.maximum(SHORT_WEIGHT * short_rate + (1 - SHORT_WEIGHT) * long_rate, 0.0)
+    # Daily spread over the long window, zero-sales days included
+    variance = np.maximum(inputs.sold_long_sq / LONG_WINDOW_DAYS - long_rate ** 2, 0.0)
+    sigma = np.sqrt(variance)
+
+    forecasted = np.zeros(len(inputs), dtype=bool)
+    if forecast_rates and len(inputs):
+        # product_id is sorted, so forecasts are matched with a binary search instead of a dict lookup per product
+        ids = np.fromiter(forecast_rates.keys(), dtype=np.int64, count=len(forecast_rates))
+        rates = np.fromiter(forecast_rates.values(), dtype=np.float64, count=len(forecast_rates))
+        pos = np.minimum(np.searchsorted(inputs.product_id, ids), len(inputs) - 1)
+        hit = inputs.product_id[pos] == ids
+        demand[pos[hit]] = np.maximum(rates[hit], 0.0)
+        forecasted[pos[hit]] = True
+
+    lead_time = np.maximum(inputs.lead_time, 0.0)
+    safety = service_z * sigma * np.sqrt(lead_time)
+    order_up_to = np.maximum(demand * (lead_time + review_days) + safety, inputs.reorder_point)
+    position = inputs.on_hand + inputs.on_order
+    order_quantity = np.where(order_up_to > position, np.ceil(order_up_to - position), 0.0).astype(np.int64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_of_cover = np.where(demand > 0, inputs.on_hand / demand, np.inf)
+    return ReorderPlan(inputs, demand, forecasted, days_of_cover, order_up_to, order_quantity)
+
+
+def group_by_supplier(plan: ReorderPlan) -> List[Dict[str, Any]]:
+    """One draft per supplier (products without one under ``unassigned``), most urgent lines first."""
+    inputs = plan.inputs
+    idx = plan.suggested
+    # Most urgent first within each supplier
+    idx = idx[np.lexsort((plan.days_of_cover[idx], inputs.supplier_id[idx]))]
+    drafts: Dict[int, Dict[str, Any]] = {}
+    for i in idx.tolist():
+        supplier = int(inputs.supplier_id[i])
+        draft = drafts.get(supplier)
+        if draft is None:
+            draft = drafts[supplier] = {
+                "supplier_id": supplier if supplier >= 0 else None,
+                "supplier_name": inputs.supplier_name[i] if supplier >= 0 else UNASSIGNED,
+                "lead_time_days": float(inputs.lead_time[i]),
+                "lines": [],
+                "total_cost": 0.0,
+            }
+        qty = int(plan.order_quantity[i])
+        cover = plan.days_of_cover[i]
+        draft["lines"].append({
+            "product_id": int(inputs.product_id[i]),
+            "product_name": inputs.name[i],
+            "quantity": qty,
+            "unit_cost": float(inputs.unit_cost[i]),
+            "on_hand": float(inputs.on_hand[i]),
+            "on_order": float(inputs.on_order[i]),
+            "daily_demand": round(float(plan.daily_demand[i]), 3),
+            "days_of_cover": None if np.isinf(cover) else round(float(cover), 1),
+            "demand_source": "forecast" if plan.forecasted[i] else "rolling",
+        })
+        draft["total_cost"] += qty * float(inputs.unit_cost[i])
+    for draft in drafts.values():
+        draft["total_cost"] = round(draft["total_cost"], 2)
+    return list(drafts.values())
+
+
+def create_draft_orders(conn: Connection, pharmacy_id: int, user_id: Any,
+                        drafts: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Write drafts that have a supplier as ``draft`` purchase orders; two multi-row inserts."""
+    drafts = [d for d in drafts if d["supplier_id"] is not None and d["lines"]]
+    if not drafts:
+        return []
+    numbers = [f"PO-{str(uuid.uuid4())[:8].upper()}" for _ in drafts]
+    orders = conn.execute(text("""
+        INSERT INTO purchase_orders (pharmacy_id, supplier_id, po_number, status, total_amount, created_by, notes)
+        SELECT :ph, u.supplier_id, u.po_number, 'draft', u.total, CAST(:uid AS bigint), 'Suggested by the reorder engine'
+        FROM unnest(CAST(:suppliers AS bigint[]), CAST(:numbers AS text[]), CAST(:totals AS numeric[]))
+            AS u(supplier_id, po_number, total)
+        RETURNING id, po_number, supplier_id
+    """), {
+        "ph": pharmacy_id, "uid": user_id,
+        "suppliers": [d["supplier_id"] for d in drafts],
+        "numbers": numbers,
+        "totals": [d["total_cost"] for d in drafts],
+    }).mappings().all()
+    po_by_number = {row["po_number"]: row["id"] for row in orders}
+
+    po_ids, pids, qtys, costs = [], [], [], []
+    for number, draft in zip(numbers, drafts):
+        for line in draft["lines"]:
+            po_ids.append(po_by_number[number])
+            pids.append(line["product_id"])
+            qtys.append(line["quantity"])
+            costs.append(line["unit_cost"])
+    conn.execute(text("""
+        INSERT INTO purchase_order_items (po_id, product_id, quantity, unit_cost, total_cost)
+        SELECT u.po_id, u.product_id, u.quantity, u.unit_cost, u.quantity * u.unit_cost
+        FROM unnest(CAST(:pos AS bigint[]), CAST(:pids AS bigint[]), CAST(:qtys AS int[]), CAST(:costs AS numeric[]))
+            AS u(po_id, product_id, quantity, unit_cost)
+    """), {"pos": po_ids, "pids": pids, "qtys": qtys, "costs": costs})
+    return [
+        {"po_id": po_by_number[number], "po_number": number, "supplier_id": draft["supplier_id"],
+         "lines": len(draft["lines"]), "total_cost": draft["total_cost"]}
+        for number, draft in zip(numbers, drafts)
+    ]
+
+
+def predict_forecast_rates(service: Any, pharmacy_id: int,
+                           horizon_days: int = FORECAST_HORIZON_DAYS) -> Dict[int, float]:
+    """
+    Mean daily demand over ``horizon_days`` for every product with a trained
+    ForecastingService model. Slow; call it outside any transaction.
+    """
+    rates: Dict[int, float] = {}
+    for model in service.list_saved_models(pharmacy_id):
+        if model.get("target_type", "product") != "product" or model.get("target_id") is None:
+            continue
+        try:
+            result = service.forecast(pharmacy_id, str(model["target_id"]), days=int(horizon_days))
+        except Exception as e:
+            logger.warning("Forecast failed for pharmacy %s product %s: %s", pharmacy_id, model["target_id"], e)
+            continue
+        if result and result.get("predictions"):
+            rates[int(model["target_id"])] = max(float(np.mean(result["predictions"])), 0.0)
+    return rates
+
+
+def store_forecast_rates(conn: Connection, pharmacy_id: int, rates: Mapping[int, float],
+                         horizon_days: int = FORECAST_HORIZON_DAYS) -> None:
+    """Replace the pharmacy's stored rates; products whose model is gone fall back to rolling demand."""
+    conn.execute(text("DELETE FROM reorder_forecast_rates WHERE pharmacy_id = :ph"), {"ph": pharmacy_id})
+    if not rates:
+        return
+    conn.execute(text("""
+        INSERT INTO reorder_forecast_rates (pharmacy_id, product_id, daily_rate, horizon_days)
+        SELECT :ph, u.product_id, u.daily_rate, :horizon
+        FROM unnest(CAST(:pids AS bigint[]), CAST(:rates AS double precision[])) AS u(product_id, daily_rate)
+        JOIN products p ON p.id = u.product_id AND p.pharmacy_id = :ph
+    """), {"ph": pharmacy_id, "horizon": int(horizon_days), "pids": list(rates.keys()), "rates": list(rates.values())})
+
+
+def load_forecast_rates(conn: Connection, pharmacy_id: int,
+                        max_age_hours: float = FORECAST_MAX_AGE_HOURS) -> Dict[int, float]:
+    """Stored mean daily rates no older than ``max_age_hours``; stale ones are ignored, not used."""
+    rows = conn.execute(text("""
+        SELECT product_id, daily_rate FROM reorder_forecast_rates
+        WHERE pharmacy_id = :ph AND computed_at > now() - make_interval(secs => :age)
+    """), {"ph": pharmacy_id, "age": max_age_hours * 3600}).all()
+    return {int(pid): float(rate) for pid, rate in rows}
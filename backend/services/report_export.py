@@ -0,0 +1,346 @@
+"""
+Streaming report export (CSV / Parquet) with constant memory.
+
+A report is described by a :class:`ReportQuery` (SQL text, bind params and an
+optional per-row filter).  Rows are read through a server-side cursor
+(``stream_results`` + ``yield_per``) one partition of ``chunk_rows`` at a
+time and encoded straight into the HTTP response, so worker memory is bounded
+by the chunk size instead of the result size.
+
+Long exports can instead run as background jobs that write to
+``REPORT_EXPORT_DIR``.  Each job keeps a small JSON manifest next to its file
+so any worker on the host can report its status and serve the download.
+
+Parquet needs ``pyarrow``; without it only CSV is offered.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    pa = None
+    pq = None
+    PARQUET_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_ROWS = int(os.getenv("REPORT_EXPORT_CHUNK_ROWS", "5000"))
+EXPORT_DIR = os.getenv("REPORT_EXPORT_DIR") or os.path.join(tempfile.gettempdir(), "phoebe_exports")
+EXPORT_WORKERS = int(os.getenv("REPORT_EXPORT_WORKERS", "2"))
+EXPORT_TTL_SECONDS = int(os.getenv("REPORT_EXPORT_TTL_HOURS", "24")) * 3600
+
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+Chunk = Sequence[Sequence[Any]]
+
+
+@dataclass
+class ReportQuery:
+    """SQL for one report plus an optional filter applied to each streamed row."""
+
+    name: str
+    sql: str
+    params: Dict[str, Any] = field(default_factory=dict)
+    row_filter: Optional[Callable[[Any], bool]] = None
+
+
+def available_formats() -> List[str]:
+    return [fmt for fmt in EXPORT_FORMATS if fmt != "parquet" or PARQUET_AVAILABLE]
+
+
+def check_format(fmt: str) -> Optional[str]:
+    """Return an error message if ``fmt`` cannot be exported, else None."""
+    if fmt not in EXPORT_FORMATS:
+        return f"Unsupported export format '{fmt}' (use one of: {', '.join(EXPORT_FORMATS)})"
+    if fmt == "parquet" and not PARQUET_AVAILABLE:
+        return "Parquet export requires pyarrow, which is not installed"
+    return None
+
+
+def export_filename(report: str, fmt: str) -> str:
+    return f"{report}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{EXPORT_FORMATS[fmt][1]}"
+
+
+def stream_rows(engine: Engine, query: ReportQuery, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[Tuple[List[str], Chunk]]:
+    """
+    Yield ``(columns, rows)`` partitions from a server-side cursor.
+
+    The connection stays open while the generator is consumed and is released
+    when it is exhausted or closed (e.g. the client disconnects mid-download).
+    """
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(
+            text(query.sql), query.params
+        )
+        columns = list(result.keys())
+        emitted = False
+        for partition in result.partitions():
+            if query.row_filter is not None:
+                partition = [row for row in partition if query.row_filter(row)]
+                if not partition:
+                    continue
+            emitted = True
+            yield columns, partition
+        if not emitted:
+            yield columns, []
+
+
+def encode_csv(chunks: Iterable[Tuple[List[str], Chunk]]) -> Iterator[bytes]:
+    """Encode partitions as CSV, one output block per partition (header first)."""
+    header_written = False
+    for columns, rows in chunks:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(rows)
+        block = buf.getvalue()
+        if block:
+            yield block.encode("utf-8")
+
+
+class _DrainingSink:
+    """Write-only file object that hands its bytes out as they are produced.
+
+    pyarrow needs ``tell()`` to be the absolute offset (row group offsets go
+    into the footer), so the position is tracked separately from the buffer,
+    which is emptied after every row group.
+    """
+
+    def __init__(self) -> None:
+        self._buf = io.BytesIO()
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        n = self._buf.write(data)
+        self._position += n
+        return n
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def writable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = self._buf.getvalue()
+        self._buf.seek(0)
+        self._buf.truncate()
+        return data
+
+
+def _arrow_type(value: Any):
+    if isinstance(value, bool):
+        return pa.bool_(), None
+    if isinstance(value, int):
+        return pa.int64(), None
+    if isinstance(value, (float, Decimal)):
+        return pa.float64(), float
+    if isinstance(value, datetime):
+        return pa.timestamp("us", tz=str(value.tzinfo) if value.tzinfo else None), None
+    if isinstance(value, date):
+        return pa.date32(), None
+    return pa.string(), str
+
+
+def _arrow_schema(columns: List[str], rows: Chunk):
+    """Pick one Arrow type per column from the first non-null value seen."""
+    fields, converters = [], []
+    for idx, name in enumerate(columns):
+        sample = next((row[idx] for row in rows if row[idx] is not None), None)
+        arrow_type, convert = _arrow_type(sample) if sample is not None else (pa.string(), str)
+        fields.append(pa.field(name, arrow_type))
+        converters.append(convert)
+    return pa.schema(fields), converters
+
+
+def encode_parquet(chunks: Iterable[Tuple[List[str], Chunk]]) -> Iterator[bytes]:
+    """Encode partitions as Parquet, one row group per partition."""
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError("Parquet export requires pyarrow")
+    sink = _DrainingSink()
+    writer = None
+    schema = converters = None
+    try:
+        for columns, rows in chunks:
+            if writer is None:
+                schema, converters = _arrow_schema(columns, rows)
+                writer = pq.ParquetWriter(sink, schema, compression="snappy")
+            if not rows:
+                continue
+            arrays = []
+            for idx, (arrow_field, convert) in enumerate(zip(schema, converters)):
+                values = [row[idx] for row in rows]
+                if convert is not None:
+                    values = [None if v is None else convert(v) for v in values]
+                arrays.append(pa.array(values, type=arrow_field.type))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        if writer is not None:
+            writer.close()
+    tail = sink.drain()
+    if tail:
+        yield tail
+
+
+_ENCODERS = {"csv": encode_csv, "parquet": encode_parquet}
+
+
+def stream_report(engine: Engine, query: ReportQuery, fmt: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[bytes]:
+    """Bytes of ``query`` encoded as ``fmt``, read and written chunk by chunk."""
+    return _ENCODERS[fmt](stream_rows(engine, query, chunk_rows))
+
+
+# ---------------------------------------------------------------------------
+# Background export jobs
+# ---------------------------------------------------------------------------
+
+
+class ExportJobManager:
+    """Runs exports on a small thread pool and tracks them via JSON manifests."""
+
+    def __init__(self, directory: str = EXPORT_DIR, workers: int = EXPORT_WORKERS,
+                 ttl_seconds: int = EXPORT_TTL_SECONDS) -> None:
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="report-export")
+            return self._executor
+
+    def _manifest_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        path = self._manifest_path(job["id"])
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(job, fh)
+        os.replace(tmp, path)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        # Job ids are uuid4 hex; anything else never maps to a file.
+        if not job_id or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        try:
+            with open(self._manifest_path(job_id), encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def file_path(self, job: Dict[str, Any]) -> str:
+        return os.path.join(self.directory, job["file_name"])
+
+    def submit(self, engine: Engine, query: ReportQuery, fmt: str, owner: Dict[str, Any],
+               chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Dict[str, Any]:
+        """Queue an export of ``query``; ``owner`` (pharmacy_id, user_id) is stored for access checks."""
+        self.cleanup_expired()
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "report": query.name,
+            "format": fmt,
+            "status": "queued",
+            "rows": 0,
+            "bytes": 0,
+            "file_name": f"{job_id}.{EXPORT_FORMATS[fmt][1]}",
+            "download_name": export_filename(query.name, fmt),
+            "created_at": datetime.utcnow().isoformat(),
+            "finished_at": None,
+            "error": None,
+            **owner,
+        }
+        self._save(job)
+        self._pool().submit(self._run, engine, query, fmt, job, chunk_rows)
+        return job
+
+    def _run(self, engine: Engine, query: ReportQuery, fmt: str, job: Dict[str, Any], chunk_rows: int) -> None:
+        job["status"] = "running"
+        self._save(job)
+        started = time.perf_counter()
+        final_path = self.file_path(job)
+        tmp_path = f"{final_path}.part"
+
+        def counted(chunks):
+            for columns, rows in chunks:
+                job["rows"] += len(rows)
+                yield columns, rows
+
+        try:
+            with open(tmp_path, "wb") as fh:
+                for block in _ENCODERS[fmt](counted(stream_rows(engine, query, chunk_rows))):
+                    fh.write(block)
+                    job["bytes"] += len(block)
+            os.replace(tmp_path, final_path)
+            job["status"] = "completed"
+        except Exception as exc:
+            logger.exception("Report export %s (%s) failed", job["id"], query.name)
+            job["status"] = "failed"
+            job["error"] = str(exc)[:500]
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        job["finished_at"] = datetime.utcnow().isoformat()
+        job["seconds"] = round(time.perf_counter() - started, 2)
+        self._save(job)
+
+    def cleanup_expired(self) -> int:
+        """Delete export files and manifests older than the TTL."""
+        if not os.path.isdir(self.directory):
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+export_jobs = ExportJobManager()
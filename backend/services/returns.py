@@ -0,0 +1,241 @@
+"""
+Set-based, row-locked return processing.
+
+:func:`record_return` handles a return of any number of lines in a fixed
+number of statements:
+
+1. the original sale row is locked (``FOR UPDATE``), so concurrent returns of
+   one sale run one after the other and cannot both pass validation;
+2. one query compares the requested quantities per product with what the
+   sale sold minus what earlier (non-cancelled) returns already took back;
+3. the batches of the returned products are locked in id order - the same
+   order checkout uses in :func:`services.pos_sales.lock_available_batches`,
+   so a return and a checkout of the same products queue instead of
+   deadlocking;
+4. the returned quantity is given back to the batches the sale actually
+   consumed, most recently allocated first, using ``sale_item_allocations``.
+   Sales recorded before allocations existed fall back to the product's
+   newest batches that have sold stock;
+5. the return, its items, the allocation ``returned_quantity`` and the batch
+   ``sold_quantity`` changes are written with multi-row statements, and
+   ``inventory.current_stock`` is recomputed once per product. Each item
+   records in ``restored_quantity`` how many of its units went back into
+   stock; the rest were unplaced.
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .pos_sales import refresh_inventory_stock
+from .sales_rollup import apply_returns
+
+
+class ReturnValidationError(ValueError):
+    """The return payload is malformed."""
+
+
+class ReturnNotFound(LookupError):
+    """The sale does not exist in the pharmacy."""
+
+
+class ReturnQuantityError(ValueError):
+    """More was requested back than the sale has left to return."""
+
+    def __init__(self, conflicts: List[Dict[str, Any]]) -> None:
+        super().__init__("Return quantity exceeds the returnable quantity")
+        self.conflicts = conflicts
+
+
+@dataclass
+class ReturnLine:
+    product_id: int
+    quantity: int
+    unit_price: float
+
+
+def parse_return_items(items: Any) -> List[ReturnLine]:
+    if not isinstance(items, list) or not items:
+        raise ReturnValidationError("No items to return")
+    lines = []
+    for raw in items:
+        if not isinstance(raw, dict):
+            raise ReturnValidationError("Each item must be an object")
+        try:
+            line = ReturnLine(int(raw["product_id"]), int(raw["quantity"]), float(raw["unit_price"]))
+        except (KeyError, TypeError, ValueError):
+            raise ReturnValidationError("Each item needs product_id, quantity and unit_price")
+        if line.quantity <= 0:
+            raise ReturnValidationError(f"Quantity must be positive for product {line.product_id}")
+        if line.unit_price < 0:
+            raise ReturnValidationError(f"Unit price cannot be negative for product {line.product_id}")
+        lines.append(line)
+    return lines
+
+
+def _returnable(conn: Connection, sale_id: int, requested: Dict[int, int]) -> List[Dict[str, Any]]:
+    """Products whose requested quantity exceeds sold minus already returned."""
+    pids = sorted(requested)
+    rows = conn.execute(text("""
+        SELECT req.product_id, req.quantity AS requested,
+               COALESCE(sold.quantity, 0) - COALESCE(ret.quantity, 0) AS returnable
+        FROM unnest(CAST(:pids AS bigint[]), CAST(:qtys AS int[])) AS req(product_id, quantity)
+        LEFT JOIN (
+            SELECT product_id, SUM(quantity) AS quantity
+            FROM sale_items WHERE sale_id = :sale_id
+            GROUP BY product_id
+        ) sold ON sold.product_id = req.product_id
+        LEFT JOIN (
+            SELECT ri.product_id, SUM(ri.quantity) AS quantity
+            FROM return_items ri
+            JOIN returns r ON r.id = ri.return_id
+            WHERE r.sale_id = :sale_id AND COALESCE(r.status, 'completed') <> 'cancelled'
+            GROUP BY ri.product_id
+        ) ret ON ret.product_id = req.product_id
+        WHERE req.quantity > COALESCE(sold.quantity, 0) - COALESCE(ret.quantity, 0)
+    """), {"pids": pids, "qtys": [requested[p] for p in pids], "sale_id": sale_id}).mappings().all()
+    return [
+        {"product_id": row["product_id"], "requested": int(row["requested"]), "returnable": max(int(row["returnable"]), 0)}
+        for row in rows
+    ]
+
+
+def _plan_restorations(conn: Connection, sale_id: int, requested: Dict[int, int]
+                       ) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int, int]], Dict[int, int]]:
+    """
+    Lock the products' batches and decide where returned units go back.
+    Returns ``([(allocation_id, qty)], [(batch_id, product_id, qty)], {product_id: unplaced qty})``.
+    """
+    pids = sorted(requested)
+    batches = conn.execute(text("""
+        SELECT id, product_id, received_at, sold_quantity
+        FROM inventory_batches
+        WHERE product_id = ANY(:pids)
+        ORDER BY id
+        FOR UPDATE
+    """), {"pids": pids}).mappings().all()
+    sold_left = {row["id"]: int(row["sold_quantity"] or 0) for row in batches}
+
+    # Sale rows are locked by the caller, so this sale's allocations cannot change underneath us
+    allocations = conn.execute(text("""
+        SELECT a.id, a.batch_id, si.product_id, a.quantity - a.returned_quantity AS open_quantity
+        FROM sale_item_allocations a
+        JOIN sale_items si ON si.id = a.sale_item_id
+        WHERE si.sale_id = :sale_id AND si.product_id = ANY(:pids)
+          AND a.quantity > a.returned_quantity
+        ORDER BY a.id DESC
+    """), {"sale_id": sale_id, "pids": pids}).mappings().all()
+
+    remaining = dict(requested)
+    alloc_updates: List[Tuple[int, int]] = []
+    restored: Dict[Tuple[int, int], int] = {}
+    for alloc in allocations:
+        pid = alloc["product_id"]
+        qty = min(remaining.get(pid, 0), int(alloc["open_quantity"]), sold_left.get(alloc["batch_id"], 0))
+        if qty <= 0:
+            continue
+        remaining[pid] -= qty
+        sold_left[alloc["batch_id"]] -= qty
+        alloc_updates.append((alloc["id"], qty))
+        restored[(alloc["batch_id"], pid)] = restored.get((alloc["batch_id"], pid), 0) + qty
+
+    # Sales without allocations (recorded before they existed): newest batches with sold stock
+    fallback = sorted(batches, key=lambda b: (b["received_at"] is not None, b["received_at"], b["id"]), reverse=True)
+    for batch in fallback:
+        pid = batch["product_id"]
+        qty = min(remaining.get(pid, 0), sold_left[batch["id"]])
+        if qty <= 0:
+            continue
+        remaining[pid] -= qty
+        sold_left[batch["id"]] -= qty
+        restored[(batch["id"], pid)] = restored.get((batch["id"], pid), 0) + qty
+
+    unplaced = {pid: qty for pid, qty in remaining.items() if qty > 0}
+    return alloc_updates, [(batch_id, pid, qty) for (batch_id, pid), qty in restored.items()], unplaced
+
+
+def record_return(conn: Connection, pharmacy_id: int, user_id: Any, sale_id: int, reason: str,
+                  lines: Sequence[ReturnLine]) -> Dict[str, Any]:
+    """Validate and write a return inside the caller's transaction; see the module docstring."""
+    sale = conn.execute(text("""
+        SELECT id, sale_number FROM sales
+        WHERE id = :sale_id AND pharmacy_id = :ph
+        FOR UPDATE
+    """), {"sale_id": sale_id, "ph": pharmacy_id}).mappings().first()
+    if not sale:
+        raise ReturnNotFound("Sale not found")
+
+    requested: Dict[int, int] = {}
+    for line in lines:
+        requested[line.product_id] = requested.get(line.product_id, 0) + line.quantity
+    conflicts = _returnable(conn, sale_id, requested)
+    if conflicts:
+        raise ReturnQuantityError(conflicts)
+
+    alloc_updates, restorations, unplaced = _plan_restorations(conn, sale_id, requested)
+
+    # Restored units are credited to the lines in order; what no batch could take stays unplaced
+    restored_left = {pid: qty - unplaced.get(pid, 0) for pid, qty in requested.items()}
+    line_restored = []
+    for line in lines:
+        qty = min(line.quantity, restored_left[line.product_id])
+        restored_left[line.product_id] -= qty
+        line_restored.append(qty)
+
+    return_number = f"RET-{sale['sale_number']}-{int(time.time())}"
+    total_refund = sum(line.quantity * line.unit_price for line in lines)
+    return_id = conn.execute(text("""
+        INSERT INTO returns (return_number, sale_id, pharmacy_id, user_id, reason, total_refund_amount, status)
+        VALUES (:return_number, :sale_id, :ph, :user_id, :reason, :total_refund, 'completed')
+        RETURNING id
+    """), {
+        "return_number": return_number, "sale_id": sale_id, "ph": pharmacy_id,
+        "user_id": user_id, "reason": reason, "total_refund": total_refund,
+    }).scalar()
+
+    conn.execute(text("""
+        INSERT INTO return_items (return_id, product_id, quantity, unit_price, restored_quantity)
+        SELECT :return_id, u.product_id, u.quantity, u.unit_price, u.restored
+        FROM unnest(CAST(:pids AS bigint[]), CAST(:qtys AS int[]), CAST(:prices AS numeric[]), CAST(:restored AS int[]))
+            WITH ORDINALITY AS u(product_id, quantity, unit_price, restored, ord)
+        ORDER BY u.ord
+    """), {
+        "return_id": return_id,
+        "pids": [line.product_id for line in lines],
+        "qtys": [line.quantity for line in lines],
+        "prices": [line.unit_price for line in lines],
+        "restored": line_restored,
+    })
+
+    if alloc_updates:
+        conn.execute(text("""
+            UPDATE sale_item_allocations a
+            SET returned_quantity = a.returned_quantity + u.quantity
+            FROM unnest(CAST(:ids AS bigint[]), CAST(:qtys AS int[])) AS u(id, quantity)
+            WHERE a.id = u.id
+        """), {"ids": [a for a, _ in alloc_updates], "qtys": [q for _, q in alloc_updates]})
+    if restorations:
+        conn.execute(text("""
+            UPDATE inventory_batches b
+            SET sold_quantity = b.sold_quantity - u.quantity
+            FROM unnest(CAST(:ids AS bigint[]), CAST(:qtys AS int[])) AS u(id, quantity)
+            WHERE b.id = u.id
+        """), {"ids": [b for b, _, _ in restorations], "qtys": [q for _, _, q in restorations]})
+
+    refresh_inventory_stock(conn, requested)
+    # Late returns correct the rollup day of the original sale
+    apply_returns(conn, [return_id])
+
+    return {
+        "return_id": return_id,
+        "return_number": return_number,
+        "total_refund": total_refund,
+        "restored": [{"batch_id": b, "product_id": p, "quantity": q} for b, p, q in sorted(restorations)],
+        # Units no batch had sold stock for (data from before batch tracking); stock is not raised for them
+        "unplaced": [{"product_id": p, "quantity": q} for p, q in sorted(unplaced.items())],
+    }
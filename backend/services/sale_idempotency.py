@@ -0,0 +1,152 @@
+"""
+Idempotency keys for POS sale submission.
+
+A terminal sends an ``Idempotency-Key`` with each sale. The first request
+claims the key in ``sale_idempotency`` (unique per pharmacy) in the same
+transaction as the sale and stores the receipt it returned. A retry of the
+same key:
+
+* hits :data:`recent_keys`, an in-process cache of recently completed keys,
+  and is answered without touching the database, or
+* conflicts on the unique key in the database (waiting for the first request
+  to commit if it is still running) and gets the stored receipt back.
+
+Either way the sale and its batch allocation run exactly once. Keys reused
+with a different payload are rejected. Rows older than
+``SALE_IDEMPOTENCY_TTL_HOURS`` are purged periodically, together with bulk
+upload keys (``pos_bulk_sale_requests``) older than
+``POS_BULK_REQUEST_TTL_HOURS``; offline terminals may retry an upload much
+later than a single sale, so that window is longer.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("SALE_IDEMPOTENCY_TTL_HOURS", "24"))
+BULK_REQUEST_TTL_HOURS = int(os.getenv("POS_BULK_REQUEST_TTL_HOURS", "72"))
+RECENT_KEY_CACHE_SIZE = int(os.getenv("SALE_IDEMPOTENCY_CACHE_SIZE", "10000"))
+RECENT_KEY_CACHE_TTL = float(os.getenv("SALE_IDEMPOTENCY_CACHE_TTL", "600"))
+PURGE_INTERVAL_SECONDS = 900
+MAX_KEY_LENGTH = 200
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different request payload."""
+
+
+def request_fingerprint(payload: Dict[str, Any]) -> str:
+    """Stable hash of a request body, ignoring the key itself."""
+    body = {k: v for k, v in (payload or {}).items() if k != "idempotency_key"}
+    raw = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class RecentKeyCache:
+    """
+    Thread-safe LRU of completed keys -> (fingerprint, response), with a TTL.
+    ``scope`` is the pharmacy id, matching the unique key of ``sale_idempotency``.
+    """
+
+    def __init__(self, max_entries: int = RECENT_KEY_CACHE_SIZE, ttl: float = RECENT_KEY_CACHE_TTL) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[Any, str], Tuple[float, str, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, scope: Any, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get((scope, key))
+            if entry is None:
+                return None
+            expires, fingerprint, response = entry
+            if expires < time.monotonic():
+                del self._entries[(scope, key)]
+                return None
+            self._entries.move_to_end((scope, key))
+            return fingerprint, response
+
+    def put(self, scope: Any, key: str, fingerprint: str, response: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[(scope, key)] = (time.monotonic() + self.ttl, fingerprint, response)
+            self._entries.move_to_end((scope, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+recent_keys = RecentKeyCache()
+
+
+def claim_key(conn: Connection, pharmacy_id: int, key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+    """
+    Claim ``key`` for this transaction. Returns None when the caller owns the
+    key and should process the sale, or the stored response of the earlier
+    request. Raises :class:`IdempotencyConflict` on a payload mismatch.
+    """
+    claimed = conn.execute(text("""
+        INSERT INTO sale_idempotency (pharmacy_id, idempotency_key, request_hash)
+        VALUES (:ph, :key, :hash)
+        ON CONFLICT (pharmacy_id, idempotency_key) DO NOTHING
+        RETURNING 1
+    """), {"ph": pharmacy_id, "key": key, "hash": fingerprint}).first()
+    if claimed:
+        return None
+    stored = conn.execute(text("""
+        SELECT request_hash, response FROM sale_idempotency
+        WHERE pharmacy_id = :ph AND idempotency_key = :key
+    """), {"ph": pharmacy_id, "key": key}).mappings().first()
+    if stored is None or stored["response"] is None:
+        # Purged between the insert and the read; treat as an in-flight duplicate.
+        raise IdempotencyConflict("A request with this Idempotency-Key is still being processed")
+    if stored["request_hash"] != fingerprint:
+        raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+    return stored["response"]
+
+
+def store_response(conn: Connection, pharmacy_id: int, key: str, sale_id: int, response: Dict[str, Any]) -> None:
+    conn.execute(text("""
+        UPDATE sale_idempotency
+        SET sale_id = :sale_id, response = CAST(:response AS jsonb)
+        WHERE pharmacy_id = :ph AND idempotency_key = :key
+    """), {"ph": pharmacy_id, "key": key, "sale_id": sale_id, "response": json.dumps(response, default=str)})
+
+
+def purge_expired_keys(conn: Connection, ttl_hours: int = IDEMPOTENCY_TTL_HOURS,
+                       bulk_ttl_hours: int = BULK_REQUEST_TTL_HOURS) -> int:
+    result = conn.execute(
+        text("DELETE FROM sale_idempotency WHERE created_at < now() - make_interval(hours => :h)"),
+        {"h": ttl_hours},
+    )
+    bulk = conn.execute(
+        text("DELETE FROM pos_bulk_sale_requests WHERE created_at < now() - make_interval(hours => :h)"),
+        {"h": bulk_ttl_hours},
+    )
+    return (result.rowcount or 0) + (bulk.rowcount or 0)
+
+
+_last_purge = 0.0
+_purge_lock = threading.Lock()
+
+
+def purge_due() -> bool:
+    """True at most once per PURGE_INTERVAL_SECONDS per process."""
+    global _last_purge
+    now = time.monotonic()
+    with _purge_lock:
+        if now - _last_purge < PURGE_INTERVAL_SECONDS:
+            return False
+        _last_purge = now
+        return True
@@ -0,0 +1,243 @@
+"""
+Daily sales rollups at (pharmacy, product, day) and (pharmacy, day) grain.
+
+The sale and return write paths call :func:`apply_sales` / :func:`apply_returns`
+inside their own transaction, so the rollups stay in step with ``sales``,
+``sale_items`` and ``returns``.  Returns are attributed to the day of the
+original sale; a return that arrives weeks later corrects that earlier day
+instead of showing up as negative sales on the return date.
+
+Every sale of a pharmacy falls on the same (pharmacy, day) row, so the write
+paths do not update it: they append their totals to
+``sales_rollup_pharmacy_deltas`` instead, which takes no shared lock.
+Readers of ``sales_rollup_pharmacy_daily`` call :func:`fold_pharmacy_deltas`
+first; it moves the committed deltas of the pharmacy into the daily rows in
+a short transaction of its own.
+
+:func:`rebuild_sales_rollups` re-derives any pharmacy/date window from the raw
+tables (backfill, repair after bulk deletes).
+
+Cost is the line's ``sale_items.unit_cost``, recorded when it was sold, so
+editing a product's cost price does not change past days. Lines without
+one fall back to the current ``products.cost_price``.
+"""
+
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional, Union
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+DateLike = Union[date, datetime, str]
+
+_SALE_TOTAL = "coalesce(s.total_amount, s.subtotal + coalesce(s.tax_amount, 0) - coalesce(s.discount_amount, 0))"
+
+_PRODUCT_SALES_SQL = """
+    INSERT INTO sales_rollup_product_daily AS t
+        (pharmacy_id, product_id, day, quantity_sold, revenue, cost, sale_lines)
+    SELECT s.pharmacy_id, si.product_id, s.created_at::date,
+           sum(si.quantity), sum(si.quantity * si.unit_price),
+           sum(si.quantity * coalesce(si.unit_cost, p.cost_price, 0)), count(*)
+    FROM sales s
+    JOIN sale_items si ON si.sale_id = s.id
+    LEFT JOIN products p ON p.id = si.product_id
+    WHERE s.status = 'completed' AND {filter}
+    GROUP BY s.pharmacy_id, si.product_id, s.created_at::date
+    ON CONFLICT (pharmacy_id, product_id, day) DO UPDATE SET
+        quantity_sold = t.quantity_sold + excluded.quantity_sold,
+        revenue = t.revenue + excluded.revenue,
+        cost = t.cost + excluded.cost,
+        sale_lines = t.sale_lines + excluded.sale_lines,
+        updated_at = now()
+"""
+
+_PHARMACY_SALES_COLUMNS = "(pharmacy_id, day, sale_count, quantity_sold, revenue, cost, total_amount)"
+
+_PHARMACY_SALES_SELECT = f"""
+    SELECT s.pharmacy_id, s.created_at::date, count(*),
+           coalesce(sum(l.quantity), 0), coalesce(sum(l.revenue), 0),
+           coalesce(sum(l.cost), 0), sum({_SALE_TOTAL})
+    FROM sales s
+    LEFT JOIN LATERAL (
+        SELECT sum(si.quantity) AS quantity,
+               sum(si.quantity * si.unit_price) AS revenue,
+               sum(si.quantity * coalesce(si.unit_cost, p.cost_price, 0)) AS cost
+        FROM sale_items si
+        LEFT JOIN products p ON p.id = si.product_id
+        WHERE si.sale_id = s.id
+    ) l ON true
+    WHERE s.status = 'completed' AND {{filter}}
+    GROUP BY s.pharmacy_id, s.created_at::date
+"""
+
+_PHARMACY_SALES_SQL = f"""
+    INSERT INTO sales_rollup_pharmacy_daily AS t {_PHARMACY_SALES_COLUMNS}
+    {_PHARMACY_SALES_SELECT}
+    ON CONFLICT (pharmacy_id, day) DO UPDATE SET
+        sale_count = t.sale_count + excluded.sale_count,
+        quantity_sold = t.quantity_sold + excluded.quantity_sold,
+        revenue = t.revenue + excluded.revenue,
+        cost = t.cost + excluded.cost,
+        total_amount = t.total_amount + excluded.total_amount,
+        updated_at = now()
+"""
+
+_PHARMACY_SALES_DELTA_SQL = f"""
+    INSERT INTO sales_rollup_pharmacy_deltas {_PHARMACY_SALES_COLUMNS}
+    {_PHARMACY_SALES_SELECT}
+"""
+
+_PRODUCT_RETURNS_SQL = """
+    INSERT INTO sales_rollup_product_daily AS t
+        (pharmacy_id, product_id, day, quantity_returned, refund_amount)
+    SELECT r.pharmacy_id, ri.product_id, s.created_at::date,
+           sum(ri.quantity), sum(ri.quantity * ri.unit_price)
+    FROM returns r
+    JOIN return_items ri ON ri.return_id = r.id
+    JOIN sales s ON s.id = r.sale_id
+    WHERE coalesce(r.status, 'completed') = 'completed' AND {filter}
+    GROUP BY r.pharmacy_id, ri.product_id, s.created_at::date
+    ON CONFLICT (pharmacy_id, product_id, day) DO UPDATE SET
+        quantity_returned = t.quantity_returned + excluded.quantity_returned,
+        refund_amount = t.refund_amount + excluded.refund_amount,
+        updated_at = now()
+"""
+
+_PHARMACY_RETURNS_COLUMNS = "(pharmacy_id, day, return_count, quantity_returned, refund_amount)"
+
+_PHARMACY_RETURNS_SELECT = """
+    SELECT r.pharmacy_id, s.created_at::date, count(*),
+           coalesce(sum(ri.quantity), 0), coalesce(sum(r.total_refund_amount), 0)
+    FROM returns r
+    JOIN sales s ON s.id = r.sale_id
+    LEFT JOIN LATERAL (
+        SELECT sum(quantity) AS quantity FROM return_items WHERE return_id = r.id
+    ) ri ON true
+    WHERE coalesce(r.status, 'completed') = 'completed' AND {filter}
+    GROUP BY r.pharmacy_id, s.created_at::date
+"""
+
+_PHARMACY_RETURNS_SQL = f"""
+    INSERT INTO sales_rollup_pharmacy_daily AS t {_PHARMACY_RETURNS_COLUMNS}
+    {_PHARMACY_RETURNS_SELECT}
+    ON CONFLICT (pharmacy_id, day) DO UPDATE SET
+        return_count = t.return_count + excluded.return_count,
+        quantity_returned = t.quantity_returned + excluded.quantity_returned,
+        refund_amount = t.refund_amount + excluded.refund_amount,
+        updated_at = now()
+"""
+
+_PHARMACY_RETURNS_DELTA_SQL = f"""
+    INSERT INTO sales_rollup_pharmacy_deltas {_PHARMACY_RETURNS_COLUMNS}
+    {_PHARMACY_RETURNS_SELECT}
+"""
+
+_FOLD_SQL = """
+    WITH moved AS (
+        DELETE FROM sales_rollup_pharmacy_deltas WHERE pharmacy_id = :ph
+        RETURNING pharmacy_id, day, sale_count, quantity_sold, revenue, cost, total_amount,
+                  return_count, quantity_returned, refund_amount
+    )
+    INSERT INTO sales_rollup_pharmacy_daily AS t
+        (pharmacy_id, day, sale_count, quantity_sold, revenue, cost, total_amount,
+         return_count, quantity_returned, refund_amount)
+    SELECT pharmacy_id, day, sum(sale_count), sum(quantity_sold), sum(revenue), sum(cost), sum(total_amount),
+           sum(return_count), sum(quantity_returned), sum(refund_amount)
+    FROM moved
+    GROUP BY pharmacy_id, day
+    ON CONFLICT (pharmacy_id, day) DO UPDATE SET
+        sale_count = t.sale_count + excluded.sale_count,
+        quantity_sold = t.quantity_sold + excluded.quantity_sold,
+        revenue = t.revenue + excluded.revenue,
+        cost = t.cost + excluded.cost,
+        total_amount = t.total_amount + excluded.total_amount,
+        return_count = t.return_count + excluded.return_count,
+        quantity_returned = t.quantity_returned + excluded.quantity_returned,
+        refund_amount = t.refund_amount + excluded.refund_amount,
+        updated_at = now()
+"""
+
+
+def _ids(values: Iterable[int]) -> list:
+    return sorted({int(v) for v in values if v is not None})
+
+
+def apply_sales(conn: Connection, sale_ids: Iterable[int]) -> None:
+    """Add newly inserted completed sales to the rollups (same transaction as the insert)."""
+    ids = _ids(sale_ids)
+    if not ids:
+        return
+    params = {"sale_ids": ids}
+    conn.execute(text(_PRODUCT_SALES_SQL.format(filter="s.id = ANY(:sale_ids)")), params)
+    conn.execute(text(_PHARMACY_SALES_DELTA_SQL.format(filter="s.id = ANY(:sale_ids)")), params)
+
+
+def apply_returns(conn: Connection, return_ids: Iterable[int]) -> None:
+    """Add newly inserted returns to the rollup day of their original sale."""
+    ids = _ids(return_ids)
+    if not ids:
+        return
+    params = {"return_ids": ids}
+    conn.execute(text(_PRODUCT_RETURNS_SQL.format(filter="r.id = ANY(:return_ids)")), params)
+    conn.execute(text(_PHARMACY_RETURNS_DELTA_SQL.format(filter="r.id = ANY(:return_ids)")), params)
+
+
+def fold_pharmacy_deltas(conn: Connection, pharmacy_id: int) -> None:
+    """Move the pharmacy's committed deltas into ``sales_rollup_pharmacy_daily`` before a read; committed at once."""
+    if conn.execute(text(_FOLD_SQL), {"ph": pharmacy_id}).rowcount:
+        conn.commit()
+
+
+def _as_date(value: Optional[DateLike]) -> Optional[date]:
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return datetime.fromisoformat(str(value)).date()
+
+
+def rebuild_sales_rollups(
+    conn: Connection,
+    pharmacy_id: Optional[int] = None,
+    date_from: Optional[DateLike] = None,
+    date_to: Optional[DateLike] = None,
+) -> Dict[str, int]:
+    """
+    Recompute the rollups for a pharmacy (or all) over an inclusive day range
+    (or all history) from the raw sale and return tables.
+    """
+    start = _as_date(date_from)
+    end = _as_date(date_to)
+
+    rollup_filter = ["true"]
+    sale_filter = ["true"]
+    params: Dict[str, object] = {}
+    if pharmacy_id is not None:
+        params["ph"] = int(pharmacy_id)
+        rollup_filter.append("pharmacy_id = :ph")
+        sale_filter.append("s.pharmacy_id = :ph")
+    if start is not None:
+        params["start"] = start
+        rollup_filter.append("day >= :start")
+        sale_filter.append("s.created_at >= :start")
+    if end is not None:
+        params["end_excl"] = end + timedelta(days=1)
+        rollup_filter.append("day < :end_excl")
+        sale_filter.append("s.created_at < :end_excl")
+
+    where_rollup = " AND ".join(rollup_filter)
+    where_sales = " AND ".join(sale_filter)
+    # Returns are keyed by the sale's day, so the same sale-date window selects them.
+    where_returns = where_sales.replace("s.pharmacy_id", "r.pharmacy_id")
+
+    deleted = conn.execute(text(f"DELETE FROM sales_rollup_product_daily WHERE {where_rollup}"), params).rowcount or 0
+    conn.execute(text(f"DELETE FROM sales_rollup_pharmacy_daily WHERE {where_rollup}"), params)
+    conn.execute(text(f"DELETE FROM sales_rollup_pharmacy_deltas WHERE {where_rollup}"), params)
+    product_rows = conn.execute(text(_PRODUCT_SALES_SQL.format(filter=where_sales)), params).rowcount or 0
+    conn.execute(text(_PHARMACY_SALES_SQL.format(filter=where_sales)), params)
+    conn.execute(text(_PRODUCT_RETURNS_SQL.format(filter=where_returns)), params)
+    conn.execute(text(_PHARMACY_RETURNS_SQL.format(filter=where_returns)), params)
+    return {"deleted": deleted, "product_day_rows": product_rows}
+
@@ -0,0 +1,210 @@
+"""
+Per-tenant storage accounting from Postgres statistics.
+
+``tenant_storage_usage`` holds, per pharmacy and table, the tenant's row count,
+its sampled average row width and its share of the table's real on-disk size.
+The admin endpoints only read it; :func:`refresh_storage_usage` rebuilds it on
+a schedule (``scripts/refresh_tenant_storage.py``).
+
+Row counts are maintained incrementally. Insert/delete triggers on every table
+in :data:`TENANT_TABLES` append per-pharmacy deltas to
+``tenant_row_count_deltas``. That table is insert-only, so writers never wait
+on a shared counter row. :func:`fold_deltas` adds the deltas to
+``tenant_row_counts``. :func:`recount` recounts exactly; it runs at creation
+and is available for repair. Tables keyed through a parent (sale items via
+their sale) lose deltas when the parent is deleted with them. A periodic
+``--recount`` corrects that.
+
+Sizes come from ``pg_total_relation_size`` (heap, TOAST and indexes). The
+total is split across tenants in proportion to ``row_count * avg_row_bytes``.
+Row widths are measured with ``pg_column_size`` over a ``TABLESAMPLE SYSTEM``
+sample of about :data:`SAMPLE_ROWS` rows per table. Tenants that are missing
+from the sample get the table-wide width.
+"""
+
+from __future__ import annotations
+
+import os
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+SAMPLE_ROWS = int(os.getenv("TENANT_STORAGE_SAMPLE_ROWS", "20000"))
+STORAGE_LIMIT_GB = 10
+
+# (category, table, parent) - parent is (parent table, foreign key column) for tables without pharmacy_id
+TENANT_TABLES: Tuple[Tuple[str, str, Optional[Tuple[str, str]]], ...] = (
+    ("products", "products", None),
+    ("inventory", "inventory", ("products", "product_id")),
+    ("inventory", "inventory_batches", ("products", "product_id")),
+    ("transactions", "sales", None),
+    ("transactions", "sale_items", ("sales", "sale_id")),
+    ("users", "users", None),
+    ("support", "support_tickets", None),
+    ("support", "support_ticket_messages", ("support_tickets", "ticket_id")),
+)
+
+
+def _from(table: str, parent: Optional[Tuple[str, str]], source: str, sample: str = "") -> Tuple[str, str]:
+    """FROM clause over ``source`` (a table or transition table) and the pharmacy_id expression."""
+    relation = f"{source} t {sample}".rstrip()
+    if parent is None:
+        return relation, "t.pharmacy_id"
+    parent_table, fk = parent
+    return f"{relation} JOIN {parent_table} par ON par.id = t.{fk}", "par.pharmacy_id"
+
+
+def trigger_function_sql(table: str, parent: Optional[Tuple[str, str]]) -> str:
+    """``CREATE FUNCTION tenant_rows_<table>_changed()`` appending the statement's row deltas."""
+    inserted, ph_new = _from(table, parent, "new_rows")
+    deleted, ph_old = _from(table, parent, "old_rows")
+    return f"""
+        CREATE OR REPLACE FUNCTION tenant_rows_{table}_changed()
+        RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO tenant_row_count_deltas (pharmacy_id, table_name, delta)
+                SELECT {ph_new}, '{table}', count(*) FROM {inserted}
+                WHERE {ph_new} IS NOT NULL GROUP BY {ph_new};
+            ELSE
+                INSERT INTO tenant_row_count_deltas (pharmacy_id, table_name, delta)
+                SELECT {ph_old}, '{table}', -count(*) FROM {deleted}
+                WHERE {ph_old} IS NOT NULL GROUP BY {ph_old};
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """
+
+
+def existing_tables(conn: Connection) -> List[Tuple[str, str, Optional[Tuple[str, str]]]]:
+    """Entries of :data:`TENANT_TABLES` whose table (and parent) exist; some are created lazily."""
+    names = sorted({t for _, t, _ in TENANT_TABLES} | {p[0] for _, _, p in TENANT_TABLES if p})
+    present = set(conn.execute(text("""
+        SELECT n FROM unnest(CAST(:names AS text[])) AS n WHERE to_regclass('public.' || n) IS NOT NULL
+    """), {"names": names}).scalars().all())
+    return [e for e in TENANT_TABLES if e[1] in present and (e[2] is None or e[2][0] in present)]
+
+
+def recount(conn: Connection, tables: Optional[Iterable[str]] = None) -> None:
+    """Exact per-tenant counts; deltas of the table are cleared in the same snapshot."""
+    only = set(tables) if tables is not None else None
+    for _, table, parent in existing_tables(conn):
+        if only is not None and table not in only:
+            continue
+        source, ph = _from(table, parent, table)
+        conn.execute(text(f"""
+            WITH cleared AS (
+                DELETE FROM tenant_row_count_deltas WHERE table_name = :t RETURNING 1
+            ), counted AS (
+                SELECT ph.id AS pharmacy_id, COALESCE(c.n, 0) AS n
+                FROM pharmacies ph
+                LEFT JOIN (SELECT {ph} AS pharmacy_id, count(*) AS n FROM {source} GROUP BY {ph}) c
+                    ON c.pharmacy_id = ph.id
+            )
+            INSERT INTO tenant_row_counts (pharmacy_id, table_name, row_count)
+            SELECT pharmacy_id, :t, n FROM counted
+            ON CONFLICT (pharmacy_id, table_name) DO UPDATE SET row_count = excluded.row_count, updated_at = now()
+        """), {"t": table})
+
+
+def fold_deltas(conn: Connection) -> None:
+    """Add pending deltas to tenant_row_counts."""
+    conn.execute(text("""
+        WITH folded AS (
+            DELETE FROM tenant_row_count_deltas RETURNING pharmacy_id, table_name, delta
+        ), summed AS (
+            SELECT f.pharmacy_id, f.table_name, SUM(f.delta) AS delta
+            FROM folded f
+            JOIN pharmacies ph ON ph.id = f.pharmacy_id
+            GROUP BY f.pharmacy_id, f.table_name
+        )
+        INSERT INTO tenant_row_counts AS c (pharmacy_id, table_name, row_count)
+        SELECT pharmacy_id, table_name, delta FROM summed
+        ON CONFLICT (pharmacy_id, table_name) DO UPDATE
+        SET row_count = GREATEST(c.row_count + excluded.row_count, 0), updated_at = now()
+    """))
+
+
+def _sample_widths(conn: Connection, table: str, parent: Optional[Tuple[str, str]]) -> Tuple[Dict[int, Decimal], Decimal]:
+    """Average row bytes per pharmacy from a block sample, and the sample-wide average."""
+    reltuples = conn.execute(text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:t)"),
+                             {"t": f"public.{table}"}).scalar() or 0
+    percent = 100.0 if reltuples <= SAMPLE_ROWS else max(0.01, 100.0 * SAMPLE_ROWS / float(reltuples))
+    source, ph = _from(table, parent, table, f"TABLESAMPLE SYSTEM ({percent:.4f})")
+    rows = conn.execute(text(f"""
+        SELECT {ph} AS pharmacy_id, count(*) AS n, AVG(pg_column_size(t.*)) AS width
+        FROM {source}
+        GROUP BY {ph}
+    """)).mappings().all()
+    sampled = sum(int(r["n"]) for r in rows)
+    overall = (sum(Decimal(r["width"]) * int(r["n"]) for r in rows) / sampled) if sampled else Decimal(0)
+    return {int(r["pharmacy_id"]): Decimal(r["width"]) for r in rows if r["pharmacy_id"] is not None}, overall
+
+
+def refresh_table_usage(conn: Connection, category: str, table: str, parent: Optional[Tuple[str, str]]) -> int:
+    """Recompute tenant_storage_usage rows of one table; returns the tenants written."""
+    widths, overall = _sample_widths(conn, table, parent)
+    stats = conn.execute(text("""
+        SELECT pg_total_relation_size(to_regclass(:t)) AS total_bytes,
+               GREATEST((SELECT reltuples FROM pg_class WHERE oid = to_regclass(:t)), 0) AS reltuples
+    """), {"t": f"public.{table}"}).mappings().one()
+    counts = conn.execute(text("""
+        SELECT pharmacy_id, row_count FROM tenant_row_counts WHERE table_name = :t ORDER BY pharmacy_id
+    """), {"t": table}).all()
+    if not counts:
+        return 0
+    data = [(int(ph), max(int(n), 0), widths.get(int(ph), overall)) for ph, n in counts]
+    tenant_bytes = sum(Decimal(n) * w for _, n, w in data)
+    # Rows outside any tenant (e.g. admin users) keep their share of the relation
+    unattributed = max(Decimal(str(stats["reltuples"])) - sum(Decimal(n) for _, n, _ in data), Decimal(0)) * overall
+    denominator = tenant_bytes + unattributed
+    total = Decimal(int(stats["total_bytes"] or 0))
+    sizes = [int(total * Decimal(n) * w / denominator) if denominator > 0 else 0 for _, n, w in data]
+    conn.execute(text("""
+        INSERT INTO tenant_storage_usage AS u (pharmacy_id, table_name, category, row_count, avg_row_bytes, size_bytes, refreshed_at)
+        SELECT v.pharmacy_id, :t, :category, v.row_count, v.avg_row_bytes, v.size_bytes, now()
+        FROM unnest(CAST(:ph AS bigint[]), CAST(:n AS bigint[]), CAST(:w AS numeric[]), CAST(:size AS bigint[]))
+            AS v(pharmacy_id, row_count, avg_row_bytes, size_bytes)
+        ON CONFLICT (pharmacy_id, table_name) DO UPDATE SET
+            category = excluded.category, row_count = excluded.row_count, avg_row_bytes = excluded.avg_row_bytes,
+            size_bytes = excluded.size_bytes, refreshed_at = excluded.refreshed_at
+    """), {
+        "t": table, "category": category,
+        "ph": [ph for ph, _, _ in data], "n": [n for _, n, _ in data],
+        "w": [round(w, 2) for _, _, w in data], "size": sizes,
+    })
+    return len(data)
+
+
+def refresh_storage_usage(engine: Engine, full_recount: bool = False) -> Dict[str, int]:
+    """Fold (or recount) row counts, then refresh every table's usage in its own transaction."""
+    with engine.begin() as conn:
+        if full_recount:
+            recount(conn)
+        else:
+            fold_deltas(conn)
+        tables = existing_tables(conn)
+    written = {}
+    for category, table, parent in tables:
+        with engine.begin() as conn:
+            written[table] = refresh_table_usage(conn, category, table, parent)
+    return written
+
+
+def storage_breakdown(conn: Connection, pharmacy_id: int) -> Sequence[Any]:
+    """Stored usage of one pharmacy by category, largest first."""
+    return conn.execute(text("""
+        SELECT category AS category_name,
+               SUM(row_count) AS record_count,
+               SUM(size_bytes) AS size_bytes,
+               pg_size_pretty(SUM(size_bytes)::bigint) AS total_size,
+               MAX(refreshed_at) AS refreshed_at
+        FROM tenant_storage_usage
+        WHERE pharmacy_id = :ph
+        GROUP BY category
+        HAVING SUM(row_count) > 0
+        ORDER BY size_bytes DESC
+    """), {"ph": pharmacy_id}).mappings().all()
@@ -0,0 +1,167 @@
+"""
+Full-text search over support tickets, ticket messages and announcements.
+
+Each searchable table has a generated ``search_vector`` column with a GIN index
+(see ``database.schema.ensure_support_search``). Titles weigh more than bodies:
+
+* ``support_tickets``: ticket number and subject (A), description (B);
+* ``support_ticket_messages``: message (C);
+* ``announcements``: title (A), content (B).
+
+:func:`prefix_query` turns user input into a ``tsquery`` in which every word is
+a prefix match, ANDed together, so ``"insu ref"`` finds "Insulin refund".
+Results are ordered by ``ts_rank``. Snippets come from ``ts_headline``, run
+only on the returned page. Snippets are HTML-escaped, and the matches are
+wrapped in ``<mark>``.
+
+Date filters are half-open ranges on ``created_at`` (``>= from`` and
+``< to + 1 day``), so the ``created_at`` indexes are usable.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+SEARCH_CONFIG = "simple"
+MAX_QUERY_TERMS = 8
+HEADLINE_OPTIONS = "MaxFragments=2, MaxWords=18, MinWords=6, StartSel=<mark>, StopSel=</mark>"
+
+_WORD = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def vector_sql(*weighted: Tuple[str, str]) -> str:
+    """``tsvector`` expression over ``(column, weight)`` pairs, for generated columns."""
+    return " || ".join(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}'::regconfig, coalesce({column}, '')), '{weight}')"
+        for column, weight in weighted
+    )
+
+
+def prefix_query(raw: str) -> Optional[str]:
+    """``to_tsquery`` text matching every word of ``raw`` as a prefix; None when there is no word."""
+    words = _WORD.findall((raw or "").lower())[:MAX_QUERY_TERMS]
+    if not words:
+        return None
+    return " & ".join(f"{w}:*" for w in words)
+
+
+def _escaped(expr: str) -> str:
+    return f"replace(replace(replace(coalesce({expr}, ''), '&', '&amp;'), '<', '&lt;'), '>', '&gt;')"
+
+
+def _headline(expr: str) -> str:
+    return f"ts_headline('{SEARCH_CONFIG}'::regconfig, {_escaped(expr)}, sq.q, '{HEADLINE_OPTIONS}')"
+
+
+def date_range_sql(column: str, params: Dict[str, Any], date_from: Optional[str], date_to: Optional[str]) -> List[str]:
+    """Sargable conditions for whole days ``date_from``..``date_to`` (inclusive) on ``column``."""
+    conditions = []
+    if date_from:
+        conditions.append(f"{column} >= CAST(:date_from AS date)")
+        params["date_from"] = date_from
+    if date_to:
+        conditions.append(f"{column} < CAST(:date_to AS date) + 1")
+        params["date_to"] = date_to
+    return conditions
+
+
+def search_tickets(conn: Connection, raw: str, *, pharmacy_id: Optional[int] = None,
+                   user_id: Optional[int] = None, include_internal: bool = False,
+                   status: Optional[str] = None, ticket_type: Optional[str] = None,
+                   date_from: Optional[str] = None, date_to: Optional[str] = None,
+                   limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Tickets whose subject, description or messages match, best first. A match in
+    a message counts at half weight. ``pharmacy_id`` scopes the search to one
+    pharmacy. Without ``include_internal``, internal messages only match for
+    their author (``user_id``).
+    """
+    query = prefix_query(raw)
+    if query is None:
+        return []
+    params: Dict[str, Any] = {"q": query, "limit": max(1, min(int(limit), 100)), "user_id": user_id}
+    filters = []
+    if pharmacy_id is not None:
+        filters.append("t.pharmacy_id = :pharmacy_id")
+        params["pharmacy_id"] = pharmacy_id
+    if status:
+        filters.append("t.status = :status")
+        params["status"] = status
+    if ticket_type:
+        filters.append("t.type = :ticket_type")
+        params["ticket_type"] = ticket_type
+    filters += date_range_sql("t.created_at", params, date_from, date_to)
+    ticket_filter = "".join(f" AND {f}" for f in filters)
+    visible = "" if include_internal else " AND (m.is_internal = false OR m.user_id = :user_id)"
+    rows = conn.execute(text(f"""
+        WITH sq AS (
+            SELECT to_tsquery('{SEARCH_CONFIG}'::regconfig, :q) AS q
+        ), hits AS (
+            SELECT t.id, ts_rank(t.search_vector, sq.q) AS rank
+            FROM support_tickets t, sq
+            WHERE t.search_vector @@ sq.q{ticket_filter}
+            UNION ALL
+            SELECT m.ticket_id, ts_rank(m.search_vector, sq.q) * 0.5
+            FROM support_ticket_messages m
+            JOIN support_tickets t ON t.id = m.ticket_id, sq
+            WHERE m.search_vector @@ sq.q{visible}{ticket_filter}
+        ), ranked AS (
+            SELECT id, MAX(rank) AS rank
+            FROM hits
+            GROUP BY id
+            ORDER BY rank DESC, id DESC
+            LIMIT :limit
+        )
+        SELECT t.id, t.ticket_number, t.pharmacy_id, t.type, t.subject, t.status, t.priority,
+               t.created_at, t.updated_at, r.rank,
+               {_headline("t.subject || ' ' || coalesce(t.description, '')")} AS snippet,
+               (
+                   SELECT {_headline("m.message")}
+                   FROM support_ticket_messages m
+                   WHERE m.ticket_id = t.id AND m.search_vector @@ sq.q{visible}
+                   ORDER BY ts_rank(m.search_vector, sq.q) DESC, m.id
+                   LIMIT 1
+               ) AS message_snippet
+        FROM ranked r
+        JOIN support_tickets t ON t.id = r.id
+        CROSS JOIN sq
+        ORDER BY r.rank DESC, t.id DESC
+    """), params).mappings().all()
+    return [dict(r) for r in rows]
+
+
+def search_announcements(conn: Connection, raw: str, *, active_only: bool = True,
+                         date_from: Optional[str] = None, date_to: Optional[str] = None,
+                         limit: int = 20) -> List[Dict[str, Any]]:
+    """Announcements whose title or content match, best first (pinned ones ahead on equal rank)."""
+    query = prefix_query(raw)
+    if query is None:
+        return []
+    params: Dict[str, Any] = {"q": query, "limit": max(1, min(int(limit), 100))}
+    filters = ["a.search_vector @@ sq.q"]
+    if active_only:
+        filters.append("a.is_active = true AND (a.expires_at IS NULL OR a.expires_at > now())")
+    filters += date_range_sql("a.created_at", params, date_from, date_to)
+    rows = conn.execute(text(f"""
+        WITH sq AS (
+            SELECT to_tsquery('{SEARCH_CONFIG}'::regconfig, :q) AS q
+        ), ranked AS (
+            SELECT a.id, ts_rank(a.search_vector, sq.q) AS rank
+            FROM announcements a, sq
+            WHERE {" AND ".join(filters)}
+            ORDER BY rank DESC, a.is_pinned DESC, a.id DESC
+            LIMIT :limit
+        )
+        SELECT a.id, a.title, a.type, a.is_pinned, a.is_active, a.created_at, a.expires_at, r.rank,
+               {_headline("a.title")} AS title_highlight,
+               {_headline("a.content")} AS snippet
+        FROM ranked r
+        JOIN announcements a ON a.id = r.id
+        CROSS JOIN sq
+        ORDER BY r.rank DESC, a.is_pinned DESC, a.id DESC
+    """), params).mappings().all()
+    return [dict(r) for r in rows]
@@ -0,0 +1,206 @@
+"""Fast JSON serialization and negotiated response compression
+
+FastJSONProvider replaces Flask's JSON provider app-wide, so every jsonify()
+goes through orjson when it is installed (stdlib json otherwise). The wire
+format stays what Flask produced - sorted keys, Decimal/UUID as strings,
+dates as HTTP dates, indented in debug mode - unless JSON_DATETIME_FORMAT=iso,
+which lets orjson emit RFC 3339 timestamps natively (no Python callback per
+datetime). Anything orjson rejects (e.g. integers beyond 64 bits) falls back
+to the stdlib encoder.
+
+install_response_compression() gzip- or brotli-encodes (when the brotli
+package is installed) JSON/text responses larger than
+RESPONSE_COMPRESS_MIN_BYTES for clients that accept it. Streamed and
+file responses, and responses that already carry a Content-Encoding, are
+left alone.
+"""
+import dataclasses
+import gzip
+import json
+import os
+import uuid
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+	import orjson
+except ImportError:  # optional dependency, stdlib json is used instead
+	orjson = None
+
+try:
+	import brotli
+except ImportError:  # optional dependency, gzip only
+	brotli = None
+
+
+def _env_flag(name, default='true'):
+	return os.getenv(name, default).lower() in ('1', 'true', 'yes')
+
+
+JSON_FAST_PATH = _env_flag('JSON_FAST_PATH')
+JSON_DATETIME_FORMAT = os.getenv('JSON_DATETIME_FORMAT', 'http').lower()  # http (Flask default) | iso
+RESPONSE_COMPRESSION = _env_flag('RESPONSE_COMPRESSION')
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.getenv('RESPONSE_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('RESPONSE_BROTLI_QUALITY', '4'))
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/', 'application/javascript', 'image/svg+xml')
+
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _http_date(o):
+	"""werkzeug.http.http_date without the email.utils round trip (several times faster)."""
+	if isinstance(o, datetime):
+		if o.tzinfo is not None:
+			o = o.astimezone(timezone.utc)
+		return (f"{_DAYS[o.weekday()]}, {o.day:02d} {_MONTHS[o.month - 1]} {o.year:04d} "
+			f"{o.hour:02d}:{o.minute:02d}:{o.second:02d} GMT")
+	return f"{_DAYS[o.weekday()]}, {o.day:02d} {_MONTHS[o.month - 1]} {o.year:04d} 00:00:00 GMT"
+
+
+def _default(o):
+	"""Same conversions as Flask's stdlib provider, for values orjson hands back."""
+	if isinstance(o, date):
+		return _http_date(o)
+	if isinstance(o, (Decimal, uuid.UUID)):
+		return str(o)
+	if dataclasses.is_dataclass(o):
+		return dataclasses.asdict(o)
+	if hasattr(o, '__html__'):
+		return str(o.__html__())
+	raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _orjson_options(indent=False):
+	options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+	if JSON_DATETIME_FORMAT != 'iso':
+		options |= orjson.OPT_PASSTHROUGH_DATETIME
+	if indent:
+		options |= orjson.OPT_INDENT_2
+	return options
+
+
+def dumps_bytes(obj):
+	"""Compact UTF-8 JSON for bodies built outside jsonify() (precomputed payloads)."""
+	if orjson is not None and JSON_FAST_PATH:
+		try:
+			return orjson.dumps(obj, default=_default, option=_orjson_options() & ~orjson.OPT_SORT_KEYS)
+		except TypeError:
+			pass
+	return json.dumps(obj, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+	"""DefaultJSONProvider with an orjson fast path for dumps() and response()."""
+
+	def _fast(self):
+		return orjson is not None and JSON_FAST_PATH
+
+	def _dump_bytes(self, obj, indent=False):
+		try:
+			return orjson.dumps(obj, default=_default, option=_orjson_options(indent))
+		except TypeError:
+			return None
+
+	def dumps(self, obj, **kwargs):
+		# Custom arguments (cls=, separators=, ...) only make sense to the stdlib encoder
+		if self._fast() and not kwargs:
+			body = self._dump_bytes(obj)
+			if body is not None:
+				return body.decode('utf-8')
+		return super().dumps(obj, **kwargs)
+
+	def response(self, *args, **kwargs):
+		if not self._fast():
+			return super().response(*args, **kwargs)
+		obj = self._prepare_response_obj(args, kwargs)
+		indent = (self.compact is None and self._app.debug) or self.compact is False
+		body = self._dump_bytes(obj, indent=indent)
+		if body is None:
+			return super().response(*args, **kwargs)
+		return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+
+def accepted_encodings(accept_encoding):
+	"""Parse an Accept-Encoding header into {coding: q}."""
+	accepted = {}
+	for part in (accept_encoding or '').split(','):
+		name, _, params = part.strip().partition(';')
+		q = 1.0
+		params = params.strip()
+		if params.startswith('q='):
+			try:
+				q = float(params[2:])
+			except ValueError:
+				q = 0.0
+		if name:
+			accepted[name.strip().lower()] = q
+	return accepted
+
+
+def negotiate_encoding(accept_encoding, available=('br', 'gzip')):
+	"""Best of ``available`` (in preference order) the client accepts, or 'identity'."""
+	accepted = accepted_encodings(accept_encoding)
+	for encoding in available:
+		if encoding == 'br' and brotli is None:
+			continue
+		if accepted.get(encoding, accepted.get('*', 0)) > 0:
+			return encoding
+	return 'identity'
+
+
+def compress(body, encoding):
+	if encoding == 'br':
+		return brotli.compress(body, quality=BROTLI_QUALITY)
+	if encoding == 'gzip':
+		return gzip.compress(body, compresslevel=GZIP_LEVEL)
+	return body
+
+
+def _compressible(response):
+	if response.status_code < 200 or response.status_code in (204, 206, 304):
+		return False
+	if response.direct_passthrough or response.is_streamed:
+		return False
+	if 'Content-Encoding' in response.headers:
+		return False
+	mimetype = response.mimetype or ''
+	return any(mimetype.startswith(m) for m in COMPRESSIBLE_MIMETYPES)
+
+
+def _compress_response(response):
+	if not _compressible(response):
+		return response
+	body = response.get_data()
+	if len(body) < RESPONSE_COMPRESS_MIN_BYTES:
+		return response
+	response.vary.add('Accept-Encoding')
+	encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''))
+	if encoding == 'identity':
+		return response
+	response.set_data(compress(body, encoding))
+	response.headers['Content-Encoding'] = encoding
+	etag, weak = response.get_etag()
+	if etag and not weak:
+		# The encoded bytes differ from the identity representation
+		response.set_etag(etag, weak=True)
+	return response
+
+
+def install_fast_json(app):
+	"""Swap in FastJSONProvider; returns True when orjson is doing the work."""
+	app.json = FastJSONProvider(app)
+	return orjson is not None and JSON_FAST_PATH
+
+
+def install_response_compression(app):
+	if not RESPONSE_COMPRESSION:
+		return False
+	app.after_request(_compress_response)
+	return True
@@ -1,14 +1,22 @@
 """Utility helper functions for the application"""
 from flask import request, abort
-from sqlalchemy import text
 from datetime import datetime, timedelta
 import os
+import threading
 from urllib.parse import urlparse, urlencode, parse_qs, urlunparse
 
+_engine = None
+_engine_lock = threading.Lock()
+
 
 def get_current_user(conn, user_id: str):
-	"""Get current user from database connection"""
-	return conn.execute(text('select id, role, pharmacy_id from users where id = :id'), {'id': user_id}).mappings().first()
+	"""
+	Get the current user's id, role and pharmacy_id (None if the user does not exist).
+	Resolved from the request memo, the JWT claims or the identity cache before
+	the database; see services/identity.py. ``conn`` may also be an engine.
+	"""
+	from services.identity import resolve_identity
+	return resolve_identity(conn, user_id)
 
 
 def require_manager_or_admin(user_row):
@@ -72,3 +80,29 @@ def get_database_url():
 	
 	return sanitized_url
 
+
+def get_engine():
+	"""
+	The SQLAlchemy engine of this process, shared by every blueprint and service.
+	One pool per worker bounds the connections to DB_POOL_SIZE + DB_MAX_OVERFLOW;
+	size them for the WEB_THREADS threads of a worker that are not serving live
+	event streams (a stream does not hold a connection). Threads beyond that
+	wait up to DB_POOL_TIMEOUT seconds for a connection.
+	"""
+	global _engine
+	if _engine is None:
+		with _engine_lock:
+			if _engine is None:
+				from sqlalchemy import create_engine
+				url = get_database_url()
+				kwargs = {'pool_pre_ping': True}
+				if url.startswith('postgresql'):
+					kwargs.update(
+						pool_size=int(os.getenv('DB_POOL_SIZE', '16')),
+						max_overflow=int(os.getenv('DB_MAX_OVERFLOW', '16')),
+						pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')),
+						connect_args={'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5'))},
+					)
+				_engine = create_engine(url, **kwargs)
+	return _engine
+
@@ -0,0 +1,222 @@
+"""Keyset (cursor) pagination shared by list endpoints
+
+Pages are addressed by an opaque cursor holding the sort key and id of the
+last row served, so page N costs one index range scan from that position
+instead of OFFSET scanning and discarding everything before it. The id is
+always the last sort key, which makes the ordering total and stable even
+when many rows share a timestamp.
+
+Callers build their own SQL and splice in the pieces:
+
+	page = KeysetPage.from_request(SALES_KEYSET)
+	sql = f'select ... where s.pharmacy_id = :ph and {page.condition(params)}
+		order by {page.order_by()} limit :page_limit'
+	rows, pagination = page.finish(conn.execute(text(sql), params).mappings().all())
+
+All key expressions must be non-null and share one direction so the cursor
+predicate is a single row-value comparison that indexes on the same columns
+can satisfy.
+
+Counts are optional (``?count=exact|estimate|none``): exact counts are cached
+briefly per query, and estimates come from ``pg_class.reltuples`` for
+unfiltered tables or the planner's row estimate for filtered queries.
+"""
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import request
+from sqlalchemy import text
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = int(os.getenv('PAGINATION_MAX_PAGE_SIZE', '500'))
+COUNT_CACHE_TTL = float(os.getenv('PAGINATION_COUNT_CACHE_TTL', '30'))
+COUNT_MODES = ('exact', 'estimate', 'none')
+
+
+class InvalidCursor(ValueError):
+	"""The cursor is malformed or belongs to a different listing."""
+
+
+def _encode_value(value):
+	if isinstance(value, datetime):
+		return {'t': 'dt', 'v': value.isoformat()}
+	if isinstance(value, date):
+		return {'t': 'd', 'v': value.isoformat()}
+	if isinstance(value, Decimal):
+		return {'t': 'n', 'v': str(value)}
+	return value
+
+
+def _decode_value(value):
+	if isinstance(value, dict):
+		kind, raw = value.get('t'), value.get('v')
+		if kind == 'dt':
+			return datetime.fromisoformat(raw)
+		if kind == 'd':
+			return date.fromisoformat(raw)
+		if kind == 'n':
+			return Decimal(raw)
+		raise InvalidCursor('Unknown cursor value type')
+	return value
+
+
+class Keyset:
+	"""A named ordering: ``keys`` are (sql expression, result column) pairs, id last."""
+
+	def __init__(self, name, keys, descending=True):
+		self.name = name
+		self.keys = list(keys)
+		self.descending = descending
+
+	def order_by(self):
+		direction = 'desc' if self.descending else 'asc'
+		return ', '.join(f'{expr} {direction}' for expr, _ in self.keys)
+
+	def encode(self, row):
+		payload = [self.name] + [_encode_value(row[column]) for _, column in self.keys]
+		raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+		return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+	def decode(self, cursor):
+		try:
+			padded = cursor + '=' * (-len(cursor) % 4)
+			payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+		except (ValueError, TypeError) as exc:
+			raise InvalidCursor('Malformed cursor') from exc
+		if not isinstance(payload, list) or len(payload) != len(self.keys) + 1 or payload[0] != self.name:
+			raise InvalidCursor('Cursor does not match this listing')
+		return [_decode_value(v) for v in payload[1:]]
+
+
+class KeysetPage:
+	"""One page request against a :class:`Keyset`."""
+
+	def __init__(self, keyset, limit=DEFAULT_PAGE_SIZE, cursor=None, offset=None, count_mode='none'):
+		self.keyset = keyset
+		self.limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+		self.after = keyset.decode(cursor) if cursor else None
+		# Legacy ?page=N clients keep OFFSET semantics until they follow next_cursor.
+		self.offset = offset if self.after is None and offset else 0
+		self.count_mode = count_mode if count_mode in COUNT_MODES else 'none'
+
+	@classmethod
+	def from_request(cls, keyset, default_limit=DEFAULT_PAGE_SIZE, limit_arg='limit', default_count='none'):
+		"""Read ``cursor``, ``limit`` (or ``limit_arg``), legacy ``page`` and ``count`` from the query string."""
+		args = request.args
+		limit = args.get(limit_arg, type=int) or args.get('limit', type=int) or default_limit
+		page = args.get('page', type=int) or 1
+		return cls(
+			keyset,
+			limit=limit,
+			cursor=args.get('cursor') or None,
+			offset=(max(page, 1) - 1) * max(1, min(limit, MAX_PAGE_SIZE)),
+			count_mode=(args.get('count') or default_count).lower(),
+		)
+
+	def condition(self, params):
+		"""SQL predicate selecting rows after the cursor; binds its values into ``params``."""
+		if self.after is None:
+			return 'true'
+		names = []
+		for idx, value in enumerate(self.after):
+			name = f'_ks{idx}'
+			params[name] = value
+			names.append(f':{name}')
+		op = '<' if self.keyset.descending else '>'
+		exprs = ', '.join(expr for expr, _ in self.keyset.keys)
+		return f'({exprs}) {op} ({", ".join(names)})'
+
+	def order_by(self):
+		return self.keyset.order_by()
+
+	def limit_clause(self, params):
+		"""``limit``/``offset`` clause fetching one extra row to detect the next page."""
+		params['page_limit'] = self.limit + 1
+		if self.offset:
+			params['page_offset'] = self.offset
+			return 'limit :page_limit offset :page_offset'
+		return 'limit :page_limit'
+
+	def finish(self, rows, total=None):
+		"""Trim the look-ahead row and build the pagination block for the response."""
+		rows = list(rows)
+		has_more = len(rows) > self.limit
+		rows = rows[:self.limit]
+		pagination = {
+			'limit': self.limit,
+			'has_more': has_more,
+			'next_cursor': self.keyset.encode(rows[-1]) if has_more and rows else None,
+		}
+		if total is not None:
+			pagination['total'] = total
+			pagination['total_estimated'] = self.count_mode == 'estimate'
+		return rows, pagination
+
+	def total(self, conn, from_where_sql, params, table=None, filtered=True, count_ttl=None):
+		"""
+		Row count for ``select count(*) <from_where_sql>`` according to ``count_mode``.
+		``table`` + ``filtered=False`` lets estimates use pg_class.reltuples directly.
+		``count_ttl`` overrides how long exact counts are reused (0: always count).
+		"""
+		if self.count_mode == 'none':
+			return None
+		params = {k: v for k, v in params.items() if not k.startswith('_ks') and not k.startswith('page_')}
+		if self.count_mode == 'estimate':
+			if table and not filtered:
+				estimate = estimated_table_rows(conn, table)
+				if estimate is not None:
+					return estimate
+			return planner_row_estimate(conn, f'select 1 {from_where_sql}', params)
+		return cached_count(conn, f'select count(*) {from_where_sql}', params, ttl=count_ttl)
+
+
+def estimated_table_rows(conn, table):
+	"""pg_class.reltuples for ``table``; None if it has never been analyzed."""
+	value = conn.execute(
+		text('select reltuples::bigint from pg_class where oid = to_regclass(:t)'),
+		{'t': table},
+	).scalar()
+	if value is None or value < 0:
+		return None
+	return int(value)
+
+
+def planner_row_estimate(conn, sql, params):
+	"""The planner's row estimate for ``sql`` (no execution)."""
+	plan = conn.execute(text(f'explain (format json) {sql}'), params).scalar()
+	if isinstance(plan, str):
+		plan = json.loads(plan)
+	return int(plan[0]['Plan']['Plan Rows'])
+
+
+_count_cache = {}
+_count_lock = threading.Lock()
+
+
+def _count_key(sql, params):
+	raw = json.dumps([sql, sorted(params.items())], default=str, separators=(',', ':'))
+	return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def cached_count(conn, sql, params, ttl=None):
+	"""Exact ``count(*)`` reused for ``ttl`` seconds per (query, params)."""
+	ttl = COUNT_CACHE_TTL if ttl is None else ttl
+	key = _count_key(sql, params)
+	now = time.monotonic()
+	with _count_lock:
+		hit = _count_cache.get(key)
+		if hit and hit[0] > now:
+			return hit[1]
+	total = int(conn.execute(text(sql), params).scalar() or 0)
+	with _count_lock:
+		if len(_count_cache) > 1024:
+			for k in [k for k, (exp, _) in _count_cache.items() if exp <= now]:
+				_count_cache.pop(k, None)
+		_count_cache[key] = (now + ttl, total)
+	return total
@@ -0,0 +1,389 @@
+"""Tenant-scoped analytics result cache with write-driven invalidation
+
+Results are keyed by (pharmacy, endpoint, normalized query params) plus the
+current generation of every data domain the endpoint reads. Write endpoints
+call bump_generation() for the domains they touch, so stale entries simply
+stop matching - no TTL guessing. The current day is part of the key because
+several dashboards compare against current_date.
+
+Tiers (ANALYTICS_CACHE_BACKEND):
+- memory   : in-process LRU only (default; exact for a single worker)
+- sqlite   : in-process LRU + a SQLite file shared by workers on one host
+- postgres : in-process LRU + UNLOGGED tables shared by every worker
+
+Concurrent misses for the same key compute once (single-flight per process).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+
+from flask import Response, jsonify, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import text
+
+DOMAINS = ('sales', 'inventory', 'returns', 'batches')
+
+ANALYTICS_CACHE_ENABLED = os.getenv('ANALYTICS_CACHE', 'true').lower() in ('1', 'true', 'yes')
+ANALYTICS_CACHE_BACKEND = os.getenv('ANALYTICS_CACHE_BACKEND', 'memory').lower()
+ANALYTICS_CACHE_MAX_ENTRIES = int(os.getenv('ANALYTICS_CACHE_MAX_ENTRIES', '512'))
+ANALYTICS_CACHE_SQLITE_PATH = os.getenv('ANALYTICS_CACHE_SQLITE_PATH', os.path.join('file_dump', 'analytics_cache.sqlite3'))
+
+
+class _MemoryStore:
+	"""Generation counters and LRU entries held in this process."""
+
+	def __init__(self, max_entries):
+		self.max_entries = max_entries
+		self._entries = OrderedDict()
+		self._generations = {}
+		self._lock = threading.Lock()
+
+	def generations(self, pharmacy_id, domains):
+		with self._lock:
+			return tuple(self._generations.get((pharmacy_id, d), 0) for d in domains)
+
+	def bump(self, pharmacy_id, domains):
+		with self._lock:
+			for d in domains:
+				key = (pharmacy_id, d)
+				self._generations[key] = self._generations.get(key, 0) + 1
+
+	def get(self, key):
+		with self._lock:
+			value = self._entries.get(key)
+			if value is not None:
+				self._entries.move_to_end(key)
+			return value
+
+	def set(self, key, value):
+		with self._lock:
+			self._entries[key] = value
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+
+	def clear(self, pharmacy_id=None):
+		with self._lock:
+			if pharmacy_id is None:
+				self._entries.clear()
+			else:
+				prefix = f'{pharmacy_id}:'
+				for key in [k for k in self._entries if k.startswith(prefix)]:
+					del self._entries[key]
+
+
+class _SQLiteStore:
+	"""Shared tier in a local SQLite file (one host, many workers)."""
+
+	def __init__(self, path, max_entries):
+		self.path = path
+		self.max_entries = max_entries
+		self._local = threading.local()
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+		conn = self._conn()
+		conn.executescript('''
+			create table if not exists generations (pharmacy_id integer, domain text, generation integer not null, primary key (pharmacy_id, domain));
+			create table if not exists entries (key text primary key, body blob not null, created_at real default (julianday('now')));
+		''')
+
+	def _conn(self):
+		conn = getattr(self._local, 'conn', None)
+		if conn is None:
+			conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+			conn.execute('pragma journal_mode=wal')
+			conn.execute('pragma synchronous=normal')
+			self._local.conn = conn
+		return conn
+
+	def generations(self, pharmacy_id, domains):
+		rows = dict(self._conn().execute(
+			f"select domain, generation from generations where pharmacy_id = ? and domain in ({','.join('?' * len(domains))})",
+			(pharmacy_id, *domains),
+		).fetchall())
+		return tuple(rows.get(d, 0) for d in domains)
+
+	def bump(self, pharmacy_id, domains):
+		self._conn().executemany(
+			'insert into generations (pharmacy_id, domain, generation) values (?, ?, 1) '
+			'on conflict (pharmacy_id, domain) do update set generation = generation + 1',
+			[(pharmacy_id, d) for d in domains],
+		)
+
+	def get(self, key):
+		row = self._conn().execute('select body from entries where key = ?', (key,)).fetchone()
+		return bytes(row[0]) if row else None
+
+	def set(self, key, value):
+		conn = self._conn()
+		conn.execute('insert or replace into entries (key, body) values (?, ?)', (key, value))
+		conn.execute(
+			'delete from entries where key in (select key from entries order by created_at desc limit -1 offset ?)',
+			(self.max_entries * 4,),
+		)
+
+	def clear(self, pharmacy_id=None):
+		if pharmacy_id is None:
+			self._conn().execute('delete from entries')
+		else:
+			self._conn().execute('delete from entries where key like ?', (f'{pharmacy_id}:%',))
+
+
+class _PostgresStore:
+	"""Shared tier in UNLOGGED Postgres tables (every worker, every host)."""
+
+	def __init__(self, max_entries):
+		from utils.helpers import get_engine
+		self.max_entries = max_entries
+		self.engine = get_engine()
+		with self.engine.begin() as conn:
+			conn.execute(text('''
+				create unlogged table if not exists analytics_cache_generations (
+					pharmacy_id bigint not null,
+					domain text not null,
+					generation bigint not null default 0,
+					primary key (pharmacy_id, domain)
+				);
+				create unlogged table if not exists analytics_cache_entries (
+					key text primary key,
+					body bytea not null,
+					created_at timestamptz default now()
+				);
+			'''))
+
+	def generations(self, pharmacy_id, domains):
+		with self.engine.connect() as conn:
+			rows = dict(conn.execute(text('''
+				select domain, generation from analytics_cache_generations
+				where pharmacy_id = :ph and domain = any(:domains)
+			'''), {'ph': pharmacy_id, 'domains': list(domains)}).fetchall())
+		return tuple(rows.get(d, 0) for d in domains)
+
+	def bump(self, pharmacy_id, domains):
+		with self.engine.begin() as conn:
+			conn.execute(text('''
+				insert into analytics_cache_generations (pharmacy_id, domain, generation)
+				select :ph, d, 1 from unnest(cast(:domains as text[])) as d
+				on conflict (pharmacy_id, domain) do update
+				set generation = analytics_cache_generations.generation + 1
+			'''), {'ph': pharmacy_id, 'domains': list(domains)})
+
+	def get(self, key):
+		with self.engine.connect() as conn:
+			body = conn.execute(text('select body from analytics_cache_entries where key = :k'), {'k': key}).scalar()
+		return bytes(body) if body is not None else None
+
+	def set(self, key, value):
+		with self.engine.begin() as conn:
+			conn.execute(text('''
+				insert into analytics_cache_entries (key, body) values (:k, :b)
+				on conflict (key) do update set body = excluded.body, created_at = now()
+			'''), {'k': key, 'b': value})
+			# Keys embed the day, so anything written before today can never hit again
+			conn.execute(text('delete from analytics_cache_entries where created_at < current_date'))
+
+	def clear(self, pharmacy_id=None):
+		with self.engine.begin() as conn:
+			if pharmacy_id is None:
+				conn.execute(text('truncate analytics_cache_entries'))
+			else:
+				conn.execute(text('delete from analytics_cache_entries where key like :p'), {'p': f'{pharmacy_id}:%'})
+
+
+class _SingleFlight:
+	"""Per-key locks so concurrent misses for one key compute once."""
+
+	def __init__(self):
+		self._locks = {}
+		self._guard = threading.Lock()
+
+	def acquire(self, key):
+		with self._guard:
+			entry = self._locks.setdefault(key, [threading.Lock(), 0])
+			entry[1] += 1
+		entry[0].acquire()
+		return entry
+
+	def release(self, key, entry):
+		entry[0].release()
+		with self._guard:
+			entry[1] -= 1
+			if entry[1] == 0:
+				self._locks.pop(key, None)
+
+
+class ResultCache:
+	"""Generation-keyed cache of serialized endpoint responses."""
+
+	def __init__(self, backend=ANALYTICS_CACHE_BACKEND, max_entries=ANALYTICS_CACHE_MAX_ENTRIES):
+		self.backend = backend
+		self.memory = _MemoryStore(max_entries)
+		self._shared = None
+		self._shared_ready = backend == 'memory'
+		self._shared_lock = threading.Lock()
+		self._flight = _SingleFlight()
+
+	@property
+	def shared(self):
+		if not self._shared_ready:
+			with self._shared_lock:
+				if not self._shared_ready:
+					try:
+						if self.backend == 'sqlite':
+							self._shared = _SQLiteStore(ANALYTICS_CACHE_SQLITE_PATH, self.memory.max_entries)
+						elif self.backend == 'postgres':
+							self._shared = _PostgresStore(self.memory.max_entries)
+					except Exception as e:
+						print(f"[result_cache] Shared tier '{self.backend}' unavailable, using memory only: {e}")
+					self._shared_ready = True
+		return self._shared
+
+	def generations(self, pharmacy_id, domains):
+		store = self.shared or self.memory
+		return store.generations(pharmacy_id, domains)
+
+	def bump(self, pharmacy_id, domains):
+		domains = tuple(d for d in domains if d in DOMAINS)
+		if pharmacy_id is None or not domains:
+			return
+		self.memory.bump(pharmacy_id, domains)
+		if self.shared is not None:
+			try:
+				self.shared.bump(pharmacy_id, domains)
+			except Exception as e:
+				# A missed shared bump could serve stale data; drop this tenant's entries instead
+				print(f"[result_cache] Shared bump failed: {e}")
+				self.clear(pharmacy_id)
+
+	def clear(self, pharmacy_id=None):
+		self.memory.clear(pharmacy_id)
+		if self.shared is not None:
+			try:
+				self.shared.clear(pharmacy_id)
+			except Exception:
+				pass
+
+	@staticmethod
+	def make_key(pharmacy_id, endpoint, params, generations):
+		normalized = json.dumps(sorted(params.items()), separators=(',', ':'), default=str)
+		digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+		gens = '.'.join(str(g) for g in generations)
+		return f'{pharmacy_id}:{endpoint}:{date.today().isoformat()}:{gens}:{digest}'
+
+	def _lookup(self, key):
+		body = self.memory.get(key)
+		if body is None and self.shared is not None:
+			try:
+				body = self.shared.get(key)
+			except Exception:
+				body = None
+			if body is not None:
+				self.memory.set(key, body)
+		return body
+
+	def get_or_compute(self, pharmacy_id, endpoint, params, domains, compute):
+		"""
+		Return (body, hit). compute() returns bytes to cache, or None to skip caching.
+		"""
+		key = self.make_key(pharmacy_id, endpoint, params, self.generations(pharmacy_id, domains))
+		body = self._lookup(key)
+		if body is not None:
+			return body, True
+		entry = self._flight.acquire(key)
+		try:
+			body = self._lookup(key)
+			if body is not None:
+				return body, True
+			body = compute()
+			if body is not None:
+				self.memory.set(key, body)
+				if self.shared is not None:
+					try:
+						self.shared.set(key, body)
+					except Exception:
+						pass
+			return body, False
+		finally:
+			self._flight.release(key, entry)
+
+
+result_cache = ResultCache()
+
+
+def bump_generation(pharmacy_id, *domains):
+	"""Invalidate cached analytics of a pharmacy for the given data domains."""
+	try:
+		result_cache.bump(pharmacy_id, domains)
+	except Exception as e:
+		print(f"[result_cache] bump failed: {e}")
+
+
+def cached_analytics(engine, endpoint, domains, roles=('staff', 'manager', 'admin')):
+	"""
+	Cache a GET view's successful JSON response per pharmacy and query string.
+	Must sit below @jwt_required(). Only 200 responses are cached.
+	"""
+	def decorator(view):
+		@wraps(view)
+		def wrapper(*args, **kwargs):
+			if not ANALYTICS_CACHE_ENABLED:
+				return view(*args, **kwargs)
+			from utils.helpers import get_current_user
+			with engine.connect() as conn:
+				me = get_current_user(conn, get_jwt_identity())
+			if not me or me['role'] not in roles:
+				return jsonify({'success': False, 'error': 'Forbidden'}), 403
+
+			params = {k: request.args.getlist(k) for k in request.args}
+			params.update({f'_{k}': v for k, v in kwargs.items()})
+			produced = {}
+
+			def compute():
+				rv = view(*args, **kwargs)
+				response = rv if isinstance(rv, Response) else None
+				if response is None or response.status_code != 200:
+					produced['response'] = rv
+					return None
+				return response.get_data()
+
+			body, hit = result_cache.get_or_compute(me['pharmacy_id'], endpoint, params, domains, compute)
+			if body is None:
+				return produced['response']
+			response = Response(body, mimetype='application/json')
+			response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+			return response
+		return wrapper
+	return decorator
+
+
+def invalidates_analytics(engine, *domains):
+	"""
+	Bump the caller's pharmacy generations for ``domains`` after a successful
+	write. Must sit below @jwt_required().
+	"""
+	def decorator(view):
+		@wraps(view)
+		def wrapper(*args, **kwargs):
+			rv = view(*args, **kwargs)
+			if not ANALYTICS_CACHE_ENABLED:
+				return rv
+			if isinstance(rv, tuple):
+				status = rv[1] if len(rv) > 1 and isinstance(rv[1], int) else 200
+			else:
+				status = getattr(rv, 'status_code', 200)
+			if 200 <= status < 300:
+				try:
+					from utils.helpers import get_current_user
+					with engine.connect() as conn:
+						me = get_current_user(conn, get_jwt_identity())
+					if me:
+						bump_generation(me['pharmacy_id'], *domains)
+				except Exception as e:
+					print(f"[result_cache] invalidation failed: {e}")
+			return rv
+		return wrapper
+	return decorator
@@ -0,0 +1,222 @@
+"""Per-request SQL profiling and slow-query capture
+
+Hooks SQLAlchemy's cursor events on every Engine (each blueprint creates its
+own), so statement count, database time, the slowest statements and repeated
+statement shapes (N+1 candidates) are recorded for the current Flask request.
+Slow statements are kept in a ring buffer; their EXPLAIN (ANALYZE, BUFFERS)
+plan is captured on demand from the admin debug endpoint.
+
+Enable with SQL_PROFILING=true. Response headers are added when
+SQL_PROFILING_HEADERS is true (defaults to SQL_PROFILING).
+"""
+import os
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from itertools import count
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def _env_flag(name, default='false'):
+	return os.getenv(name, default).lower() in ('1', 'true', 'yes')
+
+
+SQL_PROFILING_ENABLED = _env_flag('SQL_PROFILING')
+SQL_PROFILING_HEADERS = _env_flag('SQL_PROFILING_HEADERS', 'true' if SQL_PROFILING_ENABLED else 'false')
+SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', '200'))
+N_PLUS_ONE_THRESHOLD = int(os.getenv('SQL_N_PLUS_ONE_THRESHOLD', '5'))
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv('SQL_SLOW_QUERY_BUFFER', '100'))
+REQUEST_BUFFER_SIZE = int(os.getenv('SQL_REQUEST_BUFFER', '100'))
+_TOP_STATEMENTS = 5
+_STATEMENT_PREVIEW = 500
+
+_slow_queries = deque(maxlen=SLOW_QUERY_BUFFER_SIZE)
+_recent_requests = deque(maxlen=REQUEST_BUFFER_SIZE)
+_buffer_lock = threading.Lock()
+_slow_ids = count(1)
+_installed = False
+
+_WS_RE = re.compile(r'\s+')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+def statement_shape(statement):
+	"""Normalize a statement so calls differing only in literals compare equal."""
+	shape = _WS_RE.sub(' ', statement or '').strip()
+	shape = _STRING_RE.sub('?', shape)
+	shape = _NUMBER_RE.sub('?', shape)
+	shape = _IN_LIST_RE.sub('(?)', shape)
+	return shape
+
+
+class RequestProfile:
+	"""SQL activity recorded for a single request."""
+
+	__slots__ = ('started', 'statements', 'total_ms', 'shapes')
+
+	def __init__(self):
+		self.started = time.perf_counter()
+		self.statements = []
+		self.total_ms = 0.0
+		self.shapes = Counter()
+
+	def record(self, statement, duration_ms):
+		shape = statement_shape(statement)
+		self.statements.append((duration_ms, shape))
+		self.total_ms += duration_ms
+		self.shapes[shape] += 1
+
+	@property
+	def count(self):
+		return len(self.statements)
+
+	def slowest(self, limit=_TOP_STATEMENTS):
+		top = sorted(self.statements, key=lambda s: s[0], reverse=True)[:limit]
+		return [{'duration_ms': round(ms, 2), 'statement': shape[:_STATEMENT_PREVIEW]} for ms, shape in top]
+
+	def n_plus_one_candidates(self, threshold=None):
+		threshold = threshold or N_PLUS_ONE_THRESHOLD
+		return [
+			{'count': n, 'statement': shape[:_STATEMENT_PREVIEW]}
+			for shape, n in self.shapes.most_common()
+			if n >= threshold
+		]
+
+	def summary(self):
+		return {
+			'statement_count': self.count,
+			'db_time_ms': round(self.total_ms, 2),
+			'request_time_ms': round((time.perf_counter() - self.started) * 1000, 2),
+			'slowest': self.slowest(),
+			'n_plus_one_candidates': self.n_plus_one_candidates(),
+		}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	conn.info.setdefault('_sql_profiler_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	starts = conn.info.get('_sql_profiler_start')
+	if not starts:
+		return
+	duration_ms = (time.perf_counter() - starts.pop()) * 1000
+
+	endpoint = None
+	if has_request_context():
+		profile = g.get('_sql_profile')
+		if profile is not None:
+			profile.record(statement, duration_ms)
+		endpoint = request.endpoint
+
+	if duration_ms >= SLOW_QUERY_MS:
+		with _buffer_lock:
+			_slow_queries.append({
+				'id': next(_slow_ids),
+				'captured_at': datetime.utcnow().isoformat(),
+				'endpoint': endpoint,
+				'duration_ms': round(duration_ms, 2),
+				'statement': statement,
+				'parameters': None if executemany else parameters,
+				'executemany': executemany,
+				'plan': None,
+			})
+
+
+def _start_request_profile():
+	g._sql_profile = RequestProfile()
+
+
+def _finish_request_profile(response):
+	profile = g.pop('_sql_profile', None)
+	if profile is None:
+		return response
+	summary = profile.summary()
+	with _buffer_lock:
+		_recent_requests.append({
+			'endpoint': request.endpoint,
+			'method': request.method,
+			'path': request.path,
+			'status': response.status_code,
+			'captured_at': datetime.utcnow().isoformat(),
+			**summary,
+		})
+	if SQL_PROFILING_HEADERS:
+		response.headers['X-SQL-Statement-Count'] = str(summary['statement_count'])
+		response.headers['X-SQL-Time-Ms'] = f"{summary['db_time_ms']:.2f}"
+		response.headers['X-SQL-N-Plus-One'] = str(len(summary['n_plus_one_candidates']))
+	return response
+
+
+def install_sql_profiler(app):
+	"""Attach cursor listeners to all engines and request hooks to ``app``."""
+	global _installed
+	if not SQL_PROFILING_ENABLED or _installed:
+		return False
+	event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+	event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+	app.before_request(_start_request_profile)
+	app.after_request(_finish_request_profile)
+	_installed = True
+	return True
+
+
+def _public_entry(entry):
+	return {k: (v[:_STATEMENT_PREVIEW * 4] if k == 'statement' else v) for k, v in entry.items() if k != 'parameters'}
+
+
+def profiler_snapshot():
+	"""Return the slow-query ring buffer and recent request profiles."""
+	with _buffer_lock:
+		slow = [_public_entry(e) for e in _slow_queries]
+		recent = list(_recent_requests)
+	return {
+		'enabled': _installed,
+		'slow_query_ms': SLOW_QUERY_MS,
+		'n_plus_one_threshold': N_PLUS_ONE_THRESHOLD,
+		'slow_queries': slow[::-1],
+		'recent_requests': recent[::-1],
+	}
+
+
+def clear_profiler_buffers():
+	with _buffer_lock:
+		_slow_queries.clear()
+		_recent_requests.clear()
+
+
+def explain_slow_query(engine, entry_id):
+	"""
+	Capture EXPLAIN (ANALYZE, BUFFERS) for a buffered slow query.
+	Only read statements are analysed, and the transaction is always rolled back.
+	Returns (entry, error).
+	"""
+	with _buffer_lock:
+		entry = next((e for e in _slow_queries if e['id'] == entry_id), None)
+	if entry is None:
+		return None, 'Slow query not found'
+	if entry['executemany']:
+		return None, 'Cannot explain executemany statements'
+	head = entry['statement'].lstrip().split(None, 1)[0].lower() if entry['statement'].strip() else ''
+	if head not in ('select', 'with'):
+		return None, 'Only SELECT statements can be explained'
+
+	raw = engine.raw_connection()
+	try:
+		cur = raw.cursor()
+		cur.execute('EXPLAIN (ANALYZE, BUFFERS) ' + entry['statement'], entry['parameters'] or None)
+		plan = '\n'.join(row[0] for row in cur.fetchall())
+		cur.close()
+	finally:
+		raw.rollback()
+		raw.close()
+	with _buffer_lock:
+		entry['plan'] = plan
+	return _public_entry(entry), None
@@ -349,6 +349,7 @@ const InventoryManagement = () => {
                 <h3 style="margin: 0; color: #333;">
                   ${reportPeriod === 'day' ? new Date(periodData.period_date).toLocaleDateString() :
                    reportPeriod === 'week' ? `Week of ${new Date(periodData.period_date).toLocaleDateString()}` :
+                   reportPeriod === 'quarter' ? `Q${Math.floor(new Date(periodData.period_date).getMonth() / 3) + 1} ${new Date(periodData.period_date).getFullYear()}` :
                    new Date(periodData.period_date).toLocaleDateString('en-US', { month: 'long', year: 'numeric' })}
                 </h3>
                 <p style="margin: 5px 0 0 0; color: #666;">
@@ -3787,6 +3788,7 @@ const InventoryManagement = () => {
                       <option value="day">Daily</option>
                       <option value="week">Weekly</option>
                       <option value="month">Monthly</option>
+                      <option value="quarter">Quarterly</option>
                     </select>
                   </div>
                 )}
@@ -3941,6 +3943,7 @@ const InventoryManagement = () => {
                               <h4 className="font-semibold text-gray-900">
                                 {reportPeriod === 'day' ? new Date(periodData.period_date).toLocaleDateString() :
                                  reportPeriod === 'week' ? `Week of ${new Date(periodData.period_date).toLocaleDateString()}` :
+                                 reportPeriod === 'quarter' ? `Q${Math.floor(new Date(periodData.period_date).getMonth() / 3) + 1} ${new Date(periodData.period_date).getFullYear()}` :
                                  new Date(periodData.period_date).toLocaleDateString('en-US', { month: 'long', year: 'numeric' })}
                               </h4>
                               <p className="text-sm text-gray-600">
@@ -14,7 +14,7 @@ import {
   History,
   MapPin
 } from 'lucide-react';
-import { POSAPI, ManagerAPI } from '../../services/api';
+import { POSAPI, ManagerAPI, EventsAPI } from '../../services/api';
 import { useAuth } from '../../contexts/AuthContext';
 
 const POSPage = () => {
@@ -259,6 +259,34 @@ const POSPage = () => {
     filterProducts();
   }, [filterProducts]);
 
+  // Live stock from sales on other terminals; polls instead when the stream is refused
+  useEffect(() => {
+    if (!token) return undefined;
+    let pollTimer = null;
+    const applyStock = ({ data = {} }) => {
+      if (data.truncated) {
+        fetchProducts();
+        return;
+      }
+      const stock = new Map((data.products || []).map((p) => [p.product_id, Number(p.current_stock)]));
+      if (!stock.size) return;
+      setProducts((list) => list.map((p) => (
+        stock.has(p.id) ? { ...p, current_stock: stock.get(p.id), in_stock: stock.get(p.id) > 0 } : p
+      )));
+    };
+    const close = EventsAPI.subscribe(token, {
+      stock: applyStock,
+      resync: () => fetchProducts(),
+      closed: () => {
+        if (!pollTimer) pollTimer = setInterval(fetchProducts, 60000);
+      },
+    }, ['stock']);
+    return () => {
+      close();
+      if (pollTimer) clearInterval(pollTimer);
+    };
+  }, [token, fetchProducts]);
+
   // Fetch pharmacy information
   useEffect(() => {
     const fetchPharmacy = async () => {
@@ -32,7 +32,7 @@ const SupportTickets = () => {
       if (statusFilter !== 'all') params.status = statusFilter;
       if (typeFilter !== 'all') params.type = typeFilter;
       
-      const res = await SupportAPI.listTickets(params, token);
+      const res = await SupportAPI.listAllTickets(params, token);
       if (res.success) {
         let filtered = res.tickets || [];
         if (searchTerm) {
@@ -1,4 +1,5 @@
 const API_BASE = process.env.REACT_APP_API_BASE || 'http://localhost:5000';
+const EVENTS_BASE = process.env.REACT_APP_EVENTS_BASE || API_BASE;
 
 // Simple in-memory cache for GET requests (2 second TTL for faster updates)
 const requestCache = new Map();
@@ -267,6 +268,18 @@ export const SupportAPI = {
     const q = new URLSearchParams(params).toString();
     return apiRequest(`/api/support/tickets${q ? `?${q}` : ''}`, { token });
   },
+  // Every ticket matching params: follows next_cursor through the keyset pages
+  listAllTickets: async (params = {}, token) => {
+    const tickets = [];
+    let cursor = null;
+    do {
+      const res = await SupportAPI.listTickets({ ...params, limit: 500, ...(cursor ? { cursor } : {}) }, token);
+      if (!res.success) return res;
+      tickets.push(...(res.tickets || []));
+      cursor = res.pagination?.next_cursor || null;
+    } while (cursor);
+    return { success: true, tickets };
+  },
   getTicket: (ticketId, token) => apiRequest(`/api/support/tickets/${ticketId}`, { token }),
   addMessage: (ticketId, payload, token) => apiRequest(`/api/support/tickets/${ticketId}/messages`, { method: 'POST', body: payload, token }),
   updateTicket: (ticketId, payload, token) => apiRequest(`/api/support/tickets/${ticketId}`, { method: 'PATCH', body: payload, token }),
@@ -275,3 +288,33 @@ export const SupportAPI = {
 };
 
 
+
+export const EventsAPI = {
+  // Live pharmacy events over SSE; handlers are keyed by event kind (stock, low_stock, sale,
+  // inventory_request, resync). EventSource reconnects with Last-Event-ID by itself, and a
+  // reconnect may replay events already seen, so they are dropped by id here. `closed` is
+  // called when the server refuses the stream (e.g. 503 when the worker is full); keep
+  // polling then. Returns a function that closes the stream.
+  subscribe: (token, handlers = {}, kinds = []) => {
+    const params = new URLSearchParams({ jwt: token });
+    if (kinds.length) params.set('kinds', kinds.join(','));
+    const source = new EventSource(`${EVENTS_BASE}/api/events/stream?${params.toString()}`);
+    const seen = new Set();
+    const { closed, ...kindHandlers } = handlers;
+    Object.entries(kindHandlers).forEach(([kind, handler]) => {
+      source.addEventListener(kind, (event) => {
+        const payload = event.data ? JSON.parse(event.data) : {};
+        if (payload.id != null) {
+          if (seen.has(payload.id)) return;
+          seen.add(payload.id);
+          if (seen.size > 2000) seen.delete(seen.values().next().value);
+        }
+        handler(payload, event);
+      });
+    });
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED && closed) closed();
+    };
+    return () => source.close();
+  },
+};
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Compare the old ABC/VED computation with the SQL-native one.
+
+For --pharmacy-id over the last --days days, times:
+
+* legacy: per-product quantities from sale_items, then sorting, the
+  cumulative-share loop and keyword VED matching in Python (what
+  /api/manager/analytics/abc-ved did before);
+* sql: services.abc_ved.classify - rollup aggregate, window-sum ABC and the
+  stored products.ved_class in one statement.
+
+Both are reported with the class counts so they can be compared; they differ
+only at period edges (sale timestamps vs rollup days).
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.abc_ved import (  # type: ignore  # noqa: E402
+    DESIRABLE_CATEGORIES, DESIRABLE_KEYWORDS, VITAL_CATEGORIES, VITAL_KEYWORDS, classify,
+)
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark ABC/VED classification.")
+    parser.add_argument("--pharmacy-id", type=int, required=True)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+def legacy(conn, pharmacy_id, frm, to, ath=0.7, bth=0.9):
+    rows = [dict(r) for r in conn.execute(text("""
+        with sales_agg as (
+            select si.product_id, sum(si.quantity) as total_qty
+            from sale_items si join sales s on s.id = si.sale_id
+            where s.pharmacy_id = :ph and coalesce(s.status, 'completed') = 'completed'
+              and s.created_at between :from and :to
+            group by si.product_id
+        )
+        select p.id, p.name, pc.name as category_name,
+               coalesce(sa.total_qty, 0) * coalesce(p.cost_price, 0) as consumption_value
+        from products p
+        left join product_categories pc on pc.id = p.category_id
+        left join sales_agg sa on sa.product_id = p.id
+        where p.pharmacy_id = :ph and p.is_active = true
+    """), {"ph": pharmacy_id, "from": frm, "to": to}).mappings().all()]
+    total = sum(max(0.0, float(r["consumption_value"] or 0)) for r in rows) or 0.0
+    rows.sort(key=lambda r: float(r["consumption_value"] or 0), reverse=True)
+    cum = 0.0
+    for r in rows:
+        cum += (max(0.0, float(r["consumption_value"] or 0)) / total) if total > 0 else 0.0
+        r["abc_class"] = "A" if cum <= ath else "B" if cum <= bth else "C"
+        name, cat = (r["name"] or "").lower(), (r["category_name"] or "").lower()
+        if any(k in name for k in VITAL_KEYWORDS) or any(k in cat for k in VITAL_CATEGORIES):
+            r["ved_class"] = "V"
+        elif any(k in name for k in DESIRABLE_KEYWORDS) or any(k in cat for k in DESIRABLE_CATEGORIES):
+            r["ved_class"] = "D"
+        else:
+            r["ved_class"] = "E"
+    return rows
+
+
+def timed(fn, repeat):
+    samples, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), result
+
+
+def main() -> int:
+    args = parse_args()
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    to = datetime.utcnow()
+    frm = to - timedelta(days=args.days)
+    with engine.connect() as conn:
+        legacy_ms, old = timed(lambda: legacy(conn, args.pharmacy_id, frm, to), args.repeat)
+        sql_ms, (items, _) = timed(lambda: classify(conn, args.pharmacy_id, frm, to), args.repeat)
+    for label, ms, rows in (("legacy", legacy_ms, old), ("sql", sql_ms, items)):
+        cells = Counter(f"{r['abc_class']}-{r['ved_class']}" for r in rows)
+        print(f"{label:<8} {ms:>9.1f} ms  {len(rows):,} products  {dict(sorted(cells.items()))}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
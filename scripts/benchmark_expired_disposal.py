@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Compare per-product expired disposal with the set-based sweep.
+
+For --pharmacy-id, inside one transaction that is rolled back at the end (the
+database is not changed), each approach runs in its own savepoint over the
+same expired stock:
+
+* per-product: what POST /api/manager/dispose-expired/<id> does per call -
+  a FIFO loop of one UPDATE and one INSERT per batch, then a stock recompute;
+* set-based: services.disposal.dispose_chunk over chunks of --chunk-size
+  products, as POST /api/manager/dispose-expired does.
+
+Only database work is timed; HTTP and authentication per call are not, so the
+per-product figure understates the month-end one-call-per-product cost.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.disposal import DEFAULT_CHUNK_PRODUCTS, dispose_chunk, expired_product_ids  # type: ignore  # noqa: E402
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark expired stock disposal.")
+    parser.add_argument("--pharmacy-id", type=int, required=True)
+    parser.add_argument("--user-id", type=int, required=True, help="Recorded as disposed_by.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_PRODUCTS)
+    return parser.parse_args()
+
+
+def per_product(conn, pharmacy_id, user_id, product_ids):
+    units = 0
+    for pid in product_ids:
+        product = conn.execute(text("select cost_price, location from products where id = :pid"),
+                               {"pid": pid}).mappings().first()
+        batches = conn.execute(text("""
+            select id, batch_number, disposed_quantity, expiration_date, cost_price,
+                   (quantity - sold_quantity - coalesce(disposed_quantity, 0)) as available
+            from inventory_batches
+            where product_id = :pid and expiration_date is not null and expiration_date <= current_date
+              and (quantity - sold_quantity - coalesce(disposed_quantity, 0)) > 0
+            order by received_at asc
+        """), {"pid": pid}).mappings().all()
+        for batch in batches:
+            qty = int(batch["available"])
+            conn.execute(text("update inventory_batches set disposed_quantity = :q where id = :id"),
+                         {"q": int(batch["disposed_quantity"] or 0) + qty, "id": batch["id"]})
+            cost = float(batch["cost_price"] or product["cost_price"] or 0)
+            conn.execute(text("""
+                insert into disposed_products (pharmacy_id, product_id, batch_id, batch_number, quantity_disposed,
+                    cost_price, total_cost, disposed_by, expiration_date, location, reason)
+                values (:ph, :pid, :bid, :bn, :qty, :cp, :tc, :uid, :exp, :loc, 'Expired - Disposed')
+            """), {"ph": pharmacy_id, "pid": pid, "bid": batch["id"], "bn": batch["batch_number"], "qty": qty,
+                   "cp": cost, "tc": cost * qty, "uid": user_id, "exp": batch["expiration_date"],
+                   "loc": product["location"]})
+            units += qty
+        total = conn.execute(text("""
+            select coalesce(sum(quantity - sold_quantity - coalesce(disposed_quantity, 0)), 0)
+            from inventory_batches where product_id = :pid and (expiration_date is null or expiration_date > current_date)
+        """), {"pid": pid}).scalar()
+        conn.execute(text("""
+            insert into inventory (product_id, current_stock, last_updated) values (:pid, :total, now())
+            on conflict (product_id) do update set current_stock = :total, last_updated = now()
+        """), {"pid": pid, "total": max(0, total)})
+    return units
+
+
+def set_based(conn, pharmacy_id, user_id, product_ids, chunk_size):
+    units = 0
+    for start in range(0, len(product_ids), chunk_size):
+        units += dispose_chunk(conn, pharmacy_id, user_id, product_ids[start:start + chunk_size])["units"]
+    return units
+
+
+def main() -> int:
+    args = parse_args()
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    with engine.connect() as conn:
+        outer = conn.begin()
+        try:
+            product_ids = expired_product_ids(conn, args.pharmacy_id)
+            print(f"products with expired stock: {len(product_ids)}")
+            if not product_ids:
+                return 0
+            runs = [
+                ("per-product", lambda: per_product(conn, args.pharmacy_id, args.user_id, product_ids)),
+                (f"set-based (chunks of {args.chunk_size})",
+                 lambda: set_based(conn, args.pharmacy_id, args.user_id, product_ids, max(1, args.chunk_size))),
+            ]
+            for label, run in runs:
+                savepoint = conn.begin_nested()
+                started = time.perf_counter()
+                units = run()
+                elapsed = time.perf_counter() - started
+                savepoint.rollback()
+                print(f"{label:<28} {elapsed * 1000:>10.1f} ms  {units:>10,} units")
+        finally:
+            outer.rollback()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Measure JSON serialization CPU and bytes on the wire for the largest payloads.
+
+Payloads are shaped like the biggest responses: /api/products (500 rows),
+a /api/pos/transactions page, the manager stock report and
+/api/forecasting/historical. They are generated synthetically by default,
+with Decimal and datetime values as the database returns them. Pass
+--pharmacy-id to load the products and stock report rows from the database
+instead.
+
+Each payload goes through jsonify() with Flask's stdlib provider and with
+utils.fast_json.FastJSONProvider (orjson when installed). Then the body is
+compressed as install_response_compression would.
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+from dotenv import load_dotenv
+from flask import Flask, jsonify
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from utils import fast_json  # type: ignore  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark JSON serialization and compression.")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--pharmacy-id", type=int, default=None, help="Load product/stock rows from the database.")
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+def money(rng, low=1, high=2000):
+    return Decimal(f"{rng.uniform(low, high):.2f}")
+
+
+def synthetic_payloads(rng):
+    now = datetime(2026, 1, 1, 9, 0, 0)
+    products = [{
+        "id": i, "name": f"Product {i} {rng.choice(['500mg tablet', 'syrup 60ml', 'capsule'])}",
+        "category": rng.choice(["Analgesics", "Antibiotics", "Vitamins", "Antihistamines"]),
+        "unit_price": money(rng), "cost_price": money(rng), "current_stock": rng.randint(0, 900),
+        "available_stock": rng.randint(0, 900), "location": f"Shelf {rng.randint(1, 40)}",
+    } for i in range(500)]
+    transactions = {"success": True, "transactions": [{
+        "id": i, "sale_number": f"POS20260101{i:08X}", "subtotal": money(rng), "discount_amount": Decimal("0.00"),
+        "total_amount": money(rng), "payment_method": "cash", "created_at": now - timedelta(minutes=i),
+        "return_count": 0, "total_returned_amount": Decimal("0"), "has_returns": False,
+        "staff_username": "cashier1", "staff_first_name": "Ana", "staff_last_name": "Cruz",
+        "items": [{"product_id": rng.randint(1, 500), "product_name": "Product", "quantity": rng.randint(1, 5),
+                   "unit_price": money(rng), "total_price": money(rng)} for _ in range(rng.randint(1, 6))],
+    } for i in range(200)]}
+    stock_report = {"success": True, "data": [{
+        "product_id": i, "product_name": f"Product {i}", "category_name": "Analgesics",
+        "current_stock": rng.randint(0, 900), "unit_price": money(rng), "cost_price": money(rng),
+        "stock_value": money(rng, 10, 90000), "nearest_expiration": (now + timedelta(days=rng.randint(1, 700))).date(),
+        "last_restocked": now - timedelta(days=rng.randint(0, 90)), "status": "in_stock",
+    } for i in range(5000)]}
+    historical = {"success": True, "data": {
+        "dates": [(now - timedelta(days=d)).date().isoformat() for d in range(730)],
+        "values": [rng.uniform(0, 300) for _ in range(730)],
+    }}
+    return {"products (500)": products, "pos transactions (200)": transactions,
+            "stock report (5000)": stock_report, "forecast historical (730)": historical}
+
+
+def database_payloads(pharmacy_id):
+    from sqlalchemy import create_engine, text
+    from utils.helpers import get_database_url  # type: ignore
+
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    with engine.connect() as conn:
+        products = [dict(r) for r in conn.execute(text("""
+            select p.id, p.name, pc.name as category, p.unit_price, p.cost_price, p.location, p.created_at
+            from products p left join product_categories pc on pc.id = p.category_id
+            where p.pharmacy_id = :ph order by p.name limit 500
+        """), {"ph": pharmacy_id}).mappings()]
+        batches = [dict(r) for r in conn.execute(text("""
+            select b.*, p.name as product_name from inventory_batches b join products p on p.id = b.product_id
+            where p.pharmacy_id = :ph order by b.id limit 5000
+        """), {"ph": pharmacy_id}).mappings()]
+    return {"products (db)": products, "stock batches (db)": {"success": True, "data": batches}}
+
+
+def time_jsonify(app, payload, repeat):
+    samples, body = [], b""
+    with app.app_context():
+        for _ in range(repeat):
+            started = time.process_time()
+            body = jsonify(payload).get_data()
+            samples.append((time.process_time() - started) * 1000)
+    return statistics.median(samples), body
+
+
+def time_compress(body, encoding, repeat):
+    samples, out = [], body
+    for _ in range(max(1, repeat // 5)):
+        started = time.process_time()
+        out = fast_json.compress(body, encoding)
+        samples.append((time.process_time() - started) * 1000)
+    return statistics.median(samples), len(out)
+
+
+def main() -> int:
+    args = parse_args()
+    rng = random.Random(args.seed)
+    payloads = database_payloads(args.pharmacy_id) if args.pharmacy_id else synthetic_payloads(rng)
+
+    stdlib_app = Flask("stdlib")
+    fast_app = Flask("fast")
+    fast_active = fast_json.install_fast_json(fast_app)
+    print(f"fast path: {'orjson' if fast_active else 'stdlib fallback (orjson not installed)'}; "
+          f"brotli: {'yes' if fast_json.brotli else 'no'}")
+    print(f"{'payload':<26} {'stdlib ms':>10} {'fast ms':>8} {'speedup':>8} {'bytes':>10} "
+          f"{'gzip':>9} {'gzip ms':>8} {'br':>9} {'br ms':>7}")
+    for label, payload in payloads.items():
+        std_ms, _ = time_jsonify(stdlib_app, payload, args.repeat)
+        fast_ms, body = time_jsonify(fast_app, payload, args.repeat)
+        gz_ms, gz_bytes = time_compress(body, "gzip", args.repeat)
+        br = time_compress(body, "br", args.repeat) if fast_json.brotli else None
+        br_cols = f"{br[1]:>9,} {br[0]:>7.2f}" if br else f"{'-':>9} {'-':>7}"
+        print(f"{label:<26} {std_ms:>10.2f} {fast_ms:>8.2f} {std_ms / max(fast_ms, 1e-6):>7.1f}x "
+              f"{len(body):>10,} {gz_bytes:>9,} {gz_ms:>8.2f} {br_cols}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Compare OFFSET and keyset pagination at depth.
+
+Builds temporary support_tickets/sales-shaped tables with --rows rows each
+(1M by default) inside one session, indexes them the way
+ensure_keyset_pagination_indexes does, then times fetching a page at several
+depths with LIMIT/OFFSET and with the keyset cursor from utils.pagination.
+Keyset pages should cost the same at any depth; OFFSET grows linearly.
+
+Nothing is written to the real tables (everything is TEMP and rolled back).
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+from utils.pagination import Keyset, KeysetPage  # type: ignore  # noqa: E402
+
+SETUP_SQL = [
+    """
+    create temp table bench_support_tickets on commit drop as
+    select g as id, (g % 50) + 1 as pharmacy_id,
+           timestamptz '2020-01-01' + (g * interval '37 seconds') as created_at,
+           'Subject ' || g as subject
+    from generate_series(1, :rows) g
+    """,
+    "create index on bench_support_tickets (created_at desc, id desc)",
+    """
+    create temp table bench_sales on commit drop as
+    select g as id, 1 as pharmacy_id,
+           -- coarse timestamps so many rows tie and the id tiebreaker matters
+           timestamptz '2020-01-01' + ((g / 10) * interval '1 minute') as created_at,
+           (g % 5000)::numeric / 10 as total_amount
+    from generate_series(1, :rows) g
+    """,
+    "create index on bench_sales (pharmacy_id, created_at desc, id desc)",
+    "analyze bench_support_tickets",
+    "analyze bench_sales",
+]
+
+TABLES = {
+    "tickets": ("bench_support_tickets t", "true", Keyset("bench_tickets", [("t.created_at", "created_at"), ("t.id", "id")])),
+    "sales": ("bench_sales t", "t.pharmacy_id = 1", Keyset("bench_sales", [("t.created_at", "created_at"), ("t.id", "id")])),
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Time OFFSET vs keyset pagination at depth.")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Rows per table (default: 1M).")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--depths", type=int, nargs="+", default=[1, 100, 1_000, 10_000])
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per measurement (median reported).")
+    return parser.parse_args()
+
+
+def timed(conn, sql, params, repeat):
+    samples = []
+    rows = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = conn.execute(text(sql), params).mappings().all()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), rows
+
+
+def main() -> int:
+    args = parse_args()
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            print(f"Building temp tables with {args.rows:,} rows each...")
+            for sql in SETUP_SQL:
+                conn.execute(text(sql), {"rows": args.rows})
+
+            for label, (table, where, keyset) in TABLES.items():
+                print(f"\n{label}: page size {args.page_size}")
+                print(f"{'page':>8} {'offset ms':>10} {'keyset ms':>10}")
+                for depth in args.depths:
+                    if (depth - 1) * args.page_size >= args.rows:
+                        continue
+                    offset_sql = (
+                        f"select t.id, t.created_at from {table} where {where} "
+                        f"order by {keyset.order_by()} limit :n offset :o"
+                    )
+                    offset_ms, offset_rows = timed(
+                        conn, offset_sql, {"n": args.page_size, "o": (depth - 1) * args.page_size}, args.repeat
+                    )
+
+                    # Cursor = last row of the previous page, as a client following next_cursor would send
+                    cursor = None
+                    if depth > 1:
+                        prev = conn.execute(
+                            text(offset_sql), {"n": 1, "o": (depth - 1) * args.page_size - 1}
+                        ).mappings().first()
+                        cursor = keyset.encode(prev)
+                    page = KeysetPage(keyset, limit=args.page_size, cursor=cursor)
+                    params = {}
+                    keyset_sql = (
+                        f"select t.id, t.created_at from {table} where {where} and {page.condition(params)} "
+                        f"order by {page.order_by()} {page.limit_clause(params)}"
+                    )
+                    keyset_ms, keyset_rows = timed(conn, keyset_sql, params, args.repeat)
+                    keyset_rows, _ = page.finish(keyset_rows)
+
+                    same = [r["id"] for r in offset_rows] == [r["id"] for r in keyset_rows]
+                    print(f"{depth:>8,} {offset_ms:>10.2f} {keyset_ms:>10.2f}{'' if same else '  MISMATCH'}")
+        finally:
+            trans.rollback()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
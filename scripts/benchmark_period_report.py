@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Time the sales period report and count the statements it issues.
+
+For --pharmacy-id and --staff-id, runs services.period_report.period_report
+for every grain (day, week, month, quarter) over the last --days days and
+prints the median time, the number of SQL statements executed (counted with
+an engine event) and the size of the result.
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.period_report import PERIOD_GRAINS, period_report  # type: ignore  # noqa: E402
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the sales period report.")
+    parser.add_argument("--pharmacy-id", type=int, required=True)
+    parser.add_argument("--staff-id", type=int, required=True)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *a, **k: statements.append(1))
+    date_from = (date.today() - timedelta(days=args.days)).isoformat()
+    with engine.connect() as conn:
+        for grain in PERIOD_GRAINS:
+            samples = []
+            for _ in range(args.repeat):
+                statements.clear()
+                started = time.perf_counter()
+                report = period_report(conn, args.pharmacy_id, args.staff_id, grain, date_from)
+                samples.append((time.perf_counter() - started) * 1000)
+            lines = sum(len(p["medicines"]) for p in report["periods"])
+            print(f"{grain:<8} {statistics.median(samples):>9.1f} ms  {len(statements)} statement(s)  "
+                  f"{len(report['periods']):,} periods  {lines:,} line items")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Compare sales/second of bulk sale recording with one-sale-per-call recording.
+
+Generates --sales small sales over in-stock products of --pharmacy-id and
+records them twice through services.pos_sales.record_sales:
+
+* sequential: one call (and one savepoint, standing in for one request
+  transaction) per sale, as terminals did with /api/pos/process-sale;
+* bulk: --batch-size sales per call, as /api/pos/sales/bulk does.
+
+It also times the receipt read-back /api/pos/process-sale used to do after
+writing each sale (sale row + items join). Receipts now come from the
+INSERT ... RETURNING rows, so that time is saved on every checkout.
+
+Everything runs in a single transaction that is rolled back at the end, so no
+sales or stock changes are kept. HTTP/auth overhead is not included, which
+understates the gain a terminal sees over the network.
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.pos_sales import SaleInput, SaleLine, record_sales  # type: ignore  # noqa: E402
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+
+
+# What process_sale ran per sale to build the receipt before RETURNING was used
+RECEIPT_SALE_SQL = """
+    SELECT s.id, s.sale_number, s.subtotal, s.tax_amount, s.discount_amount,
+           s.total_amount, s.payment_method, s.created_at
+    FROM sales s WHERE s.id = :sale_id
+"""
+RECEIPT_ITEMS_SQL = """
+    SELECT si.quantity, si.unit_price, si.total_price, p.name as product_name
+    FROM sale_items si JOIN products p ON si.product_id = p.id
+    WHERE si.sale_id = :sale_id ORDER BY si.id
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark bulk vs sequential POS sale recording.")
+    parser.add_argument("--pharmacy-id", type=int, required=True)
+    parser.add_argument("--user-id", type=int, default=None, help="Cashier (defaults to a user of the pharmacy).")
+    parser.add_argument("--sales", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+def make_sales(products, count, rng):
+    sales = []
+    for _ in range(count):
+        lines = [SaleLine(product_id=pid, quantity=1, unit_price=float(price))
+                 for pid, price in rng.sample(products, k=min(len(products), rng.randint(1, 3)))]
+        sales.append(SaleInput(items=lines, payment_method="cash"))
+    return sales
+
+
+def main() -> int:
+    args = parse_args()
+    rng = random.Random(args.seed)
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            user_id = args.user_id or conn.execute(
+                text("select id from users where pharmacy_id = :ph order by id limit 1"), {"ph": args.pharmacy_id}
+            ).scalar()
+            products = [
+                (row.id, row.unit_price)
+                for row in conn.execute(text("""
+                    select p.id, coalesce(p.unit_price, 1) as unit_price
+                    from products p
+                    join inventory_batches b on b.product_id = p.id
+                    where p.pharmacy_id = :ph and coalesce(p.is_active, true)
+                      and (b.expiration_date is null or b.expiration_date > current_date)
+                    group by p.id
+                    having sum(b.quantity - b.sold_quantity - coalesce(b.disposed_quantity, 0)) >= :need
+                """), {"ph": args.pharmacy_id, "need": args.sales * 2})
+            ]
+            if not products or user_id is None:
+                print("Need a user and products with enough stock for this pharmacy.")
+                return 1
+
+            sequential_sales = make_sales(products, args.sales, rng)
+            bulk_sales = make_sales(products, args.sales, rng)
+
+            started = time.perf_counter()
+            created = 0
+            sale_ids = []
+            for sale in sequential_sales:
+                with conn.begin_nested():
+                    outcomes = record_sales(conn, args.pharmacy_id, user_id, [sale])
+                    created += sum(o.status == "created" for o in outcomes)
+                    sale_ids += [o.sale_id for o in outcomes if o.receipt is not None]
+            sequential_s = time.perf_counter() - started
+            print(f"sequential: {created}/{args.sales} sales in {sequential_s:.2f}s ({created / sequential_s:,.1f} sales/s)")
+
+            started = time.perf_counter()
+            for sale_id in sale_ids:
+                conn.execute(text(RECEIPT_SALE_SQL), {"sale_id": sale_id}).first()
+                conn.execute(text(RECEIPT_ITEMS_SQL), {"sale_id": sale_id}).all()
+            readback_ms = (time.perf_counter() - started) * 1000 / max(len(sale_ids), 1)
+            print(f"receipt read-back avoided: {readback_ms:.2f} ms/sale (2 queries) "
+                  f"= {readback_ms * len(sale_ids) / 1000 / sequential_s:.0%} of sequential write time")
+
+            started = time.perf_counter()
+            created = 0
+            for i in range(0, len(bulk_sales), args.batch_size):
+                with conn.begin_nested():
+                    outcomes = record_sales(conn, args.pharmacy_id, user_id, bulk_sales[i:i + args.batch_size])
+                    created += sum(o.status == "created" for o in outcomes)
+            bulk_s = time.perf_counter() - started
+            print(f"bulk x{args.batch_size}: {created}/{args.sales} sales in {bulk_s:.2f}s ({created / bulk_s:,.1f} sales/s)")
+            print(f"speedup: {sequential_s / bulk_s:.1f}x")
+        finally:
+            trans.rollback()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
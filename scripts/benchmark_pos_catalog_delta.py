@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Compare a full POS catalog pull with the versioned delta feed.
+
+For --pharmacy-id, inside one transaction that is rolled back at the end:
+
+* full: the /api/pos/products query and JSON body terminals pulled on every
+  refresh;
+* delta: services.pos_catalog.catalog_changes after --changes products had
+  their price changed (so the triggers stamp them with a new version).
+
+For each it reports the JSON payload size (raw and gzip), wall time and
+process CPU time (serialisation and row handling on the app server; database
+time is in the wall figure).
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.pos_catalog import catalog_changes, catalog_version  # type: ignore  # noqa: E402
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+
+FULL_QUERY = """
+    SELECT
+        p.id, p.name, p.unit_price, p.cost_price,
+        pc.name as category_name,
+        COALESCE((
+            SELECT SUM(b.quantity - COALESCE(b.sold_quantity, 0) - COALESCE(b.disposed_quantity, 0))
+            FROM inventory_batches b
+            WHERE b.product_id = p.id
+            AND (b.expiration_date IS NULL OR b.expiration_date > CURRENT_DATE)
+        ), 0) as current_stock,
+        p.location,
+        COALESCE(p.reorder_point, 0) as reorder_point,
+        p.preferred_supplier_id
+    FROM products p
+    LEFT JOIN product_categories pc ON p.category_id = pc.id
+    WHERE p.is_active = true
+    ORDER BY p.name
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark full catalog pulls against the delta feed.")
+    parser.add_argument("--pharmacy-id", type=int, required=True)
+    parser.add_argument("--changes", type=int, default=20, help="Products to change before the delta pull.")
+    parser.add_argument("--repeat", type=int, default=10)
+    return parser.parse_args()
+
+
+def measure(fn, repeat):
+    walls, cpus, body = [], [], b""
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        body = json.dumps(fn(), default=str).encode("utf-8")
+        cpus.append((time.process_time() - cpu) * 1000)
+        walls.append((time.perf_counter() - wall) * 1000)
+    return statistics.median(walls), statistics.median(cpus), len(body), len(gzip.compress(body))
+
+
+def main() -> int:
+    args = parse_args()
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            def full():
+                rows = [dict(r) for r in conn.execute(text(FULL_QUERY)).mappings().all()]
+                for row in rows:
+                    row["in_stock"] = row["current_stock"] > 0
+                return {"success": True, "products": rows}
+
+            base = catalog_version(conn, args.pharmacy_id)
+            changed = conn.execute(text("""
+                UPDATE products SET unit_price = unit_price + 0.01
+                WHERE id IN (
+                    SELECT id FROM products WHERE pharmacy_id = :ph AND is_active = true ORDER BY random() LIMIT :n
+                )
+            """), {"ph": args.pharmacy_id, "n": args.changes}).rowcount
+            print(f"catalog version {base} -> {catalog_version(conn, args.pharmacy_id)} after changing {changed} products")
+
+            def delta():
+                return {"success": True, "since": base, **catalog_changes(conn, args.pharmacy_id, base)}
+
+            def unchanged():
+                version = catalog_version(conn, args.pharmacy_id)
+                return {"success": True, "since": version, **catalog_changes(conn, args.pharmacy_id, version)}
+
+            print(f"{'pull':<12} {'bytes':>10} {'gzip':>9} {'wall ms':>9} {'cpu ms':>8}")
+            for label, fn in (("full", full), ("delta", delta), ("up-to-date", unchanged)):
+                wall, cpu, raw, packed = measure(fn, args.repeat)
+                print(f"{label:<12} {raw:>10,} {packed:>9,} {wall:>9.2f} {cpu:>8.2f}")
+        finally:
+            trans.rollback()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
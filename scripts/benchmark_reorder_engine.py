@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Time the reorder engine at catalog scale.
+
+By default --skus synthetic products (50,000) are built directly as
+services.reorder.ReorderInputs rows with realistic stock, demand, lead
+times and suppliers, so no database is needed. Each run times:
+
+* building the column arrays from rows (what load_inputs does after fetch);
+* compute_plan, with forecast rates for --forecasts of the products;
+* group_by_supplier, which shapes the draft purchase orders.
+
+Pass --pharmacy-id to also time load_inputs against the database.
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.reorder import ReorderInputs, compute_plan, group_by_supplier, load_inputs  # type: ignore  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the reorder suggestion engine.")
+    parser.add_argument("--skus", type=int, default=50_000)
+    parser.add_argument("--suppliers", type=int, default=40)
+    parser.add_argument("--forecasts", type=int, default=500, help="Products with a forecast rate.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--pharmacy-id", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+def synthetic_rows(rng, skus, suppliers):
+    rows = []
+    for pid in range(1, skus + 1):
+        supplier = rng.randint(1, suppliers) if rng.random() < 0.9 else None
+        rate = rng.choice([0, 0, 0.2, 1, 3, 8, 20]) * rng.uniform(0.5, 1.5)
+        long_sold = rate * 28
+        rows.append((
+            pid, f"Product {pid}", supplier, f"Supplier {supplier}" if supplier else None,
+            rng.choice([3, 5, 7, 14]), rng.choice([0, 0, 10, 20]), round(rng.uniform(1, 500), 2),
+            rng.randint(0, 400), rng.choice([0, 0, 0, 50]),
+            rate * 7 * rng.uniform(0.7, 1.3), long_sold, long_sold * rate * rng.uniform(1.0, 2.0),
+        ))
+    return rows
+
+
+def timed(fn, repeat):
+    samples, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), result
+
+
+def main() -> int:
+    args = parse_args()
+    rng = random.Random(args.seed)
+    rows = synthetic_rows(rng, args.skus, args.suppliers)
+    forecasts = {pid: rng.uniform(0, 10) for pid in rng.sample(range(1, args.skus + 1), min(args.forecasts, args.skus))}
+
+    build_ms, inputs = timed(lambda: ReorderInputs.from_rows(rows), args.repeat)
+    plan_ms, plan = timed(lambda: compute_plan(inputs, forecast_rates=forecasts), args.repeat)
+    group_ms, drafts = timed(lambda: group_by_supplier(plan), args.repeat)
+    lines = sum(len(d["lines"]) for d in drafts)
+    print(f"SKUs: {len(inputs):,}  suggested lines: {lines:,}  draft orders: {len(drafts)}")
+    print(f"{'arrays from rows':<22} {build_ms:>9.1f} ms")
+    print(f"{'compute_plan':<22} {plan_ms:>9.1f} ms")
+    print(f"{'group_by_supplier':<22} {group_ms:>9.1f} ms")
+    print(f"{'total':<22} {build_ms + plan_ms + group_ms:>9.1f} ms")
+
+    if args.pharmacy_id:
+        from sqlalchemy import create_engine
+        from utils.helpers import get_database_url  # type: ignore
+
+        engine = create_engine(get_database_url(), pool_pre_ping=True)
+
+        def load():
+            with engine.connect() as conn:
+                return load_inputs(conn, args.pharmacy_id)
+
+        load_ms, db_inputs = timed(load, args.repeat)
+        print(f"{'load_inputs (db)':<22} {load_ms:>9.1f} ms  ({len(db_inputs):,} products)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Check that report exports run in constant memory.
+
+Streams a detailed-sales-shaped export of --rows lines (5M by default) through
+the CSV (and, when pyarrow is installed, Parquet) encoders and fails if peak
+RSS grows by more than --max-mb over the starting footprint.
+
+Rows are synthesized in --chunk-rows partitions, exactly as the server-side
+cursor hands them over, so the check needs no database. Pass --pharmacy-id to
+export the real sale lines of a pharmacy through Postgres instead.
+"""
+from __future__ import annotations
+
+import argparse
+import resource
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.report_export import (  # type: ignore  # noqa: E402
+    DEFAULT_CHUNK_ROWS,
+    PARQUET_AVAILABLE,
+    ReportQuery,
+    encode_csv,
+    encode_parquet,
+    stream_rows,
+)
+
+COLUMNS = [
+    "sale_id", "sale_number", "created_at", "staff_name", "product_name",
+    "quantity", "unit_price", "total_price", "payment_method",
+]
+
+SALE_LINES_SQL = """
+    select s.id as sale_id, s.sale_number, s.created_at,
+           u.first_name || ' ' || u.last_name as staff_name,
+           p.name as product_name, si.quantity, si.unit_price, si.total_price,
+           s.payment_method
+    from sale_items si
+    join sales s on s.id = si.sale_id
+    join products p on p.id = si.product_id
+    left join users u on u.id = s.user_id
+    where s.pharmacy_id = :pharmacy_id
+    order by s.created_at, si.id
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measure report export memory at large row counts.")
+    parser.add_argument("--rows", type=int, default=5_000_000, help="Synthetic rows to export (default: 5M).")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="Rows per cursor partition.")
+    parser.add_argument("--max-mb", type=float, default=64.0, help="Allowed peak RSS growth in MB.")
+    parser.add_argument("--formats", nargs="+", default=["csv", "parquet"], choices=["csv", "parquet"])
+    parser.add_argument("--pharmacy-id", type=int, default=None, help="Export real sale lines instead of synthetic rows.")
+    return parser.parse_args()
+
+
+def synthetic_chunks(rows: int, chunk_rows: int):
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    emitted = 0
+    while emitted < rows:
+        size = min(chunk_rows, rows - emitted)
+        chunk = []
+        for i in range(emitted, emitted + size):
+            qty = i % 7 + 1
+            price = Decimal(f"{(i % 500) + 1}.25")
+            chunk.append((
+                i // 3 + 1,
+                f"SALE-{i // 3 + 1:09d}",
+                start + timedelta(seconds=i * 7),
+                "Staff Member",
+                f"Product {i % 2500}",
+                qty,
+                price,
+                price * qty,
+                "cash",
+            ))
+        emitted += size
+        yield COLUMNS, chunk
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def main() -> int:
+    args = parse_args()
+    encoders = {"csv": encode_csv, "parquet": encode_parquet}
+    engine = None
+    if args.pharmacy_id is not None:
+        from sqlalchemy import create_engine
+        from utils.helpers import get_database_url  # type: ignore
+        engine = create_engine(get_database_url(), pool_pre_ping=True)
+
+    failed = False
+    for fmt in args.formats:
+        if fmt == "parquet" and not PARQUET_AVAILABLE:
+            print("parquet: skipped (pyarrow not installed)")
+            continue
+        if engine is not None:
+            chunks = stream_rows(engine, ReportQuery("sale_lines", SALE_LINES_SQL, {"pharmacy_id": args.pharmacy_id}), args.chunk_rows)
+        else:
+            chunks = synthetic_chunks(args.rows, args.chunk_rows)
+
+        baseline = peak_rss_mb()
+        rows = 0
+
+        def counted(source):
+            nonlocal rows
+            for columns, chunk in source:
+                rows += len(chunk)
+                yield columns, chunk
+
+        started = time.perf_counter()
+        written = 0
+        for block in encoders[fmt](counted(chunks)):
+            written += len(block)
+        elapsed = time.perf_counter() - started
+        growth = peak_rss_mb() - baseline
+        ok = growth <= args.max_mb
+        failed |= not ok
+        print(
+            f"{fmt}: {rows:,} rows, {written / 1e6:,.1f} MB written in {elapsed:.1f}s "
+            f"({rows / elapsed if elapsed else 0:,.0f} rows/s), peak RSS growth {growth:.1f} MB "
+            f"[{'ok' if ok else f'over {args.max_mb:.0f} MB ceiling'}]"
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Compare ILIKE scans with the full-text index for support ticket search.
+
+Inside one transaction that is rolled back at the end, inserts synthetic
+tickets for --pharmacy-id (created by --user-id) in stages up to --tickets
+(1M by default), with one message per ticket, analyzes the tables, and at
+every stage times a substring search (``subject/description ILIKE``, as the
+endpoints did before the index) against services.text_search.search_tickets
+for each query. Nothing is left behind.
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.text_search import search_tickets  # type: ignore  # noqa: E402
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+
+WORDS = [
+    "insulin", "refund", "printer", "receipt", "barcode", "scanner", "login", "password", "expiry",
+    "batch", "invoice", "supplier", "report", "export", "sync", "offline", "discount", "inventory",
+]
+
+QUERIES = ["insulin", "receipt print", "barc", "offline sync invoice"]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark support ticket full-text search.")
+    parser.add_argument("--pharmacy-id", type=int, required=True)
+    parser.add_argument("--user-id", type=int, required=True, help="ticket creator for the synthetic rows")
+    parser.add_argument("--tickets", type=int, default=1_000_000)
+    parser.add_argument("--stages", type=int, default=3, help="sizes grow tenfold per stage up to --tickets")
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+def _insert(conn, start: int, count: int, pharmacy_id: int, user_id: int) -> None:
+    params = {"start": start, "count": count, "ph": pharmacy_id, "uid": user_id, "words": WORDS}
+    conn.execute(text("""
+        WITH words AS (
+            SELECT CAST(:words AS text[]) AS w
+        ), tickets AS (
+            INSERT INTO support_tickets (ticket_number, pharmacy_id, created_by, type, subject, description, created_at)
+            SELECT 'BENCH-' || g, :ph, :uid, 'support',
+                   w[1 + g % 18] || ' ' || w[1 + (g / 18) % 18] || ' issue',
+                   'Customer reports ' || w[1 + (g / 7) % 18] || ' and ' || w[1 + (g / 11) % 18] || ' problems at the counter',
+                   now() - (g % 720) * interval '1 day'
+            FROM generate_series(CAST(:start AS bigint), CAST(:start AS bigint) + :count - 1) AS g, words
+            RETURNING id
+        )
+        INSERT INTO support_ticket_messages (ticket_id, user_id, message)
+        SELECT t.id, :uid, 'Follow-up about ' || w[1 + t.id % 18] || ' after the ' || w[1 + (t.id / 5) % 18] || ' update'
+        FROM tickets t, words
+    """), params)
+    conn.execute(text("ANALYZE support_tickets"))
+    conn.execute(text("ANALYZE support_ticket_messages"))
+
+
+def _ilike(conn, pharmacy_id: int, query: str) -> int:
+    rows = conn.execute(text("""
+        SELECT t.id FROM support_tickets t
+        WHERE t.pharmacy_id = :ph
+          AND (t.subject ILIKE :p OR t.description ILIKE :p
+               OR EXISTS (SELECT 1 FROM support_ticket_messages m WHERE m.ticket_id = t.id AND m.message ILIKE :p))
+        ORDER BY t.created_at DESC, t.id DESC
+        LIMIT 20
+    """), {"ph": pharmacy_id, "p": f"%{query}%"}).all()
+    return len(rows)
+
+
+def _median_ms(fn, repeat: int):
+    samples, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), result
+
+
+def main() -> int:
+    args = parse_args()
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    sizes = sorted({max(1, args.tickets // 10 ** i) for i in range(args.stages)})
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            inserted = 0
+            for size in sizes:
+                _insert(conn, inserted + 1, size - inserted, args.pharmacy_id, args.user_id)
+                inserted = size
+                print(f"{size:,} synthetic tickets")
+                for query in QUERIES:
+                    ilike_ms, ilike_hits = _median_ms(lambda: _ilike(conn, args.pharmacy_id, query), args.repeat)
+                    fts_ms, results = _median_ms(
+                        lambda: search_tickets(conn, query, pharmacy_id=args.pharmacy_id, user_id=args.user_id),
+                        args.repeat,
+                    )
+                    print(f"  {query!r:<24} ILIKE {ilike_ms:>9.1f} ms ({ilike_hits} hits)   "
+                          f"FTS {fts_ms:>8.1f} ms ({len(results)} hits)")
+        finally:
+            trans.rollback()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""
+Fan-out check for the live events hub: many SSE subscribers in one process.
+
+By default this runs in-process without a database. It opens --subscribers
+streams on one services.live_events.LiveEventHub, each consumed by its own
+thread as a gunicorn gthread worker would. It then dispatches --events
+events to the pharmacy and checks that every subscriber got every event in
+order. It reports delivery latency percentiles, the time to fan one event
+out, the thread count and the resident memory.
+
+With --base-url and --token, it opens the same number of real
+/api/events/stream connections to a running worker instead. It inserts the
+events into live_events (--pharmacy-id) so they travel through
+NOTIFY and the worker's listener, then checks delivery the same way. That
+mode writes rows to live_events; they are pruned with the rest. Point it at
+the gevent events process (backend/events_app.py): a gthread worker of the
+main app answers 503 beyond LIVE_EVENTS_MAX_STREAMS, which is reported as
+subscriber errors.
+"""
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import resource
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import urlencode, urlparse
+
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.live_events import LiveEventHub  # type: ignore  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Check SSE fan-out to many subscribers in one worker.")
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--pharmacy-id", type=int, default=1)
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between events")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--base-url", help="check a running worker, e.g. http://localhost:5000")
+    parser.add_argument("--token", help="JWT of a user of --pharmacy-id (with --base-url)")
+    return parser.parse_args()
+
+
+class Receiver:
+    """What one subscriber received: event ids in order and their delivery latencies."""
+
+    def __init__(self) -> None:
+        self.ids = []
+        self.latencies = []
+        self.error = None
+
+    def record(self, event_id: int, sent_at: float) -> None:
+        self.ids.append(event_id)
+        self.latencies.append(time.time() - sent_at)
+
+
+def _parse_stream(lines, receiver: Receiver, expected: int) -> None:
+    data = None
+    for raw in lines:
+        line = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+        for part in line.splitlines() or [""]:
+            if part.startswith("data: "):
+                data = json.loads(part[6:])
+            elif part == "" and data is not None:
+                # Horizon messages (an "id:" line only) carry no data and are skipped
+                if "id" in data:
+                    receiver.record(int(data["id"]), float(data["data"]["sent_at"]))
+                data = None
+                if len(receiver.ids) >= expected:
+                    return
+
+
+def run_in_process(args: argparse.Namespace, receivers) -> None:
+    hub = LiveEventHub(None, listen=False)
+    subscriptions = [hub.subscribe(args.pharmacy_id) for _ in receivers]
+
+    def consume(sub, receiver):
+        try:
+            _parse_stream(hub.stream(sub), receiver, args.events)
+        except Exception as e:  # pragma: no cover - reported below
+            receiver.error = e
+
+    threads = [threading.Thread(target=consume, args=(s, r), daemon=True) for s, r in zip(subscriptions, receivers)]
+    for t in threads:
+        t.start()
+    print(f"{hub.subscriber_count():,} subscribers, {threading.active_count():,} threads")
+    fanout = []
+    for i in range(1, args.events + 1):
+        started = time.perf_counter()
+        hub.dispatch({"id": i, "pharmacy_id": args.pharmacy_id, "kind": "stock",
+                      "data": {"sent_at": time.time(), "products": [{"product_id": i, "current_stock": i}]},
+                      "created_at": None})
+        fanout.append((time.perf_counter() - started) * 1000)
+        time.sleep(args.interval)
+    for t in threads:
+        t.join(args.timeout)
+    hub.stop()
+    print(f"dispatch to all subscribers: median {statistics.median(fanout):.2f} ms, max {max(fanout):.2f} ms")
+
+
+def run_against_worker(args: argparse.Namespace, receivers) -> None:
+    from sqlalchemy import create_engine, text
+
+    from utils.helpers import get_database_url  # type: ignore
+
+    url = urlparse(args.base_url)
+    path = "/api/events/stream?" + urlencode({"jwt": args.token, "kinds": "stock"})
+    connected = threading.Barrier(len(receivers) + 1, timeout=args.timeout)
+
+    def consume(receiver):
+        try:
+            conn_cls = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+            conn = conn_cls(url.hostname, url.port, timeout=args.timeout)
+            conn.request("GET", path, headers={"Accept": "text/event-stream"})
+            response = conn.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            response.readline()  # retry: line, sent once the stream is registered
+            connected.wait()
+            _parse_stream(iter(response.readline, b""), receiver, args.events)
+            conn.close()
+        except Exception as e:
+            receiver.error = e
+            try:
+                connected.abort()
+            except Exception:
+                pass
+
+    threads = [threading.Thread(target=consume, args=(r,), daemon=True) for r in receivers]
+    for t in threads:
+        t.start()
+    try:
+        connected.wait()
+    except threading.BrokenBarrierError:
+        for t in threads:
+            t.join(args.timeout)
+        print(f"not every stream could be opened against {args.base_url}")
+        return
+    print(f"{len(receivers):,} streams open against {args.base_url}")
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    for _ in range(args.events):
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO live_events (pharmacy_id, kind, data)
+                VALUES (:ph, 'stock', jsonb_build_object('sent_at', CAST(:sent_at AS float8), 'products', '[]'::jsonb))
+            """), {"ph": args.pharmacy_id, "sent_at": time.time()})
+        time.sleep(args.interval)
+    for t in threads:
+        t.join(args.timeout)
+
+
+def main() -> int:
+    args = parse_args()
+    if args.base_url and not args.token:
+        print("--token is required with --base-url")
+        return 2
+    receivers = [Receiver() for _ in range(args.subscribers)]
+    if args.base_url:
+        run_against_worker(args, receivers)
+    else:
+        run_in_process(args, receivers)
+
+    errors = [r.error for r in receivers if r.error is not None]
+    complete = [r for r in receivers if len(r.ids) == args.events and r.ids == sorted(r.ids)]
+    latencies = sorted(l for r in receivers for l in r.latencies)
+    print(f"{len(complete):,}/{len(receivers):,} subscribers received all {args.events} events in order")
+    if latencies:
+        p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000  # noqa: E731
+        print(f"delivery latency: p50 {p(0.50):.1f} ms, p99 {p(0.99):.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+    print(f"max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    if errors:
+        counts = Counter(str(e) or type(e).__name__ for e in errors)
+        print(f"{len(errors)} subscriber error(s): " + ", ".join(f"{n} x {msg}" for msg, n in counts.most_common(3)))
+    return 0 if len(complete) == len(receivers) and not errors else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
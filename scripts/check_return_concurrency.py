@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Concurrency check for returns against checkouts of the same products.
+
+Records --sales small sales of the given in-stock products of --pharmacy-id,
+then runs --threads workers at once. Half of them keep checking out the same
+products through services.pos_sales.record_sales. The other half return one
+unit of those sales through services.returns.record_return. Each operation
+has its own transaction. The check reports deadlocks (there should be none)
+and verifies that no sale line was returned more often than it was sold.
+
+This writes real sales and returns; point it at a scratch database.
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.pos_sales import SaleInput, SaleLine, record_sales  # type: ignore  # noqa: E402
+from services.returns import ReturnLine, ReturnQuantityError, record_return  # type: ignore  # noqa: E402
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run returns and checkouts of the same products concurrently.")
+    parser.add_argument("--pharmacy-id", type=int, required=True)
+    parser.add_argument("--product-ids", type=int, nargs="+", required=True)
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--sales", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=20)
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    engine = create_engine(get_database_url(), pool_pre_ping=True, pool_size=args.threads + 2)
+    rng = random.Random(7)
+
+    def sale():
+        return SaleInput(items=[SaleLine(pid, 1, 1.0) for pid in rng.sample(args.product_ids, k=len(args.product_ids))],
+                         payment_method="cash")
+
+    with engine.begin() as conn:
+        outcomes = record_sales(conn, args.pharmacy_id, args.user_id, [sale() for _ in range(args.sales)])
+    sale_ids = [o.sale_id for o in outcomes if o.sale_id]
+    print(f"seeded {len(sale_ids)} sales")
+
+    counts = {"sales": 0, "returns": 0, "rejected": 0, "deadlocks": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.seconds
+
+    def worker(kind):
+        local = random.Random()
+        while time.monotonic() < deadline:
+            try:
+                with engine.begin() as conn:
+                    if kind == "sale":
+                        record_sales(conn, args.pharmacy_id, args.user_id, [sale()])
+                    else:
+                        record_return(conn, args.pharmacy_id, args.user_id, local.choice(sale_ids), "concurrency check",
+                                      [ReturnLine(local.choice(args.product_ids), 1, 1.0)])
+                key = "sales" if kind == "sale" else "returns"
+            except ReturnQuantityError:
+                key = "rejected"
+            except DBAPIError as exc:
+                key = "deadlocks" if "deadlock" in str(exc).lower() else "errors"
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=worker, args=("sale" if i % 2 else "return",)) for i in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print(", ".join(f"{k}: {v}" for k, v in counts.items()))
+
+    with engine.connect() as conn:
+        over = conn.execute(text("""
+            SELECT count(*) FROM (
+                SELECT r.sale_id, ri.product_id, SUM(ri.quantity) AS returned
+                FROM returns r JOIN return_items ri ON ri.return_id = r.id
+                WHERE r.sale_id = ANY(:ids)
+                GROUP BY r.sale_id, ri.product_id
+            ) ret
+            JOIN (
+                SELECT sale_id, product_id, SUM(quantity) AS sold
+                FROM sale_items WHERE sale_id = ANY(:ids)
+                GROUP BY sale_id, product_id
+            ) sold USING (sale_id, product_id)
+            WHERE ret.returned > sold.sold
+        """), {"ids": sale_ids}).scalar()
+    ok = counts["deadlocks"] == 0 and counts["errors"] == 0 and over == 0
+    print(f"over-returned sale lines: {over}")
+    print("OK" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
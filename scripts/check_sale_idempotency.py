@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Concurrency check for idempotent sale submission.
+
+Fires the same /api/pos/process-sale request with one Idempotency-Key from
+--threads threads at once against a running backend and verifies that every
+successful response carries the same sale id (exactly one sale was written),
+then times cached retries of the completed key.
+
+Example:
+    python scripts/check_sale_idempotency.py --base-url http://localhost:5000 \\
+        --token "$JWT" --product-id 42 --unit-price 12.50
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fire one Idempotency-Key from many threads.")
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--token", required=True, help="JWT of a POS user.")
+    parser.add_argument("--product-id", type=int, required=True)
+    parser.add_argument("--unit-price", type=float, default=1.0)
+    parser.add_argument("--quantity", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--retries", type=int, default=200, help="Sequential retries timed after the burst.")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    url = f"{args.base_url.rstrip('/')}/api/pos/process-sale"
+    key = f"idem-check-{uuid.uuid4()}"
+    headers = {"Authorization": f"Bearer {args.token}", "Idempotency-Key": key}
+    body = {
+        "items": [{"product_id": args.product_id, "quantity": args.quantity, "unit_price": args.unit_price}],
+        "payment_method": "cash",
+    }
+
+    barrier = threading.Barrier(args.threads)
+    results = []
+    lock = threading.Lock()
+
+    def fire():
+        barrier.wait()
+        resp = requests.post(url, json=body, headers=headers, timeout=60)
+        with lock:
+            results.append((resp.status_code, resp.json()))
+
+    threads = [threading.Thread(target=fire) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    sale_ids = {r["sale"]["id"] for status, r in results if status == 200 and r.get("success")}
+    replayed = sum(1 for status, r in results if status == 200 and r.get("replayed"))
+    errors = [(status, r.get("error")) for status, r in results if status != 200]
+    print(f"{args.threads} concurrent requests: sale ids {sorted(sale_ids)}, {replayed} replayed, {len(errors)} errors")
+    for status, error in errors[:5]:
+        print(f"  {status}: {error}")
+
+    timings = []
+    for _ in range(args.retries):
+        started = time.perf_counter()
+        resp = requests.post(url, json=body, headers=headers, timeout=60)
+        timings.append((time.perf_counter() - started) * 1000)
+        if resp.status_code != 200 or resp.json()["sale"]["id"] not in sale_ids:
+            print(f"retry returned a different result: {resp.status_code} {resp.text[:200]}")
+            return 1
+    print(f"{args.retries} retries: median {statistics.median(timings):.2f} ms round trip")
+
+    ok = len(sale_ids) == 1 and not errors
+    print("OK: exactly one sale recorded" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Import the product/batch CSV exports (the same files the AI semantic index is
+built from) into a pharmacy's catalogue using the COPY-based bulk loader.
+
+Each CSV row becomes (or refreshes) a product and, when it carries a positive
+quantity, a delivery batch. Inventory totals are recomputed per chunk.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.bulk_loader import (  # type: ignore  # noqa: E402
+    INVENTORY_CSV_FILES,
+    BulkLoader,
+    iter_inventory_csv,
+)
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Bulk import inventory CSV exports into a pharmacy.",
+    )
+    parser.add_argument(
+        "--pharmacy-id",
+        type=int,
+        required=True,
+        help="Pharmacy ID to import into.",
+    )
+    parser.add_argument(
+        "--csv-dir",
+        required=True,
+        help="Directory containing the inventory CSV files.",
+    )
+    parser.add_argument(
+        "--files",
+        nargs="*",
+        default=list(INVENTORY_CSV_FILES),
+        help="CSV file names to import (default: the standard export set).",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=50000,
+        help="Rows streamed per COPY chunk (default 50000).",
+    )
+    parser.add_argument(
+        "--batch-prefix",
+        default=None,
+        help="Batch number prefix; re-running with the same prefix will not duplicate batches.",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    loader = BulkLoader(engine, chunk_rows=args.chunk_rows)
+
+    stats = loader.import_inventory(
+        args.pharmacy_id,
+        iter_inventory_csv(args.csv_dir, args.files),
+        batch_prefix=args.batch_prefix,
+    )
+    print(stats)
+    print(
+        f"Products touched: {stats.merged}, batches created: {stats.extra.get('batches', 0)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
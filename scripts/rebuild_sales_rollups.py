@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Backfill or rebuild the daily sales rollup tables
+(sales_rollup_product_daily / sales_rollup_pharmacy_daily) from the raw
+sales, sale_items and returns tables.
+
+Without arguments every pharmacy's full history is rebuilt. Use
+--pharmacy-id and --from/--to to repair a window, e.g. after bulk deletes.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from database.schema import ensure_sales_rollup_tables  # type: ignore  # noqa: E402
+from services.sales_rollup import rebuild_sales_rollups  # type: ignore  # noqa: E402
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Rebuild daily sales rollups from raw sales and returns.",
+    )
+    parser.add_argument(
+        "--pharmacy-id",
+        type=int,
+        default=None,
+        help="Only rebuild this pharmacy (default: all).",
+    )
+    parser.add_argument(
+        "--from",
+        dest="date_from",
+        default=None,
+        help="First sale day to rebuild (YYYY-MM-DD, default: all history).",
+    )
+    parser.add_argument(
+        "--to",
+        dest="date_to",
+        default=None,
+        help="Last sale day to rebuild (YYYY-MM-DD, inclusive).",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    ensure_sales_rollup_tables()
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+
+    start = time.time()
+    with engine.begin() as conn:
+        result = rebuild_sales_rollups(
+            conn,
+            pharmacy_id=args.pharmacy_id,
+            date_from=args.date_from,
+            date_to=args.date_to,
+        )
+    print(
+        f"Rebuilt {result['product_day_rows']} product-day rows "
+        f"(replaced {result['deleted']}) in {time.time() - start:.2f}s."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Refresh tenant_storage_usage, e.g. hourly from cron.
+
+Folds the pending row-count deltas into tenant_row_counts. It then samples
+row widths with pg_column_size over TABLESAMPLE, reads
+pg_total_relation_size for every tracked table and stores each pharmacy's
+share. With --recount, row counts are recounted exactly first. This is
+slower, but it corrects deltas lost when a parent row was deleted together
+with its children; a weekly run is enough.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.storage_accounting import refresh_storage_usage  # type: ignore  # noqa: E402
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Refresh per-tenant storage accounting.")
+    parser.add_argument("--recount", action="store_true", help="Recount rows exactly instead of folding deltas.")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    started = time.perf_counter()
+    written = refresh_storage_usage(engine, full_recount=args.recount)
+    for table, tenants in written.items():
+        print(f"{table:<26} {tenants:>6} tenant(s)")
+    print(f"refreshed in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Roll the expiry-risk index over to today, e.g. nightly from cron just after
+midnight.
+
+Days to expiry and sell-through velocity move with the calendar, so each
+pharmacy's batch_expiry_risk rows are recomputed once a day. Readers do this
+lazily on the first request of the day; running it here keeps that cost off
+the first manager landing page. Pharmacies already rolled over today are
+skipped, so running it twice is harmless.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.expiry_risk import roll_over_all, roll_over_expiry_risk  # type: ignore  # noqa: E402
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Roll the expiry-risk index over to today.")
+    parser.add_argument("--pharmacy-id", type=int, default=None, help="Default: every pharmacy.")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    started = time.perf_counter()
+    if args.pharmacy_id:
+        with engine.begin() as conn:
+            done = [args.pharmacy_id] if roll_over_expiry_risk(conn, args.pharmacy_id) else []
+    else:
+        done = roll_over_all(engine)
+    print(f"rolled over {len(done)} pharmacy(ies) in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Run the reorder engine for one or every pharmacy, e.g. hourly from cron.
+
+Prints the suggestion summary per pharmacy. Each run first refreshes the
+forecast demand rates of products with a trained model
+(reorder_forecast_rates) outside any transaction; the API reads the same
+stored rates, so its suggestions match this job's. --skip-forecasts keeps the
+stored rates as they are.
+
+With --create-drafts the suggestions become draft purchase orders (one per
+supplier), created by --user-id or, when omitted, by the pharmacy's first
+manager. Open drafts count as stock on order, so running again does not order
+the same gap twice.
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.reorder import (  # type: ignore  # noqa: E402
+    compute_plan, create_draft_orders, group_by_supplier, load_forecast_rates, load_inputs,
+    predict_forecast_rates, store_forecast_rates,
+)
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+
+logger = logging.getLogger("run_reorder_engine")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compute reorder suggestions and optionally create draft POs.")
+    parser.add_argument("--pharmacy-id", type=int, default=None, help="Default: every pharmacy.")
+    parser.add_argument("--create-drafts", action="store_true")
+    parser.add_argument("--user-id", type=int, default=None, help="created_by of the draft purchase orders.")
+    parser.add_argument("--skip-forecasts", action="store_true", help="Plan with the stored forecast rates.")
+    return parser.parse_args()
+
+
+def forecasting_service(db_url: str):
+    """The API's ForecastingService, or None when its model dependencies are missing."""
+    try:
+        from forecasting_service import ForecastingService  # type: ignore
+    except ImportError as e:
+        logger.warning("Forecasting unavailable, keeping the stored rates: %s", e)
+        return None
+    return ForecastingService(db_url)
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    db_url = get_database_url()
+    engine = create_engine(db_url, pool_pre_ping=True)
+    service = None if args.skip_forecasts else forecasting_service(db_url)
+    with engine.connect() as conn:
+        if args.pharmacy_id:
+            pharmacies = [args.pharmacy_id]
+        else:
+            pharmacies = conn.execute(text("select id from pharmacies order by id")).scalars().all()
+
+    for pharmacy_id in pharmacies:
+        started = time.perf_counter()
+        # Model inference is slow, so it runs before the transaction opens
+        rates = predict_forecast_rates(service, pharmacy_id) if service is not None else None
+        with engine.begin() as conn:
+            if rates is not None:
+                store_forecast_rates(conn, pharmacy_id, rates)
+            inputs = load_inputs(conn, pharmacy_id)
+            drafts = group_by_supplier(compute_plan(inputs, forecast_rates=load_forecast_rates(conn, pharmacy_id)))
+            created = []
+            if args.create_drafts:
+                user_id = args.user_id or conn.execute(text("""
+                    select id from users where pharmacy_id = :ph and role = 'manager' order by id limit 1
+                """), {"ph": pharmacy_id}).scalar()
+                if user_id is None:
+                    logger.warning("pharmacy %s: no manager to own the drafts, skipped", pharmacy_id)
+                else:
+                    created = create_draft_orders(conn, pharmacy_id, user_id, drafts)
+        lines = sum(len(d["lines"]) for d in drafts)
+        print(f"pharmacy {pharmacy_id}: {len(inputs):,} products, {lines:,} lines for {len(drafts)} supplier(s), "
+              f"{len(created)} draft PO(s) created in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -11,7 +11,7 @@ import math
 import sys
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from dotenv import load_dotenv
 from sqlalchemy import create_engine, text
@@ -25,6 +25,8 @@ if str(BACKEND_DIR) not in sys.path:
 
 load_dotenv()
 
+from services.bulk_loader import BulkLoader  # type: ignore  # noqa: E402
+from services.sales_rollup import rebuild_sales_rollups  # type: ignore  # noqa: E402
 from train_models import get_products_for_pharmacy  # type: ignore  # noqa: E402
 from utils.helpers import get_database_url  # type: ignore  # noqa: E402
 
@@ -110,32 +112,6 @@ def ensure_historical_table(engine: Engine) -> None:
         )
 
 
-def get_table_columns(engine: Engine, table_name: str) -> Sequence[str]:
-    query = text(
-        """
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_schema = 'public' AND table_name = :table
-        """
-    )
-    with engine.connect() as conn:
-        rows = conn.execute(query, {"table": table_name}).fetchall()
-    return [row[0] for row in rows]
-
-
-def get_table_column_details(engine: Engine, table_name: str) -> List[Dict[str, str]]:
-    query = text(
-        """
-        SELECT column_name, is_generated
-        FROM information_schema.columns
-        WHERE table_schema = 'public' AND table_name = :table
-        """
-    )
-    with engine.connect() as conn:
-        rows = conn.execute(query, {"table": table_name}).fetchall()
-    return [{"name": row[0], "is_generated": row[1]} for row in rows]
-
-
 class ProgressReporter:
     def __init__(self, total: int, desc: str):
         self.total = total
@@ -199,6 +175,18 @@ def delete_existing_dummy_sales(
                 ),
                 {"ids": id_list},
             )
+            # Deleted dummy sales must drop out of the daily rollups too
+            rebuild_sales_rollups(conn, pharmacy_id, start_date, end_date)
+
+
+def _iter_with_progress(
+    product_series: Dict[int, List[Tuple[datetime, int]]],
+    progress: Optional[ProgressReporter],
+) -> Iterable[Tuple[int, List[Tuple[datetime, int]]]]:
+    for product_id, series in product_series.items():
+        yield product_id, series
+        if progress:
+            progress.update()
 
 
 def seed_historical_sales(
@@ -206,57 +194,19 @@ def seed_historical_sales(
     pharmacy_id: int,
     product_series: Dict[int, List[Tuple[datetime, int]]],
     progress: Optional[ProgressReporter] = None,
+    loader: Optional[BulkLoader] = None,
 ) -> int:
-    hist_columns = set(get_table_columns(engine, "historical_sales_daily"))
-    include_created = "created_at" in hist_columns
-    include_updated = "updated_at" in hist_columns
-
-    insert_cols = ["pharmacy_id", "product_id", "sale_date", "quantity_sold"]
-    values_expr = [":pharmacy_id", ":product_id", ":sale_date", ":quantity_sold"]
-    if include_created:
-        insert_cols.append("created_at")
-        values_expr.append("now()")
-    if include_updated:
-        insert_cols.append("updated_at")
-        values_expr.append("now()")
-
-    insert_sql = text(
-        f"""
-        INSERT INTO historical_sales_daily (
-            {', '.join(insert_cols)}
-        )
-        VALUES ({', '.join(values_expr)});
-        """
+    loader = loader or BulkLoader(engine)
+    rows = (
+        (product_id, current_date.date(), float(quantity))
+        for product_id, series in _iter_with_progress(product_series, progress)
+        for current_date, quantity in series
     )
-    delete_sql = text(
-        """
-        DELETE FROM historical_sales_daily
-        WHERE pharmacy_id = :pharmacy_id
-          AND product_id = :product_id
-          AND sale_date = :sale_date;
-        """
-    )
-    rows = 0
-    with engine.begin() as conn:
-        for idx, (product_id, series) in enumerate(product_series.items(), 1):
-            for current_date, quantity in series:
-                params = {
-                    "pharmacy_id": pharmacy_id,
-                    "product_id": product_id,
-                    "sale_date": current_date.date(),
-                    "quantity_sold": float(quantity),
-                }
-                conn.execute(delete_sql, params)
-                conn.execute(
-                    insert_sql,
-                    params,
-                )
-                rows += 1
-            if progress:
-                progress.update()
+    stats = loader.load_historical_sales(pharmacy_id, rows)
     if progress:
         progress.close()
-    return rows
+    print(stats)
+    return stats.rows
 
 
 def pick_user_id(engine: Engine, pharmacy_id: int) -> int:
@@ -294,102 +244,19 @@ def seed_recent_sales(
     products_lookup: Dict[int, Dict],
     recent_cutoff: datetime,
     progress: Optional[ProgressReporter] = None,
+    loader: Optional[BulkLoader] = None,
 ) -> int:
-    sales_details = get_table_column_details(engine, "sales")
-    sales_columns = {col["name"] for col in sales_details}
-    generated_sales_cols = {
-        col["name"] for col in sales_details if col["is_generated"] == "ALWAYS"
-    }
-
-    item_details = get_table_column_details(engine, "sale_items")
-    item_columns = {col["name"] for col in item_details}
-    generated_item_cols = {
-        col["name"] for col in item_details if col["is_generated"] == "ALWAYS"
-    }
-
-    required_sale_cols = {
-        "sale_number",
-        "pharmacy_id",
-        "user_id",
-        "subtotal",
-        "tax_amount",
-        "discount_amount",
-        "payment_method",
-        "status",
-        "notes",
-        "created_at",
-    }
-    missing = required_sale_cols - sales_columns
-    if missing:
-        raise RuntimeError(f"'sales' table missing required columns: {', '.join(missing)}")
-
-    include_total = "total_amount" in sales_columns and "total_amount" not in generated_sales_cols
-    include_updated = "updated_at" in sales_columns
-
-    insert_sales_cols = [
-        "sale_number",
-        "pharmacy_id",
-        "user_id",
-        "subtotal",
-        "tax_amount",
-        "discount_amount",
-        "payment_method",
-        "status",
-        "notes",
-        "created_at",
-    ]
-    if include_total:
-        insert_sales_cols.append("total_amount")
-    if include_updated:
-        insert_sales_cols.append("updated_at")
-
-    sales_sql = text(
-        f"""
-        INSERT INTO sales ({', '.join(insert_sales_cols)})
-        VALUES ({', '.join(':'+c for c in insert_sales_cols)})
-        RETURNING id
-        """
-    )
+    loader = loader or BulkLoader(engine)
 
-    required_item_cols = {"sale_id", "product_id", "quantity", "unit_price"}
-    if not required_item_cols.issubset(item_columns):
-        raise RuntimeError(
-            f"'sale_items' table missing required columns: "
-            f"{', '.join(required_item_cols - item_columns)}"
-        )
-    include_total_price = "total_price" in item_columns and "total_price" not in generated_item_cols
-    include_item_created = "created_at" in item_columns
-
-    item_cols = ["sale_id", "product_id", "quantity", "unit_price"]
-    if include_total_price:
-        item_cols.append("total_price")
-    if include_item_created:
-        item_cols.append("created_at")
-
-    sale_items_sql = text(
-        f"""
-        INSERT INTO sale_items ({', '.join(item_cols)})
-        VALUES ({', '.join(':'+c for c in item_cols)})
-        """
-    )
-
-    inserted = 0
-    tz_now = datetime.now(timezone.utc)
-
-    with engine.begin() as conn:
-        for idx, (product_id, series) in enumerate(product_series.items(), 1):
-            product = products_lookup[product_id]
-            unit_price = float(product.get("unit_price") or 50)
+    def rows() -> Iterable[Tuple[str, datetime, int, int, float]]:
+        for product_id, series in _iter_with_progress(product_series, progress):
+            unit_price = float(products_lookup[product_id].get("unit_price") or 50)
             for current_date, quantity in series:
                 if current_date < recent_cutoff or quantity <= 0:
                     continue
                 sale_number = (
                     f"DUMMY-{pharmacy_id}-{product_id}-{current_date.strftime('%Y%m%d')}"
                 )
-                subtotal = unit_price * quantity
-                tax_amount = subtotal * 0.12
-                discount_amount = 0.0
-                total_amount = subtotal + tax_amount - discount_amount
                 created_at = datetime(
                     current_date.year,
                     current_date.month,
@@ -398,44 +265,20 @@ def seed_recent_sales(
                     0,
                     tzinfo=timezone.utc,
                 )
+                yield sale_number, created_at, product_id, quantity, unit_price
 
-                sales_payload = {
-                    "sale_number": sale_number,
-                    "pharmacy_id": pharmacy_id,
-                    "user_id": user_id,
-                    "subtotal": subtotal,
-                    "tax_amount": tax_amount,
-                    "discount_amount": discount_amount,
-                    "payment_method": "cash",
-                    "status": "completed",
-                    "notes": "[DUMMY_RECENT_SALES]",
-                    "created_at": created_at,
-                }
-                if include_total:
-                    sales_payload["total_amount"] = total_amount
-                if include_updated:
-                    sales_payload["updated_at"] = tz_now
-
-                sale_id = conn.execute(sales_sql, sales_payload).scalar_one()
-
-                item_payload = {
-                    "sale_id": sale_id,
-                    "product_id": product_id,
-                    "quantity": quantity,
-                    "unit_price": unit_price,
-                }
-                if include_total_price:
-                    item_payload["total_price"] = subtotal
-                if include_item_created:
-                    item_payload["created_at"] = created_at
-
-                conn.execute(sale_items_sql, item_payload)
-                inserted += 1
-            if progress:
-                progress.update()
+    stats = loader.load_sales(
+        pharmacy_id,
+        user_id,
+        rows(),
+        tax_rate=0.12,
+        payment_method="cash",
+        notes="[DUMMY_RECENT_SALES]",
+    )
     if progress:
         progress.close()
-    return inserted
+    print(stats)
+    return stats.rows
 
 
 def retrain_models(pharmacy_id: int, limit: int, days: int) -> None:
@@ -470,6 +313,12 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Skip triggering model retraining after seeding data.",
     )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=50000,
+        help="Rows streamed per COPY chunk (default 50000).",
+    )
     parser.add_argument(
         "--days",
         type=int,
@@ -509,6 +358,7 @@ def main() -> None:
         product_series[pid] = series
 
     products_lookup = {int(p["id"]): p for p in products}
+    loader = BulkLoader(engine, chunk_rows=args.chunk_rows)
 
     hist_progress = ProgressReporter(len(product_series), "Historical")
     seeded_hist = seed_historical_sales(
@@ -516,6 +366,7 @@ def main() -> None:
         pharmacy_id,
         product_series,
         progress=hist_progress,
+        loader=loader,
     )
 
     delete_existing_dummy_sales(engine, pharmacy_id, start_date, today)
@@ -529,6 +380,7 @@ def main() -> None:
         products_lookup,
         recent_cutoff,
         progress=recent_progress,
+        loader=loader,
     )
 
     print(
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Record yesterday's inventory snapshots, e.g. nightly from cron just after
+midnight.
+
+Each pharmacy's inventory_daily_snapshots rows are written for every full day
+not recorded yet. A pharmacy that has never been recorded gets its whole
+history backfilled from inventory_batches, sales, return_items and
+disposed_products. Readers of /api/manager/inventory/history do this lazily
+on their first request of the day; running it here keeps that cost off the
+request. Pharmacies already up to date are skipped, so running it twice is
+harmless. --rebuild backfills every pharmacy again from scratch, e.g. after
+correcting past data.
+
+With --benchmark, it then reads a year of monthly history for the pharmacy
+(--pharmacy-id, default the first one) and reports the time and size.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT_DIR / "backend"
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+load_dotenv()
+
+from services.inventory_snapshots import inventory_history, roll_over_all, roll_over_snapshots  # type: ignore  # noqa: E402
+from utils.helpers import get_database_url  # type: ignore  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Record daily inventory snapshots up to yesterday.")
+    parser.add_argument("--pharmacy-id", type=int, default=None, help="Default: every pharmacy.")
+    parser.add_argument("--rebuild", action="store_true", help="Backfill all history again.")
+    parser.add_argument("--benchmark", action="store_true", help="Time a year of monthly history afterwards.")
+    parser.add_argument("--grain", default="month", choices=("month", "week", "day"))
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    started = time.perf_counter()
+    if args.pharmacy_id:
+        with engine.begin() as conn:
+            if args.rebuild:
+                conn.execute(text("""
+                    UPDATE inventory_snapshot_state SET recorded_through = NULL WHERE pharmacy_id = :ph
+                """), {"ph": args.pharmacy_id})
+            done = [args.pharmacy_id] if roll_over_snapshots(conn, args.pharmacy_id) else []
+    else:
+        done = roll_over_all(engine, rebuild=args.rebuild)
+    print(f"recorded {len(done)} pharmacy(ies) in {time.perf_counter() - started:.2f}s")
+
+    if args.benchmark:
+        with engine.connect() as conn:
+            pharmacy_id = args.pharmacy_id or conn.execute(text("SELECT min(id) FROM pharmacies")).scalar()
+            rows = conn.execute(text("""
+                SELECT count(*) FROM inventory_daily_snapshots WHERE pharmacy_id = :ph
+            """), {"ph": pharmacy_id}).scalar()
+            today = date.today()
+            timings = []
+            for _ in range(3):
+                started = time.perf_counter()
+                result = inventory_history(conn, pharmacy_id, today - timedelta(days=365), today, grain=args.grain)
+                timings.append(time.perf_counter() - started)
+        print(f"pharmacy {pharmacy_id}: {rows:,} snapshot rows, {len(result['products']):,} products, "
+              f"{len(result['periods'])} {args.grain} periods")
+        print(f"one year of history: best {min(timings) * 1000:.0f} ms, worst {max(timings) * 1000:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,6 +1,6 @@
 #!/bin/bash
 cd backend
-gunicorn app:app --bind 0.0.0.0:$PORT --workers 2 --timeout 120
+gunicorn app:app --bind 0.0.0.0:$PORT --workers 1 --timeout 120 --worker-class gthread --threads ${WEB_THREADS:-64}
 
 
 